@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+An optional pass over the `write` data of a send-stream, which finds files
+(and blocks of files) that have identical content, but do not share
+storage.  `Chunk.chunk_clones` already describes the storage that IS
+shared, so this answers the complementary question: how many bytes would
+we save by reflinking, or by restructuring the layers?
+
+`index_send_stream` applies the send-stream to a `SubvolumeSet`, like
+`apply_send_stream`, and meanwhile hashes the data of each `write`, keyed
+by the inode being written.  Only the hashes are kept, never the data:
+
+  - Each regular file is split into `block_size` blocks, and a block's
+    hash is computed once all of its bytes were written.  Most writes
+    append to the previous one, so a block that a `write` ends in the
+    middle of keeps a streaming `hashlib` object until the next `write`.
+
+  - Blocks that were never written are holes, and read as zeros.  They
+    count towards the file's content, but not towards the savings, since
+    they take no storage.
+
+  - A file's hash is the hash of its size and of its block hashes.
+
+We give up on (i.e. do not index) the files whose content cannot be known
+from the `write`s in this send-stream: those with data from a parent
+subvolume, or from a `clone` -- which already shares storage -- and those
+that were partly overwritten within a block, or truncated to the middle of
+a hashed block.  These are counted in `DedupSummary.unindexed_files`.
+"""
+import hashlib
+from collections import Counter
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+)
+
+from .incomplete_inode import IncompleteFile
+from .inode_id import InodeID
+from .parse_send_stream import parse_send_stream_fields
+from .send_stream import SendStreamDataRef, SendStreamItem, SendStreamItems
+from .subvolume import Subvolume
+from .subvolume_set import SubvolumeSet, SubvolumeSetMutator
+
+# The page size, and the usual btrfs sector size, so this is also the
+# granularity at which btrfs can share storage.
+DEFAULT_BLOCK_SIZE = 4096
+_hash = hashlib.sha256
+
+
+class DuplicateFiles(NamedTuple):
+    "Two or more inodes with the same content, & no data from a `clone`."
+    size: int
+    # Sorted.  One tuple of paths per inode, >1 path for hardlinks.
+    paths: Tuple[Tuple[bytes, ...], ...]
+
+    @property
+    def savings(self) -> int:
+        "The bytes saved by making all the inodes share one copy."
+        return self.size * (len(self.paths) - 1)
+
+
+class DedupSummary(NamedTuple):
+    indexed_files: int
+    unindexed_files: int
+    # The written (i.e. non-hole) bytes of the indexed files
+    data_bytes: int
+    # If every set of `DuplicateFiles` shared storage
+    file_dedup_bytes: int
+    # If every block with a given content were stored once.  This is at
+    # least `file_dedup_bytes`, but btrfs can only share whole blocks, so
+    # `block_size` must not exceed the filesystem's sector size.
+    block_dedup_bytes: int
+
+
+class _FileHashes:
+    """
+    The hashes of the blocks of a file that was created in this
+    send-stream.  `blocks` has the blocks that were written in full,
+    while `partial` has the `(hash, length)` of blocks whose first `length`
+    bytes are known.  Any unknown bytes are holes.
+    """
+
+    __slots__ = ("blocks", "partial")
+
+    def __init__(self):
+        self.blocks: Dict[int, bytes] = {}
+        self.partial: Dict[int, Tuple[Any, int]] = {}
+
+    def write(self, block_size: int, offset: int, data) -> bool:
+        "Returns False if we cannot know the resulting content."
+        view = memoryview(data)
+        idx, start = divmod(offset, block_size)
+        pos = 0
+        while pos < len(view):
+            piece = view[pos : pos + block_size - start]
+            pos += len(piece)
+            if len(piece) == block_size:  # The common, aligned case
+                self.blocks[idx] = _hash(piece).digest()
+                self.partial.pop(idx, None)
+            else:
+                if idx in self.blocks:
+                    return False  # We no longer have the overwritten bytes
+                hasher, length = self.partial.get(idx, (None, 0))
+                if start < length:
+                    return False  # Ditto
+                if hasher is None:
+                    hasher = _hash()
+                if start > length:
+                    hasher.update(bytes(start - length))  # A hole
+                hasher.update(piece)
+                length = start + len(piece)
+                if length == block_size:
+                    self.blocks[idx] = hasher.digest()
+                    self.partial.pop(idx, None)
+                else:
+                    self.partial[idx] = (hasher, length)
+            idx += 1
+            start = 0
+        return True
+
+    def truncate(self, block_size: int, size: int) -> bool:
+        "Returns False if we cannot know the resulting content."
+        last_idx, last_length = divmod(size, block_size)
+        if last_length:
+            if last_idx in self.blocks:
+                return False  # Cannot un-hash the truncated bytes
+            _hasher, length = self.partial.get(last_idx, (None, 0))
+            if length > last_length:
+                return False
+            last_idx += 1
+        for blocks in (self.blocks, self.partial):
+            for idx in [i for i in blocks if i >= last_idx]:
+                del blocks[idx]
+        return True
+
+    def gen_block_hashes(
+        self, block_size: int, size: int
+    ) -> Iterable[Tuple[bytes, int, bool]]:
+        "Yields `(hash, length, is_hole)` for each block of the file."
+        num_blocks = -(-size // block_size)
+        for idx in range(num_blocks):
+            length = min(block_size, size - idx * block_size)
+            block_hash = self.blocks.get(idx)
+            if block_hash is not None:
+                yield block_hash, length, False
+                continue
+            hasher, known = self.partial.get(idx, (None, 0))
+            if hasher is None:
+                yield _zeros_hash(length), length, True
+                continue
+            if known < length:
+                hasher = hasher.copy()
+                hasher.update(bytes(length - known))
+            yield hasher.digest(), length, False
+
+
+_ZEROS_HASHES: Dict[int, bytes] = {}
+
+
+def _zeros_hash(length: int) -> bytes:
+    zeros_hash = _ZEROS_HASHES.get(length)
+    if zeros_hash is None:
+        zeros_hash = _ZEROS_HASHES[length] = _hash(bytes(length)).digest()
+    return zeros_hash
+
+
+class ContentHashIndex:
+    """
+    The block & file hashes of the regular files of `subvolume`, keyed by
+    inode number -- hardlinks are the same inode, and so are never
+    reported as duplicates of each other.
+    """
+
+    def __init__(self, *, subvolume: Subvolume, block_size: int):
+        if block_size <= 0:
+            raise RuntimeError(f"Bad block size {block_size}")
+        self.subvolume = subvolume
+        self.block_size = block_size
+        # Files we cannot index map to `None`.
+        self._id_to_hashes: Dict[int, Optional[_FileHashes]] = {}
+
+    def _path_to_id(self, path: bytes) -> Optional[int]:
+        ino_id = self.subvolume.id_map.get_id(path)
+        return None if ino_id is None else ino_id.id
+
+    def _hashes(self, path: bytes) -> Optional[_FileHashes]:
+        ino_num = self._path_to_id(path)
+        if ino_num not in self._id_to_hashes:
+            # Not created by this send-stream, so some of its data came
+            # from the parent subvolume.
+            self._id_to_hashes[ino_num] = None
+        return self._id_to_hashes[ino_num]
+
+    def apply_fields(
+        self,
+        mutator: SubvolumeSetMutator,
+        item_type: Type[SendStreamItem],
+        fields: Tuple[Any, ...],
+    ) -> None:
+        "Applies an item to `mutator`, which must be for our subvolume."
+        mutator.apply_fields(item_type, fields)
+        si = SendStreamItems
+        if item_type is si.mkfile:
+            self._id_to_hashes[self._path_to_id(fields[0])] = _FileHashes()
+        elif item_type is si.write:
+            path, offset, data = fields
+            if isinstance(data, SendStreamDataRef):
+                raise RuntimeError(f"Need the data for write to {path}")
+            hashes = self._hashes(path)
+            if hashes and not hashes.write(self.block_size, offset, data):
+                self._id_to_hashes[self._path_to_id(path)] = None
+        elif item_type is si.truncate:
+            path, size = fields
+            hashes = self._hashes(path)
+            if hashes and not hashes.truncate(self.block_size, size):
+                self._id_to_hashes[self._path_to_id(path)] = None
+        elif item_type in (si.clone, si.update_extent):
+            # `clone` data is already shared, `update_extent` has no data
+            self._id_to_hashes[self._path_to_id(fields[0])] = None
+
+    def _gen_file_ids(self) -> Iterable[InodeID]:
+        "The IDs of the regular files in the subvolume, by inode number."
+        subvol = self.subvolume
+        for ino_num in sorted(self._id_to_hashes):
+            ino_id = InodeID(id=ino_num, inner_id_map=subvol.id_map.inner)
+            if isinstance(subvol.id_to_inode.get(ino_id), IncompleteFile):
+                yield ino_id
+
+    def _gen_indexed_files(self):
+        "Yields `(inode ID, size, [(hash, length, is_hole), ...])`."
+        for ino_id in self._gen_file_ids():
+            hashes = self._id_to_hashes[ino_id.id]
+            if hashes is not None:
+                size = self.subvolume.id_to_inode[ino_id].extent.length
+                yield ino_id, size, list(
+                    hashes.gen_block_hashes(self.block_size, size)
+                )
+
+    def duplicate_files(self) -> List[DuplicateFiles]:
+        "Non-empty duplicates, the largest `savings` first."
+        hash_to_ids: Dict[Tuple[bytes, int], List[InodeID]] = {}
+        for ino_id, size, block_hashes in self._gen_indexed_files():
+            if size:
+                file_hash = _hash(b"%d:" % size)
+                for block_hash, _length, _is_hole in block_hashes:
+                    file_hash.update(block_hash)
+                hash_to_ids.setdefault(
+                    (file_hash.digest(), size), []
+                ).append(ino_id)
+        get_paths = self.subvolume.id_map.get_paths
+        return sorted(
+            (
+                DuplicateFiles(
+                    size=size,
+                    paths=tuple(
+                        sorted(tuple(sorted(get_paths(i))) for i in ino_ids)
+                    ),
+                )
+                for (_digest, size), ino_ids in hash_to_ids.items()
+                if len(ino_ids) > 1
+            ),
+            key=lambda d: (-d.savings, d.paths),
+        )
+
+    def summary(self) -> DedupSummary:
+        indexed_files = 0
+        data_bytes = 0
+        block_counts: Counter = Counter()
+        for _ino_id, _size, block_hashes in self._gen_indexed_files():
+            indexed_files += 1
+            for block_hash, length, is_hole in block_hashes:
+                if not is_hole:
+                    data_bytes += length
+                    block_counts[block_hash, length] += 1
+        num_files = sum(1 for _ in self._gen_file_ids())
+        return DedupSummary(
+            indexed_files=indexed_files,
+            unindexed_files=num_files - indexed_files,
+            data_bytes=data_bytes,
+            file_dedup_bytes=sum(d.savings for d in self.duplicate_files()),
+            block_dedup_bytes=sum(
+                length * (count - 1)
+                for (_digest, length), count in block_counts.items()
+            ),
+        )
+
+
+def index_send_stream(
+    subvol_set: SubvolumeSet,
+    infile,
+    *,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    verify_crc: bool = False,
+) -> ContentHashIndex:
+    """
+    Like `apply_send_stream`, but also hashes the data being written.
+    For a full send-stream, that indexes every regular file.  For an
+    incremental one, only the files that it creates are indexed.
+    """
+    fields_iter = parse_send_stream_fields(infile, verify_crc=verify_crc)
+    for item_type, fields in fields_iter:
+        mutator = SubvolumeSetMutator.new(subvol_set, item_type(*fields))
+        break
+    else:
+        raise RuntimeError(f"Send-stream {infile} has no commands")
+    index = ContentHashIndex(
+        subvolume=mutator.subvolume, block_size=block_size
+    )
+    for item_type, fields in fields_iter:
+        index.apply_fields(mutator, item_type, fields)
+    return index
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+CRC-32C (Castagnoli), as used to checksum the commands of a btrfs
+send-stream.
+
+Watch out: btrfs computes its checksums via the kernel's `crc32c(seed,
+...)`, which does NOT invert the CRC on the way in and out, unlike the
+"standard" CRC-32C of iSCSI & co.  `crc32c()` here follows the btrfs
+convention, so `crc32c(data)` is what `btrfs send` puts in the header.
+Like the kernel function, it can be chained: `crc32c(b, crc32c(a))` is
+the same as `crc32c(a + b)`.
+
+`crc32c` uses the native implementation from the `crc32c` module when it
+is importable.  Otherwise, we fall back to `crc32c_pure_python`, which is
+table-driven, but still orders of magnitude slower.
+"""
+
+_CASTAGNOLI_POLY_REVERSED = 0x82F63B78
+_MASK = 0xFFFFFFFF
+
+
+def _make_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ (_CASTAGNOLI_POLY_REVERSED if crc & 1 else 0)
+        table.append(crc)
+    return tuple(table)
+
+
+_TABLE = _make_table()
+
+
+def crc32c_pure_python(data: bytes, crc: int = 0) -> int:
+    "`data` may be any bytes-like object, including a `memoryview`."
+    table = _TABLE  # Local lookups are faster in the loop below
+    for byte in data:
+        crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc
+
+
+try:
+    from crc32c import crc32c as _native_crc32c
+except ImportError:  # pragma: no cover
+    HAVE_NATIVE_CRC32C = False
+    crc32c = crc32c_pure_python
+else:  # pragma: no cover
+    HAVE_NATIVE_CRC32C = True
+
+    def crc32c(data: bytes, crc: int = 0) -> int:
+        # The module implements the standard CRC-32C, which inverts the
+        # CRC on entry and exit, so undo both inversions.
+        return _native_crc32c(data, crc ^ _MASK) ^ _MASK
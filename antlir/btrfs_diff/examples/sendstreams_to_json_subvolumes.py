@@ -49,7 +49,6 @@ from ..inode_utils import (
     erase_utimes_in_range,
 )
 from ..parse_send_stream import parse_send_stream
-from ..rendered_tree import emit_non_unique_traversal_ids
 from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
 
 
@@ -162,7 +161,7 @@ def main(argv):
             )
 
     if args.show_only:
-        result = {}
+        name_to_subvol = {}
         # This hides cross-subvolume clone annotations, see `--show-only`.
         for which_subvol in args.show_only:
             subvol = subvols.get_by_rendered_id(which_subvol)
@@ -170,15 +169,21 @@ def main(argv):
                 raise RuntimeError(
                     f"Unknown subvol {which_subvol}, try without --show-only"
                 )
-            result[which_subvol] = emit_non_unique_traversal_ids(
-                freeze(subvol).render()
-            )
+            name_to_subvol[which_subvol] = freeze(subvol)
     else:
-        result = freeze(subvols).map(
-            lambda sv: emit_non_unique_traversal_ids(sv.render())
-        )
+        # Nothing reads `subvols` after this, so don't keep a second copy.
+        name_to_subvol = freeze(subvols, in_place=True).map(lambda sv: sv)
     # Future: is there a `pprint`-style compact & pretty JSON output?
-    print(json.dumps(result, sort_keys=True, indent=2))
+    #
+    # This is `print(json.dumps(..., sort_keys=True, indent=2))`, except
+    # that we stream each subvolume, since their `RenderedTree`s and JSON
+    # can be much bigger than the `Subvolume`s.
+    out = sys.stdout
+    out.write("{")
+    for i, (name, subvol) in enumerate(sorted(name_to_subvol.items())):
+        out.write(("," if i else "") + "\n  " + json.dumps(name) + ": ")
+        subvol.write_rendered_json(out, indent=2, level=1)
+    out.write("\n}\n" if name_to_subvol else "}\n")
 
 
 if __name__ == "__main__":
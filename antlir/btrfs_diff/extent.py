@@ -211,7 +211,9 @@ class Extent(NamedTuple):
 
     @staticmethod
     def empty():
-        return Extent.__new(())
+        # Unlike the ground-truth leaves, this has no identity to preserve,
+        # so every new file can share one object.
+        return _EMPTY_EXTENT
 
     def truncate(self, length: int):
         return Extent.__new(
@@ -224,6 +226,11 @@ class Extent(NamedTuple):
         # E.g., should `extent.Extent.empty().write(offset=5, length=0)`
         # create a hole, or remain empty?
         assert what.length > 0, "Future: not sure how to hangle length = 0"
+        # Appends are by far the most common case, since `btrfs send`
+        # writes files sequentially.  This is what the general case below
+        # would compute, minus the 3 empty extents it makes and discards.
+        if offset == self.length:
+            return Extent.__new((self, what))
         return Extent.__new(
             (
                 Extent.__new(self, length=min(self.length, offset)),
@@ -316,3 +323,6 @@ class Extent(NamedTuple):
 
     def __deepcopy__(self, memo):
         return self  # See the docstring
+
+
+_EMPTY_EXTENT = Extent(content=(), offset=0, length=0)
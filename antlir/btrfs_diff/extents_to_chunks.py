@@ -100,6 +100,10 @@ the structures of the write forks, respecting `truncate`, `write`, and
       by which the N-1 spanning tree edges are selected.  It's easy to make
       such a process deterministic, but it still adds cognitive load.
 
+      Consumers that do not need the symmetric form -- e.g. with many
+      files reflinking the same extents -- can instead pass
+      `spanning_tree=True` to `extents_to_chunks_with_clones`.
+
 [1] The current code tracks clones of HOLEs, because it makes no effort to
     ignore them.  I would guess that btrfs lacks this tracking, since such
     clones would save no space.  Once this is confirmed, it would be very
@@ -116,9 +120,8 @@ the structures of the write forks, respecting `truncate`, `write`, and
 
 """
 # Future: frozentypes instead of NamedTuples can permit some cleanups below.
-import functools
 from collections import defaultdict
-from typing import Dict, Iterable, NamedTuple, Sequence, Tuple
+from typing import Dict, Iterable, List, NamedTuple, Sequence, Tuple
 
 from .extent import Extent
 from .inode import Chunk, ChunkClone, Clone
@@ -176,176 +179,215 @@ class _CloneExtentRef(NamedTuple):
         )
 
 
-# If these change, we have to update `_clone_op_compare_key`
-assert Clone._fields.index("inode_id") == 0
-assert _CloneExtentRef._fields.index("clone") == 0
-
-
-# Our _CloneOp ordering obeys the following invariants:
-#  - sort by position first
-#  - sort by action second, putting POPs before PUSHes (see their def'ns)
-# We do not need finer-grained ordering because:
-#  (1) we only do work on POPs,
-#  (2) the work done on all the POPs at one position does not depend on the
-#      order of the _CloneOps -- we symmetrically record the relationship in
-#      both directions:
-#        (just-popped op, each unpopped op)
-#        (each unpopped op, just-popped op)
-#
-# We could get the desired ordering implicitly by:
-#  - relying on the order of field declaration in `_CloneOp` (not bad)
-#  - making `Inode`s comparable (a bit ugly, comparing Extents is pricy,
-#    comparing InodeIDs would require some comparator boilerplate)
-# Luckily, being explicit is not *that* painful.
-def _clone_op_compare_key(c: "_CloneOp"):
-    return (
-        # The preceding asserts make these [1:] hacks tolerable.
-        c.pos,
-        c.action,
-        c.ref[1:],
-        c.ref.clone[1:],
-        c.ref.clone.inode_id.id,
-    )
-
-
-def _clone_op_compare(fn):
-    @functools.wraps(fn)
-    def cmp(self: "_CloneOp", other: "_CloneOp"):
-        assert isinstance(other, _CloneOp)
-        # We only compare ops within one extent. The tests assume this to
-        # justify focusing on single-extent examples, so check it.
-        assert self.ref.extent is other.ref.extent
-        # All our items are distinct, since `clone.offset` is `inode_offset`,
-        # which is strictly increasing in each inode.  We have no business
-        # comparing a _CloneOp with itself.
-        assert tuple.__ne__(self, other)
-        return fn(_clone_op_compare_key(self), _clone_op_compare_key(other))
-
-    return cmp
+# Sweep-line events sort by position first, and put POPs before PUSHes
+# second, so that intervals that merely touch do not count as overlapping.
+_POP = 0
+_PUSH = 1
+# Most chunks have no clones, so they all share one empty `frozenset`.
+_NO_CHUNK_CLONES = frozenset()
 
 
-class _CloneOp(NamedTuple):
-    PUSH = "push"
-    POP = "pop"
-    assert POP < PUSH  # We want to sort all POPs before any PUSHes
-
-    pos: int
-    action: str
-    ref: _CloneExtentRef
-
-    # NamedTuple confuses functools.total_ordering, so define all 6 comparators
-    __eq__ = _clone_op_compare(tuple.__eq__)
-    __ne__ = _clone_op_compare(tuple.__ne__)
-    __lt__ = _clone_op_compare(tuple.__lt__)
-    __le__ = _clone_op_compare(tuple.__le__)
-    __gt__ = _clone_op_compare(tuple.__gt__)
-    __ge__ = _clone_op_compare(tuple.__ge__)
-
-
-def _leaf_extent_id_to_clone_ops(
+def _leaf_extent_id_to_clone_refs(
     ids_and_extents: Iterable[Tuple[InodeID, Extent]]
-):
+) -> Dict[int, List[_CloneExtentRef]]:
     """
-    To collect the parts of a Chunk that are cloned, we will run a variation
-    on the standard interval-overlap algorithm.  We first sort the starts &
-    ends of each interval, and then do a sequential scan that uses starts to
-    add, and ends to remove, a tracking object from a "current intervals"
-    structure.
-
-    This function simply prepares the set of interval starts & ends for each
-    InodeID, the computation is in `_leaf_ref_to_chunk_clones_from_clone_ops`.
+    To collect the parts of a Chunk that are cloned, we will run the
+    standard sweep-line algorithm for interval overlaps.  We first sort the
+    starts & ends of each interval, and then do a sequential scan that uses
+    starts to add, and ends to remove, an interval from a "currently open
+    intervals" structure.
+
+    This function simply groups the intervals (aka the inodes' trimmed
+    leaves) by their leaf Extent, the computation is in
+    `_ref_idx_to_offsets_clones`.
     """
-    leaf_extent_id_to_clone_ops = defaultdict(list)
+    leaf_extent_id_to_clone_refs = defaultdict(list)
     for ino_id, extent in ids_and_extents:
         file_offset = 0
         for leaf_idx, (offset, length, leaf_extent) in enumerate(
             extent.gen_trimmed_leaves()
         ):
-            ref = _CloneExtentRef(
-                clone=Clone(inode_id=ino_id, offset=file_offset, length=length),
-                extent=leaf_extent,
-                offset=offset,
-                leaf_idx=leaf_idx,
-            )
-            leaf_extent_id_to_clone_ops[id(leaf_extent)].extend(
-                [
-                    _CloneOp(pos=offset, action=_CloneOp.PUSH, ref=ref),
-                    _CloneOp(pos=offset + length, action=_CloneOp.POP, ref=ref),
-                ]
+            leaf_extent_id_to_clone_refs[id(leaf_extent)].append(
+                _CloneExtentRef(
+                    clone=Clone(
+                        inode_id=ino_id, offset=file_offset, length=length
+                    ),
+                    extent=leaf_extent,
+                    offset=offset,
+                    leaf_idx=leaf_idx,
+                )
             )
             file_offset += length
-    return leaf_extent_id_to_clone_ops
+    return leaf_extent_id_to_clone_refs
 
 
-def _leaf_ref_to_chunk_clones_from_clone_ops(
-    extent_id: int, clone_ops: Iterable[_CloneOp]
-):
-    "As per `_leaf_extent_id_to_clone_ops`, this computes interval overlaps"
-    active_ops: Dict[_CloneExtentRef, _CloneOp] = {}  # Tracks open intervals
-    leaf_ref_to_chunk_clones = defaultdict(list)
-    for op in sorted(clone_ops):
-        # Whenever an interval (aka an Inode's Extent's "trimmed leaf")
-        # ends, we create `ChunkClone` objects **to** and **from** all the
-        # concurrently open intervals.
-        if op.action is _CloneOp.POP:
-            pushed_op = active_ops.pop(op.ref)
-            assert pushed_op.ref is op.ref
-            assert id(op.ref.extent) == extent_id
-            assert pushed_op.pos == op.ref.offset
-            assert pushed_op.pos + op.ref.clone.length == op.pos
-
-            for clone_op in active_ops.values():
-                assert op.ref.extent is clone_op.ref.extent
+def _gen_sorted_sweep_events(clone_refs: Sequence[_CloneExtentRef]):
+    """
+    Yields `(pos, action, idx, ref)`, where `idx` is the index of `ref`.
+
+    The sort keys are plain integers, so that the sort never has to call
+    back into Python to compare `InodeID`s or `Extent`s.  The fields after
+    `action` only serve to make the output of spanning-tree mode
+    independent of the input order where possible -- `idx` breaks the
+    remaining ties, so `ref` never gets compared.
+    """
+    events = []
+    for idx, ref in enumerate(clone_refs):
+        tiebreak = (ref.clone.inode_id.id, ref.clone.offset, idx)
+        events.append((ref.offset, _PUSH, *tiebreak, ref))
+        events.append((ref.offset + ref.clone.length, _POP, *tiebreak, ref))
+    events.sort()
+    for pos, action, _ino_id, _file_offset, idx, ref in events:
+        yield pos, action, idx, ref
+
+
+def _add_offset_clone(
+    ref_idx_to_offsets_clones: Dict[int, List[Tuple[int, Clone]]],
+    *,
+    to_idx: int,
+    to_ref: _CloneExtentRef,
+    from_ref: _CloneExtentRef,
+    start: int,
+    end: int,
+) -> None:
+    "Records that `from_ref`'s inode also has bytes [start, end) of `to_ref`"
+    assert to_ref.extent is from_ref.extent
+    # The future `ChunkClone` -- but its `offset` is still Extent-relative,
+    # so avoid making an object that we would just throw away.
+    ref_idx_to_offsets_clones[to_idx].append(
+        (
+            start,
+            Clone(
+                inode_id=from_ref.clone.inode_id,
+                offset=from_ref.clone.offset + (start - from_ref.offset),
+                length=end - start,
+            ),
+        )
+    )
+
 
+def _ref_idx_to_offsets_clones(
+    extent_id: int,
+    clone_refs: Sequence[_CloneExtentRef],
+    *,
+    spanning_tree: bool,
+) -> Dict[int, List[Tuple[int, Clone]]]:
+    """
+    As per `_leaf_extent_id_to_clone_refs`, this computes interval overlaps.
+    The output is keyed by the index in `clone_refs`, which is cheaper to
+    hash than a `_CloneExtentRef`.
+
+    Whenever an interval (aka an Inode's Extent's "trimmed leaf") ends, the
+    symmetric mode creates clones **to** and **from** all the concurrently
+    open intervals.
+
+    In `spanning_tree` mode, the oldest open interval is the "anchor", and
+    every other open interval has one edge to it.  An edge ends when either
+    side ends, and is recorded only on the newer side.  When the anchor
+    ends, the next-oldest open interval becomes the anchor.  Thus, the
+    bytes shared by N intervals get N - 1 clones.
+    """
+    ref_idx_to_offsets_clones = defaultdict(list)
+    if len(clone_refs) < 2:
+        return ref_idx_to_offsets_clones  # Nothing to overlap with
+    # Tracks open intervals by index, in the order they were opened
+    active_refs: Dict[int, _CloneExtentRef] = {}
+    # Spanning-tree mode: the index of the anchor, and the start of the
+    # edge from each other open interval to the anchor.
+    anchor_idx = None
+    idx_to_edge_start: Dict[int, int] = {}
+    for pos, action, idx, ref in _gen_sorted_sweep_events(clone_refs):
+        if action == _PUSH:
+            assert idx not in active_refs
+            active_refs[idx] = ref
+            if spanning_tree:
+                if anchor_idx is None:
+                    anchor_idx = idx
+                else:
+                    idx_to_edge_start[idx] = pos
+            continue
+
+        assert action == _POP
+        assert active_refs.pop(idx) is ref
+        assert id(ref.extent) == extent_id
+        assert ref.offset + ref.clone.length == pos
+        if not spanning_tree:
+            # This loop makes O(N^2) clones for N-fold clones, so it
+            # inlines `_add_offset_clone`, and hoists what it can.
+            offsets_clones = ref_idx_to_offsets_clones[idx]
+            ino_id = ref.clone.inode_id
+            extent_to_file_offset = ref.clone.offset - ref.offset
+            for other_idx, other_ref in active_refs.items():
                 # The cloned portion's extent offset is the larger of the 2
-                bigger_offset = max(clone_op.ref.offset, op.ref.offset)
-
-                # Record that `clone_op` clones part of `op`'s inode.
-                leaf_ref_to_chunk_clones[op.ref].append(
-                    ChunkClone(
-                        offset=bigger_offset,
-                        clone=Clone(
-                            inode_id=clone_op.ref.clone.inode_id,
-                            offset=clone_op.ref.clone.offset
-                            + (bigger_offset - clone_op.ref.offset),
-                            length=op.pos - bigger_offset,
+                start = max(other_ref.offset, ref.offset)
+                # Record that `other_ref` clones part of `ref`'s inode, and
+                # vice-versa.
+                offsets_clones.append(
+                    (
+                        start,
+                        Clone(
+                            inode_id=other_ref.clone.inode_id,
+                            offset=other_ref.clone.offset
+                            + (start - other_ref.offset),
+                            length=pos - start,
                         ),
                     )
                 )
-
-                # Record that `op` clones part of `clone_op`'s inode.
-                leaf_ref_to_chunk_clones[clone_op.ref].append(
-                    ChunkClone(
-                        offset=bigger_offset,
-                        clone=Clone(
-                            inode_id=op.ref.clone.inode_id,
-                            offset=op.ref.clone.offset
-                            + (bigger_offset - op.ref.offset),
-                            length=op.pos - bigger_offset,  # Same length
+                ref_idx_to_offsets_clones[other_idx].append(
+                    (
+                        start,
+                        Clone(
+                            inode_id=ino_id,
+                            offset=extent_to_file_offset + start,
+                            length=pos - start,  # Same length
                         ),
                     )
                 )
-        # Sorting guarantees all POPs for `pos` are handled before PUSHes
-        elif op.action == _CloneOp.PUSH:
-            assert op.ref not in active_ops
-            active_ops[op.ref] = op
+        elif idx != anchor_idx:
+            start = idx_to_edge_start.pop(idx)
+            if start < pos:  # Edges made by an anchor change may be empty
+                _add_offset_clone(
+                    ref_idx_to_offsets_clones,
+                    to_idx=idx,
+                    to_ref=ref,
+                    from_ref=clone_refs[anchor_idx],
+                    start=start,
+                    end=pos,
+                )
         else:
-            raise AssertionError(op)  # pragma: no cover
-    return leaf_ref_to_chunk_clones
+            # Close all the anchor's edges, and reopen them to its heir.
+            for other_idx, start in idx_to_edge_start.items():
+                if start < pos:
+                    _add_offset_clone(
+                        ref_idx_to_offsets_clones,
+                        to_idx=other_idx,
+                        to_ref=active_refs[other_idx],
+                        from_ref=ref,
+                        start=start,
+                        end=pos,
+                    )
+            anchor_idx = next(iter(active_refs), None)
+            idx_to_edge_start = {
+                other_idx: pos
+                for other_idx in active_refs
+                if other_idx != anchor_idx
+            }
+    assert not active_refs
+    return ref_idx_to_offsets_clones
 
 
 def _id_to_leaf_idx_to_chunk_clones(
-    ids_and_extents: Iterable[Tuple[InodeID, Extent]]
+    ids_and_extents: Iterable[Tuple[InodeID, Extent]], *, spanning_tree: bool
 ):
     'Aggregates newly created ChunkClones per InodeID, and per "trimmed leaf"'
     id_to_leaf_idx_to_chunk_clones = defaultdict(dict)
-    for extent_id, clone_ops in _leaf_extent_id_to_clone_ops(
+    for extent_id, clone_refs in _leaf_extent_id_to_clone_refs(
         ids_and_extents
     ).items():
-        leaf_ref_to_chunk_clones = _leaf_ref_to_chunk_clones_from_clone_ops(
-            extent_id, clone_ops
-        )
-        for leaf_ref, offsets_clones in leaf_ref_to_chunk_clones.items():
+        for ref_idx, offsets_clones in _ref_idx_to_offsets_clones(
+            extent_id, clone_refs, spanning_tree=spanning_tree
+        ).items():
+            leaf_ref = clone_refs[ref_idx]
             d = id_to_leaf_idx_to_chunk_clones[leaf_ref.clone.inode_id]
             # A `leaf_idx` from a specific inode ID refers to one extent,
             # and each extent is handled in one iteration, so it cannot be
@@ -360,16 +402,22 @@ def _id_to_leaf_idx_to_chunk_clones(
 
 
 def extents_to_chunks_with_clones(
-    ids_and_extents: Sequence[Tuple[InodeID, Extent]]
+    ids_and_extents: Sequence[Tuple[InodeID, Extent]],
+    *,
+    spanning_tree: bool = False,
 ) -> Iterable[Tuple[InodeID, Sequence[Chunk]]]:
     """
     Converts the nested, history-preserving `Extent` structures into flat
     sequences of `Chunk`s, while being careful to annotate cloned parts as
     described in this file's docblock.  The `InodeID`s are needed to ensure
     that the `Chunk`s' `Clone` objects refer to the appropriate files.
+
+    With `spanning_tree=True`, the bytes shared by N `Chunk`s get only
+    N - 1 `ChunkClone`s, each recorded on one of the two `Chunk`s that it
+    links -- see `_ref_idx_to_offsets_clones`.
     """
     id_to_leaf_idx_to_chunk_clones = _id_to_leaf_idx_to_chunk_clones(
-        ids_and_extents
+        ids_and_extents, spanning_tree=spanning_tree
     )
     for ino_id, extent in ids_and_extents:
         leaf_to_chunk_clones = id_to_leaf_idx_to_chunk_clones.get(ino_id, {})
@@ -412,7 +460,11 @@ def extents_to_chunks_with_clones(
             Chunk(
                 kind=c.kind,
                 length=c.length,
-                chunk_clones=frozenset(c.chunk_clones),
+                chunk_clones=(
+                    frozenset(c.chunk_clones)
+                    if c.chunk_clones
+                    else _NO_CHUNK_CLONES
+                ),
             )
             for c in new_chunks
         )
@@ -18,52 +18,210 @@ provisions for `freeze`ing self-referential structures, because it is
 impossible to construct a recursively immutable structure that references
 itself.
 
+Unlike `deepcopy`, we do not copy what is already immutable: a `tuple`,
+`frozenset`, or `MappingProxyType` whose items all freeze to themselves is
+returned as-is.  So, re-freezing a frozen structure is cheap, and e.g. the
+`Extent`s & `Chunk`s of a frozen `Subvolume` are not duplicated.
+
+The built-in containers are traversed with an explicit stack, so deeply
+nested structures do not hit the recursion limit.
+
+With `in_place=True`, `freeze` may also seal a `dict` by wrapping it in a
+`MappingProxyType`, instead of copying it.  This avoids holding two copies
+of a large structure at once, but the caller must not mutate (or even use)
+the original after freezing it.  Objects with custom `freeze` methods can
+opt into this via `freezes_in_place(_memo)`.
+
 Future: Once `deepfrozen` is landed, this sort of thing should get nicer.
 """
+import enum
+import functools
+import itertools
+import operator
 from enum import Enum
 from types import MappingProxyType
 
+# Immutable, and never worth memoizing.
+_PRIMITIVE_TYPES = (bytes, Enum, float, int, str, type(None))
+# Like the built-in empty `tuple` and `frozenset`, share one empty mapping.
+_EMPTY_MAPPING = MappingProxyType({})
+
+
+class _FreezeMemo(dict):
+    "A `_memo` that also carries the `in_place` flag to custom `freeze`s."
+
+    __slots__ = ("in_place",)
+
+    def __init__(self, *, in_place: bool):
+        super().__init__()
+        self.in_place = in_place
+
+
+def freezes_in_place(_memo) -> bool:
+    "For custom `freeze` methods: may they seal containers in place?"
+    return getattr(_memo, "in_place", False)
+
+
+class _Kind(enum.Enum):
+    CUSTOM = 1  # Has a `freeze` method
+    DICT = 2
+    MAPPING_PROXY = 3
+    NAMEDTUPLE = 4
+    TUPLE = 5
+    LIST = 6
+    FROZENSET = 7
+    SET = 8
+
+
+_MAPPING_KINDS = (_Kind.DICT, _Kind.MAPPING_PROXY)
+_IMMUTABLE_KINDS = (_Kind.NAMEDTUPLE, _Kind.TUPLE, _Kind.FROZENSET)
+
+
+@functools.lru_cache(maxsize=None)
+def _kind(t: type) -> _Kind:
+    "We freeze many objects of few types, so classify each type just once."
+    if hasattr(t, "freeze"):
+        return _Kind.CUSTOM
+    # This is a lame-o way of identifying `NamedTuple`s. Using `deepfrozen`
+    # would avoid this kludge.
+    if (
+        issubclass(t, tuple)
+        and hasattr(t, "_replace")
+        and hasattr(t, "_fields")
+        and hasattr(t, "_make")
+    ):
+        return _Kind.NAMEDTUPLE
+    for base, kind in (
+        (dict, _Kind.DICT),
+        (MappingProxyType, _Kind.MAPPING_PROXY),
+        (tuple, _Kind.TUPLE),
+        (list, _Kind.LIST),
+        (frozenset, _Kind.FROZENSET),
+        (set, _Kind.SET),
+    ):
+        if issubclass(t, base):
+            return kind
+    raise NotImplementedError(t)
 
-def freeze(obj, *, _memo=None, **kwargs):
+
+def _unfrozen_children(obj, kind: _Kind, _memo):
+    "The items that must be frozen before `obj` can be."
+    return [
+        c
+        for c in (
+            itertools.chain.from_iterable(obj.items())
+            if kind in _MAPPING_KINDS
+            else obj
+        )
+        if not isinstance(c, _PRIMITIVE_TYPES) and id(c) not in _memo
+    ]
+
+
+def _freeze_mapping(obj, kind: _Kind, _memo):
+    if kind is _Kind.DICT and not freezes_in_place(_memo):
+        if not obj:
+            return _EMPTY_MAPPING
+        return MappingProxyType(
+            {
+                (k if isinstance(k, _PRIMITIVE_TYPES) else _memo[id(k)]): (
+                    v if isinstance(v, _PRIMITIVE_TYPES) else _memo[id(v)]
+                )
+                for k, v in obj.items()
+            }
+        )
+    # Reuse `obj` where possible, so check which items were already frozen.
+    keys = list(obj.keys())
+    values = list(obj.values())
+    frozen_keys = [
+        k if isinstance(k, _PRIMITIVE_TYPES) else _memo[id(k)] for k in keys
+    ]
+    frozen_values = [
+        v if isinstance(v, _PRIMITIVE_TYPES) else _memo[id(v)] for v in values
+    ]
+    if all(map(operator.is_, keys, frozen_keys)):
+        if all(map(operator.is_, values, frozen_values)):
+            if kind is _Kind.MAPPING_PROXY:
+                return obj  # Assume no-one else can write to its `dict`
+            return MappingProxyType(obj)  # `freezes_in_place` is set
+        elif kind is _Kind.DICT:  # `freezes_in_place` is set
+            for k, v, fv in zip(keys, values, frozen_values):
+                if v is not fv:
+                    obj[k] = fv
+            return MappingProxyType(obj)
+    return MappingProxyType(dict(zip(frozen_keys, frozen_values)))
+
+
+def _freeze_from_children(obj, kind: _Kind, _memo):
+    "Builds the frozen variant of `obj`, once all its children are frozen."
+    if kind in _MAPPING_KINDS:
+        return _freeze_mapping(obj, kind, _memo)
+    items = [
+        i if isinstance(i, _PRIMITIVE_TYPES) else _memo[id(i)] for i in obj
+    ]
+    if kind in _IMMUTABLE_KINDS and all(map(operator.is_, obj, items)):
+        return obj
+    if kind is _Kind.NAMEDTUPLE:
+        return obj._make(items)
+    if kind in (_Kind.TUPLE, _Kind.LIST):
+        return tuple(items)
+    return frozenset(items)
+
+
+def freeze(obj, *, _memo=None, in_place: bool = False, **kwargs):
     # Don't bother memoizing primitive types
-    if isinstance(obj, (bytes, Enum, float, int, str, type(None))):
+    if isinstance(obj, _PRIMITIVE_TYPES):
         return obj
 
     if _memo is None:
-        _memo = {}
+        _memo = _FreezeMemo(in_place=in_place)
+    else:
+        assert not in_place, "Pass `in_place` only to the outermost `freeze`"
 
     if id(obj) in _memo:  # Already frozen?
         return _memo[id(obj)]
 
-    if hasattr(obj, "freeze"):
+    kind = _kind(type(obj))
+    if kind is _Kind.CUSTOM:
         frozen = obj.freeze(_memo=_memo, **kwargs)
     else:
         # At the moment, I don't have a need for passing extra data into
         # items that live inside containers.  If we're relaxing this, just
-        # be sure to add `**kwargs` to each `freeze()` call below.
+        # be sure to pass `**kwargs` to the `freeze` methods called below.
         assert kwargs == {}, kwargs
-        # This is a lame-o way of identifying `NamedTuple`s. Using
-        # `deepfrozen` would avoid this kludge.
-        if (
-            isinstance(obj, tuple)
-            and hasattr(obj, "_replace")
-            and hasattr(obj, "_fields")
-            and hasattr(obj, "_make")
-        ):
-            frozen = obj._make(freeze(i, _memo=_memo) for i in obj)
-        elif isinstance(obj, (list, tuple)):
-            frozen = tuple(freeze(i, _memo=_memo) for i in obj)
-        elif isinstance(obj, dict):
-            frozen = MappingProxyType(
-                {
-                    freeze(k, _memo=_memo): freeze(v, _memo=_memo)
-                    for k, v in obj.items()
-                }
-            )
-        elif isinstance(obj, (set, frozenset)):
-            frozen = frozenset(freeze(i, _memo=_memo) for i in obj)
-        else:
-            raise NotImplementedError(type(obj))
-
+        unfrozen_children = _unfrozen_children(obj, kind, _memo)
+        if unfrozen_children:
+            _freeze_children(obj, unfrozen_children, _memo)
+        frozen = _freeze_from_children(obj, kind, _memo)
     _memo[id(obj)] = frozen
     return frozen
+
+
+def _freeze_children(obj, unfrozen_children, _memo) -> None:
+    """
+    Memoizes the frozen variants of all of `obj`'s descendants, via a
+    post-order traversal.  Each entry on the stack is `(item,
+    children_are_frozen)`, and we push the children in reverse, so that
+    they get frozen in the same order as they would have by recursion.
+    """
+    in_progress = {id(obj)}
+    stack = [(c, False) for c in reversed(unfrozen_children)]
+    while stack:
+        item, children_are_frozen = stack.pop()
+        if id(item) in _memo:  # E.g. an item referenced twice
+            continue
+        kind = _kind(type(item))
+        if children_are_frozen:
+            in_progress.remove(id(item))
+        elif kind is _Kind.CUSTOM:
+            _memo[id(item)] = item.freeze(_memo=_memo)
+            continue
+        else:
+            unfrozen_children = _unfrozen_children(item, kind, _memo)
+            if unfrozen_children:
+                if id(item) in in_progress:
+                    raise RuntimeError(f"Cannot freeze self-referential {item}")
+                in_progress.add(id(item))
+                stack.append((item, True))
+                stack.extend((c, False) for c in reversed(unfrozen_children))
+                continue
+        _memo[id(item)] = _freeze_from_children(item, kind, _memo)
@@ -30,15 +30,48 @@ Future: with `deepfrozen` done, it would be simplest to merge
 `IncompleteInode` with `Inode`, and just have `apply_item` return a
 partly-modified copy, in the style of `NamedTuple._replace`.
 """
+import functools
 import itertools
 import stat
 from abc import ABC
-from typing import Dict, Optional, Sequence, Type
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
 
 from .extent import Extent
 from .freeze import freeze
 from .inode import Chunk, Inode, InodeOwner, InodeUtimes
 from .parse_dump import SendStreamItem, SendStreamItems
+from .send_stream import item_fields
+
+
+# Large images repeat a handful of owners, xattr names, and xattr values
+# (e.g. SELinux labels) on almost every inode.  Storing one shared copy of
+# each saves a sizable fraction of the RAM per inode.  The caches are
+# bounded, so unusual images only lose the sharing, and we skip big values,
+# which are rarely repeated, and which the cache would keep alive.
+_MAX_INTERNED_XATTR_LEN = 256
+
+
+@functools.lru_cache(maxsize=4096)
+def _intern_owner(uid: int, gid: int) -> InodeOwner:
+    return InodeOwner(uid=uid, gid=gid)
+
+
+@functools.lru_cache(maxsize=4096)
+def _intern_bytes(b: bytes) -> bytes:
+    return b
+
+
+def _maybe_intern_xattr(b: bytes) -> bytes:
+    return _intern_bytes(b) if len(b) <= _MAX_INTERNED_XATTR_LEN else b
 
 
 class IncompleteInode(ABC):
@@ -59,6 +92,9 @@ class IncompleteInode(ABC):
     # If any of these are None, the filesystem was created badly.
     # Exception: symlinks don't have permissions.
 
+    # We keep one of these per inode, so skip the per-instance `__dict__`.
+    __slots__ = ("file_type", "mode", "owner", "utimes", "xattrs")
+
     def __init__(self, *, item: SendStreamItem):
         assert isinstance(item, self.INITIAL_ITEM)
         self.file_type = self.FILE_TYPE
@@ -87,25 +123,50 @@ class IncompleteInode(ABC):
         }
 
     def apply_item(self, item: SendStreamItem) -> None:
-        assert not isinstance(item, SendStreamItems.clone), "Do .apply_clone()"
-        if isinstance(item, SendStreamItems.remove_xattr):
-            del self.xattrs[item.name]
-        elif isinstance(item, SendStreamItems.set_xattr):
-            self.xattrs[item.name] = item.data
-        elif isinstance(item, SendStreamItems.chmod):
-            if stat.S_IFMT(item.mode) != 0:
-                raise RuntimeError(
-                    f"{item} cannot change file type bits of {self}"
-                )
-            self.mode = item.mode
-        elif isinstance(item, SendStreamItems.chown):
-            self.owner = InodeOwner(uid=item.uid, gid=item.gid)
-        elif isinstance(item, SendStreamItems.utimes):
-            self.utimes = InodeUtimes(
-                ctime=item.ctime, mtime=item.mtime, atime=item.atime
+        self.apply_fields(type(item), item_fields(item))
+
+    def apply_fields(
+        self, item_type: Type[SendStreamItem], fields: Tuple[Any, ...]
+    ) -> None:
+        """
+        Same as `apply_item(item_type(*fields))`, but does not construct
+        the item, see `parse_send_stream_fields`.
+        """
+        apply_fn = self._ITEM_TYPE_TO_APPLY.get(item_type)
+        if apply_fn is None:
+            assert item_type is not SendStreamItems.clone, "Do .apply_clone()"
+            raise RuntimeError(f"{self} cannot apply {item_type(*fields)}")
+        apply_fn(self, *fields)
+
+    # Each `_apply_<item>` takes the fields of that item, in order.
+
+    def _apply_remove_xattr(self, path: bytes, name: bytes) -> None:
+        del self.xattrs[name]
+
+    def _apply_set_xattr(self, path: bytes, name: bytes, data: bytes) -> None:
+        self.xattrs[_maybe_intern_xattr(name)] = _maybe_intern_xattr(data)
+
+    def _apply_chmod(self, path: bytes, mode: int) -> None:
+        if stat.S_IFMT(mode) != 0:
+            raise RuntimeError(
+                f"{SendStreamItems.chmod(path, mode)} cannot change file "
+                f"type bits of {self}"
             )
-        else:
-            raise RuntimeError(f"{self} cannot apply {item}")
+        self.mode = mode
+
+    def _apply_chown(self, path: bytes, gid: int, uid: int) -> None:
+        self.owner = _intern_owner(uid, gid)
+
+    def _apply_utimes(self, path: bytes, atime, mtime, ctime) -> None:
+        self.utimes = InodeUtimes(ctime=ctime, mtime=mtime, atime=atime)
+
+    _ITEM_TYPE_TO_APPLY: Mapping[Type[SendStreamItem], Callable] = {
+        SendStreamItems.remove_xattr: _apply_remove_xattr,
+        SendStreamItems.set_xattr: _apply_set_xattr,
+        SendStreamItems.chmod: _apply_chmod,
+        SendStreamItems.chown: _apply_chown,
+        SendStreamItems.utimes: _apply_utimes,
+    }
 
     def apply_clone(
         self, item: SendStreamItems.clone, from_ino: "IncompleteInode"
@@ -117,6 +178,8 @@ class IncompleteInode(ABC):
 
 
 class IncompleteDir(IncompleteInode):
+    __slots__ = ()
+
     FILE_TYPE = stat.S_IFDIR
     INITIAL_ITEM = SendStreamItems.mkdir
 
@@ -124,6 +187,8 @@ class IncompleteDir(IncompleteInode):
 class IncompleteFile(IncompleteInode):
     extent: Extent
 
+    __slots__ = ("extent",)
+
     FILE_TYPE = stat.S_IFREG
     INITIAL_ITEM = SendStreamItems.mkfile
 
@@ -140,17 +205,21 @@ class IncompleteFile(IncompleteInode):
             **super()._freeze_kwargs(_memo=_memo, chunks=chunks),
         }
 
-    def apply_item(self, item: SendStreamItem) -> None:
-        if isinstance(item, SendStreamItems.truncate):
-            self.extent = self.extent.truncate(length=item.size)
-        elif isinstance(item, SendStreamItems.write):
-            self.extent = self.extent.write(
-                offset=item.offset, length=len(item.data)
-            )
-        elif isinstance(item, SendStreamItems.update_extent):
-            self.extent = self.extent.write(offset=item.offset, length=item.len)
-        else:
-            super().apply_item(item=item)
+    def _apply_truncate(self, path: bytes, size: int) -> None:
+        self.extent = self.extent.truncate(length=size)
+
+    def _apply_write(self, path: bytes, offset: int, data) -> None:
+        self.extent = self.extent.write(offset=offset, length=len(data))
+
+    def _apply_update_extent(self, path: bytes, offset: int, len: int) -> None:
+        self.extent = self.extent.write(offset=offset, length=len)
+
+    _ITEM_TYPE_TO_APPLY = {
+        **IncompleteInode._ITEM_TYPE_TO_APPLY,
+        SendStreamItems.truncate: _apply_truncate,
+        SendStreamItems.write: _apply_write,
+        SendStreamItems.update_extent: _apply_update_extent,
+    }
 
     def apply_clone(
         self, item: SendStreamItems.clone, from_ino: IncompleteInode
@@ -196,11 +265,15 @@ class IncompleteFile(IncompleteInode):
 
 
 class IncompleteSocket(IncompleteInode):
+    __slots__ = ()
+
     FILE_TYPE = stat.S_IFSOCK
     INITIAL_ITEM = SendStreamItems.mksock
 
 
 class IncompleteFifo(IncompleteInode):
+    __slots__ = ()
+
     FILE_TYPE = stat.S_IFIFO
     INITIAL_ITEM = SendStreamItems.mkfifo
 
@@ -208,6 +281,9 @@ class IncompleteFifo(IncompleteInode):
 class IncompleteDevice(IncompleteInode):
     dev: int
 
+    # Unlike other inode types, the file type varies per instance.
+    __slots__ = ("dev", "FILE_TYPE")
+
     INITIAL_ITEM = SendStreamItems.mknod
 
     def __init__(self, *, item: SendStreamItem):
@@ -234,6 +310,8 @@ class IncompleteDevice(IncompleteInode):
 class IncompleteSymlink(IncompleteInode):
     dest: bytes
 
+    __slots__ = ("dest",)
+
     FILE_TYPE = stat.S_IFLNK
     INITIAL_ITEM = SendStreamItems.symlink
 
@@ -251,8 +329,12 @@ class IncompleteSymlink(IncompleteInode):
             **super()._freeze_kwargs(_memo=_memo, chunks=chunks),
         }
 
-    def apply_item(self, item: SendStreamItem) -> None:
-        if isinstance(item, SendStreamItems.chmod):
-            raise RuntimeError(f"{item} cannot chmod symlink {self}")
-        else:
-            super().apply_item(item=item)
+    def _apply_chmod(self, path: bytes, mode: int) -> None:
+        raise RuntimeError(
+            f"{SendStreamItems.chmod(path, mode)} cannot chmod symlink {self}"
+        )
+
+    _ITEM_TYPE_TO_APPLY = {
+        **IncompleteInode._ITEM_TYPE_TO_APPLY,
+        SendStreamItems.chmod: _apply_chmod,
+    }
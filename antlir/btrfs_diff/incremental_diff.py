@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Answers "what changed between a parent layer and its child?", given the
+child's incremental send-stream (`btrfs send -p PARENT CHILD`).
+
+The parent must already be in a `SubvolumeSet`, e.g. via
+`apply_send_stream`.  We apply the incremental stream to a copy-on-write
+snapshot of the parent, noting every inode that the stream touches.  Then,
+we compare just those inodes with their counterparts in the parent.  Since
+nothing is frozen or rendered, the cost of the diff is proportional to the
+size of the incremental stream, not to that of the image.
+
+The result is a sorted list of `Change`s:
+
+  - ADDED / REMOVED: a directory entry that exists only in the child /
+    the parent.  When an entry is removed, and re-added with the same file
+    type, we instead compare the two inodes as below -- e.g. `btrfs send`
+    replaces a file by writing a new one under a temporary name, and
+    renaming it over the old one.
+
+  - RENAMED: the only directory entry of an inode has a new name, or a
+    new parent directory.  Renaming a directory does not change the
+    entries of its descendants, so we do not report them.  Inodes with
+    several entries (hardlinks) instead get ADDED & REMOVED.
+
+  - MODIFIED_METADATA: the mode, owner, times, xattrs, or device number
+    differ.  Note that `btrfs send` updates the times of every directory
+    whose entries changed.
+
+  - MODIFIED_CONTENT: the data of a file was written, truncated, or cloned
+    into, or a symlink now points elsewhere.  We do not compare the data
+    itself, so rewriting the same bytes also counts as a change.
+
+An inode that changed on multiple counts gets one `Change` per count, and
+the ones with several paths get a `Change` per path.
+"""
+import enum
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
+
+from .incomplete_inode import (
+    IncompleteFile,
+    IncompleteInode,
+    IncompleteSymlink,
+)
+from .inode import Inode
+from .inode_id import InodeID, InodeIDMap
+from .parse_send_stream import parse_send_stream_fields
+from .send_stream import SendStreamItem, SendStreamItems
+from .subvolume import Subvolume
+from .subvolume_set import (
+    apply_send_stream,
+    SubvolumeSet,
+    SubvolumeSetMutator,
+)
+
+
+class ChangeKind(enum.Enum):
+    ADDED = 1
+    REMOVED = 2
+    RENAMED = 3
+    MODIFIED_METADATA = 4
+    MODIFIED_CONTENT = 5
+
+    # Like `Extent.Kind`, make the `repr` `eval`able.
+    def __repr__(self):
+        return f"ChangeKind.{self.name}"
+
+
+class Change(NamedTuple):
+    kind: ChangeKind
+    path: bytes
+    # Only set for `RENAMED`
+    old_path: Optional[bytes] = None
+
+
+# Items whose `dest` is a path in the same subvolume, which they touch.
+_ITEMS_WITH_DEST = (SendStreamItems.rename, SendStreamItems.link)
+
+
+def _metadata(ino: Union[IncompleteInode, Inode]) -> Tuple[Any, ...]:
+    return (
+        ino.mode,
+        ino.owner,
+        ino.utimes,
+        ino.xattrs,
+        getattr(ino, "dev", None),
+    )
+
+
+def _content_changed(
+    old_ino: Union[IncompleteInode, Inode],
+    new_ino: Union[IncompleteInode, Inode],
+) -> bool:
+    if isinstance(old_ino, IncompleteFile):
+        # `Extent`s compare by structure, which ignores what was written.
+        # But, they are immutable, and a snapshot's copy of an inode
+        # shares its `Extent` until the data changes.
+        return old_ino.extent is not new_ino.extent
+    if isinstance(old_ino, IncompleteSymlink):
+        return old_ino.dest != new_ino.dest
+    return False
+
+
+def _gen_inode_changes(
+    path: bytes,
+    old_ino: Union[IncompleteInode, Inode],
+    new_ino: Union[IncompleteInode, Inode],
+) -> Iterator[Change]:
+    if _metadata(old_ino) != _metadata(new_ino):
+        yield Change(kind=ChangeKind.MODIFIED_METADATA, path=path)
+    if _content_changed(old_ino, new_ino):
+        yield Change(kind=ChangeKind.MODIFIED_CONTENT, path=path)
+
+
+# A directory entry, as `(directory inode number, name)`.  Unlike paths,
+# these are comparable between the parent and the child, even when the
+# child renamed a directory.
+_Entry = Tuple[int, bytes]
+
+
+def _entries(id_map: InodeIDMap, paths: Iterable[bytes]) -> Dict[_Entry, bytes]:
+    "Maps each entry of an inode to its path."
+    entries = {}
+    for path in paths:
+        dirname, _, name = path.rpartition(b"/")
+        entries[id_map.get_id(dirname or b".").id, name] = path
+    return entries
+
+
+def _diff_touched_inodes(
+    parent: Subvolume, child: Subvolume, touched_ids: Iterable[int]
+) -> List[Change]:
+    changes = []
+    # Entries whose inodes are only in the parent, or only in the child.
+    removed: Dict[_Entry, Tuple[bytes, Union[IncompleteInode, Inode]]] = {}
+    added: Dict[_Entry, Tuple[bytes, Union[IncompleteInode, Inode]]] = {}
+    for num in touched_ids:
+        old_id = InodeID(id=num, inner_id_map=parent.id_map.inner)
+        new_id = InodeID(id=num, inner_id_map=child.id_map.inner)
+        old_ino = parent.id_to_inode.get(old_id)
+        new_ino = child.id_to_inode.get(new_id)
+        new_paths = (
+            () if new_ino is None else sorted(child.id_map.get_paths(new_id))
+        )
+        old_entries = _entries(
+            parent.id_map,
+            () if old_ino is None else parent.id_map.get_paths(old_id),
+        )
+        new_entries = _entries(child.id_map, new_paths)
+        if len(old_entries) == 1 and len(new_entries) == 1:
+            ((old_entry, old_path),) = old_entries.items()
+            ((new_entry, new_path),) = new_entries.items()
+            if old_entry != new_entry:
+                changes.append(
+                    Change(
+                        kind=ChangeKind.RENAMED,
+                        path=new_path,
+                        old_path=old_path,
+                    )
+                )
+        else:
+            for entry, path in old_entries.items():
+                if entry not in new_entries:
+                    removed[entry] = (path, old_ino)
+            for entry, path in new_entries.items():
+                if entry not in old_entries:
+                    added[entry] = (path, new_ino)
+        if old_ino is not None and new_ino is not None:
+            for path in new_paths:
+                changes.extend(_gen_inode_changes(path, old_ino, new_ino))
+
+    for entry, (old_path, old_ino) in removed.items():
+        new_path, new_ino = added.pop(entry, (None, None))
+        if new_ino is None or old_ino.file_type != new_ino.file_type:
+            changes.append(Change(kind=ChangeKind.REMOVED, path=old_path))
+            if new_ino is not None:
+                changes.append(Change(kind=ChangeKind.ADDED, path=new_path))
+        else:  # Replaced by a new inode of the same type
+            changes.extend(_gen_inode_changes(new_path, old_ino, new_ino))
+    changes.extend(
+        Change(kind=ChangeKind.ADDED, path=path) for path, _ in added.values()
+    )
+    changes.sort(key=lambda c: (c.path, c.kind.value))
+    return changes
+
+
+def apply_incremental_fields(
+    subvol_set: SubvolumeSet,
+    fields_iter: Iterable[Tuple[Type[SendStreamItem], Tuple[Any, ...]]],
+) -> List[Change]:
+    """
+    Applies an incremental send-stream, in the `(item_type, fields)` form
+    of `parse_send_stream_fields`, to `subvol_set`, which must contain its
+    parent.  Returns the `Change`s relative to the parent.
+    """
+    fields_iter = iter(fields_iter)
+    for item_type, fields in fields_iter:
+        snapshot = item_type(*fields)
+        break
+    else:
+        raise RuntimeError("Incremental send-stream has no commands")
+    if not isinstance(snapshot, SendStreamItems.snapshot):
+        raise RuntimeError(f"{snapshot} is not an incremental send-stream")
+    mutator = SubvolumeSetMutator.new(subvol_set, snapshot)
+    parent = subvol_set.uuid_to_subvolume[snapshot.parent_uuid.decode()]
+    child = mutator.subvolume
+
+    touched_ids: Set[int] = set()
+    get_id = child.id_map.get_id
+    for item_type, fields in fields_iter:
+        # Note the inodes at the item's paths both before & after applying
+        # it, to see both the ones it deletes, and the ones it creates.
+        paths = fields[:2] if item_type in _ITEMS_WITH_DEST else fields[:1]
+        for path in paths:
+            ino_id = get_id(path)
+            if ino_id is not None:
+                touched_ids.add(ino_id.id)
+        mutator.apply_fields(item_type, fields)
+        for path in paths:
+            ino_id = get_id(path)
+            if ino_id is not None:
+                touched_ids.add(ino_id.id)
+    return _diff_touched_inodes(parent, child, sorted(touched_ids))
+
+
+def diff_send_streams(parent_infile, child_infile, **kwargs) -> List[Change]:
+    """
+    Returns the `Change`s that the incremental send-stream `child_infile`
+    makes to `parent_infile`, a full send-stream of its parent.  To diff
+    several children of one parent, use `apply_incremental_fields` with
+    a shared `SubvolumeSet`.  `kwargs` go to `parse_send_stream_fields`.
+    """
+    subvol_set = SubvolumeSet.new()
+    apply_send_stream(subvol_set, parent_infile, **kwargs)
+    return apply_incremental_fields(
+        subvol_set, parse_send_stream_fields(child_infile, **kwargs)
+    )
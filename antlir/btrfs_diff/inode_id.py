@@ -11,11 +11,17 @@ reason, InodeIDs are tightly integrated with a path mapping, which is used
 to represent the Inode instead of the underlying integer ID, whenever
 possible.
 """
+import copy
+import functools
 import itertools
 import os
-from collections import defaultdict, deque
+from collections import OrderedDict, deque
+from types import MappingProxyType
 from typing import (
     Any,
+    Callable,
+    FrozenSet,
+    Iterable,
     Iterator,
     Mapping,
     NamedTuple,
@@ -23,9 +29,10 @@ from typing import (
     Sequence,
     Set,
     Tuple,
+    Union,
 )
 
-from .freeze import freeze
+from .freeze import freeze, freezes_in_place
 
 
 def tail(n: int, iterable):
@@ -85,14 +92,30 @@ class InodeID(NamedTuple):
         )
 
 
-def _norm_split_path(p: bytes) -> Sequence[bytes]:
+# How many recently resolved directories each `InodeIDMap` remembers.
+_DIR_CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize=4096)
+def _intern_name(name: bytes) -> bytes:
+    """
+    Recently seen path components share one `bytes` object, which is then
+    also used by the `_PathEntry` maps and `_ReversePathEntry`s.
+    """
+    return name
+
+
+# Consecutive send-stream items usually operate on the same path, e.g. a
+# file gets created, written, chmod-ed, and renamed into place.
+@functools.lru_cache(maxsize=4096)
+def _norm_split_path(p: bytes) -> Tuple[bytes, ...]:
     # Check explicitly since the downstream errors are incomprehensible.
     if not isinstance(p, bytes):
         raise TypeError(f"Expected bytes, got {p}")
     p = os.path.normpath(p)
     if os.path.isabs(p):
         raise ValueError(f"Need relative path, got {p}")
-    return [] if p == b"." else p.split(b"/")
+    return () if p == b"." else tuple(map(_intern_name, p.split(b"/")))
 
 
 # forward declaration so that is_root() type checks
@@ -122,13 +145,28 @@ class _ReversePathEntry(NamedTuple):
 _ROOT_REVERSE_ENTRY = _ReversePathEntry(name=b"", parent_int_id=None)
 
 
+# Nearly every inode has exactly 1 path, so rather than wrap each entry in a
+# 1-element set, we store the entry alone.  Only hardlinked files get a set.
+_ReverseEntries = Union[_ReversePathEntry, FrozenSet[_ReversePathEntry]]
+
+
+def _iter_reverse_entries(
+    entries: _ReverseEntries,
+) -> Iterable[_ReversePathEntry]:
+    if isinstance(entries, _ReversePathEntry):
+        return (entries,)
+    return entries
+
+
 class _InnerInodeIDMap(NamedTuple):
     "Explained where `InodeIDMap.inner` is declared."
     description: Any  # repr()able, to be used for repr()ing InodeIDs
     # The key is not an `InodeID` to avoid a circular dependency.  The
-    # values correspond to different hardlinks to the same file inode.
-    # Directories will always have a single element in the set.
-    id_to_reverse_entries: Mapping[int, Set[_ReversePathEntry]]
+    # values correspond to different hardlinks to the same file inode, see
+    # `_ReverseEntries`.  Directories will always have a single entry.
+    #
+    # The values are immutable, so `InodeIDMap.snapshot` can share them.
+    id_to_reverse_entries: Mapping[int, _ReverseEntries]
 
     def _assert_mine(self, inode_id: InodeID) -> InodeID:
         if inode_id.inner_id_map is not self:
@@ -141,16 +179,18 @@ class _InnerInodeIDMap(NamedTuple):
     ) -> Iterator[bytes]:
         parent_id = rev_entry.parent_int_id
         assert parent_id is not None, "Never called with _ROOT_REVERSE_ENTRY"
-        (  # Directories don't have hardlink, so they have just 1 reverse entry
-            parent,
-        ) = self.id_to_reverse_entries[parent_id]
+        # Directories don't have hardlinks, so they have just 1 reverse entry
+        parent = self.id_to_reverse_entries[parent_id]
+        assert isinstance(parent, _ReversePathEntry), parent
         if not parent.is_root():
             yield from self._rev_entry_to_path(parent)
         yield rev_entry.name
 
     def gen_paths(self, inode_id: InodeID) -> Iterator[bytes]:
-        for rev_entry in self.id_to_reverse_entries.get(
-            self._assert_mine(inode_id).id, ()  # we tolerate anonymous inodes
+        for rev_entry in _iter_reverse_entries(
+            self.id_to_reverse_entries.get(
+                self._assert_mine(inode_id).id, ()  # tolerate anonymous inodes
+            )
         ):
             if rev_entry.is_root():
                 yield b"."
@@ -158,12 +198,76 @@ class _InnerInodeIDMap(NamedTuple):
                 yield b"/".join(self._rev_entry_to_path(rev_entry))
 
 
+class _ChildMap(dict):
+    """
+    The `name_to_child` of a directory `_PathEntry`.  A map may only mutate
+    the `_ChildMap`s whose `owner` is its current token, which is the
+    `owner` of its root.  `InodeIDMap.snapshot` gives both maps new tokens,
+    so the `_ChildMap`s that they share get copied on their next write.
+    """
+
+    __slots__ = ("owner",)
+
+    def __init__(self, owner: Any, *args):
+        super().__init__(*args)
+        self.owner = owner
+
+
+def _owner(name_to_child: Mapping[bytes, "_PathEntry"]) -> Any:
+    # Frozen maps have `MappingProxyType`s, which allow no mutation anyway.
+    return getattr(name_to_child, "owner", None)
+
+
 class _PathEntry(NamedTuple):
+    # Entries shared with a snapshot may hold an `InodeID` from the other
+    # map -- `InodeIDMap` always re-binds those before handing them out.
     id: InodeID
     # `None` -> the entry is a file, a mapping -> it's a directory.
     name_to_child: Optional[Mapping[bytes, "_PathEntry"]]
 
 
+def _freeze_entry(
+    root: _PathEntry, frozen_inner: _InnerInodeIDMap, *, seal_owner: Any
+) -> _PathEntry:
+    """
+    Returns a frozen copy of the tree at `root`, whose `InodeID`s refer to
+    `frozen_inner`.  A `_ChildMap` with the owner `seal_owner` is not shared
+    with any other map, so it is sealed in place instead of being copied.
+
+    Uses an explicit stack, since directory trees can be arbitrarily deep.
+    """
+    # A post-order traversal.  The frozen entries go on `frozen_entries`,
+    # where each directory finds the frozen entries of its children.
+    stack = [(root, False)]
+    frozen_entries = []
+    while stack:
+        entry, children_are_frozen = stack.pop()
+        ino_id = InodeID(id=entry.id.id, inner_id_map=frozen_inner)
+        name_to_child = entry.name_to_child
+        if name_to_child is None:
+            frozen_entries.append(_PathEntry(id=ino_id, name_to_child=None))
+            continue
+        if not children_are_frozen:
+            stack.append((entry, True))
+            stack.extend((c, False) for c in name_to_child.values())
+            continue
+        # We pushed the children in order, so they were frozen in reverse.
+        first = len(frozen_entries) - len(name_to_child)
+        frozen_children = reversed(frozen_entries[first:])
+        del frozen_entries[first:]
+        if seal_owner is not None and _owner(name_to_child) is seal_owner:
+            for name, frozen_child in zip(list(name_to_child), frozen_children):
+                name_to_child[name] = frozen_child
+            frozen_map = name_to_child
+        else:
+            frozen_map = dict(zip(name_to_child, frozen_children))
+        frozen_entries.append(
+            _PathEntry(id=ino_id, name_to_child=MappingProxyType(frozen_map))
+        )
+    (frozen_root,) = frozen_entries
+    return frozen_root
+
+
 class InodeIDMap(NamedTuple):
     """
     Path -> Inode mapping, represents the directory structure of a filesystem.
@@ -188,36 +292,105 @@ class InodeIDMap(NamedTuple):
     # necessary so that our `freeze()` can make a recursively-immutable
     # variant of `InodeIDMap`.
     inner: _InnerInodeIDMap
+    # An LRU of path components -> directory `_PathEntry`, which lets us
+    # skip walking from the root to the parent of each path.  Any change
+    # that replaces or removes a directory entry clears it.  It is `None`
+    # for frozen maps.
+    dir_cache: Optional["OrderedDict[Tuple[bytes, ...], _PathEntry]"]
 
     @classmethod
     def new(cls, *, description: Any = ""):
         inner = _InnerInodeIDMap(
-            description=description, id_to_reverse_entries=defaultdict(set)
+            description=description, id_to_reverse_entries={}
         )
         counter = itertools.count()
         self = cls(
             inode_id_counter=counter,
             root=_PathEntry(
                 id=InodeID(id=next(counter), inner_id_map=inner),
-                name_to_child={},
+                name_to_child=_ChildMap(object()),
             ),
             inner=inner,
+            dir_cache=OrderedDict(),
         )
-        self.inner.id_to_reverse_entries[self.root.id.id].add(
-            _ROOT_REVERSE_ENTRY
-        )
+        self.inner.id_to_reverse_entries[self.root.id.id] = _ROOT_REVERSE_ENTRY
         return self
 
     def freeze(self, *, _memo):
         "Returns a recursively immutable copy of `self`."
-        return self._make(
-            freeze(i, _memo=_memo)  # can't add IDs once frozen
-            for i in self._replace(inode_id_counter=None)
+        inner = freeze(self.inner, _memo=_memo)
+        return type(self)(
+            inode_id_counter=None,  # can't add IDs once frozen
+            # Not a plain `freeze`, since entries shared with a snapshot
+            # may hold `InodeID`s of the other map.
+            root=_freeze_entry(
+                self.root,
+                inner,
+                seal_owner=_owner(self.root.name_to_child)
+                if freezes_in_place(_memo)
+                else None,
+            ),
+            inner=inner,
+            dir_cache=None,
         )
 
+    def snapshot(self, *, description: Any) -> "InodeIDMap":
+        """
+        Returns a map with the same paths & inode IDs as `self`, but a new
+        `description`, like `deepcopy` would.  Instead of copying, the two
+        maps share all their structure except for the root directory, and
+        each copies a shared directory (along with its ancestors) when it
+        first modifies it.  So, a snapshot costs O(number of inodes) for
+        one shallow copy of `id_to_reverse_entries`, and not a deep copy
+        of the whole tree.
+        """
+        inner = _InnerInodeIDMap(
+            description=description,
+            id_to_reverse_entries=dict(self.inner.id_to_reverse_entries),
+        )
+        snapshot = type(self)(
+            # Continue counting where `self` is, just as `deepcopy` would
+            inode_id_counter=copy.copy(self.inode_id_counter),
+            root=_PathEntry(
+                id=InodeID(id=self.root.id.id, inner_id_map=inner),
+                name_to_child=_ChildMap(object(), self.root.name_to_child),
+            ),
+            inner=inner,
+            dir_cache=OrderedDict(),
+        )
+        # From now on, `self` may not modify the directories it shared.
+        self.root.name_to_child.owner = object()
+        return snapshot
+
     def next(self) -> InodeID:
         return InodeID(id=next(self.inode_id_counter), inner_id_map=self.inner)
 
+    def _bind(self, inode_id: InodeID) -> InodeID:
+        "Maps an `InodeID` from a shared `_PathEntry` to our own."
+        if inode_id.inner_id_map is self.inner:
+            return inode_id
+        return InodeID(id=inode_id.id, inner_id_map=self.inner)
+
+    def _own_dir(self, parts: Sequence[bytes]) -> _PathEntry:
+        """
+        Returns the existing directory at `parts`, after copying any
+        directories on its path that we share with a snapshot, so that
+        the caller may mutate its `name_to_child`.
+        """
+        owner = _owner(self.root.name_to_child)
+        entry = self.root
+        for name in parts:
+            child = entry.name_to_child[name]
+            if _owner(child.name_to_child) is not owner:
+                child = _PathEntry(
+                    id=self._bind(child.id),
+                    name_to_child=_ChildMap(owner, child.name_to_child),
+                )
+                entry.name_to_child[name] = child
+                self.dir_cache.clear()  # It may hold the replaced entry
+            entry = child
+        return entry
+
     def _gen_entries(
         self, parts: Sequence[bytes]
     ) -> Iterator[Optional[_PathEntry]]:
@@ -234,6 +407,39 @@ class InodeIDMap(NamedTuple):
                 # this differently.  A last value of `None` is a sentinel.
                 break
 
+    def _get_dir_entry(self, parts: Sequence[bytes]) -> Optional[_PathEntry]:
+        """
+        Like `tail(1, self._gen_entries(parts))`, but remembers the
+        directories it resolved in `dir_cache`.
+        """
+        cache = self.dir_cache
+        if cache is not None:
+            entry = cache.get(parts)
+            if entry is not None:
+                cache.move_to_end(parts)
+                return entry
+        (entry,) = tail(1, self._gen_entries(parts))
+        if (
+            cache is not None
+            and entry is not None
+            and entry.name_to_child is not None
+        ):
+            cache[parts] = entry
+            if len(cache) > _DIR_CACHE_SIZE:
+                cache.popitem(last=False)
+        return entry
+
+    def _get_parent_and_entry(
+        self, parts: Sequence[bytes]
+    ) -> Tuple[Optional[_PathEntry], Optional[_PathEntry]]:
+        "Contract: never call this on the root, aka empty `parts`"
+        parent = self._get_dir_entry(parts[:-1])
+        if parent is None:
+            return None, None
+        if parent.name_to_child is None:
+            raise RuntimeError(f"{parts[-1]}'s parent in {parts} is a file")
+        return parent, parent.name_to_child.get(parts[-1])
+
     def _get_parts_parent_and_entry(
         self, path: bytes
     ) -> Tuple[Sequence[bytes], _PathEntry, _PathEntry]:
@@ -241,7 +447,7 @@ class InodeIDMap(NamedTuple):
         parts = _norm_split_path(path)
         if not parts:
             raise RuntimeError("Cannot remove the root path")
-        parent, entry = tail(2, self._gen_entries(parts))
+        parent, entry = self._get_parent_and_entry(parts)
         if entry is None:
             raise RuntimeError(f"Cannot remove non-existent {path}")
         return parts, parent, entry
@@ -255,7 +461,13 @@ class InodeIDMap(NamedTuple):
         return ino_id
 
     def add_dir(self, ino_id: InodeID, path: bytes) -> InodeID:
-        self._add_path(_PathEntry(id=ino_id, name_to_child={}), path)
+        self._add_path(
+            _PathEntry(
+                id=ino_id,
+                name_to_child=_ChildMap(_owner(self.root.name_to_child)),
+            ),
+            path,
+        )
         return ino_id
 
     def _add_path(self, entry: _PathEntry, path: bytes) -> None:
@@ -272,7 +484,7 @@ class InodeIDMap(NamedTuple):
             break  # It's enough to check 1 entry
 
         parts = _norm_split_path(path)
-        (parent,) = tail(1, self._gen_entries(parts[:-1]))
+        parent = self._get_dir_entry(parts[:-1])
         if parent is None:
             raise RuntimeError(f"Missing ancestor for {path}")
         if parent.name_to_child is None:
@@ -285,11 +497,18 @@ class InodeIDMap(NamedTuple):
             )
 
         reverse_parent = self.inner.id_to_reverse_entries.get(parent.id.id)
-        assert isinstance(reverse_parent, set) and len(reverse_parent) == 1
+        assert isinstance(reverse_parent, _ReversePathEntry), reverse_parent
 
+        if _owner(parent.name_to_child) is not _owner(self.root.name_to_child):
+            parent = self._own_dir(parts[:-1])
         parent.name_to_child[parts[-1]] = entry
-        self.inner.id_to_reverse_entries[entry.id.id].add(
-            _ReversePathEntry(name=parts[-1], parent_int_id=parent.id.id)
+        id_to_rev = self.inner.id_to_reverse_entries
+        rev = _ReversePathEntry(name=parts[-1], parent_int_id=parent.id.id)
+        prev_revs = id_to_rev.get(entry.id.id)
+        id_to_rev[entry.id.id] = (
+            rev
+            if prev_revs is None
+            else frozenset(_iter_reverse_entries(prev_revs)) | {rev}
         )
 
     def remove_path(self, path: bytes) -> InodeID:
@@ -307,9 +526,8 @@ class InodeIDMap(NamedTuple):
                 return False  # `parts` is longer than the path to the root
             if part != reverse_entry.name:
                 return False  # Different paths
-            entries = self.inner.id_to_reverse_entries.get(maybe_id)
-            assert isinstance(entries, set) and len(entries) == 1
-            (reverse_entry,) = entries
+            reverse_entry = self.inner.id_to_reverse_entries.get(maybe_id)
+            assert isinstance(reverse_entry, _ReversePathEntry), reverse_entry
         # Since `parts` never has a component corresponding to the root
         # inode, if we got this far, it must be that all of `parts` had a
         # name match.
@@ -342,14 +560,28 @@ class InodeIDMap(NamedTuple):
         maybe_map = parent.name_to_child
         assert maybe_map is not None, "parent must have name_to_child map"
 
+        if _owner(maybe_map) is not _owner(self.root.name_to_child):
+            maybe_map = self._own_dir(parts[:-1]).name_to_child
         del maybe_map[parts[-1]]
+        if entry.name_to_child is not None:
+            self.dir_cache.clear()  # The paths under `entry` are now stale
 
-        entries = self.inner.id_to_reverse_entries[entry.id.id]
+        rev_entries = self.inner.id_to_reverse_entries[entry.id.id]
+        if isinstance(rev_entries, _ReversePathEntry):
+            # Not a hardlink, so no need to check that it matches `parts`.
+            del self.inner.id_to_reverse_entries[entry.id.id]
+            return entry._replace(id=self._bind(entry.id))
+        entries = set(rev_entries)
         entries.remove(self._matching_reverse_path_entry(entries, parts))
-        if not entries:
+        if len(entries) > 1:
+            self.inner.id_to_reverse_entries[entry.id.id] = frozenset(entries)
+        elif entries:
+            (self.inner.id_to_reverse_entries[entry.id.id],) = entries
+        else:
             del self.inner.id_to_reverse_entries[entry.id.id]
 
-        return entry
+        # `rename_path` re-adds the entry, so it must be ours.
+        return entry._replace(id=self._bind(entry.id))
 
     def rename_path(self, src: bytes, dest: bytes):
         """
@@ -366,8 +598,11 @@ class InodeIDMap(NamedTuple):
             self._add_path(entry, src)
             raise
 
-    def _get_entry(self, path: bytes) -> _PathEntry:
-        (entry,) = tail(1, self._gen_entries(_norm_split_path(path)))
+    def _get_entry(self, path: bytes) -> Optional[_PathEntry]:
+        parts = _norm_split_path(path)
+        if not parts:
+            return self.root
+        _parent, entry = self._get_parent_and_entry(parts)
         return entry
 
     def get_id(self, path: bytes) -> Optional[InodeID]:
@@ -376,7 +611,7 @@ class InodeIDMap(NamedTuple):
         contains a file as a non-final component.
         """
         entry = self._get_entry(path)
-        return None if entry is None else entry.id
+        return None if entry is None else self._bind(entry.id)
 
     def get_paths(self, inode_id: InodeID) -> Set[bytes]:
         return set(self.inner.gen_paths(inode_id))
@@ -398,3 +633,47 @@ class InodeIDMap(NamedTuple):
             return {
                 os.path.normpath(os.path.join(path, name)) for name in maybe_map
             }
+
+    def num_paths(self, inode_id: InodeID) -> int:
+        "Like `len(self.get_paths(inode_id))`, but without building paths."
+        entries = self.inner.id_to_reverse_entries.get(
+            self.inner._assert_mine(inode_id).id, ()
+        )
+        return 1 if isinstance(entries, _ReversePathEntry) else len(entries)
+
+    def gen_tree(
+        self, path: bytes = b".", *, sort_key: Optional[Callable] = None
+    ) -> Iterator[Tuple[int, bytes, InodeID, bool]]:
+        """
+        A pre-order traversal of the tree at `path`, yielding `(depth,
+        name, inode_id, is_dir)`.  The starting entry has depth 0 and the
+        name `path`.  If `sort_key` is set, the children of each directory
+        are visited in the order of `sort_key(name)`.
+
+        Unlike repeated `get_children` calls, this does not build paths or
+        look up each directory from the root.  It holds only the unvisited
+        siblings of the current entry's ancestors.  Do not mutate the map
+        while the traversal is running.
+        """
+        entry = self._get_entry(path)
+        assert entry is not None, f'"{path}" does not exist!'
+        stack = [(0, path, entry)]
+        while stack:
+            depth, name, entry = stack.pop()
+            name_to_child = entry.name_to_child
+            yield depth, name, self._bind(entry.id), name_to_child is not None
+            if name_to_child:
+                # Given a `sort_key`, push in reverse, so that the stack
+                # pops in order.  Otherwise, the order is unspecified.
+                stack.extend(
+                    (depth + 1, child_name, child)
+                    for child_name, child in (
+                        name_to_child.items()
+                        if sort_key is None
+                        else sorted(
+                            name_to_child.items(),
+                            key=lambda kv: sort_key(kv[0]),
+                            reverse=True,
+                        )
+                    )
+                )
@@ -58,10 +58,20 @@ Limitations of `btrfs receive --dump` (filed as T25376790):
    unravel the source of a clone when more than one source is in use.
 """
 import datetime
+import functools
 import os
 import re
 from collections import OrderedDict
-from typing import Any, BinaryIO, Dict, Iterable, Optional, Pattern, Tuple
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Optional,
+    Pattern,
+    Tuple,
+)
 
 from .send_stream import SendStreamItem, SendStreamItems
 
@@ -108,13 +118,30 @@ def unquote_btrfs_progs_path(s):
     custom un-quoting function.  Future: fix `btrfs-progs` so that other
     fields (paths & data) are quoted too.
     """
+    if b"\\" not in s:  # The common case
+        return s
+    # No escape sequence contains `/`, so we can un-quote the directory
+    # separately, and reuse that for all the paths in the same directory.
+    dirname, slash, basename = s.rpartition(b"/")
+    return _unquote_dirname(dirname) + slash + _unquote(basename)
+
+
+def _unquote(s: bytes) -> bytes:
     return _ESCAPED_REGEX.sub(lambda m: _ESCAPED_TO_UNESCAPED[m.group(0)], s)
 
 
+_unquote_dirname = functools.lru_cache(maxsize=1024)(_unquote)
+
+
 class RegexItemParser:
     "Almost all item types can be parsed with a single regex."
 
     regex: Pattern = re.compile(b"")
+    # `parse_btrfs_dump` does not use `regex`, but rather splits `details`
+    # on spaces into these `(field, b"key=", is_valid)`.  The last value
+    # may contain spaces, unless `is_valid` rejects them.  Both parsers
+    # must accept exactly the same lines.
+    fields: Tuple[Tuple[str, bytes, Callable[[bytes], bool]], ...] = ()
 
     @classmethod
     def parse_details(
@@ -141,8 +168,85 @@ class RegexItemParser:
             else None
         )
 
+    @classmethod
+    def split_details(
+        cls, subvol_name: bytes, details: bytes
+    ) -> Optional[Dict[str, Any]]:
+        "Same as `parse_details`, but using `fields` instead of `regex`."
+        fields = _field_parsers(cls)
+        if not fields:
+            return None if details else {}
+        values = details.split(b" ", len(fields) - 1)
+        if len(values) != len(fields):
+            return None
+        # Like `regex`, check the whole line before converting anything.
+        for (_name, key, is_valid, _conv, _context_conv), value in zip(
+            fields, values
+        ):
+            if not (value.startswith(key) and is_valid(value[len(key) :])):
+                return None
+        return {
+            name: (
+                conv(value[len(key) :])
+                if context_conv is None
+                else context_conv(
+                    conv(value[len(key) :]), subvol_name=subvol_name
+                )
+            )
+            for (name, key, _is_valid, conv, context_conv), value in zip(
+                fields, values
+            )
+        }
+
+
+@functools.lru_cache(maxsize=None)
+def _field_parsers(parser_type: type):
+    "Resolves the `conv_FIELD_NAME` methods just once per item type."
+    return tuple(
+        (
+            name,
+            key,
+            is_valid,
+            getattr(parser_type, f"conv_{name}", lambda x: x),
+            getattr(parser_type, f"context_conv_{name}", None),
+        )
+        for name, key, is_valid in parser_type.fields
+    )
 
-def _normalize_subvolume_path(s: bytes, *, subvol_name: bytes) -> bytes:
+
+# Validators for `RegexItemParser.fields`, matching the character classes
+# of the corresponding regexes.
+def _is_any(s: bytes) -> bool:
+    return True
+
+
+def _is_nonempty(s: bytes) -> bool:
+    return s != b""
+
+
+def _is_digits(s: bytes) -> bool:
+    return s.isdigit()  # ASCII-only for `bytes`
+
+
+def _is_octal(s: bytes) -> bool:
+    return s != b"" and not s.strip(b"01234567")
+
+
+def _is_hex(s: bytes) -> bool:
+    return s != b"" and not s.strip(b"0123456789abcdef")
+
+
+def _is_uuid(s: bytes) -> bool:
+    return s != b"" and not s.strip(b"-0123456789abcdef")
+
+
+def _is_word(s: bytes) -> bool:
+    return s != b"" and b" " not in s
+
+
+def _uncached_normalize_subvolume_path(
+    s: bytes, *, subvol_name: bytes
+) -> bytes:
     # `normpath` is needed since `btrfs receive --dump` is inconsistent
     # about trailing slashes on directory paths.
     stripped = os.path.relpath(s, subvol_name)
@@ -151,6 +255,24 @@ def _normalize_subvolume_path(s: bytes, *, subvol_name: bytes) -> bytes:
     return stripped
 
 
+_cached_relpath = functools.lru_cache(maxsize=1024)(os.path.relpath)
+
+
+def _normalize_subvolume_path(s: bytes, *, subvol_name: bytes) -> bytes:
+    """
+    `relpath` is slow, so we memoize it for the directory part of `s`.
+    This is only valid when the last component of `s` is a plain name.
+    """
+    dirname, _, basename = s.rpartition(b"/")
+    if not dirname or basename in (b"", b".", b".."):
+        return _uncached_normalize_subvolume_path(s, subvol_name=subvol_name)
+    stripped = _cached_relpath(dirname, subvol_name)
+    stripped = basename if stripped == b"." else stripped + b"/" + basename
+    if len(stripped) >= len(s) or stripped.startswith(b".."):
+        raise RuntimeError(f"{s} did not start with {subvol_name}")
+    return stripped
+
+
 def _from_octal(s: bytes) -> int:
     return int(s, base=8)
 
@@ -167,6 +289,10 @@ class SendStreamItemParsers:
         regex = re.compile(
             br"uuid=(?P<uuid>[-0-9a-f]+) " br"transid=(?P<transid>[0-9]+)"
         )
+        fields = (
+            ("uuid", b"uuid=", _is_uuid),
+            ("transid", b"transid=", _is_digits),
+        )
         conv_transid = staticmethod(int)
 
     class snapshot(RegexItemParser):
@@ -176,6 +302,12 @@ class SendStreamItemParsers:
             br"parent_uuid=(?P<parent_uuid>[-0-9a-f]+) "
             br"parent_transid=(?P<parent_transid>[0-9]+)"
         )
+        fields = (
+            ("uuid", b"uuid=", _is_uuid),
+            ("transid", b"transid=", _is_digits),
+            ("parent_uuid", b"parent_uuid=", _is_uuid),
+            ("parent_transid", b"parent_transid=", _is_digits),
+        )
         conv_transid = staticmethod(int)
         conv_parent_transid = staticmethod(int)
 
@@ -187,6 +319,7 @@ class SendStreamItemParsers:
 
     class mknod(RegexItemParser):
         regex = re.compile(br"mode=(?P<mode>[0-7]+) dev=0x(?P<dev>[0-9a-f]+)")
+        fields = (("mode", b"mode=", _is_octal), ("dev", b"dev=0x", _is_hex))
         conv_mode = staticmethod(_from_octal)
 
         @staticmethod
@@ -205,15 +338,18 @@ class SendStreamItemParsers:
         # process it at all.  Unfortunately, `dest` is not quoted in
         # `send-dump.c`.
         regex = re.compile(br"dest=(?P<dest>.*)")
+        fields = (("dest", b"dest=", _is_any),)
 
     class rename(RegexItemParser):
         # This path is not quoted in `send-dump.c`
         regex = re.compile(br"dest=(?P<dest>.*)")
+        fields = (("dest", b"dest=", _is_any),)
         context_conv_dest = _normalize_subvolume_path
 
     class link(RegexItemParser):
         # This path is not quoted in `send-dump.c`
         regex = re.compile(br"dest=(?P<dest>.*)")
+        fields = (("dest", b"dest=", _is_any),)
 
         # `btrfs receive` is inconsistent -- unlike other paths, its `dest`
         # does not start with the subvolume path.
@@ -237,11 +373,33 @@ class SendStreamItemParsers:
             br"clone_offset=(?P<clone_offset>[0-9]+)"
             br"(?P<from_uuid>)(?P<from_transid>)"
         )
+        # Unlike other items, the free-form field is not the last one.
+        fields = (
+            ("offset", b"offset=", _is_digits),
+            ("len", b"len=", _is_digits),
+            ("from_path", b"from=", _is_nonempty),
+        )
         conv_offset = staticmethod(int)
         conv_len = staticmethod(int)
         context_conv_from_path = _normalize_subvolume_path
         conv_clone_offset = staticmethod(int)
 
+        @classmethod
+        def split_details(
+            cls, subvol_name: bytes, details: bytes
+        ) -> Optional[Dict[str, Any]]:
+            # Like the greedy `from_path`, split on the last `clone_offset=`
+            rest, sep, clone_offset = details.rpartition(b" clone_offset=")
+            if not sep or not clone_offset.isdigit():
+                return None
+            parsed = super().split_details(subvol_name, rest)
+            if parsed is None:
+                return None
+            parsed["clone_offset"] = int(clone_offset)
+            parsed["from_uuid"] = b""
+            parsed["from_transid"] = b""
+            return parsed
+
     class set_xattr:
         # `btrfs --dump` outputs a `len` field, which is just `len(data)`,
         # but see the caveat below.
@@ -291,20 +449,49 @@ class SendStreamItemParsers:
                     return {"name": m.group(1), "data": data}
             return None
 
+        @classmethod
+        def split_details(
+            cls, subvol_name: bytes, details: bytes
+        ) -> Optional[Dict[str, Any]]:
+            "Same as `parse_details`, read it for the details."
+            rest, sep, length = details.rpartition(b" len=")
+            if not sep or not length.isdigit():
+                return None
+            length = int(length)
+            for has_trailing_null in [False, True]:
+                end_of_data = len(rest) - length + has_trailing_null
+                name_and_key = rest[:end_of_data]
+                data = rest[end_of_data:]
+                if has_trailing_null:
+                    data += b"\0"
+                assert len(data) == length  # We don't need to store `len`
+                if name_and_key.startswith(b"name=") and name_and_key.endswith(
+                    b" data="
+                ):
+                    return {
+                        "name": name_and_key[len(b"name=") : -len(b" data=")],
+                        "data": data,
+                    }
+            return None
+
     class remove_xattr(RegexItemParser):
         # This name is not quoted in `send-dump.c`
         regex = re.compile(br"name=(?P<name>.*)")
+        fields = (("name", b"name=", _is_any),)
 
     class truncate(RegexItemParser):
         regex = re.compile(br"size=(?P<size>[0-9]+)")
+        fields = (("size", b"size=", _is_digits),)
         conv_size = staticmethod(int)
 
     class chmod(RegexItemParser):
         regex = re.compile(br"mode=(?P<mode>[0-7]+)")
+        fields = (("mode", b"mode=", _is_octal),)
         conv_mode = staticmethod(_from_octal)
 
     class chown(RegexItemParser):
         regex = re.compile(br"gid=(?P<gid>[0-9]+) uid=(?P<uid>[0-9]+)")
+        fields = (("gid", b"gid=", _is_digits), ("uid", b"uid=", _is_digits))
         conv_gid = staticmethod(int)
         conv_uid = staticmethod(int)
 
@@ -314,9 +501,17 @@ class SendStreamItemParsers:
             br"mtime=(?P<mtime>[^ ]+) "
             br"ctime=(?P<ctime>[^ ]+)"
         )
+        fields = (
+            ("atime", b"atime=", _is_word),
+            ("mtime", b"mtime=", _is_word),
+            ("ctime", b"ctime=", _is_word),
+        )
 
-        @classmethod
-        def conv_atime(cls, t: bytes) -> Tuple[int, int]:
+        # Most timestamps in a dump are repeated many times, and `strptime`
+        # is slow.
+        @staticmethod
+        @functools.lru_cache(maxsize=1024)
+        def conv_atime(t: bytes) -> Tuple[int, int]:
             return (
                 int(
                     datetime.datetime.strptime(
@@ -332,6 +527,10 @@ class SendStreamItemParsers:
     # This is used instead of `write` when `btrfs send --no-data` is used.
     class update_extent(RegexItemParser):
         regex = re.compile(br"offset=(?P<offset>[0-9]+) len=(?P<len>[0-9]+)")
+        fields = (
+            ("offset", b"offset=", _is_digits),
+            ("len", b"len=", _is_digits),
+        )
         conv_offset = staticmethod(int)
         conv_len = staticmethod(int)
 
@@ -349,9 +548,91 @@ NAME_TO_ITEM_TYPE = {
     if k[0] != "_" and k != "write"
 }
 assert set(NAME_TO_PARSER_TYPE.keys()) == set(NAME_TO_ITEM_TYPE.keys())
+_NAME_TO_ITEM_TYPE_AND_PARSER = {
+    name: (item_type, NAME_TO_PARSER_TYPE[name])
+    for name, item_type in NAME_TO_ITEM_TYPE.items()
+}
+# `_parse_btrfs_dump_regex` explains why `write` becomes `update_extent`.
+_NAME_TO_ITEM_TYPE_AND_PARSER[b"write"] = _NAME_TO_ITEM_TYPE_AND_PARSER[
+    b"update_extent"
+]
+_BACKSLASH = ord(b"\\")
+
+
+# `parse_btrfs_dump` reads this many bytes of lines at a time.
+_BATCH_BYTES = 2 ** 20
 
 
 def parse_btrfs_dump(binary_infile: BinaryIO) -> Iterable[SendStreamItem]:
+    """
+    Yields the `SendStreamItem`s for the lines of `btrfs receive --dump`
+    output in `binary_infile`.
+
+    To be fast, this splits the lines on their fixed `key=value` layout,
+    see `RegexItemParser.fields`, and reads them in batches.  It accepts
+    and rejects the same lines as `_parse_btrfs_dump_regex`, the simpler
+    reference implementation, and raises the same errors.
+    """
+    subvol_name = None
+    read_batch = functools.partial(binary_infile.readlines, _BATCH_BYTES)
+    for lines in iter(read_batch, []):
+        for l in lines:
+            # This mimics the regex `([^ ]+) +((\\ |[^ ])+) *(.*)\n`
+            item_name, _, rest = l.partition(b" ")
+            rest = rest.lstrip(b" ")
+            # The path ends at the first space not escaped by a backslash.
+            end = rest.find(b" ")
+            while end > 0 and rest[end - 1] == _BACKSLASH:
+                end = rest.find(b" ", end + 1)
+            if end == -1:
+                path, details = rest[:-1], b""
+            else:
+                path, details = rest[:end], rest[end + 1 : -1].lstrip(b" ")
+            if not item_name or not path or l[-1:] != b"\n":
+                raise RuntimeError(f"line has unexpected format: {repr(l)}")
+
+            item_class_and_parser = _NAME_TO_ITEM_TYPE_AND_PARSER.get(item_name)
+            if not item_class_and_parser:
+                raise RuntimeError(
+                    f"unknown item type {item_name} in {repr(l)}"
+                )
+            item_class, item_parser = item_class_and_parser
+
+            # See `_parse_btrfs_dump_regex` for why we unquote here.
+            unnormalized_path = unquote_btrfs_progs_path(path)
+
+            if subvol_name is None:
+                if not item_class.sets_subvol_name:
+                    raise RuntimeError(
+                        f"First stream item did not set subvolume name: {l}"
+                    )
+                path = os.path.normpath(unnormalized_path)
+                subvol_name = path
+                if b"/" in path:
+                    raise RuntimeError(f"subvol path {path} contains /")
+            elif item_class.sets_subvol_name:
+                raise RuntimeError(
+                    f"Subvolume {subvol_name} created more than once."
+                )
+            else:
+                path = _normalize_subvolume_path(
+                    unnormalized_path, subvol_name=subvol_name
+                )
+
+            fields = item_parser.split_details(subvol_name, details)
+            if fields is None:
+                raise RuntimeError(
+                    f"unexpected format in line details: {repr(l)}"
+                )
+            fields["path"] = path
+
+            yield item_class(**fields)
+
+
+def _parse_btrfs_dump_regex(
+    binary_infile: BinaryIO,
+) -> Iterable[SendStreamItem]:
+    "The original, regex-based `parse_btrfs_dump`, for tests & benchmarks."
     reg = re.compile(br"([^ ]+) +((\\ |[^ ])+) *(.*)\n")
     subvol_name = None
     for l in binary_infile:
@@ -4,19 +4,77 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-"Parses the btrfs send-stream binary format. Only version 1 is supported."
+"""
+Parses the btrfs send-stream binary format. Only version 1 is supported.
+
+There are several parser modes, which produce identical `SendStreamItems`:
+
+ - The default mode reads `infile` one command at a time via the
+   `read_command` & `read_attribute` primitives.  It is simple, and works
+   with any file-like object.
+
+ - `zero_copy=True` is meant for multi-GB send-streams.  It memory-maps
+   `infile` when it is a regular file (or borrows the buffer of a
+   `BytesIO`), and otherwise reads it in large blocks.  Commands and
+   attributes are then decoded from `memoryview` slices using precompiled
+   `struct.Struct`s, so the only copies made are of the attribute values
+   that end up in the parsed items.
+
+ - `lazy_write_data=True` implies `zero_copy`, and additionally does not
+   copy file data out of the stream.  Instead, `write.data` becomes a
+   `SendStreamDataRef` locating the data in `infile`.  This bounds the
+   memory use of consumers like `Subvolume`, which only need the length.
+
+In either mode, `verify_crc=True` checks the CRC32C of each command as it
+is decoded -- see `crc32c_utils.py` for the fast & slow implementations.
+
+`parse_send_stream_fields` is the `zero_copy` parse, minus constructing
+the `SendStreamItem`s -- it yields `(item_type, fields)` pairs instead.
+
+All modes share the per-kind tables `_ATTRIBUTE_KIND_TO_CONV` and
+`_COMMAND_KIND_TO_ITEM_TYPE_AND_FIELDS`, which are the only place that
+knows how to interpret a given attribute or command.
+"""
 import enum
+import functools
+import io
+import mmap
 import os
+import stat
 import struct
 import uuid
+from contextlib import contextmanager
 from io import BytesIO
-from typing import Iterator, NamedTuple, Tuple
-
-from .send_stream import SendStreamItem, SendStreamItems
+from types import SimpleNamespace
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+)
+
+from .crc32c_utils import crc32c
+from .send_stream import SendStreamDataRef, SendStreamItem, SendStreamItems
 
 
 BTRFS_SEND_STREAM_MAGIC = b"btrfs-stream\0"
 
+# Precompiled formats -- `struct.calcsize` & format-string parsing show up
+# prominently in profiles of large send-streams.
+_VERSION = struct.Struct("<I")
+_COMMAND_HEADER = struct.Struct("<IHI")  # length, kind, crc
+_ATTRIBUTE_HEADER = struct.Struct("<HH")  # kind, length
+_UINT64 = struct.Struct("<Q")
+_TIME = struct.Struct("<QI")
+
+# `zero_copy` reads non-mappable streams in blocks of at least this size.
+_BLOCK_SIZE = 8 << 20
+
 
 def file_unpack(fmt, infile):
     size = struct.calcsize(fmt)
@@ -128,210 +186,472 @@ class AttributeHeader(NamedTuple):
         return AttributeHeader(kind=AttributeKind(kind), length=length)
 
 
+# The `conv_*` functions accept `bytes` or a `memoryview` slice.
+
+
 def conv_uuid(s: bytes) -> bytes:
-    return str(uuid.UUID(bytes=s)).encode()  # All our other strings are bytes
+    # All our other strings are bytes
+    return str(uuid.UUID(bytes=bytes(s))).encode()
 
 
 def conv_uint64(s: bytes) -> int:
-    (i,) = struct.unpack("<Q", s)
+    (i,) = _UINT64.unpack(s)
     return i
 
 
 def conv_time(s: bytes) -> Tuple[int, int]:
-    s, us = struct.unpack("<QI", s)
+    s, us = _TIME.unpack(s)
     # pyre wants an explicit check even though struct.unpack will raise
     assert isinstance(s, int) and isinstance(us, int), "struct.unpack() failed"
     return s, us
 
 
+def conv_bytes(s: bytes) -> bytes:
+    return bytes(s)
+
+
+# Each path recurs in several consecutive commands, and `normpath` is slow.
+_normpath = functools.lru_cache(maxsize=4096)(os.path.normpath)
+
+
+def conv_path(s: bytes) -> bytes:
+    return _normpath(bytes(s))
+
+
+_ATTRIBUTE_KIND_TO_CONV: Mapping[AttributeKind, Callable[[bytes], Any]] = {
+    AttributeKind.UUID: conv_uuid,
+    AttributeKind.CTRANSID: conv_uint64,
+    AttributeKind.INO: conv_uint64,
+    AttributeKind.SIZE: conv_uint64,
+    AttributeKind.MODE: conv_uint64,
+    AttributeKind.UID: conv_uint64,
+    AttributeKind.GID: conv_uint64,
+    AttributeKind.RDEV: conv_uint64,
+    AttributeKind.CTIME: conv_time,
+    AttributeKind.MTIME: conv_time,
+    AttributeKind.ATIME: conv_time,
+    AttributeKind.XATTR_NAME: conv_bytes,
+    AttributeKind.XATTR_DATA: conv_bytes,
+    AttributeKind.PATH: conv_path,
+    AttributeKind.PATH_TO: conv_path,
+    # NB This is NOT normalized since we don't want to normalize symlinks
+    AttributeKind.PATH_LINK: conv_bytes,
+    AttributeKind.FILE_OFFSET: conv_uint64,
+    AttributeKind.DATA: conv_bytes,
+    AttributeKind.CLONE_UUID: conv_uuid,
+    AttributeKind.CLONE_CTRANSID: conv_uint64,
+    AttributeKind.CLONE_PATH: conv_path,
+    AttributeKind.CLONE_OFFSET: conv_uint64,
+    AttributeKind.CLONE_LEN: conv_uint64,
+}
+assert set(_ATTRIBUTE_KIND_TO_CONV) == set(AttributeKind)
+
+# Keyed on the raw on-disk value, so that the hot loop of `zero_copy`
+# parsing can skip constructing `AttributeKind` via the `enum` machinery.
+_ATTRIBUTE_VALUE_TO_KIND_AND_CONV = {
+    kind.value: (kind, conv) for kind, conv in _ATTRIBUTE_KIND_TO_CONV.items()
+}
+
+# `AttributeKind.value`s -- the decoded attributes are keyed on these, since
+# hashing `enum` members is slow.
+_A = SimpleNamespace(**{kind.name: kind.value for kind in AttributeKind})
+# The `SendStreamItem` type of each command, and a function that makes its
+# fields, in declaration order, from the decoded attributes.  `END` makes no
+# item.  `parse_send_stream_fields` yields these pairs as-is, for consumers
+# that do not need the items.
+_COMMAND_KIND_TO_ITEM_TYPE_AND_FIELDS: Mapping[
+    CommandKind,
+    Tuple[
+        Optional[Type[SendStreamItem]],
+        Callable[[Mapping[int, Any]], Tuple[Any, ...]],
+    ],
+] = {
+    CommandKind.SUBVOL: (
+        SendStreamItems.subvol,
+        lambda a: (a[_A.PATH], a[_A.UUID], a[_A.CTRANSID]),
+    ),
+    CommandKind.SNAPSHOT: (
+        SendStreamItems.snapshot,
+        lambda a: (
+            a[_A.PATH],
+            a[_A.UUID],
+            a[_A.CTRANSID],
+            a[_A.CLONE_UUID],
+            a[_A.CLONE_CTRANSID],
+        ),
+    ),
+    CommandKind.MKFILE: (SendStreamItems.mkfile, lambda a: (a[_A.PATH],)),
+    CommandKind.MKDIR: (SendStreamItems.mkdir, lambda a: (a[_A.PATH],)),
+    CommandKind.MKNOD: (
+        SendStreamItems.mknod,
+        lambda a: (a[_A.PATH], a[_A.MODE], a[_A.RDEV]),
+    ),
+    CommandKind.MKFIFO: (SendStreamItems.mkfifo, lambda a: (a[_A.PATH],)),
+    CommandKind.MKSOCK: (SendStreamItems.mksock, lambda a: (a[_A.PATH],)),
+    CommandKind.SYMLINK: (
+        SendStreamItems.symlink,
+        # NB Unlike the other `dest` attributes, we don't normalize this.
+        lambda a: (a[_A.PATH], _normpath(a[_A.PATH_LINK])),
+    ),
+    CommandKind.RENAME: (
+        SendStreamItems.rename,
+        lambda a: (a[_A.PATH], a[_A.PATH_TO]),
+    ),
+    CommandKind.LINK: (
+        SendStreamItems.link,
+        lambda a: (a[_A.PATH], _normpath(a[_A.PATH_LINK])),
+    ),
+    CommandKind.UNLINK: (SendStreamItems.unlink, lambda a: (a[_A.PATH],)),
+    CommandKind.RMDIR: (SendStreamItems.rmdir, lambda a: (a[_A.PATH],)),
+    CommandKind.WRITE: (
+        SendStreamItems.write,
+        lambda a: (a[_A.PATH], a[_A.FILE_OFFSET], a[_A.DATA]),
+    ),
+    CommandKind.CLONE: (
+        SendStreamItems.clone,
+        lambda a: (
+            a[_A.PATH],
+            a[_A.FILE_OFFSET],
+            a[_A.CLONE_LEN],
+            a[_A.CLONE_UUID],
+            a[_A.CLONE_CTRANSID],
+            a[_A.CLONE_PATH],
+            a[_A.CLONE_OFFSET],
+        ),
+    ),
+    CommandKind.SET_XATTR: (
+        SendStreamItems.set_xattr,
+        lambda a: (a[_A.PATH], a[_A.XATTR_NAME], a[_A.XATTR_DATA]),
+    ),
+    CommandKind.REMOVE_XATTR: (
+        SendStreamItems.remove_xattr,
+        lambda a: (a[_A.PATH], a[_A.XATTR_NAME]),
+    ),
+    CommandKind.TRUNCATE: (
+        SendStreamItems.truncate,
+        lambda a: (a[_A.PATH], a[_A.SIZE]),
+    ),
+    CommandKind.CHMOD: (
+        SendStreamItems.chmod,
+        lambda a: (a[_A.PATH], a[_A.MODE]),
+    ),
+    CommandKind.CHOWN: (
+        SendStreamItems.chown,
+        lambda a: (a[_A.PATH], a[_A.GID], a[_A.UID]),
+    ),
+    CommandKind.UTIMES: (
+        SendStreamItems.utimes,
+        lambda a: (a[_A.PATH], a[_A.ATIME], a[_A.MTIME], a[_A.CTIME]),
+    ),
+    CommandKind.END: (None, lambda a: ()),
+    CommandKind.UPDATE_EXTENT: (
+        SendStreamItems.update_extent,
+        lambda a: (a[_A.PATH], a[_A.FILE_OFFSET], a[_A.SIZE]),
+    ),
+}
+assert set(_COMMAND_KIND_TO_ITEM_TYPE_AND_FIELDS) == set(CommandKind)
+
+# Like `_ATTRIBUTE_VALUE_TO_KIND_AND_CONV`, for the `zero_copy` hot loop.
+_COMMAND_VALUE_TO_KIND_TYPE_AND_FIELDS = {
+    kind.value: (kind, item_type, fields)
+    for kind, (
+        item_type,
+        fields,
+    ) in _COMMAND_KIND_TO_ITEM_TYPE_AND_FIELDS.items()
+}
+
+
 def read_attribute(infile):
     attr_header = AttributeHeader.from_file(infile)
     attr_data = infile.read(attr_header.length)
     if len(attr_data) != attr_header.length:
         raise RuntimeError(f"{attr_header} got {len(attr_data)} bytes")
+    return attr_header.kind, _ATTRIBUTE_KIND_TO_CONV[attr_header.kind](
+        attr_data
+    )
+
+
+# The CRC covers the whole command, with the header's `crc` field zeroed.
+# Chaining from a cached CRC of the header leaves one `crc32c` call per
+# command, since the same (length, kind) pairs recur throughout a stream.
+@functools.lru_cache(maxsize=4096)
+def _zeroed_header_crc(length: int, kind_value: int) -> int:
+    return crc32c(_COMMAND_HEADER.pack(length, kind_value, 0))
+
 
-    if attr_header.kind == AttributeKind.UUID:
-        return attr_header.kind, conv_uuid(attr_data)
-    elif attr_header.kind == AttributeKind.CTRANSID:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.INO:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.SIZE:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.MODE:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.UID:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.GID:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.RDEV:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.CTIME:
-        return attr_header.kind, conv_time(attr_data)
-    elif attr_header.kind == AttributeKind.MTIME:
-        return attr_header.kind, conv_time(attr_data)
-    elif attr_header.kind == AttributeKind.ATIME:
-        return attr_header.kind, conv_time(attr_data)
-    elif attr_header.kind == AttributeKind.XATTR_NAME:
-        return attr_header.kind, attr_data
-    elif attr_header.kind == AttributeKind.XATTR_DATA:
-        return attr_header.kind, attr_data
-    elif attr_header.kind == AttributeKind.PATH:
-        return attr_header.kind, os.path.normpath(attr_data)
-    elif attr_header.kind == AttributeKind.PATH_TO:
-        return attr_header.kind, os.path.normpath(attr_data)
-    elif attr_header.kind == AttributeKind.PATH_LINK:
-        # NB This is NOT normalized since we don't want to normalize symlinks
-        return attr_header.kind, attr_data
-    elif attr_header.kind == AttributeKind.FILE_OFFSET:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.DATA:
-        return attr_header.kind, attr_data
-    elif attr_header.kind == AttributeKind.CLONE_UUID:
-        return attr_header.kind, conv_uuid(attr_data)
-    elif attr_header.kind == AttributeKind.CLONE_CTRANSID:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.CLONE_PATH:
-        return attr_header.kind, os.path.normpath(attr_data)
-    elif attr_header.kind == AttributeKind.CLONE_OFFSET:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.CLONE_LEN:
-        return attr_header.kind, conv_uint64(attr_data)
-
-    raise RuntimeError(f"Fix me: unhandled {attr_header}")  # pragma: no cover
-
-
-def read_command(infile):
+def read_command(infile, *, verify_crc: bool = False):
     cmd_header = CommandHeader.from_file(infile)
 
     s = infile.read(cmd_header.length)
     if len(s) != cmd_header.length:
         raise RuntimeError(f"{cmd_header} got {len(s)} bytes")
-    # Future: pull in the `crc32c` module and check the CRC.
+    if verify_crc and cmd_header.crc != crc32c(
+        s, _zeroed_header_crc(cmd_header.length, cmd_header.kind.value)
+    ):
+        raise RuntimeError(f"{cmd_header} failed CRC check")
 
     attr_bytes = BytesIO(s)
     kind_to_attr = {}
     while attr_bytes.tell() != len(s):
         kind, attr = read_attribute(attr_bytes)
-        if kind in kind_to_attr:
+        if kind.value in kind_to_attr:
             raise RuntimeError(f"{kind} occurred twice in {cmd_header}")
-        kind_to_attr[kind] = attr
-
-    if cmd_header.kind == CommandKind.SUBVOL:
-        return SendStreamItems.subvol(
-            path=kind_to_attr[AttributeKind.PATH],
-            uuid=kind_to_attr[AttributeKind.UUID],
-            transid=kind_to_attr[AttributeKind.CTRANSID],
-        )
-    elif cmd_header.kind == CommandKind.SNAPSHOT:
-        return SendStreamItems.snapshot(
-            path=kind_to_attr[AttributeKind.PATH],
-            uuid=kind_to_attr[AttributeKind.UUID],
-            transid=kind_to_attr[AttributeKind.CTRANSID],
-            parent_uuid=kind_to_attr[AttributeKind.CLONE_UUID],
-            parent_transid=kind_to_attr[AttributeKind.CLONE_CTRANSID],
-        )
-    elif cmd_header.kind == CommandKind.MKFILE:
-        return SendStreamItems.mkfile(path=kind_to_attr[AttributeKind.PATH])
-    elif cmd_header.kind == CommandKind.MKDIR:
-        return SendStreamItems.mkdir(path=kind_to_attr[AttributeKind.PATH])
-    elif cmd_header.kind == CommandKind.MKNOD:
-        return SendStreamItems.mknod(
-            path=kind_to_attr[AttributeKind.PATH],
-            mode=kind_to_attr[AttributeKind.MODE],
-            dev=kind_to_attr[AttributeKind.RDEV],
-        )
-    elif cmd_header.kind == CommandKind.MKFIFO:
-        return SendStreamItems.mkfifo(path=kind_to_attr[AttributeKind.PATH])
-    elif cmd_header.kind == CommandKind.MKSOCK:
-        return SendStreamItems.mksock(path=kind_to_attr[AttributeKind.PATH])
-    elif cmd_header.kind == CommandKind.SYMLINK:
-        return SendStreamItems.symlink(
-            path=kind_to_attr[AttributeKind.PATH],
-            # NB Unlike the other `dest` attributes, we don't normalize this.
-            dest=os.path.normpath(kind_to_attr[AttributeKind.PATH_LINK]),
-        )
-    elif cmd_header.kind == CommandKind.RENAME:
-        return SendStreamItems.rename(
-            path=kind_to_attr[AttributeKind.PATH],
-            dest=kind_to_attr[AttributeKind.PATH_TO],
+        kind_to_attr[kind.value] = attr
+
+    item_type, fields = _COMMAND_KIND_TO_ITEM_TYPE_AND_FIELDS[cmd_header.kind]
+    return None if item_type is None else item_type(*fields(kind_to_attr))
+
+
+class _StreamWindow:
+    """
+    A `memoryview` onto the part of the send-stream that `zero_copy`
+    parsing is currently decoding.  `view[0]` is at offset `base` in the
+    file -- for pipes, this counts the bytes read since parsing started.
+
+    When the stream is memory-mapped, the window covers the whole stream,
+    and `read_block` is `None`.  Otherwise, `require` replaces the window
+    with the unconsumed tail plus a freshly read block whenever a command
+    straddles the end of the window.  Blocks are immutable `bytes`, so
+    callers may safely hold on to the old `view` until their next
+    `require`.
+    """
+
+    def __init__(
+        self,
+        *,
+        view: memoryview,
+        base: int,
+        pos: int,
+        read_block: Optional[Callable[[int], bytes]],
+    ):
+        self.view = view
+        self.base = base
+        self.pos = pos
+        self._read_block = read_block
+
+    def require(self, size: int) -> int:
+        "Returns how many of the `size` bytes at `pos` are available."
+        available = len(self.view) - self.pos
+        if available >= size or self._read_block is None:
+            return available
+        blocks = [self.view[self.pos :].tobytes()]
+        while available < size:
+            block = self._read_block(size - available)
+            if not block:
+                break
+            blocks.append(block)
+            available += len(block)
+        self.view = memoryview(b"".join(blocks))
+        self.base += self.pos
+        self.pos = 0
+        return available
+
+
+@contextmanager
+def _open_stream_window(infile) -> Iterator[_StreamWindow]:
+    """
+    Memory-maps regular files, and borrows the buffer of `BytesIO`.  Other
+    file objects (e.g. pipes) are read in blocks of `_BLOCK_SIZE`.  On
+    exit, `infile` is positioned right after the bytes that were consumed.
+    """
+    if isinstance(infile, io.BytesIO):
+        with infile.getbuffer() as view:
+            window = _StreamWindow(
+                view=view, base=0, pos=infile.tell(), read_block=None
+            )
+            yield window
+        infile.seek(window.pos)
+        return
+
+    try:
+        fileno = infile.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        fileno = None
+    st = None if fileno is None else os.fstat(fileno)
+    # `mmap` rejects empty files, those are handled by the read path.
+    if st is None or not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+        window = _StreamWindow(
+            view=memoryview(b""),
+            base=infile.tell() if infile.seekable() else 0,
+            pos=0,
+            read_block=lambda size: infile.read(max(size, _BLOCK_SIZE)),
         )
-    elif cmd_header.kind == CommandKind.LINK:
-        return SendStreamItems.link(
-            path=kind_to_attr[AttributeKind.PATH],
-            dest=os.path.normpath(kind_to_attr[AttributeKind.PATH_LINK]),
-        )
-    elif cmd_header.kind == CommandKind.UNLINK:
-        return SendStreamItems.unlink(path=kind_to_attr[AttributeKind.PATH])
-    elif cmd_header.kind == CommandKind.RMDIR:
-        return SendStreamItems.rmdir(path=kind_to_attr[AttributeKind.PATH])
-    elif cmd_header.kind == CommandKind.WRITE:
-        return SendStreamItems.write(
-            path=kind_to_attr[AttributeKind.PATH],
-            offset=kind_to_attr[AttributeKind.FILE_OFFSET],
-            data=kind_to_attr[AttributeKind.DATA],
-        )
-    elif cmd_header.kind == CommandKind.CLONE:
-        return SendStreamItems.clone(
-            path=kind_to_attr[AttributeKind.PATH],
-            offset=kind_to_attr[AttributeKind.FILE_OFFSET],
-            len=kind_to_attr[AttributeKind.CLONE_LEN],
-            from_uuid=kind_to_attr[AttributeKind.CLONE_UUID],
-            from_transid=kind_to_attr[AttributeKind.CLONE_CTRANSID],
-            from_path=kind_to_attr[AttributeKind.CLONE_PATH],
-            clone_offset=kind_to_attr[AttributeKind.CLONE_OFFSET],
-        )
-    elif cmd_header.kind == CommandKind.SET_XATTR:
-        return SendStreamItems.set_xattr(
-            path=kind_to_attr[AttributeKind.PATH],
-            name=kind_to_attr[AttributeKind.XATTR_NAME],
-            data=kind_to_attr[AttributeKind.XATTR_DATA],
-        )
-    elif cmd_header.kind == CommandKind.REMOVE_XATTR:
-        return SendStreamItems.remove_xattr(
-            path=kind_to_attr[AttributeKind.PATH],
-            name=kind_to_attr[AttributeKind.XATTR_NAME],
-        )
-    elif cmd_header.kind == CommandKind.TRUNCATE:
-        return SendStreamItems.truncate(
-            path=kind_to_attr[AttributeKind.PATH],
-            size=kind_to_attr[AttributeKind.SIZE],
-        )
-    elif cmd_header.kind == CommandKind.CHMOD:
-        return SendStreamItems.chmod(
-            path=kind_to_attr[AttributeKind.PATH],
-            mode=kind_to_attr[AttributeKind.MODE],
-        )
-    elif cmd_header.kind == CommandKind.CHOWN:
-        return SendStreamItems.chown(
-            path=kind_to_attr[AttributeKind.PATH],
-            uid=kind_to_attr[AttributeKind.UID],
-            gid=kind_to_attr[AttributeKind.GID],
+        yield window
+        # We read ahead, so rewind to just past the parsed commands if we can.
+        if infile.seekable():
+            infile.seek(window.pos - len(window.view), io.SEEK_CUR)
+        return
+
+    mm = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    try:
+        with memoryview(mm) as view:
+            window = _StreamWindow(
+                view=view, base=0, pos=infile.tell(), read_block=None
+            )
+            yield window
+        infile.seek(window.pos)
+    finally:
+        # The slices made by `_decode_attributes` are temporaries, so the
+        # mapping is normally unpinned by now.  The exception is a parse
+        # error, whose traceback can hold a slice -- then the garbage
+        # collector will unmap it, and we must not mask the real error.
+        try:
+            mm.close()
+        except BufferError:  # pragma: no cover
+            pass
+
+
+def _decode_attributes(
+    view: memoryview,
+    pos: int,
+    end: int,
+    cmd_header_fn,
+    # If set, `DATA` becomes a `SendStreamDataRef`, whose offset is this
+    # plus the position in `view`.
+    data_ref_base: Optional[int],
+) -> Dict[int, Any]:
+    "Returns the attributes keyed on `AttributeKind.value`."
+    kind_to_attr = {}
+    while pos != end:
+        if end - pos < _ATTRIBUTE_HEADER.size:
+            raise RuntimeError(
+                f"Not enough bytes {view[pos:end].tobytes()} for attribute "
+                f"header in {cmd_header_fn()}"
+            )
+        kind_value, length = _ATTRIBUTE_HEADER.unpack_from(view, pos)
+        pos += _ATTRIBUTE_HEADER.size
+        kind_and_conv = _ATTRIBUTE_VALUE_TO_KIND_AND_CONV.get(kind_value)
+        if kind_and_conv is None:
+            raise RuntimeError(
+                f"Unknown attribute kind {kind_value} in {cmd_header_fn()}"
+            )
+        kind, conv = kind_and_conv
+        if end - pos < length:
+            raise RuntimeError(
+                f"{AttributeHeader(kind=kind, length=length)} got "
+                f"{end - pos} bytes"
+            )
+        if kind_value in kind_to_attr:
+            raise RuntimeError(f"{kind} occurred twice in {cmd_header_fn()}")
+        if kind_value == _A.DATA and data_ref_base is not None:
+            kind_to_attr[kind_value] = SendStreamDataRef(
+                offset=data_ref_base + pos, length=length
+            )
+        else:
+            kind_to_attr[kind_value] = conv(view[pos : pos + length])
+        pos += length
+    return kind_to_attr
+
+
+def _check_stream_window_preamble(window: _StreamWindow) -> None:
+    preamble_size = len(BTRFS_SEND_STREAM_MAGIC) + _VERSION.size
+    available = window.require(preamble_size)
+    magic_end = window.pos + min(available, len(BTRFS_SEND_STREAM_MAGIC))
+    magic = window.view[window.pos : magic_end].tobytes()
+    if magic != BTRFS_SEND_STREAM_MAGIC:
+        raise RuntimeError(f'Magic {magic}, not "{BTRFS_SEND_STREAM_MAGIC}"')
+    if available < preamble_size:
+        raise RuntimeError("Not enough bytes for the send-stream version")
+    (version,) = _VERSION.unpack_from(window.view, magic_end)
+    if version != 1:
+        raise RuntimeError(f"Got version {version}, but we require version 1")
+    window.pos += preamble_size
+
+
+def _parse_stream_window(
+    window: _StreamWindow,
+    *,
+    lazy_write_data: bool,
+    verify_crc: bool,
+) -> Iterator[Tuple[Type[SendStreamItem], Tuple[Any, ...]]]:
+    "Yields `(item_type, fields)`, see `parse_send_stream_fields`."
+    header_size = _COMMAND_HEADER.size
+    while True:
+        # Skip the `require` call when the whole header is in the window.
+        available = len(window.view) - window.pos
+        if available < header_size:
+            available = window.require(header_size)
+        if available < header_size:
+            raise RuntimeError(
+                f"Not enough bytes "
+                f"{window.view[window.pos :].tobytes()} for command header"
+            )
+        length, kind_value, crc = _COMMAND_HEADER.unpack_from(
+            window.view, window.pos
         )
-    elif cmd_header.kind == CommandKind.UTIMES:
-        return SendStreamItems.utimes(
-            path=kind_to_attr[AttributeKind.PATH],
-            ctime=kind_to_attr[AttributeKind.CTIME],
-            mtime=kind_to_attr[AttributeKind.MTIME],
-            atime=kind_to_attr[AttributeKind.ATIME],
+        kind_type_and_fields = _COMMAND_VALUE_TO_KIND_TYPE_AND_FIELDS.get(
+            kind_value
         )
-    elif cmd_header.kind == CommandKind.END:
-        return None
-    elif cmd_header.kind == CommandKind.UPDATE_EXTENT:
-        return SendStreamItems.update_extent(
-            path=kind_to_attr[AttributeKind.PATH],
-            offset=kind_to_attr[AttributeKind.FILE_OFFSET],
-            len=kind_to_attr[AttributeKind.SIZE],
+        if kind_type_and_fields is None:
+            raise RuntimeError(f"Unknown command kind {kind_value}")
+        kind, item_type, fields = kind_type_and_fields
+
+        def cmd_header_fn():
+            return CommandHeader(kind=kind, length=length, crc=crc)
+
+        available = len(window.view) - window.pos - header_size
+        if available < length:
+            available = window.require(header_size + length) - header_size
+        if available < length:
+            raise RuntimeError(f"{cmd_header_fn()} got {available} bytes")
+        start = window.pos + header_size
+        if verify_crc and crc != crc32c(
+            window.view[start : start + length],
+            _zeroed_header_crc(length, kind_value),
+        ):
+            raise RuntimeError(f"{cmd_header_fn()} failed CRC check")
+        window.pos = start + length
+        attrs = _decode_attributes(
+            window.view,
+            start,
+            window.pos,
+            cmd_header_fn,
+            window.base if lazy_write_data else None,
         )
+        if item_type is None:
+            return
+        yield item_type, fields(attrs)
+
+
+def parse_send_stream(
+    infile,
+    *,
+    zero_copy: bool = False,
+    lazy_write_data: bool = False,
+    verify_crc: bool = False,
+) -> Iterator[SendStreamItem]:
+    """
+    Yields the `SendStreamItem`s from the send-stream at the current
+    position of `infile`.  Read the module docblock for `zero_copy`,
+    `lazy_write_data`, and `verify_crc`.
+    """
+    if zero_copy or lazy_write_data:
+        for item_type, fields in parse_send_stream_fields(
+            infile, lazy_write_data=lazy_write_data, verify_crc=verify_crc
+        ):
+            yield item_type(*fields)
+        return
 
-    raise AssertionError(f"Fix me: unhandled {cmd_header}")  # pragma: no cover
-
-
-def parse_send_stream(infile) -> Iterator[SendStreamItem]:
     check_magic(infile)
     check_version(infile)
     while True:
-        cmd = read_command(infile)
+        cmd = read_command(infile, verify_crc=verify_crc)
         if cmd is None:
             return
         yield cmd
+
+
+def parse_send_stream_fields(
+    infile, *, lazy_write_data: bool = False, verify_crc: bool = False
+) -> Iterator[Tuple[Type[SendStreamItem], Tuple[Any, ...]]]:
+    """
+    Like `parse_send_stream(infile, zero_copy=True, ...)`, but yields
+    `(item_type, fields)` instead of `item_type(*fields)`.  Constructing
+    the items is a large part of the cost of parsing, so consumers that
+    can work with the fields should, see e.g. `Subvolume.apply_fields`.
+    """
+    with _open_stream_window(infile) as window:
+        _check_stream_window_preamble(window)
+        yield from _parse_stream_window(
+            window, lazy_write_data=lazy_write_data, verify_crc=verify_crc
+        )
@@ -12,10 +12,13 @@ output of `btrfs receive --dump`.  The latter parse is imperfect and has a
 number of limitations, but we find it useful for testing -- refer to the
 `parse_dump.py` docblock.
 """
+import dataclasses
+import functools
+import operator
 import re
 from collections import Counter
 from dataclasses import dataclass
-from typing import Callable, ClassVar, Iterable, Tuple
+from typing import Any, Callable, ClassVar, Iterable, Tuple, Type, Union
 
 
 _SELINUX_XATTR = b"security.selinux"
@@ -49,6 +52,32 @@ class SendStreamItem:
         return re.sub(r"^((\w+|<\w+>)\.)*", "", repr(self))
 
 
+@dataclass(frozen=True)
+class SendStreamDataRef:
+    """
+    `parse_send_stream(..., lazy_write_data=True)` puts this in `write.data`
+    in place of the actual bytes, so that the parse does not hold file
+    content in memory.  Most consumers only need `len(item.data)`, the rest
+    can `resolve` it against the send-stream file.
+    """
+
+    offset: int  # Where the data starts in the send-stream file
+    length: int
+
+    def __len__(self):
+        return self.length
+
+    def resolve(self, stream) -> bytes:
+        """
+        `stream` is a buffer holding the send-stream file, typically an
+        `mmap.mmap` of it, or the `bytes` that were parsed.
+        """
+        data = bytes(stream[self.offset : self.offset + self.length])
+        if len(data) != self.length:
+            raise RuntimeError(f"{self} got {len(data)} bytes")
+        return data
+
+
 class SendStreamItems:
     """
     This class only exists to group its inner classes.
@@ -140,7 +169,7 @@ class SendStreamItems:
     @dataclass(frozen=True)
     class write(SendStreamItem):
         offset: int
-        data: bytes
+        data: Union[bytes, SendStreamDataRef]
 
     @dataclass(frozen=True)
     class clone(SendStreamItem):
@@ -186,6 +215,27 @@ class SendStreamItems:
         len: int
 
 
+@functools.lru_cache(maxsize=None)
+def _item_fields_getter(
+    item_type: Type[SendStreamItem],
+) -> Callable[[SendStreamItem], Tuple[Any, ...]]:
+    names = [f.name for f in dataclasses.fields(item_type)]
+    if len(names) == 1:  # `attrgetter` would not return a tuple
+        (name,) = names
+        return lambda item: (getattr(item, name),)
+    return operator.attrgetter(*names)
+
+
+def item_fields(item: SendStreamItem) -> Tuple[Any, ...]:
+    """
+    Returns the fields of `item` in declaration order, so that
+    `type(item)(*item_fields(item)) == item`.  The `apply_fields` methods
+    of `Subvolume` and `IncompleteInode` take items in this form, which
+    `parse_send_stream_fields` produces without constructing the items.
+    """
+    return _item_fields_getter(type(item))(item)
+
+
 def get_frequency_of_selinux_xattrs(items):
     'Returns {"xattr_value": <count>}. Useful for ItemFilters.selinux_xattr.'
     counter = Counter()
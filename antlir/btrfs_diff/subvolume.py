@@ -26,7 +26,18 @@ mutate its state.
   specified by the standard.
 
 - Maximum path lengths are not checked.
+
+- Memory use is about 1.2 KB per inode (see `benchmark_subvolume_memory`
+  -- 20k files with the metadata of a real `btrfs send`), down from 1.75
+  KB thanks to `__slots__`, interning, and `_OwnedInodeIDs`.  A 2M-file
+  image thus still needs a few GB per `Subvolume`.  Getting to a few
+  hundred bytes would take a columnar store, i.e. arrays of mode, owner,
+  and times indexed by inode ID, with `IncompleteInode` as a view.  That
+  is not implemented, since every consumer of `IncompleteInode`, and the
+  copy-on-write snapshots, rely on it being a standalone object.
 """
+import copy
+import json
 import os
 from types import MappingProxyType
 from typing import (
@@ -36,14 +47,17 @@ from typing import (
     NamedTuple,
     Optional,
     Sequence,
+    Set,
+    TextIO,
     Tuple,
+    Type,
     Union,
     ValuesView,
 )
 
 from .coroutine_utils import while_not_exited
 from .extents_to_chunks import extents_to_chunks_with_clones
-from .freeze import freeze
+from .freeze import freeze, freezes_in_place
 from .incomplete_inode import (
     IncompleteDevice,
     IncompleteDir,
@@ -56,7 +70,7 @@ from .incomplete_inode import (
 from .inode import Chunk, Inode
 from .inode_id import InodeID, InodeIDMap
 from .rendered_tree import RenderedTree, TraversalIDMaker
-from .send_stream import SendStreamItem, SendStreamItems
+from .send_stream import item_fields, SendStreamItem, SendStreamItems
 
 
 _DUMP_ITEM_TO_INCOMPLETE_INODE = {
@@ -69,6 +83,39 @@ _DUMP_ITEM_TO_INCOMPLETE_INODE = {
 }
 
 
+class _OwnedInodeIDs:
+    """
+    The IDs of the inodes that a `Subvolume` does not share with a
+    snapshot, which it may thus mutate in place.  `InodeIDMap` hands out
+    IDs in increasing order, so instead of one set entry per inode, we
+    store the first ID allocated after the latest snapshot, plus the IDs
+    of the older inodes that were copied since.
+    """
+
+    __slots__ = ("first_unshared_id", "copied_ids")
+
+    def __init__(self, first_unshared_id: int = 0):
+        self.first_unshared_id = first_unshared_id
+        self.copied_ids: Set[int] = set()
+
+    def __contains__(self, ino_id: InodeID) -> bool:
+        return (
+            ino_id.id >= self.first_unshared_id or ino_id.id in self.copied_ids
+        )
+
+    def add(self, ino_id: InodeID) -> None:
+        if ino_id.id < self.first_unshared_id:
+            self.copied_ids.add(ino_id.id)
+
+    def discard(self, ino_id: InodeID) -> None:
+        self.copied_ids.discard(ino_id.id)
+
+    def share_all(self, first_unshared_id: int) -> None:
+        "Call on snapshot: the IDs below `first_unshared_id` become shared."
+        self.first_unshared_id = first_unshared_id
+        self.copied_ids = set()
+
+
 # Future: `deepfrozen` would let us lose the `new` methods on NamedTuples,
 # and avoid `deepcopy`.
 class Subvolume(NamedTuple):
@@ -76,14 +123,15 @@ class Subvolume(NamedTuple):
     Models a btrfs subvolume, knows how to apply SendStreamItem mutations
     to itself.
 
-    IMPORTANT: Keep this object correctly `deepcopy`able, we need that
-    for snapshotting. Notes:
+    Snapshots are made by `snapshot`, which shares the inodes & the
+    directory structure with the original, copying them on write.
+
+    IMPORTANT: Keep this object correctly `deepcopy`able, our tests rely
+    on that. Notes:
 
       - `InodeIDMap` opaquely holds a `description`, which in practice
         is a `SubvolumeDescription` that is **NOT** safely `deepcopy`able
-        unless the whole `Volume` is being copied in one call.  For
-        single-volume snapshots, `SubvolumeSetMutator` has an icky
-        workaround :)
+        unless the whole `Volume` is being copied in one call.
 
       - The tests for `InodeIDMap` try to ensure that it is safely
         `deepcopy`able.  Changes to its members should be validated there.
@@ -107,15 +155,39 @@ class Subvolume(NamedTuple):
     # require us to share inodes across subvolumes.
     id_map: InodeIDMap
     id_to_inode: Mapping[Optional[InodeID], Union[IncompleteInode, Inode]]
+    # The inodes that are not shared with a snapshot, which we may thus
+    # mutate in place.  The rest are copied on write.
+    owned_inode_ids: _OwnedInodeIDs
 
     @classmethod
     def new(cls, *, id_map, **kwargs) -> "Subvolume":
         kwargs.setdefault("id_to_inode", {})
+        kwargs.setdefault("owned_inode_ids", _OwnedInodeIDs())
         kwargs["id_to_inode"][id_map.get_id(b".")] = IncompleteDir(
             item=SendStreamItems.mkdir(path=b".")
         )
         return cls(id_map=id_map, **kwargs)
 
+    def snapshot(self, *, description: Any) -> "Subvolume":
+        """
+        Returns a copy of `self` whose `InodeIDMap` has the given
+        `description`.  The copy shares the inodes with `self`, and
+        whichever of the two first mutates a shared inode copies it.
+        """
+        id_map = self.id_map.snapshot(description=description)
+        # Peek without consuming, both maps will next allocate this ID.
+        first_unshared_id = next(copy.copy(id_map.inode_id_counter))
+        # `self` no longer owns any of its inodes.
+        self.owned_inode_ids.share_all(first_unshared_id)
+        return type(self)(
+            id_map=id_map,
+            id_to_inode={
+                InodeID(id=ino_id.id, inner_id_map=id_map.inner): ino
+                for ino_id, ino in self.id_to_inode.items()
+            },
+            owned_inode_ids=_OwnedInodeIDs(first_unshared_id),
+        )
+
     def inode_at_path(
         self, path: bytes
     ) -> Optional[Union[IncompleteInode, Inode]]:
@@ -132,89 +204,160 @@ class Subvolume(NamedTuple):
             raise RuntimeError(f"Cannot apply {item}, {path} does not exist")
         return ino
 
+    def _require_owned_inode_at_path(
+        self, item: SendStreamItem, path: bytes
+    ) -> Union[IncompleteInode, Inode]:
+        "Like `_require_inode_at_path`, but the inode may be mutated."
+        ino_id = self.id_map.get_id(path)
+        if ino_id is None:
+            raise RuntimeError(f"Cannot apply {item}, {path} does not exist")
+        return self._own_inode(ino_id)
+
+    def _own_inode(self, ino_id: InodeID) -> IncompleteInode:
+        "Returns the inode for `ino_id`, first copying it if it is shared."
+        ino = self.id_to_inode[ino_id]
+        if ino_id not in self.owned_inode_ids:
+            # `Extent`s copy as themselves, so clones are still tracked.
+            ino = copy.deepcopy(ino)
+            # pyre-fixme[16]: This is supposed to be frozen!!!
+            self.id_to_inode[ino_id] = ino
+            self.owned_inode_ids.add(ino_id)
+        return ino
+
     def _delete(self, path):
         ino_id = self.id_map.remove_path(path)
         if not self.id_map.get_paths(ino_id):
             del self.id_to_inode[ino_id]
+            self.owned_inode_ids.discard(ino_id)
 
     def apply_item(self, item: SendStreamItem) -> None:
-        for item_type, inode_class in _DUMP_ITEM_TO_INCOMPLETE_INODE.items():
-            if isinstance(item, item_type):
-                ino_id = self.id_map.next()
-                if isinstance(item, SendStreamItems.mkdir):
-                    self.id_map.add_dir(ino_id, item.path)
-                else:
-                    self.id_map.add_file(ino_id, item.path)
-                assert ino_id not in self.id_to_inode
-                # pyre-fixme[16]: This is supposed to be frozen!!!
-                self.id_to_inode[ino_id] = inode_class(item=item)
-                return  # Done applying item
-
-        if isinstance(item, SendStreamItems.rename):
-            if item.dest.startswith(item.path + b"/"):
-                raise RuntimeError(f"{item} makes path its own subdirectory")
-
-            old_id = self.id_map.get_id(item.path)
-            if old_id is None:
-                raise RuntimeError(f"source of {item} does not exist")
-            new_id = self.id_map.get_id(item.dest)
-
-            # Per `rename (2)`, renaming same-inode links has NO effect o_O
-            if old_id == new_id:
-                return
-
-            # No destination path? Easy.
-            if new_id is None:
-                self.id_map.rename_path(item.path, item.dest)
-                return
-
-            # Overwrite an existing path.
-            if isinstance(self.id_to_inode[old_id], IncompleteDir):
-                new_ino = self.id_to_inode[new_id]
-                # _delete() below will ensure that the destination is empty
-                if not isinstance(new_ino, IncompleteDir):
-                    raise RuntimeError(
-                        f"{item} cannot overwrite {new_ino}, since a "
-                        "directory may only overwrite an empty directory"
-                    )
-            elif isinstance(self.id_to_inode[new_id], IncompleteDir):
+        self._apply(type(item), item_fields(item), item)
+
+    def apply_fields(
+        self, item_type: Type[SendStreamItem], fields: Tuple[Any, ...]
+    ) -> None:
+        """
+        Same as `apply_item(item_type(*fields))`, but only constructs the
+        item if needed, see `parse_send_stream_fields`.
+        """
+        self._apply(item_type, fields, None)
+
+    def _apply(
+        self,
+        item_type: Type[SendStreamItem],
+        fields: Tuple[Any, ...],
+        item: Optional[SendStreamItem],
+    ) -> None:
+        inode_class = _DUMP_ITEM_TO_INCOMPLETE_INODE.get(item_type)
+        if inode_class is not None:
+            if item is None:
+                item = item_type(*fields)
+            ino_id = self.id_map.next()
+            if item_type is SendStreamItems.mkdir:
+                self.id_map.add_dir(ino_id, item.path)
+            else:
+                self.id_map.add_file(ino_id, item.path)
+            assert ino_id not in self.id_to_inode
+            # pyre-fixme[16]: This is supposed to be frozen!!!
+            # New IDs are never shared, no need to update
+            # `owned_inode_ids`.
+            self.id_to_inode[ino_id] = inode_class(item=item)
+            return  # Done applying item
+
+        apply_fn = _ITEM_TYPE_TO_APPLY.get(item_type)
+        if apply_fn is not None:
+            apply_fn(self, *fields)
+            return
+
+        # Any other operation must be handled at inode scope.
+        ino_id = self.id_map.get_id(fields[0])
+        if ino_id is None:
+            raise RuntimeError(
+                f"Cannot apply {item or item_type(*fields)}, path does not "
+                "exist"
+            )
+        ino = self._own_inode(ino_id)
+        # pyre-fixme[16]: Inode doesn't have apply_item() ...
+        if item is None:
+            ino.apply_fields(item_type, fields)
+        else:
+            ino.apply_item(item)
+
+    # Each `_apply_<item>` takes the fields of that item, in order.
+
+    def _apply_rename(self, path: bytes, dest: bytes) -> None:
+        if dest.startswith(path + b"/"):
+            raise RuntimeError(
+                f"{SendStreamItems.rename(path, dest)} makes path its own "
+                "subdirectory"
+            )
+
+        old_id = self.id_map.get_id(path)
+        if old_id is None:
+            raise RuntimeError(
+                f"source of {SendStreamItems.rename(path, dest)} does not exist"
+            )
+        new_id = self.id_map.get_id(dest)
+
+        # Per `rename (2)`, renaming same-inode links has NO effect o_O
+        if old_id == new_id:
+            return
+
+        # No destination path? Easy.
+        if new_id is None:
+            self.id_map.rename_path(path, dest)
+            return
+
+        # Overwrite an existing path.
+        item = SendStreamItems.rename(path, dest)
+        if isinstance(self.id_to_inode[old_id], IncompleteDir):
+            new_ino = self.id_to_inode[new_id]
+            # _delete() below will ensure that the destination is empty
+            if not isinstance(new_ino, IncompleteDir):
                 raise RuntimeError(
-                    f"{item} cannot overwrite a directory with a non-directory"
+                    f"{item} cannot overwrite {new_ino}, since a "
+                    "directory may only overwrite an empty directory"
                 )
-            self._delete(item.dest)
-            self.id_map.rename_path(item.path, item.dest)
-            # NB: Per `rename (2)`, if either the new or the old inode is a
-            # symbolic link, they get treated just as regular files.
-        elif isinstance(item, SendStreamItems.unlink):
-            if isinstance(self.inode_at_path(item.path), IncompleteDir):
-                raise RuntimeError(f"Cannot {item} a directory")
-            self._delete(item.path)
-        elif isinstance(item, SendStreamItems.rmdir):
-            if not isinstance(self.inode_at_path(item.path), IncompleteDir):
-                raise RuntimeError(f"Can only {item} a directory")
-            self._delete(item.path)
-        elif isinstance(item, SendStreamItems.link):
-            if self.id_map.get_id(item.path) is not None:
-                raise RuntimeError(f"Destination of {item} already exists")
-            old_id = self.id_map.get_id(item.dest)
-            if old_id is None:
-                raise RuntimeError(f"{item} source does not exist")
-            if isinstance(self.id_to_inode[old_id], IncompleteDir):
-                raise RuntimeError(f"Cannot {item} a directory")
-            self.id_map.add_file(old_id, item.path)
-        else:  # Any other operation must be handled at inode scope.
-            ino = self.inode_at_path(item.path)
-            if ino is None:
-                raise RuntimeError(f"Cannot apply {item}, path does not exist")
-            # pyre-fixme[16]: Inode doesn't have apply_item() ...
-            self._require_inode_at_path(item, item.path).apply_item(item=item)
+        elif isinstance(self.id_to_inode[new_id], IncompleteDir):
+            raise RuntimeError(
+                f"{item} cannot overwrite a directory with a non-directory"
+            )
+        self._delete(dest)
+        self.id_map.rename_path(path, dest)
+        # NB: Per `rename (2)`, if either the new or the old inode is a
+        # symbolic link, they get treated just as regular files.
+
+    def _apply_unlink(self, path: bytes) -> None:
+        if isinstance(self.inode_at_path(path), IncompleteDir):
+            raise RuntimeError(
+                f"Cannot {SendStreamItems.unlink(path)} a directory"
+            )
+        self._delete(path)
+
+    def _apply_rmdir(self, path: bytes) -> None:
+        if not isinstance(self.inode_at_path(path), IncompleteDir):
+            raise RuntimeError(
+                f"Can only {SendStreamItems.rmdir(path)} a directory"
+            )
+        self._delete(path)
+
+    def _apply_link(self, path: bytes, dest: bytes) -> None:
+        item = SendStreamItems.link(path, dest)
+        if self.id_map.get_id(path) is not None:
+            raise RuntimeError(f"Destination of {item} already exists")
+        old_id = self.id_map.get_id(dest)
+        if old_id is None:
+            raise RuntimeError(f"{item} source does not exist")
+        if isinstance(self.id_to_inode[old_id], IncompleteDir):
+            raise RuntimeError(f"Cannot {item} a directory")
+        self.id_map.add_file(old_id, path)
 
     def apply_clone(
         self, item: SendStreamItems.clone, from_subvol: "Subvolume"
     ):
         assert isinstance(item, SendStreamItems.clone)
         # pyre-fixme[16]: Inode doesn't have apply_clone() ...
-        return self._require_inode_at_path(item, item.path).apply_clone(
+        return self._require_owned_inode_at_path(item, item.path).apply_clone(
             item, from_subvol._require_inode_at_path(item, item.from_path)
         )
 
@@ -246,16 +389,26 @@ class Subvolume(NamedTuple):
                     list(self._inode_ids_and_extents())
                 )
             )
+        # In place, we drop each `IncompleteInode` as soon as it is frozen,
+        # so that both variants of every inode never coexist in RAM.
+        in_place = freezes_in_place(_memo)
+        id_to_inode = {}
+        for id in list(self.id_to_inode) if in_place else self.id_to_inode:
+            ino = (
+                self.id_to_inode.pop(id) if in_place else self.id_to_inode[id]
+            )
+            # Bypass the `_memo` of `freeze`, since an inode shared with a
+            # snapshot has different `chunks` in each.
+            # pyre-fixme[6]: id is Optional[InodeID] not InodeID
+            id_to_inode[freeze(id, _memo=_memo)] = ino.freeze(
+                _memo=_memo, chunks=id_to_chunks.get(id)
+            )
         return type(self)(
             id_map=freeze(self.id_map, _memo=_memo),
-            id_to_inode=MappingProxyType(
-                {
-                    freeze(id, _memo=_memo):
-                    # pyre-fixme[6]: id is Optional[InodeID] not InodeID
-                    freeze(ino, _memo=_memo, chunks=id_to_chunks.get(id))
-                    for id, ino in self.id_to_inode.items()
-                }
-            ),
+            id_to_inode=MappingProxyType(id_to_inode),
+            # Nothing is shared, and mutations fail since `Inode`s lack
+            # `apply_item`.
+            owned_inode_ids=_OwnedInodeIDs(),
         )
 
     def inodes(self) -> ValuesView[Union[Inode, IncompleteInode]]:
@@ -375,3 +528,83 @@ class Subvolume(NamedTuple):
             lambda ino: id_maker.next_with_nonce(id(ino)).wrap(repr(ino)),
             top_path=top_path,
         )
+
+    def write_rendered_json(
+        self, out: TextIO, top_path=b".", *, indent: int = 2, level: int = 0
+    ) -> None:
+        """
+        Writes to `out` the same text as
+
+            json.dumps(
+                emit_non_unique_traversal_ids(self.render(top_path)),
+                sort_keys=True,
+                indent=indent,
+            )
+
+        but without materializing the `RenderedTree`, which for a large
+        subvolume is many times bigger than the output.  `level` is the
+        nesting depth of this tree in an enclosing JSON document.
+
+        Only files can repeat, and they are the leaves of the tree, so a
+        top-down walk meets them in the same order as `map_bottom_up`, and
+        assigns the same traversal IDs.  We keep a stack of the open
+        directories, and the IDs of the inodes that occur more than once.
+        """
+        id_map = self.id_map
+        # A hardlink may have some of its paths outside of `top_path`.
+        num_occurrences = {}
+        for _depth, _name, ino_id, is_dir in id_map.gen_tree(top_path):
+            if not is_dir and id_map.num_paths(ino_id) > 1:
+                num_occurrences[ino_id] = num_occurrences.get(ino_id, 0) + 1
+        ino_id_to_trav_id = {}
+
+        def nl(lvl):
+            return "\n" + " " * (indent * lvl)
+
+        # Each open directory is `[lvl, has_children]`, where `lvl` is its
+        # JSON nesting level.  A child's level is 2 more than its parent's,
+        # since it is nested in the parent's `[ino, {...}]`.
+        open_dirs = []
+
+        def close_dirs(depth):
+            while len(open_dirs) > depth:
+                lvl, has_children = open_dirs.pop()
+                out.write((nl(lvl + 1) if has_children else "") + "}")
+                out.write(nl(lvl) + "]")
+
+        for depth, name, ino_id, is_dir in id_map.gen_tree(
+            top_path, sort_key=lambda n: n.decode(errors="surrogateescape")
+        ):
+            close_dirs(depth)
+            lvl = level + 2 * depth
+            if open_dirs:
+                parent = open_dirs[-1]
+                out.write("," if parent[1] else "")
+                parent[1] = True
+                key = name.decode(errors="surrogateescape")
+                out.write(nl(lvl) + json.dumps(key) + ": ")
+            ino_json = json.dumps(repr(self.id_to_inode[ino_id]))
+            if num_occurrences.get(ino_id, 0) > 1:
+                trav_id = ino_id_to_trav_id.setdefault(
+                    ino_id, len(ino_id_to_trav_id)
+                )
+                ino_json = (
+                    f"[{nl(lvl + 2)}{ino_json},{nl(lvl + 2)}{trav_id}"
+                    f"{nl(lvl + 1)}]"
+                )
+            out.write("[" + nl(lvl + 1) + ino_json)
+            if is_dir:
+                out.write("," + nl(lvl + 1) + "{")
+                open_dirs.append([lvl, False])
+            else:
+                out.write(nl(lvl) + "]")
+        close_dirs(0)
+
+
+# The `Subvolume`-scoped items, other than those that make inodes.
+_ITEM_TYPE_TO_APPLY = {
+    SendStreamItems.rename: Subvolume._apply_rename,
+    SendStreamItems.unlink: Subvolume._apply_unlink,
+    SendStreamItems.rmdir: Subvolume._apply_rmdir,
+    SendStreamItems.link: Subvolume._apply_link,
+}
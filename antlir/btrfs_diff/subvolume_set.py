@@ -14,20 +14,28 @@ directory tree the way they would be in a real btrfs filesystem.  This is
 not done here simply because we don't have a need to model it, but you can
 easily imagine a path-aware `Volume` abstraction on top of this.
 """
-import copy
 import itertools
 from collections import Counter
 from types import MappingProxyType
 
-# Future: `deepfrozen` would let us lose the `new` methods on NamedTuples,
-# and avoid `deepcopy`.
-from typing import Iterator, Mapping, NamedTuple, Optional, Union
+# Future: `deepfrozen` would let us lose the `new` methods on NamedTuples.
+from typing import (
+    Any,
+    Iterator,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
 
 from .extents_to_chunks import extents_to_chunks_with_clones
 from .freeze import freeze
 from .incomplete_inode import IncompleteInode
 from .inode import Inode
 from .inode_id import InodeIDMap
+from .parse_send_stream import parse_send_stream_fields
 from .rendered_tree import RenderedTree
 from .send_stream import SendStreamItem, SendStreamItems
 from .subvolume import Subvolume
@@ -69,9 +77,8 @@ class SubvolumeDescription(NamedTuple):
     IMPORTANT: Because of our `.name_uuid_prefix_counts` member, which is
     owned by a `SubvolumeSet`, this object would ONLY be safely
     `deepcopy`able if we were to copy the `SubvolumeSet` in one call -- but
-    we never do that.  When we make snapshots in `SubvolumeSetMutator`, we
-    have to work around this problem, since a naive implementation would
-    `deepcopy` this object via `Subvolume.id_map.description`.
+    we never do that.  Snapshots made by `SubvolumeSetMutator` do not copy
+    it either, since `Subvolume.snapshot` takes the new description.
     """
 
     name: bytes
@@ -208,20 +215,10 @@ class SubvolumeSetMutator(NamedTuple):
         )
         if isinstance(subvol_item, SendStreamItems.snapshot):
             uuid = parent_id.uuid if parent_id is not None else ""
-            parent_subvol = subvol_set.uuid_to_subvolume[uuid]
-            # `SubvolumeDescription` references a part `SubvolumeSet`, so it
-            # is not correctly `deepcopy`able as part of a `Subvolume`.  And
-            # we want to modify the `InodeIDMap`'s `description` in any
-            # case, so let's just bulk-replace the old description instance.
-            # This would not be sane if the old instance were of a type that
-            # may be interned by the runtime, like `int`, hence the assert.
-            assert isinstance(
-                parent_subvol.id_map.inner.description, SubvolumeDescription
-            )
-            subvol = copy.deepcopy(
-                # pyre-fixme[6]: unsafe(?) deepcopy across different types!!!
-                parent_subvol,
-                memo={id(parent_subvol.id_map.inner.description): description},
+            # Copy-on-write, so long chains of incremental send-streams
+            # only copy what each of them changes.
+            subvol = subvol_set.uuid_to_subvolume[uuid].snapshot(
+                description=description
             )
         else:
             subvol = Subvolume.new(
@@ -252,3 +249,32 @@ class SubvolumeSetMutator(NamedTuple):
                 raise RuntimeError(f"Unknown from_uuid for {item}")
             return self.subvolume.apply_clone(item, from_subvol)
         return self.subvolume.apply_item(item)
+
+    def apply_fields(
+        self, item_type: Type[SendStreamItem], fields: Tuple[Any, ...]
+    ):
+        "Same as `apply_item(item_type(*fields))`, see `Subvolume`."
+        if item_type is SendStreamItems.clone:
+            return self.apply_item(item_type(*fields))
+        return self.subvolume.apply_fields(item_type, fields)
+
+
+def apply_send_stream(
+    subvol_set: SubvolumeSet, infile, **kwargs
+) -> Subvolume:
+    """
+    Applies the send-stream in `infile` to a new `Subvolume` in
+    `subvol_set`, and returns it.  `kwargs` go to `parse_send_stream_fields`.
+
+    This is the fast way of doing `SubvolumeSetMutator.apply_item` on each
+    item of `parse_send_stream`, since the items are never constructed.
+    """
+    fields_iter = parse_send_stream_fields(infile, **kwargs)
+    for item_type, fields in fields_iter:
+        mutator = SubvolumeSetMutator.new(subvol_set, item_type(*fields))
+        break
+    else:
+        raise RuntimeError(f"Send-stream {infile} has no commands")
+    for item_type, fields in fields_iter:
+        mutator.apply_fields(item_type, fields)
+    return mutator.subvolume
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Measures how fast a binary send-stream becomes an in-memory `SubvolumeSet`.
+Like the other benchmarks in this directory, this is a development tool,
+not a test:
+
+  buck run antlir/btrfs_diff:benchmark-apply-send-stream -- --files 150000
+
+We synthesize a send-stream in which each file is created under a
+temporary name, gets its data & metadata, and is renamed into place --
+about 7 commands per file.  It is then applied in two ways:
+
+ - "items": `parse_send_stream` feeding `SubvolumeSetMutator.apply_item`,
+ - "fused": `apply_send_stream`, which does not build `SendStreamItem`s.
+
+Both use `lazy_write_data`, so that copying file data does not dominate.
+"""
+import argparse
+import struct
+import tempfile
+import time
+import uuid
+
+from ..crc32c_utils import crc32c
+from ..parse_send_stream import (
+    BTRFS_SEND_STREAM_MAGIC,
+    AttributeKind,
+    CommandKind,
+    parse_send_stream,
+)
+from ..subvolume_set import (
+    apply_send_stream,
+    SubvolumeSet,
+    SubvolumeSetMutator,
+)
+
+
+def _attr(kind: AttributeKind, data: bytes) -> bytes:
+    return struct.pack("<HH", kind.value, len(data)) + data
+
+
+def _cmd(kind: CommandKind, *attrs: bytes) -> bytes:
+    payload = b"".join(attrs)
+    header = struct.pack("<IHI", len(payload), kind.value, 0)
+    return (
+        struct.pack(
+            "<IHI", len(payload), kind.value, crc32c(payload, crc32c(header))
+        )
+        + payload
+    )
+
+
+def _make_sendstream(num_files: int, files_per_dir: int) -> bytes:
+    A = AttributeKind
+    u64 = struct.Struct("<Q").pack
+    time = struct.pack("<QI", 1600000000, 0)
+    data = b"x" * 1000
+    cmds = [
+        BTRFS_SEND_STREAM_MAGIC + struct.pack("<I", 1),
+        _cmd(
+            CommandKind.SUBVOL,
+            _attr(A.PATH, b"vol"),
+            _attr(A.UUID, uuid.UUID(int=1).bytes),
+            _attr(A.CTRANSID, u64(1)),
+        ),
+    ]
+    for f in range(num_files):
+        d = b"d%d" % (f // files_per_dir)
+        if f % files_per_dir == 0:
+            cmds.append(_cmd(CommandKind.MKDIR, _attr(A.PATH, d)))
+        tmp = _attr(A.PATH, b"%s/o%d-1-0" % (d, f))
+        cmds.extend(
+            [
+                _cmd(CommandKind.MKFILE, tmp),
+                _cmd(
+                    CommandKind.WRITE,
+                    tmp,
+                    _attr(A.FILE_OFFSET, u64(0)),
+                    _attr(A.DATA, data),
+                ),
+                _cmd(
+                    CommandKind.CHOWN,
+                    tmp,
+                    _attr(A.UID, u64(0)),
+                    _attr(A.GID, u64(0)),
+                ),
+                _cmd(CommandKind.CHMOD, tmp, _attr(A.MODE, u64(0o644))),
+                _cmd(
+                    CommandKind.UTIMES,
+                    tmp,
+                    _attr(A.ATIME, time),
+                    _attr(A.MTIME, time),
+                    _attr(A.CTIME, time),
+                ),
+                _cmd(
+                    CommandKind.SET_XATTR,
+                    tmp,
+                    _attr(A.XATTR_NAME, b"security.selinux"),
+                    _attr(A.XATTR_DATA, b"system_u:object_r:usr_t:s0\0"),
+                ),
+                _cmd(
+                    CommandKind.RENAME,
+                    tmp,
+                    _attr(A.PATH_TO, b"%s/file%d" % (d, f)),
+                ),
+            ]
+        )
+    cmds.append(_cmd(CommandKind.END))
+    return b"".join(cmds)
+
+
+def _apply_items(infile) -> SubvolumeSet:
+    subvols = SubvolumeSet.new()
+    items = parse_send_stream(infile, lazy_write_data=True)
+    mutator = SubvolumeSetMutator.new(subvols, next(items))
+    for item in items:
+        mutator.apply_item(item)
+    return subvols
+
+
+def _apply_fused(infile) -> SubvolumeSet:
+    subvols = SubvolumeSet.new()
+    apply_send_stream(subvols, infile, lazy_write_data=True)
+    return subvols
+
+
+def _main():
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    p.add_argument("--files", type=int, default=150000)
+    p.add_argument("--files-per-dir", type=int, default=100)
+    args = p.parse_args()
+
+    sendstream = _make_sendstream(args.files, args.files_per_dir)
+    with tempfile.TemporaryFile() as infile:
+        infile.write(sendstream)
+        infile.seek(0)
+        num_cmds = sum(1 for _ in parse_send_stream(infile, zero_copy=True))
+        print(f"{len(sendstream)} bytes, {num_cmds + 1} commands")
+        for name, apply_fn in [
+            ("items", _apply_items),
+            ("fused", _apply_fused),
+        ]:
+            infile.seek(0)
+            start = time.perf_counter()
+            apply_fn(infile)
+            secs = time.perf_counter() - start
+            print(
+                f"  {name:<10} {secs:8.2f} s "
+                f"{(num_cmds + 1) / secs:10.0f} commands/s"
+            )
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Measures `extents_to_chunks_with_clones` on files that reflink the same
+extents many times over, as happens with RPM-installed files cloned
+across layers.  Like the other benchmarks here, this is a development
+tool, not a test:
+
+  buck run antlir/btrfs_diff:benchmark-extents-to-chunks -- --copies 50
+
+We compare the sweep line, in the symmetric and the spanning-tree output
+modes, to the `cmp_to_key`-style sort that the module used to do.
+"""
+import argparse
+import functools
+import time
+from collections import defaultdict
+from unittest import mock
+
+from .. import extents_to_chunks
+from ..extent import Extent
+from ..extents_to_chunks import extents_to_chunks_with_clones
+from ..inode_id import InodeIDMap
+
+
+def _python_cmp_ref_idx_to_offsets_clones(
+    extent_id, clone_refs, *, spanning_tree
+):
+    "The pre-sweep-line implementation, for comparison."
+    assert not spanning_tree, "Only supports the symmetric mode"
+
+    def key(op):
+        pos, action, _idx, ref = op
+        return (pos, action, ref[1:], ref.clone[1:], ref.clone.inode_id.id)
+
+    def cmp(a, b):
+        assert a[3].extent is b[3].extent
+        ka, kb = key(a), key(b)
+        return (ka > kb) - (ka < kb)
+
+    ops = []
+    for idx, ref in enumerate(clone_refs):
+        ops.append((ref.offset, "push", idx, ref))
+        ops.append((ref.offset + ref.clone.length, "pop", idx, ref))
+    active_refs = {}
+    ref_idx_to_offsets_clones = defaultdict(list)
+    for pos, action, idx, ref in sorted(ops, key=functools.cmp_to_key(cmp)):
+        if action == "push":
+            active_refs[ref] = idx
+            continue
+        del active_refs[ref]
+        for other_ref, other_idx in active_refs.items():
+            start = max(other_ref.offset, ref.offset)
+            for to_idx, to_ref, from_ref in [
+                (idx, ref, other_ref),
+                (other_idx, other_ref, ref),
+            ]:
+                extents_to_chunks._add_offset_clone(
+                    ref_idx_to_offsets_clones,
+                    to_idx=to_idx,
+                    to_ref=to_ref,
+                    from_ref=from_ref,
+                    start=start,
+                    end=pos,
+                )
+    return ref_idx_to_offsets_clones
+
+
+def _make_ids_and_extents(num_extents: int, copies: int, num_files: int):
+    id_map = InodeIDMap.new()
+    ids_and_extents = []
+    for e in range(num_extents):
+        source = Extent.empty().write(offset=0, length=4096)
+        ids_and_extents.append(
+            (id_map.add_file(id_map.next(), b"src%d" % e), source)
+        )
+        for c in range(copies):
+            # Most copies clone the whole extent, some clone a part.
+            offset = 512 * (c % 3)
+            ids_and_extents.append(
+                (
+                    id_map.add_file(id_map.next(), b"src%d_copy%d" % (e, c)),
+                    Extent.empty().clone(
+                        to_offset=0,
+                        from_extent=source,
+                        from_offset=offset,
+                        length=4096 - offset,
+                    ),
+                )
+            )
+    for f in range(num_files):
+        ids_and_extents.append(
+            (
+                id_map.add_file(id_map.next(), b"f%d" % f),
+                Extent.empty().write(offset=0, length=4096),
+            )
+        )
+    return ids_and_extents
+
+
+def _main():
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    p.add_argument("--extents", type=int, default=500)
+    p.add_argument("--copies", type=int, default=20)
+    p.add_argument("--files", type=int, default=20000, help="Not cloned")
+    args = p.parse_args()
+
+    ids_and_extents = _make_ids_and_extents(
+        args.extents, args.copies, args.files
+    )
+    print(
+        f"{args.extents} extents cloned {args.copies} times each, "
+        f"{args.files} other files"
+    )
+    for name, spanning_tree, patch in [
+        (
+            "python-cmp",
+            False,
+            mock.patch.object(
+                extents_to_chunks,
+                "_ref_idx_to_offsets_clones",
+                _python_cmp_ref_idx_to_offsets_clones,
+            ),
+        ),
+        ("sweep", False, mock.MagicMock()),
+        ("spanning-tree", True, mock.MagicMock()),
+    ]:
+        with patch:
+            start = time.perf_counter()
+            num_clones = sum(
+                len(chunk.chunk_clones)
+                for _ino_id, chunks in extents_to_chunks_with_clones(
+                    ids_and_extents, spanning_tree=spanning_tree
+                )
+                for chunk in chunks
+            )
+            secs = time.perf_counter() - start
+        print(f"  {name:<15} {secs:8.2f} s {num_clones:10} ChunkClones")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Measures how fast a `Subvolume` applies a rename-heavy send-stream, which
+stresses the path lookups of `InodeIDMap`.  Like the other benchmarks in
+this directory, this is a development tool, not a test:
+
+  buck run antlir/btrfs_diff:benchmark-inode-id-renames -- --packages 200
+
+The stream mimics RPM installs & upgrades: each file is created under a
+temporary name in a deep directory, gets its data & metadata, and is then
+renamed into place.  The upgrade pass renames a fresh temporary file over
+every existing one.
+"""
+import argparse
+import time
+
+from ..parse_dump import SendStreamItems
+from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
+
+
+def _gen_items(packages: int, files: int, depth: int):
+    si = SendStreamItems
+    prefix = b"usr"
+    yield si.mkdir(path=prefix)
+    for d in range(1, depth):
+        prefix += b"/lib%d" % d
+        yield si.mkdir(path=prefix)
+    for upgrade in (False, True):
+        for p in range(packages):
+            pkg_dir = prefix + b"/pkg%d" % p
+            if not upgrade:
+                yield si.mkdir(path=pkg_dir)
+            for f in range(files):
+                tmp = pkg_dir + b"/;%x" % (p * files + f)
+                yield si.mkfile(path=tmp)
+                yield si.write(path=tmp, offset=0, data=b"x")
+                yield si.chown(path=tmp, uid=0, gid=0)
+                yield si.chmod(path=tmp, mode=0o644)
+                yield si.utimes(
+                    path=tmp, atime=(1, 0), mtime=(1, 0), ctime=(1, 0)
+                )
+                yield si.rename(path=tmp, dest=pkg_dir + b"/file%d.py" % f)
+
+
+def _main():
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    p.add_argument("--packages", type=int, default=200)
+    p.add_argument("--files", type=int, default=50)
+    p.add_argument("--depth", type=int, default=6)
+    args = p.parse_args()
+
+    items = list(_gen_items(args.packages, args.files, args.depth))
+    print(
+        f"{len(items)} items for {args.packages} packages of {args.files} "
+        f"files at depth {args.depth}"
+    )
+    mutator = SubvolumeSetMutator.new(
+        SubvolumeSet.new(),
+        SendStreamItems.subvol(path=b"vol", uuid=b"0", transid=1),
+    )
+    start = time.perf_counter()
+    for item in items:
+        mutator.apply_item(item)
+    secs = time.perf_counter() - start
+    print(f"  {secs:.2f} s, {1e6 * secs / len(items):.1f} us/item")
+
+
+if __name__ == "__main__":
+    _main()
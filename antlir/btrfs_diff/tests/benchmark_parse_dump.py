@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Compares `parse_btrfs_dump` with `_parse_btrfs_dump_regex`, the regex-based
+implementation it replaced.  Like the other benchmarks in this directory,
+this is a development tool, not a test:
+
+  buck run antlir/btrfs_diff:benchmark-parse-dump -- --files 150000
+
+We synthesize `btrfs receive --dump` output in the style of the gold
+`demo_sendstreams` -- each file is created under a temporary name, renamed
+into place, and gets data, an SELinux label, an owner, a mode, and times --
+7 lines per file, so the default is just over 1M lines.  Some of the names
+contain characters that `--dump` escapes.
+"""
+import argparse
+import tempfile
+import time
+
+from ..parse_dump import _parse_btrfs_dump_regex, parse_btrfs_dump
+
+
+_TIME = b"2019-07-23T11:54:26-0700"
+
+
+def _make_dump(num_files: int, files_per_dir: int) -> bytes:
+    lines = [
+        b"subvol ./vol uuid=481757f7-6c61-2942-9bea-ee222b120c81 "
+        b"transid=93993"
+    ]
+    for f in range(num_files):
+        d = f // files_per_dir
+        if f % files_per_dir == 0:
+            lines.append(b"mkdir ./vol/dir%d" % d)
+        tmp = b"./vol/o%d-93991-0" % (f + 257)
+        # Every 10th name has a space, which `--dump` escapes.
+        name = b"file\\ %d" % f if f % 10 == 0 else b"file%d" % f
+        path = b"./vol/dir%d/%s" % (d, name)
+        lines.extend(
+            [
+                b"mkfile %s" % tmp,
+                b"rename %s dest=%s" % (tmp, path.replace(b"\\ ", b" ")),
+                b"write %s offset=0 len=%d" % (path, 100 + f % 4000),
+                b"set_xattr %s name=security.selinux "
+                b"data=user_u:object_r:base_t len=23" % path,
+                b"chown %s gid=0 uid=0" % path,
+                b"chmod %s mode=644" % path,
+                b"utimes %s atime=%s mtime=%s ctime=%s"
+                % (path, _TIME, _TIME, _TIME),
+            ]
+        )
+    return b"\n".join(lines) + b"\n"
+
+
+def _main():
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    p.add_argument("--files", type=int, default=150000)
+    p.add_argument("--files-per-dir", type=int, default=100)
+    args = p.parse_args()
+
+    dump = _make_dump(args.files, args.files_per_dir)
+    num_lines = dump.count(b"\n")
+    print(f"{len(dump)} bytes, {num_lines} lines")
+    with tempfile.TemporaryFile() as infile:
+        infile.write(dump)
+        for name, parse_fn in [
+            ("regex", _parse_btrfs_dump_regex),
+            ("split", parse_btrfs_dump),
+        ]:
+            infile.seek(0)
+            start = time.perf_counter()
+            num_items = sum(1 for _ in parse_fn(infile))
+            secs = time.perf_counter() - start
+            assert num_items == num_lines, (num_items, num_lines)
+            print(
+                f"  {name:<10} {secs:8.2f} s {num_lines / secs:10.0f} lines/s"
+            )
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Measures the throughput of `parse_send_stream` in its different modes on the
+gold `demo_sendstreams` fixtures.  Like `make-demo-sendstreams`, this is a
+development tool, not a test:
+
+  buck run antlir/btrfs_diff:benchmark-parse-send-stream -- --repeat 500
+
+Every fixture is parsed `--repeat` times from a `BytesIO`, and from a
+regular file (which `zero_copy` memory-maps).  We report the best of
+`--rounds` timings, since the minimum is the least noisy estimate.
+
+The fixtures are small, so to check how e.g. `verify_crc` behaves on large
+streams, pass your own with `--sendstream`.
+"""
+import argparse
+import io
+import tempfile
+import time
+from typing import Callable, Iterator, Tuple
+
+from ..crc32c_utils import HAVE_NATIVE_CRC32C
+from ..parse_send_stream import parse_send_stream
+from .demo_sendstreams import gold_demo_sendstreams
+
+
+def _best_time(fn: Callable[[], None], rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _gen_benchmarks(
+    sendstream: bytes, repeat: int
+) -> Iterator[Tuple[str, Callable[[], None]]]:
+    for mode, kwargs in [
+        ("default", {}),
+        ("zero_copy", {"zero_copy": True}),
+        ("lazy_write_data", {"lazy_write_data": True}),
+        ("zero_copy+verify_crc", {"zero_copy": True, "verify_crc": True}),
+    ]:
+
+        def parse_bytesio(kwargs=kwargs):
+            for _ in range(repeat):
+                infile = io.BytesIO(sendstream)
+                for _item in parse_send_stream(infile, **kwargs):
+                    pass
+
+        yield f"{mode} BytesIO", parse_bytesio
+
+        def parse_file(kwargs=kwargs):
+            with tempfile.TemporaryFile() as f:
+                f.write(sendstream)
+                for _ in range(repeat):
+                    f.seek(0)
+                    for _item in parse_send_stream(f, **kwargs):
+                        pass
+
+        yield f"{mode} file", parse_file
+
+
+def _main():
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    p.add_argument("--repeat", type=int, default=100)
+    p.add_argument("--rounds", type=int, default=5)
+    p.add_argument(
+        "--sendstream",
+        action="append",
+        default=[],
+        help="Also benchmark the send-stream in this file. Can be repeated.",
+    )
+    args = p.parse_args()
+
+    print(
+        "CRC32C implementation: "
+        + ("native" if HAVE_NATIVE_CRC32C else "pure Python")
+    )
+    name_to_sendstream = {
+        name: d["sendstream"] for name, d in gold_demo_sendstreams().items()
+    }
+    for path in args.sendstream:
+        with open(path, "rb") as f:
+            name_to_sendstream[path] = f.read()
+    for name, sendstream in sorted(name_to_sendstream.items()):
+        num_items = sum(1 for _ in parse_send_stream(io.BytesIO(sendstream)))
+        print(f"{name}: {len(sendstream)} bytes, {num_items} items")
+        for bench_name, fn in _gen_benchmarks(sendstream, args.repeat):
+            secs = _best_time(fn, args.rounds)
+            print(
+                f"  {bench_name:<30} "
+                f"{len(sendstream) * args.repeat / secs / 1e6:8.1f} MB/s "
+                f"{num_items * args.repeat / secs:10.0f} items/s"
+            )
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Measures the RAM that a `Subvolume` needs per inode, by applying a
+synthetic send-stream that creates a large tree of files & directories,
+each with the metadata that a real `btrfs send` emits.  Like the other
+benchmarks here, this is a development tool, not a test:
+
+  buck run antlir/btrfs_diff:benchmark-subvolume-memory -- --files 1000000
+
+The report counts the memory allocated while applying the stream (as seen
+by `tracemalloc`), excluding the send-stream items themselves, and lists
+the source lines that allocated the most.
+
+For `--files 20000`, this went from 1753 to 1214 bytes per inode with
+`__slots__` & interning, and is 1262 now.  See "Known issues" in
+`subvolume.py` for what a bigger reduction would take.
+"""
+import argparse
+import gc
+import tracemalloc
+
+from ..parse_dump import SendStreamItems
+from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
+
+
+def _gen_items(num_dirs: int, num_files: int):
+    si = SendStreamItems
+    # Like the parser, make new `bytes` objects for every item, otherwise
+    # the constants would be shared, and the report too optimistic.
+    for d in range(num_dirs):
+        yield si.mkdir(path=b"d%d" % d)
+    for f in range(num_files):
+        path = b"d%d/f%d" % (f % num_dirs, f)
+        yield si.mkfile(path=path)
+        yield si.write(path=path, offset=4096 * (f % 3), data=b"x" * 100)
+        yield si.chown(path=path, uid=f % 2, gid=f % 2)
+        yield si.chmod(path=path, mode=0o644)
+        yield si.set_xattr(
+            path=path,
+            name=b"security.%s" % b"selinux",
+            data=b"system_u:object_r:%s:s0\0" % b"usr_t",
+        )
+        t = 1600000000 + f
+        yield si.utimes(path=path, atime=(t, f), mtime=(t, f), ctime=(t, f))
+
+
+def _main():
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    p.add_argument("--dirs", type=int, default=1000)
+    p.add_argument("--files", type=int, default=100000)
+    p.add_argument("--top", type=int, default=10, help="Source lines to show")
+    args = p.parse_args()
+
+    subvols = SubvolumeSet.new()
+    mutator = SubvolumeSetMutator.new(
+        subvols, SendStreamItems.subvol(path=b"big", uuid=b"0", transid=1)
+    )
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for item in _gen_items(args.dirs, args.files):
+        mutator.apply_item(item)
+    del item  # Only count what the subvolume retains
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "lineno")
+    total = sum(s.size_diff for s in stats)
+    num_inodes = args.dirs + args.files
+    print(
+        f"{args.files} files in {args.dirs} directories: "
+        f"{total / 1e6:.1f} MB, {total / num_inodes:.0f} bytes per inode"
+    )
+    for s in stats[: args.top]:
+        frame = s.traceback[0]
+        print(
+            f"  {s.size_diff / num_inodes:7.0f} B/inode  "
+            f"{frame.filename}:{frame.lineno}"
+        )
+
+
+if __name__ == "__main__":
+    _main()
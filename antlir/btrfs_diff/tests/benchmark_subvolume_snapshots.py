@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Measures the cost of applying a chain of incremental send-streams, each a
+snapshot of the previous one, onto a large base subvolume.  Like
+`benchmark-parse-send-stream`, this is a development tool, not a test:
+
+  buck run antlir/btrfs_diff:benchmark-subvolume-snapshots -- --files 20000
+
+We compare the copy-on-write `Subvolume.snapshot` to the `deepcopy` that
+`SubvolumeSetMutator` used to do, and report the time & the memory
+allocated for the chain (as seen by `tracemalloc`).
+"""
+import argparse
+import copy
+import time
+import tracemalloc
+from unittest import mock
+
+from ..parse_dump import SendStreamItems
+from ..subvolume import Subvolume
+from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
+
+
+def _deepcopy_snapshot(self, *, description):
+    "The pre-copy-on-write implementation, for comparison."
+    return copy.deepcopy(
+        self, memo={id(self.id_map.inner.description): description}
+    )
+
+
+def _make_base(subvols: SubvolumeSet, num_dirs: int, num_files: int):
+    si = SendStreamItems
+    mutator = SubvolumeSetMutator.new(
+        subvols, si.subvol(path=b"base", uuid=b"0", transid=1)
+    )
+    for d in range(num_dirs):
+        mutator.apply_item(si.mkdir(path=b"d%d" % d))
+    for f in range(num_files):
+        path = b"d%d/f%d" % (f % num_dirs, f)
+        mutator.apply_item(si.mkfile(path=path))
+        mutator.apply_item(si.write(path=path, offset=0, data=b"x" * 100))
+        mutator.apply_item(si.chmod(path=path, mode=0o644))
+        mutator.apply_item(si.set_xattr(path=path, name=b"user.a", data=b"b"))
+
+
+def _apply_chain(
+    subvols: SubvolumeSet,
+    num_dirs: int,
+    num_files: int,
+    snapshots: int,
+    changes: int,
+):
+    "Each snapshot touches `changes` files of the previous one."
+    si = SendStreamItems
+    for n in range(1, snapshots + 1):
+        mutator = SubvolumeSetMutator.new(
+            subvols,
+            si.snapshot(
+                path=b"snap%d" % n,
+                uuid=b"%d" % n,
+                transid=n + 1,
+                parent_uuid=b"%d" % (n - 1),
+                parent_transid=n,
+            ),
+        )
+        for c in range(changes):
+            f = (n * changes + c) % num_files
+            path = b"d%d/f%d" % (f % num_dirs, f)
+            mutator.apply_item(si.write(path=path, offset=50, data=b"y"))
+            mutator.apply_item(si.chmod(path=path, mode=0o600))
+        mutator.apply_item(si.mkfile(path=b"d0/new%d" % n))
+        mutator.apply_item(si.rename(path=b"d0/new%d" % n, dest=b"new%d" % n))
+
+
+def _main():
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    p.add_argument("--dirs", type=int, default=100)
+    p.add_argument("--files", type=int, default=5000)
+    p.add_argument("--snapshots", type=int, default=20)
+    p.add_argument("--changes", type=int, default=50)
+    args = p.parse_args()
+
+    print(
+        f"{args.files} files in {args.dirs} directories, a chain of "
+        f"{args.snapshots} snapshots changing {args.changes} files each"
+    )
+    for name, snapshot_fn in [
+        ("copy-on-write", Subvolume.snapshot),
+        ("deepcopy", _deepcopy_snapshot),
+    ]:
+        subvols = SubvolumeSet.new()
+        _make_base(subvols, args.dirs, args.files)
+        with mock.patch.object(Subvolume, "snapshot", snapshot_fn):
+            tracemalloc.start()
+            start = time.perf_counter()
+            _apply_chain(
+                subvols, args.dirs, args.files, args.snapshots, args.changes
+            )
+            secs = time.perf_counter() - start
+            allocated, _peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        print(f"  {name:<15} {secs:8.2f} s {allocated / 1e6:10.1f} MB")
+
+
+if __name__ == "__main__":
+    _main()
@@ -18,10 +18,9 @@ from ..inode_utils import (
     erase_selinux_xattr,
     erase_utimes_in_range,
 )
-from ..parse_send_stream import parse_send_stream
 from ..rendered_tree import RenderedTree, emit_non_unique_traversal_ids
 from ..subvolume import Subvolume
-from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
+from ..subvolume_set import apply_send_stream, SubvolumeSet
 from .subvolume_utils import expected_subvol_add_traversal_ids
 
 
@@ -37,11 +36,10 @@ def render_subvolume(subvol: "Subvolume") -> "RenderedTree":
 
 
 def add_sendstream_to_subvol_set(subvols: SubvolumeSet, sendstream: bytes):
-    parsed = parse_send_stream(BytesIO(sendstream))
-    mutator = SubvolumeSetMutator.new(subvols, next(parsed))
-    for i in parsed:
-        mutator.apply_item(i)
-    return mutator.subvolume
+    # Rendering never looks at file data, so don't copy it out of the stream
+    return apply_send_stream(
+        subvols, BytesIO(sendstream), lazy_write_data=True
+    )
 
 
 # We could do this on each `mutator.subvol` in `add_...`, but that would
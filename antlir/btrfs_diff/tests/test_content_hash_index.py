@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import io
+import unittest
+
+from ..content_hash_index import (
+    ContentHashIndex,
+    DedupSummary,
+    DuplicateFiles,
+    index_send_stream,
+)
+from ..send_stream import item_fields, SendStreamDataRef, SendStreamItems
+from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
+from .demo_sendstreams import gold_demo_sendstreams
+
+
+def _index(*items, block_size=4) -> ContentHashIndex:
+    si = SendStreamItems
+    subvols = SubvolumeSet.new()
+    mutator = SubvolumeSetMutator.new(
+        subvols, si.subvol(path=b"vol", uuid=b"v", transid=1)
+    )
+    index = ContentHashIndex(
+        subvolume=mutator.subvolume, block_size=block_size
+    )
+    for item in items:
+        index.apply_fields(mutator, type(item), item_fields(item))
+    return index
+
+
+def _file(path, *writes):
+    si = SendStreamItems
+    return [si.mkfile(path=path)] + [
+        si.write(path=path, offset=offset, data=data)
+        for offset, data in writes
+    ]
+
+
+class ContentHashIndexTestCase(unittest.TestCase):
+    def test_duplicate_files(self):
+        si = SendStreamItems
+        index = _index(
+            *_file(b"a", (0, b"0123456789")),
+            # Different writes, same content
+            *_file(b"b", (0, b"01"), (2, b"234"), (5, b"56789")),
+            *_file(b"c", (4, b"456789"), (0, b"0123")),
+            si.link(path=b"a2", dest=b"a"),
+            # Same blocks as the above, except for the last
+            *_file(b"d", (0, b"0123456789\0")),
+            # Holes are zeros
+            *_file(b"z1", (0, b"\0\0\0\0\0\0\0\0\0\0\0")),
+            *_file(b"z2"),
+            si.truncate(path=b"z2", size=11),
+            # Empty files are not worth reporting
+            *_file(b"e1"),
+            *_file(b"e2"),
+        )
+        self.assertEqual(
+            [
+                DuplicateFiles(
+                    size=10, paths=((b"a", b"a2"), (b"b",), (b"c",))
+                ),
+                DuplicateFiles(size=11, paths=((b"z1",), (b"z2",))),
+            ],
+            index.duplicate_files(),
+        )
+        self.assertEqual(20, index.duplicate_files()[0].savings)
+        self.assertEqual(
+            DedupSummary(
+                indexed_files=8,
+                unindexed_files=0,
+                # `z2` is all holes
+                data_bytes=3 * 10 + 2 * 11,
+                file_dedup_bytes=20 + 11,
+                # The 3 copies of `a`, 2 blocks of `d`, 1 block of `z1`
+                block_dedup_bytes=2 * 10 + 2 * 4 + 4,
+            ),
+            index.summary(),
+        )
+
+    def test_unindexed_files(self):
+        si = SendStreamItems
+        index = _index(
+            *_file(b"ok", (0, b"0123456789")),
+            # Overwrite within a block
+            *_file(b"overwrite", (0, b"0123456789"), (1, b"1")),
+            *_file(b"overwrite_partial", (0, b"012"), (1, b"1")),
+            # Fill in a hole of a hashed block
+            *_file(b"fill_hole", (1, b"123"), (0, b"0")),
+            # Truncate to the middle of a hashed block
+            *_file(b"truncate", (0, b"0123456789")),
+            si.truncate(path=b"truncate", size=2),
+            *_file(b"clone"),
+            si.clone(
+                path=b"clone",
+                offset=0,
+                len=10,
+                from_uuid=b"v",
+                from_transid=1,
+                from_path=b"ok",
+                clone_offset=0,
+            ),
+            *_file(b"update_extent"),
+            si.update_extent(path=b"update_extent", offset=0, len=10),
+            # Indexable overwrites & truncations
+            *_file(b"ok_overwrite", (0, b"abcd"), (0, b"0123")),
+            si.write(path=b"ok_overwrite", offset=4, data=b"456789"),
+            *_file(b"ok_truncate", (0, b"01234567"), (8, b"8")),
+            si.truncate(path=b"ok_truncate", size=20),
+            si.truncate(path=b"ok_truncate", size=10),
+            si.write(path=b"ok_truncate", offset=9, data=b"9"),
+            # Not reported, since it's gone
+            *_file(b"gone", (0, b"0123456789")),
+            si.unlink(path=b"gone"),
+        )
+        self.assertEqual(
+            [
+                DuplicateFiles(
+                    size=10,
+                    paths=((b"ok",), (b"ok_overwrite",), (b"ok_truncate",)),
+                ),
+            ],
+            index.duplicate_files(),
+        )
+        self.assertEqual((3, 6), index.summary()[:2])
+
+    def test_lazy_write_data(self):
+        si = SendStreamItems
+        with self.assertRaisesRegex(RuntimeError, "Need the data for write"):
+            _index(
+                *_file(b"a"),
+                si.write(
+                    path=b"a",
+                    offset=0,
+                    data=SendStreamDataRef(offset=0, length=1),
+                ),
+            )
+
+    def test_bad_block_size(self):
+        with self.assertRaisesRegex(RuntimeError, "Bad block size 0"):
+            _index(block_size=0)
+
+    def test_gold_demo_sendstreams(self):
+        stream_dict = gold_demo_sendstreams()
+        subvols = SubvolumeSet.new()
+        create_ops = index_send_stream(
+            subvols, io.BytesIO(stream_dict["create_ops"]["sendstream"])
+        )
+        self.assertEqual([], create_ops.duplicate_files())
+        self.assertEqual(
+            DedupSummary(
+                indexed_files=4,
+                unindexed_files=1,  # `56KB_nuls_clone`
+                data_bytes=94208,
+                file_dedup_bytes=0,
+                # Most of the blocks are all-zero
+                block_dedup_bytes=86016,
+            ),
+            create_ops.summary(),
+        )
+        mutate_ops = index_send_stream(
+            subvols, io.BytesIO(stream_dict["mutate_ops"]["sendstream"])
+        )
+        # `hello_big_hole` is from the parent, and `een` has no data
+        self.assertEqual((0, 2), mutate_ops.summary()[:2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import random
+import unittest
+
+from ..crc32c_utils import HAVE_NATIVE_CRC32C, crc32c, crc32c_pure_python
+
+
+class Crc32cTestCase(unittest.TestCase):
+    def test_standard_check_value(self):
+        # The standard CRC-32C inverts on entry and exit, btrfs does not.
+        for fn in [crc32c, crc32c_pure_python]:
+            self.assertEqual(
+                0xE3069283, fn(b"123456789", 0xFFFFFFFF) ^ 0xFFFFFFFF
+            )
+            self.assertEqual(0, fn(b""))
+
+    def test_chaining_and_buffer_types(self):
+        data = bytes(random.Random(7).getrandbits(8) for _ in range(1000))
+        expected = crc32c_pure_python(data)
+        for fn in [crc32c, crc32c_pure_python]:
+            self.assertEqual(expected, fn(data))
+            self.assertEqual(expected, fn(memoryview(data)))
+            self.assertEqual(expected, fn(data[300:], fn(data[:300])))
+
+    @unittest.skipUnless(HAVE_NATIVE_CRC32C, "needs the `crc32c` module")
+    def test_native_is_used(self):
+        self.assertIsNot(crc32c, crc32c_pure_python)  # pragma: no cover
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,6 +9,7 @@ import math
 import re
 import textwrap
 import unittest
+from collections import defaultdict
 from typing import Iterable, Tuple
 
 from ..extent import Extent
@@ -180,10 +181,11 @@ class ExtentsToChunksTestCase(unittest.TestCase):
                 file_extent,
             )
 
-    def _repr_chunks_from_figure(self, s, **kwargs):
+    def _repr_chunks_from_figure(self, s, spanning_tree=False, **kwargs):
         return _repr_ids_and_chunks(
             extents_to_chunks_with_clones(
-                list(self._gen_ids_and_extents_from_figure(s, **kwargs))
+                list(self._gen_ids_and_extents_from_figure(s, **kwargs)),
+                spanning_tree=spanning_tree,
             )
         )
 
@@ -470,6 +472,79 @@ class ExtentsToChunksTestCase(unittest.TestCase):
             ),
         )
 
+    def _check_spanning_tree(self, figure):
+        """
+        For every byte of the backing extent, the `ChunkClone`s covering
+        that byte must link the file bytes that share it into a tree.
+        """
+        self.id_map = InodeIDMap.new()  # Each figure reuses the file names
+        ranges = sorted(_gen_ranges_from_figure(figure))
+        file_pos_to_extent_pos = {}
+        for name, group in itertools.groupby(ranges, key=lambda x: x[0]):
+            file_offset = 0
+            for _, offset, length in group:
+                for i in range(length):
+                    file_pos_to_extent_pos[(name, file_offset + i)] = offset + i
+                file_offset += length
+
+        # Union-find over file bytes, counting the byte-level edges
+        parent = {k: k for k in file_pos_to_extent_pos}
+
+        def find(k):
+            while parent[k] != k:
+                k = parent[k]
+            return k
+
+        num_edges = 0
+        for name, chunks in self._repr_chunks_from_figure(
+            figure, spanning_tree=True
+        ).items():
+            ((_kind, chunk_clones),) = chunks
+            for cc in chunk_clones:
+                other, *nums = re.match(
+                    r"(.*):([0-9]+)\+([0-9]+)@([0-9]+)$", cc
+                ).groups()
+                other_offset, length, offset = map(int, nums)
+                for i in range(length):
+                    a, b = (name, offset + i), (other, other_offset + i)
+                    self.assertEqual(
+                        file_pos_to_extent_pos[a], file_pos_to_extent_pos[b]
+                    )
+                    self.assertNotEqual(find(a), find(b), f"Cycle at {a}")
+                    parent[find(a)] = find(b)
+                    num_edges += 1
+
+        extent_pos_to_roots = defaultdict(set)
+        for k, pos in file_pos_to_extent_pos.items():
+            extent_pos_to_roots[pos].add(find(k))
+        for pos, roots in extent_pos_to_roots.items():
+            self.assertEqual(1, len(roots), f"Disconnected at {pos}")
+        # Acyclic & connected, so this is implied, but it's the point :)
+        self.assertEqual(
+            len(file_pos_to_extent_pos) - len(extent_pos_to_roots), num_edges
+        )
+
+    def test_spanning_tree(self):
+        self.assertEqual(
+            {
+                "a": [("DATA/1", set())],
+                "b": [("DATA/1", {"a:0+1@0"})],
+                "c": [("DATA/1", {"a:0+1@0"})],
+                "d": [("DATA/1", {"a:0+1@0"})],
+            },
+            self._repr_chunks_from_figure("d\nc\na\nb", spanning_tree=True),
+        )
+        for figure in [
+            self.FIG1,
+            "aabbbaabbb",
+            "AAA  AAA\n  BBBBCCCCCC\n CCC",
+            "cccccccccccccc\naaabbaabb   a",
+            " ddd\n ccc\nbbbeee\naaa  fff",
+            "bbaa\naabb",
+            "aaaaaaaa\n  bb\n  cccc\n     dddd\n eeeeeeeeee",
+        ]:
+            self._check_spanning_tree(figure)
+
     def test_multi_extent(self):
         # There are 3 `write` commands below, one for each of `a`, `b`, and
         # `c`.  We also create a few HOLE leaf extents along the way.  All
@@ -8,7 +8,7 @@ import unittest
 from types import MappingProxyType
 from typing import NamedTuple, Sequence
 
-from ..freeze import freeze
+from ..freeze import freeze, freezes_in_place
 
 
 class FreezeTestCase(unittest.TestCase):
@@ -60,6 +60,56 @@ class FreezeTestCase(unittest.TestCase):
             [type(i) for i in f],
         )
 
+    def test_reuses_immutable(self):
+        t = (1, "a", (2,), frozenset([3]), MappingProxyType({4: (5,)}))
+        self.assertIs(t, freeze(t))
+        # Any mutable descendant forces a copy of all of its ancestors.
+        t2 = (t, ([],))
+        ft2 = freeze(t2)
+        self.assertIsNot(t2, ft2)
+        self.assertIs(t, ft2[0])
+        self.assertEqual((t, ((),)), ft2)
+        self.assertIs(freeze({}), freeze({}))
+
+    def test_deep_nesting(self):
+        deep = []
+        for _ in range(10000):  # Deeper than the recursion limit
+            deep = [deep, {"k": deep}]
+        frozen = freeze(deep)
+        for _ in range(10000):
+            self.assertIs(frozen[0], frozen[1]["k"])
+            frozen = frozen[0]
+        self.assertEqual((), frozen)
+
+    def test_self_referential(self):
+        l = [1]
+        l.append({"l": l})
+        with self.assertRaisesRegex(RuntimeError, "self-referential"):
+            freeze(l)
+
+    def test_in_place(self):
+        l = []
+        d = {"a": l, "b": "c"}
+        fd = freeze(d, in_place=True)
+        self.assertEqual({"a": (), "b": "c"}, fd)
+        self.assertIsInstance(fd, MappingProxyType)
+        # The `dict` was sealed, not copied, so writes to it are visible.
+        self.assertIsInstance(d["a"], tuple)
+        d["b"] = "x"
+        self.assertEqual("x", fd["b"])
+
+        test_case = self
+
+        class Foo:
+            def freeze(self, *, _memo):
+                test_case.assertTrue(freezes_in_place(_memo))
+                return "banana"
+
+        self.assertEqual(("banana",), freeze([Foo()], in_place=True))
+        self.assertFalse(freezes_in_place({}))
+        with self.assertRaises(AssertionError):
+            freeze([], _memo={}, in_place=True)
+
     def test_not_implemented(self):
         with self.assertRaises(NotImplementedError):
             freeze(object())
@@ -83,6 +83,34 @@ class IncompleteInodeTestCase(unittest.TestCase):
         with self.assertRaisesRegex(RuntimeError, "cannot apply FakeItem"):
             ino.apply_item(FakeItem(path=b"a"))
 
+    def test_shared_attributes(self):
+        big = b"x" * 1000
+        inodes = []
+        for path in [b"a", b"b"]:
+            ino = IncompleteFile(item=SSI.mkfile(path=path))
+            ino.apply_item(SSI.chown(path=path, uid=10, gid=20))
+            # Build equal, but distinct, `bytes` for each inode
+            for name, data in [(b"cat", b"nip"), (b"dog", big)]:
+                ino.apply_item(
+                    SSI.set_xattr(
+                        path=path,
+                        name=bytes(bytearray(name)),
+                        data=bytes(bytearray(data)),
+                    )
+                )
+            with self.assertRaises(AttributeError):
+                ino.cat = 5  # `__slots__` has no room for this
+            inodes.append(ino)
+        a, b = inodes
+        self.assertIs(a.owner, b.owner)
+        ((a_cat, a_nip), (a_dog, a_big)) = a.xattrs.items()
+        ((b_cat, b_nip), (b_dog, b_big)) = b.xattrs.items()
+        self.assertIs(a_cat, b_cat)
+        self.assertIs(a_nip, b_nip)
+        self.assertIs(a_dog, b_dog)
+        self.assertEqual(a_big, b_big)
+        self.assertIsNot(a_big, b_big)  # Too big to share
+
     # These have no special logic, so this exercise is mildly redundant,
     # but hey, unexecuted Python is a dead, smelly, broken Python.
     def test_simple_file_types(self):
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import io
+import unittest
+
+from ..incremental_diff import (
+    apply_incremental_fields,
+    Change,
+    ChangeKind,
+    diff_send_streams,
+)
+from ..rendered_tree import emit_all_traversal_ids
+from ..send_stream import item_fields, SendStreamItems
+from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
+from .demo_sendstreams import gold_demo_sendstreams
+
+
+_C = ChangeKind
+
+
+def _make_parent(subvols: SubvolumeSet):
+    si = SendStreamItems
+    mutator = SubvolumeSetMutator.new(
+        subvols, si.subvol(path=b"parent", uuid=b"p", transid=1)
+    )
+    for item in [
+        si.mkdir(path=b"d"),
+        si.mkfile(path=b"d/f"),
+        si.write(path=b"d/f", offset=0, data=b"abc"),
+        si.chmod(path=b"d/f", mode=0o644),
+        si.mkfile(path=b"same"),
+        si.write(path=b"same", offset=0, data=b"abc"),
+        si.mkfile(path=b"replaced"),
+        si.mkfile(path=b"becomes_dir"),
+        si.mkfile(path=b"gone"),
+        si.symlink(path=b"sym", dest=b"same"),
+        si.mkfile(path=b"hard1"),
+        si.link(path=b"hard2", dest=b"hard1"),
+        si.mkdir(path=b"old_dir"),
+        si.mkfile(path=b"old_dir/untouched"),
+    ]:
+        mutator.apply_item(item)
+
+
+def _snapshot(*items):
+    si = SendStreamItems
+    return [
+        (type(i), item_fields(i))
+        for i in [
+            si.snapshot(
+                path=b"child",
+                uuid=b"c",
+                transid=2,
+                parent_uuid=b"p",
+                parent_transid=1,
+            ),
+            *items,
+        ]
+    ]
+
+
+class IncrementalDiffTestCase(unittest.TestCase):
+    def setUp(self):
+        self.maxDiff = 12345
+
+    def test_gold_diff(self):
+        stream_dict = gold_demo_sendstreams()
+        self.assertEqual(
+            [
+                Change(_C.MODIFIED_METADATA, b"."),
+                Change(_C.REMOVED, b"dir_to_remove"),
+                # `goodbye` & `hello/world` were hardlinks
+                Change(_C.ADDED, b"farewell"),
+                Change(_C.MODIFIED_METADATA, b"farewell"),
+                Change(_C.REMOVED, b"goodbye"),
+                Change(_C.REMOVED, b"hello/world"),
+                Change(_C.MODIFIED_METADATA, b"hello_big_hole"),
+                Change(_C.MODIFIED_CONTENT, b"hello_big_hole"),
+                Change(_C.RENAMED, b"hello_renamed", b"hello"),
+                Change(_C.MODIFIED_METADATA, b"hello_renamed"),
+                Change(_C.ADDED, b"hello_renamed/een"),
+            ],
+            diff_send_streams(
+                io.BytesIO(stream_dict["create_ops"]["sendstream"]),
+                io.BytesIO(stream_dict["mutate_ops"]["sendstream"]),
+            ),
+        )
+
+    def test_changes(self):
+        si = SendStreamItems
+        subvols = SubvolumeSet.new()
+        _make_parent(subvols)
+        parent_render = emit_all_traversal_ids(
+            subvols.uuid_to_subvolume["p"].render()
+        )
+        self.assertEqual(
+            [
+                Change(_C.ADDED, b"becomes_dir"),
+                Change(_C.REMOVED, b"becomes_dir"),
+                Change(_C.MODIFIED_CONTENT, b"d/f"),
+                Change(_C.REMOVED, b"gone"),
+                # Metadata changes are reported for all hardlinks
+                Change(_C.MODIFIED_METADATA, b"hard1"),
+                Change(_C.REMOVED, b"hard2"),
+                Change(_C.RENAMED, b"new_dir", b"old_dir"),
+                Change(_C.MODIFIED_CONTENT, b"replaced"),
+                Change(_C.ADDED, b"sneaky"),
+                Change(_C.MODIFIED_METADATA, b"sneaky"),
+                Change(_C.MODIFIED_CONTENT, b"sym"),
+            ],
+            apply_incremental_fields(
+                subvols,
+                _snapshot(
+                    # Rewriting the same bytes is a change
+                    si.write(path=b"d/f", offset=0, data=b"abc"),
+                    # Changing a mode, and changing it back is not
+                    si.chmod(path=b"d/f", mode=0o600),
+                    si.chmod(path=b"d/f", mode=0o644),
+                    si.mkfile(path=b"o1"),
+                    si.write(path=b"o1", offset=0, data=b"x"),
+                    si.rename(path=b"o1", dest=b"replaced"),
+                    # An identical replacement is not a change
+                    si.mkfile(path=b"o2"),
+                    si.rename(path=b"o2", dest=b"old_dir/untouched"),
+                    si.unlink(path=b"becomes_dir"),
+                    si.mkdir(path=b"becomes_dir"),
+                    si.unlink(path=b"gone"),
+                    si.unlink(path=b"sym"),
+                    si.symlink(path=b"sym", dest=b"d/f"),
+                    si.unlink(path=b"hard2"),
+                    si.link(path=b"sneaky", dest=b"hard1"),
+                    si.chown(path=b"sneaky", uid=1, gid=1),
+                    si.rename(path=b"old_dir", dest=b"new_dir"),
+                ),
+            ),
+        )
+        # The parent is unchanged
+        self.assertEqual(
+            parent_render,
+            emit_all_traversal_ids(subvols.uuid_to_subvolume["p"].render()),
+        )
+
+    def test_no_changes(self):
+        subvols = SubvolumeSet.new()
+        _make_parent(subvols)
+        si = SendStreamItems
+        self.assertEqual(
+            [],
+            apply_incremental_fields(
+                subvols,
+                _snapshot(si.rename(path=b"same", dest=b"same")),
+            ),
+        )
+
+    def test_errors(self):
+        si = SendStreamItems
+        subvols = SubvolumeSet.new()
+        with self.assertRaisesRegex(RuntimeError, "has no commands"):
+            apply_incremental_fields(subvols, [])
+        with self.assertRaisesRegex(RuntimeError, "not an incremental "):
+            apply_incremental_fields(
+                subvols,
+                [(si.subvol, (b"x", b"u", 1))],
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
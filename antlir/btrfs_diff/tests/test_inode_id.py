@@ -10,6 +10,7 @@ from types import SimpleNamespace
 
 from ..freeze import freeze
 from ..inode_id import (
+    _DIR_CACHE_SIZE,
     _ROOT_REVERSE_ENTRY,
     InodeID,
     InodeIDMap,
@@ -191,7 +192,7 @@ class InodeIDTestCase(DeepCopyTestCase):
         id_map = yield from maybe_replace_map(id_map, "removed a")
         for im, _ns in unfrozen_and_frozen(id_map, mut_ns):
             self.assertEqual(
-                {0: {_ROOT_REVERSE_ENTRY}}, im.inner.id_to_reverse_entries
+                {0: _ROOT_REVERSE_ENTRY}, im.inner.id_to_reverse_entries
             )
             self.assertEqual(
                 _PathEntry(
@@ -316,9 +317,9 @@ class InodeIDTestCase(DeepCopyTestCase):
         self.assertEqual("", saved_frozen_map.inner.description)
         self.assertEqual(
             {
-                0: {_ROOT_REVERSE_ENTRY},
-                INO1_ID: {_ReversePathEntry(name=b"a", parent_int_id=0)},
-                INO2_ID: {_ReversePathEntry(name=b"d", parent_int_id=INO1_ID)},
+                0: _ROOT_REVERSE_ENTRY,
+                INO1_ID: _ReversePathEntry(name=b"a", parent_int_id=0),
+                INO2_ID: _ReversePathEntry(name=b"d", parent_int_id=INO1_ID),
             },
             saved_frozen_map.inner.id_to_reverse_entries,
         )
@@ -326,6 +327,149 @@ class InodeIDTestCase(DeepCopyTestCase):
     def test_inode_id_and_map(self):
         self.check_deepcopy_at_each_step(self._check_id_and_map)
 
+    def test_snapshot(self):
+        cat = InodeIDMap.new(description="cat")
+        cat.add_dir(cat.next(), b"a")
+        cat.add_dir(cat.next(), b"a/b")
+        f_id = cat.add_file(cat.next(), b"a/b/f")
+        cat.add_file(f_id, b"g")
+        tiger = cat.snapshot(description="tiger")
+
+        # Same structure & IDs, but the `InodeID`s are those of `tiger`
+        tiger_f_id = tiger.get_id(b"a/b/f")
+        self.assertEqual("tiger@a/b/f,g", repr(tiger_f_id))
+        self.assertEqual(f_id.id, tiger_f_id.id)
+        self.assertIs(tiger.inner, tiger_f_id.inner_id_map)
+        self.assertEqual({b"a/b/f", b"g"}, tiger.get_paths(tiger_f_id))
+        self.assertEqual(cat.next().id, tiger.next().id)
+
+        # Mutate both maps, neither sees the changes of the other.
+        tiger.rename_path(b"a/b", b"c")
+        tiger.add_file(tiger.next(), b"c/h")
+        self.assertEqual(tiger_f_id, tiger.remove_path(b"g"))
+        cat.add_dir(cat.next(), b"a/b/i")
+        self.assertEqual(f_id, cat.remove_path(b"a/b/f"))
+        self.assertEqual({b"c/f"}, tiger.get_paths(tiger_f_id))
+        self.assertEqual(
+            {b"c/f", b"c/h"}, tiger.get_children(tiger.get_id(b"c"))
+        )
+        self.assertEqual(set(), tiger.get_children(tiger.get_id(b"a")))
+        self.assertEqual({b"g"}, cat.get_paths(f_id))
+        self.assertEqual({b"a/b/i"}, cat.get_children(cat.get_id(b"a/b")))
+
+        # Freezing re-binds the shared `InodeID`s to the frozen map.
+        frozen_tiger = freeze(tiger)
+        self.assertEqual(
+            InodeID(id=f_id.id, inner_id_map=frozen_tiger.inner),
+            frozen_tiger.get_id(b"c/f"),
+        )
+        self.assertEqual("tiger@c/f", repr(frozen_tiger.get_id(b"c/f")))
+
+    def test_reverse_entries(self):
+        id_map = InodeIDMap.new()
+        id_map.add_dir(id_map.next(), b"a")
+        f_id = id_map.add_file(id_map.next(), b"a/f")
+        # A lone path is stored without a set
+        self.assertIsInstance(
+            id_map.inner.id_to_reverse_entries[f_id.id], _ReversePathEntry
+        )
+        for path in [b"g", b"a/h"]:
+            id_map.add_file(f_id, path)
+        self.assertEqual(
+            frozenset(
+                [
+                    _ReversePathEntry(name=b"f", parent_int_id=1),
+                    _ReversePathEntry(name=b"g", parent_int_id=0),
+                    _ReversePathEntry(name=b"h", parent_int_id=1),
+                ]
+            ),
+            id_map.inner.id_to_reverse_entries[f_id.id],
+        )
+        self.assertEqual(f_id, id_map.remove_path(b"a/f"))
+        self.assertEqual({b"g", b"a/h"}, id_map.get_paths(f_id))
+        self.assertEqual(f_id, id_map.remove_path(b"g"))
+        self.assertEqual(
+            _ReversePathEntry(name=b"h", parent_int_id=1),
+            id_map.inner.id_to_reverse_entries[f_id.id],
+        )
+        self.assertEqual(f_id, id_map.remove_path(b"a/h"))
+        self.assertNotIn(f_id.id, id_map.inner.id_to_reverse_entries)
+
+    def test_gen_tree(self):
+        id_map = InodeIDMap.new()
+        a_id = id_map.add_dir(id_map.next(), b"a")
+        b_id = id_map.add_file(id_map.next(), b"b")
+        c_id = id_map.add_dir(id_map.next(), b"a/c")
+        for path in [b"a/e", b"a/d"]:
+            id_map.add_file(b_id, path)
+        self.assertEqual(1, id_map.num_paths(a_id))
+        self.assertEqual(3, id_map.num_paths(b_id))
+        root_id = id_map.get_id(b".")
+        self.assertEqual(
+            [
+                (0, b".", root_id, True),
+                (1, b"a", a_id, True),
+                (2, b"c", c_id, True),
+                (2, b"d", b_id, False),
+                (2, b"e", b_id, False),
+                (1, b"b", b_id, False),
+            ],
+            list(id_map.gen_tree(sort_key=lambda n: n)),
+        )
+        self.assertEqual(
+            [(0, b"a", a_id, True), (1, b"e", b_id, False)],
+            list(id_map.gen_tree(b"a", sort_key=lambda n: -n[0]))[:2],
+        )
+        # Without a `sort_key`, we get the same entries in some order.
+        self.assertEqual(
+            sorted(id_map.gen_tree(b"a", sort_key=lambda n: n)),
+            sorted(id_map.gen_tree(b"a")),
+        )
+        frozen_map = freeze(id_map)
+        self.assertEqual(
+            [(0, b"b", frozen_map.get_id(b"b"), False)],
+            list(frozen_map.gen_tree(b"b")),
+        )
+
+    def test_dir_cache(self):
+        id_map = InodeIDMap.new()
+        a_id = id_map.add_dir(id_map.next(), b"a")
+        b_id = id_map.add_dir(id_map.next(), b"a/b")
+        f_id = id_map.add_file(id_map.next(), b"a/b/f")
+        self.assertEqual(f_id, id_map.get_id(b"./a//b/f"))
+        self.assertEqual([(), (b"a",), (b"a", b"b")], list(id_map.dir_cache))
+        # Renaming a file keeps the cache, renaming a directory clears it.
+        id_map.rename_path(b"a/b/f", b"a/b/g")
+        self.assertEqual(3, len(id_map.dir_cache))
+        id_map.rename_path(b"a/b", b"c")
+        self.assertEqual([()], list(id_map.dir_cache))  # Re-added `c`
+        self.assertIsNone(id_map.get_id(b"a/b"))
+        self.assertEqual(f_id, id_map.get_id(b"c/g"))
+        with self.assertRaisesRegex(RuntimeError, "h''s parent.*is a file"):
+            id_map.get_id(b"c/g/h")
+
+        # Copy-on-write replaces the entries shared with the snapshot.
+        snap = id_map.snapshot(description="snap")
+        self.assertEqual({}, snap.dir_cache)
+        snap.add_file(snap.next(), b"c/h")
+        self.assertEqual({}, snap.dir_cache)
+        self.assertEqual({b"c/g", b"c/h"}, snap.get_children(snap.get_id(b"c")))
+        self.assertEqual(3, len(id_map.dir_cache))
+        id_map.add_file(id_map.next(), b"c/i")
+        self.assertEqual({b"c/g", b"c/i"}, id_map.get_children(b_id))
+
+        # The LRU evicts the least recently used directory.
+        for i in range(_DIR_CACHE_SIZE):
+            id_map.add_dir(id_map.next(), b"a/d%d" % i)
+            id_map.add_file(id_map.next(), b"a/d%d/f" % i)
+        self.assertEqual(f_id, id_map.get_id(b"c/g"))
+        self.assertEqual(_DIR_CACHE_SIZE, len(id_map.dir_cache))
+        self.assertNotIn((b"a", b"d0"), id_map.dir_cache)
+        self.assertEqual((b"c",), next(reversed(id_map.dir_cache)))
+        frozen_map = freeze(id_map)
+        self.assertIsNone(frozen_map.dir_cache)
+        self.assertEqual(a_id.id, frozen_map.get_id(b"a").id)
+
     def test_description(self):
         cat_map = InodeIDMap.new(description="cat")
         self.assertEqual(
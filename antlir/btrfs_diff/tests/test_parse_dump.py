@@ -10,6 +10,7 @@ import unittest
 from typing import List, Sequence
 
 from ..parse_dump import (
+    _parse_btrfs_dump_regex,
     NAME_TO_PARSER_TYPE,
     parse_btrfs_dump,
     unquote_btrfs_progs_path,
@@ -23,8 +24,32 @@ from .demo_sendstreams_expected import get_filtered_and_expected_items
 unittest.util._MAX_LENGTH = 12345
 
 
+def _parse_to_list(parse_fn, dump: bytes):
+    "Returns the items, or the error, so that errors can be compared."
+    try:
+        return list(parse_fn(io.BytesIO(dump)))
+    except Exception as ex:
+        return ex
+
+
+def _parse_to_comparable(parse_fn, dump: bytes):
+    res = _parse_to_list(parse_fn, dump)
+    return (type(res), str(res)) if isinstance(res, Exception) else res
+
+
+def _parse_dump_to_list(dump: bytes) -> List[SendStreamItem]:
+    "Checks that both parsers agree, including on errors."
+    items = _parse_to_list(parse_btrfs_dump, dump)
+    assert _parse_to_comparable(
+        _parse_btrfs_dump_regex, dump
+    ) == _parse_to_comparable(parse_btrfs_dump, dump), dump
+    if isinstance(items, Exception):
+        raise items
+    return items
+
+
 def _parse_lines_to_list(s: Sequence[bytes]) -> List[SendStreamItem]:
-    return list(parse_btrfs_dump(io.BytesIO(b"\n".join(s) + b"\n")))
+    return _parse_dump_to_list(b"\n".join(s) + b"\n")
 
 
 class ParseBtrfsDumpTestCase(unittest.TestCase):
@@ -187,6 +212,71 @@ class ParseBtrfsDumpTestCase(unittest.TestCase):
             with self.assertRaisesRegex(RuntimeError, "in line details:"):
                 _parse_lines_to_list(bad_lines)
 
+    def test_split_matches_regex(self):
+        uuid = "01234567-0123-0123-0123-012345678901"
+        subvol = f"subvol ./s uuid={uuid} transid=12\n".encode()
+        # Each line is parsed on its own, after `subvol`.
+        for line in [
+            b"mkfile ./s/a\\ b\\ \\\\ c",
+            b"mkfile ./s/a\\ \\ \\",
+            b"mkdir ./s/d/../e/",
+            b"mkdir ./s/.",
+            b"mkdir ./s/d   ",
+            b"mkdir  ./s/d",
+            b"mkfile ./s/\\344\\270\\255",
+            b"mkfile ./s/a x",
+            b"mkfile ./t/a",
+            b"mkfile ./s",
+            b"mkfile ./s/..",
+            b"mkfile",
+            b"mkfile ",
+            b" mkfile ./s/a",
+            b"rename ./s/a dest=./s/b c",
+            b"rename ./s/a dest=./s/",
+            b"rename ./s/a dest=./s/../b",
+            b"rename ./s/a dest=",
+            b"rename ./s/a dst=./s/b",
+            b"link ./s/a dest=b/../c",
+            b"symlink ./s/a dest= a b ",
+            b"clone ./s/a offset=1 len=2 from=./s/b c clone_offset=3",
+            b"clone ./s/a offset=1 len=2 from=./s/b clone_offset=x "
+            b"clone_offset=3",
+            b"clone ./s/a offset=1 len=2 from= clone_offset=3",
+            b"clone ./s/a offset=1 len=2 from=./s/b clone_offset=3 ",
+            b"clone ./s/a offset=1 len=x from=./s/b clone_offset=3",
+            b"set_xattr ./s/a name=a b data=c d len=3",
+            b"set_xattr ./s/a name= data= len=0",
+            b"set_xattr ./s/a name=x data= len=1",
+            b"set_xattr ./s/a name=x data=y len=+1",
+            b"remove_xattr ./s/a name=a b",
+            b"chmod ./s/a mode=755",
+            b"chmod ./s/a mode=758",
+            b"chmod ./s/a mode=",
+            b"chmod ./s/a mode=755 ",
+            b"chown ./s/a gid=1 uid=2",
+            b"chown ./s/a gid=1  uid=2",
+            b"chown ./s/a gid=\xd9\xa1 uid=2",
+            b"mknod ./s/a mode=20644 dev=0x1f",
+            b"mknod ./s/a mode=20644 dev=0x1F",
+            b"mknod ./s/a mode=20644 dev=1f",
+            b"truncate ./s/a size=5",
+            b"truncate ./s/a size=-5",
+            b"update_extent ./s/a offset=0 len=5",
+            b"write ./s/a offset=0 len=5",
+            b"write ./s/a offset=0 len=5 data=",
+            b"utimes ./s/a atime=2020-01-01T00:00:00+0000 "
+            b"mtime=2020-01-01T00:00:00+0000 ctime=2020-01-01T00:00:00+0000",
+            b"utimes ./s/a atime=2020-01-01T00:00:00+0000 "
+            b"mtime=2020-01-01T00:00:00+0000 ctime=2020-01-01T00:00:00 +0000",
+            b"snapshot ./s uuid=a transid=1 parent_uuid=b parent_transid=2",
+            b"subvol ./s uuid=a transid=1",
+        ]:
+            for dump in [subvol + line + b"\n", subvol + line]:
+                self.assertEqual(
+                    _parse_to_comparable(_parse_btrfs_dump_regex, dump),
+                    _parse_to_comparable(parse_btrfs_dump, dump),
+                )
+
     def test_str_uses_unqualified_class_name(self):
         self.assertEqual(
             "mkfile(path='cat and dog')",
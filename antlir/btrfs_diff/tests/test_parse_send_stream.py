@@ -9,9 +9,14 @@ This test only validates the binary send-stream parser. We rely on the fact
 that `test_parse_dump.py` already sanity-checks the gold data.
 """
 import io
+import mmap
+import os
 import struct
+import tempfile
+import threading
 import unittest
-from typing import Iterable
+from typing import Iterable, List
+from unittest import mock
 
 from ..parse_send_stream import (
     AttributeKind,
@@ -20,10 +25,16 @@ from ..parse_send_stream import (
     check_version,
     file_unpack,
     parse_send_stream,
+    parse_send_stream_fields,
     read_attribute,
     read_command,
 )
-from ..send_stream import SendStreamItem
+from ..send_stream import (
+    item_fields,
+    SendStreamDataRef,
+    SendStreamItem,
+    SendStreamItems,
+)
 from .demo_sendstreams import gold_demo_sendstreams
 from .demo_sendstreams_expected import get_filtered_and_expected_items
 
@@ -32,8 +43,21 @@ from .demo_sendstreams_expected import get_filtered_and_expected_items
 unittest.util._MAX_LENGTH = 12345
 
 
-def _parse_stream_bytes(s: bytes) -> Iterable[SendStreamItem]:
-    return parse_send_stream(io.BytesIO(s))
+def _parse_stream_bytes(
+    s: bytes, *, zero_copy: bool = False
+) -> Iterable[SendStreamItem]:
+    return parse_send_stream(io.BytesIO(s), zero_copy=zero_copy)
+
+
+def _cmd(kind: CommandKind, attrs: bytes) -> bytes:
+    return struct.pack("<IHI", len(attrs), kind.value, 0) + attrs
+
+
+def _attr(kind: AttributeKind, data: bytes) -> bytes:
+    return struct.pack("<HH", kind.value, len(data)) + data
+
+
+_STREAM_PREAMBLE = b"btrfs-stream\0" + struct.pack("<I", 1)
 
 
 class ParseSendStreamTestCase(unittest.TestCase):
@@ -42,16 +66,199 @@ class ParseSendStreamTestCase(unittest.TestCase):
 
     def test_verify_gold_parse(self):
         stream_dict = gold_demo_sendstreams()
-        filtered_items, expected_items = get_filtered_and_expected_items(
-            items=[
-                *_parse_stream_bytes(stream_dict["create_ops"]["sendstream"]),
-                *_parse_stream_bytes(stream_dict["mutate_ops"]["sendstream"]),
-            ],
-            build_start_time=stream_dict["create_ops"]["build_start_time"],
-            build_end_time=stream_dict["mutate_ops"]["build_end_time"],
-            dump_mode=False,
+        for zero_copy in [False, True]:
+            filtered_items, expected_items = get_filtered_and_expected_items(
+                items=[
+                    *_parse_stream_bytes(
+                        stream_dict["create_ops"]["sendstream"],
+                        zero_copy=zero_copy,
+                    ),
+                    *_parse_stream_bytes(
+                        stream_dict["mutate_ops"]["sendstream"],
+                        zero_copy=zero_copy,
+                    ),
+                ],
+                build_start_time=stream_dict["create_ops"]["build_start_time"],
+                build_end_time=stream_dict["mutate_ops"]["build_end_time"],
+                dump_mode=False,
+            )
+            self.assertEqual(filtered_items, expected_items)
+
+    def test_fields(self):
+        for d in gold_demo_sendstreams().values():
+            items = list(_parse_stream_bytes(d["sendstream"]))
+            fields = list(parse_send_stream_fields(io.BytesIO(d["sendstream"])))
+            self.assertEqual(
+                [(type(i), item_fields(i)) for i in items], fields
+            )
+            self.assertEqual(
+                items, [item_type(*f) for item_type, f in fields]
+            )
+
+    def test_zero_copy_file_types(self):
+        stream = gold_demo_sendstreams()["create_ops"]["sendstream"]
+        expected = list(_parse_stream_bytes(stream))
+
+        # A regular file is memory-mapped, and left positioned just past
+        # the parsed stream.
+        with tempfile.TemporaryFile() as f:
+            f.write(b"head" + stream + b"tail")
+            f.seek(4)
+            self.assertEqual(
+                expected, list(parse_send_stream(f, zero_copy=True))
+            )
+            self.assertEqual(b"tail", f.read())
+
+        # Pipes cannot be mapped, so they are read in blocks.
+        r_fd, w_fd = os.pipe()
+
+        def write_stream():
+            with open(w_fd, "wb") as w:
+                w.write(stream)
+
+        writer = threading.Thread(target=write_stream)
+        writer.start()
+        with open(r_fd, "rb") as r:
+            self.assertEqual(
+                expected, list(parse_send_stream(r, zero_copy=True))
+            )
+        writer.join()
+
+        # Seekable non-`BytesIO` objects are rewound to the end of the stream
+        with io.BufferedReader(io.BytesIO(stream + b"tail")) as f:
+            self.assertEqual(
+                expected, list(parse_send_stream(f, zero_copy=True))
+            )
+            self.assertEqual(b"tail", f.read())
+
+        # Empty files cannot be mapped either
+        with tempfile.TemporaryFile() as f:
+            with self.assertRaisesRegex(RuntimeError, "Magic b'', not "):
+                list(parse_send_stream(f, zero_copy=True))
+
+    def test_lazy_write_data(self):
+        stream = gold_demo_sendstreams()["create_ops"]["sendstream"]
+        expected = list(_parse_stream_bytes(stream))
+        self.assertTrue(
+            any(isinstance(i, SendStreamItems.write) for i in expected)
+        )
+
+        def resolve(items: List[SendStreamItem], buf) -> List[SendStreamItem]:
+            resolved = []
+            for item in items:
+                if isinstance(item, SendStreamItems.write):
+                    self.assertIsInstance(item.data, SendStreamDataRef)
+                    self.assertEqual(item.data.length, len(item.data))
+                    item = SendStreamItems.write(
+                        path=item.path,
+                        offset=item.offset,
+                        data=item.data.resolve(buf),
+                    )
+                resolved.append(item)
+            return resolved
+
+        # Offsets are relative to the start of the file, not of the stream
+        buf = io.BytesIO(b"head" + stream)
+        buf.seek(4)
+        self.assertEqual(
+            expected,
+            resolve(
+                list(parse_send_stream(buf, lazy_write_data=True)),
+                buf.getvalue(),
+            ),
+        )
+
+        with tempfile.TemporaryFile() as f:
+            f.write(b"head" + stream)
+            f.seek(4)
+            items = list(parse_send_stream(f, lazy_write_data=True))
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                self.assertEqual(expected, resolve(items, mm))
+
+        # Small blocks check that offsets survive refilling the window.
+        with mock.patch(
+            "antlir.btrfs_diff.parse_send_stream._BLOCK_SIZE", 1000
+        ), io.BufferedReader(io.BytesIO(b"head" + stream)) as f:
+            f.read(4)
+            items = list(parse_send_stream(f, lazy_write_data=True))
+            self.assertEqual(expected, resolve(items, b"head" + stream))
+
+        with self.assertRaisesRegex(RuntimeError, "got 2 bytes"):
+            SendStreamDataRef(offset=1, length=3).resolve(b"abc")
+
+    def test_verify_crc(self):
+        stream = gold_demo_sendstreams()["create_ops"]["sendstream"]
+        expected = list(_parse_stream_bytes(stream))
+        # The first command follows the preamble, its `path` is at the end.
+        length, _kind, _crc = struct.unpack_from(
+            "<IHI", stream, len(_STREAM_PREAMBLE)
+        )
+        corrupt_at = len(_STREAM_PREAMBLE) + 10 + length - 1
+        corrupted = (
+            stream[:corrupt_at]
+            + bytes([stream[corrupt_at] ^ 1])
+            + stream[corrupt_at + 1 :]
         )
-        self.assertEqual(filtered_items, expected_items)
+        for zero_copy in [False, True]:
+            self.assertEqual(
+                expected,
+                list(
+                    parse_send_stream(
+                        io.BytesIO(stream), zero_copy=zero_copy, verify_crc=True
+                    )
+                ),
+            )
+            # Without verification, the corruption goes unnoticed.
+            self.assertNotEqual(
+                expected, list(_parse_stream_bytes(corrupted, zero_copy=True))
+            )
+            with self.assertRaisesRegex(
+                RuntimeError, "CommandKind.SUBVOL.* failed CRC check"
+            ):
+                list(
+                    parse_send_stream(
+                        io.BytesIO(corrupted),
+                        zero_copy=zero_copy,
+                        verify_crc=True,
+                    )
+                )
+
+    def test_zero_copy_errors(self):
+        def parse(s):
+            return list(_parse_stream_bytes(s, zero_copy=True))
+
+        with self.assertRaisesRegex(RuntimeError, "Magic b'xxx', not "):
+            parse(b"xxx")
+        with self.assertRaisesRegex(RuntimeError, "send-stream version"):
+            parse(_STREAM_PREAMBLE[:-1])
+        with self.assertRaisesRegex(RuntimeError, "we require version 1"):
+            parse(_STREAM_PREAMBLE[:-4] + struct.pack("<I", 2))
+        with self.assertRaisesRegex(RuntimeError, "for command header"):
+            parse(_STREAM_PREAMBLE + b"abc")
+        with self.assertRaisesRegex(RuntimeError, "Unknown command kind 0"):
+            parse(_STREAM_PREAMBLE + struct.pack("<IHI", 0, 0, 0))
+        with self.assertRaisesRegex(RuntimeError, "CommandHead.* got 2 bytes"):
+            parse(_STREAM_PREAMBLE + _cmd(CommandKind.MKFILE, b"abcd")[:-2])
+        with self.assertRaisesRegex(RuntimeError, "for attribute header"):
+            parse(_STREAM_PREAMBLE + _cmd(CommandKind.MKFILE, b"abc"))
+        with self.assertRaisesRegex(RuntimeError, "Unknown attribute kind 0"):
+            parse(_STREAM_PREAMBLE + _cmd(CommandKind.MKFILE, b"\0" * 4))
+        with self.assertRaisesRegex(RuntimeError, "AttributeH.* got 1 bytes"):
+            parse(
+                _STREAM_PREAMBLE
+                + _cmd(
+                    CommandKind.MKFILE, _attr(AttributeKind.PATH, b"ab")[:-1]
+                )
+            )
+        with self.assertRaisesRegex(RuntimeError, "\\.PATH occurred twice"):
+            parse(
+                _STREAM_PREAMBLE
+                + _cmd(
+                    CommandKind.MKFILE,
+                    _attr(AttributeKind.PATH, b"cat")
+                    + _attr(AttributeKind.PATH, b"dog"),
+                )
+            )
 
     def test_errors(self):
         with self.assertRaisesRegex(RuntimeError, "Magic b'xxx', not "):
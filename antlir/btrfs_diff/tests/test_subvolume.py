@@ -5,6 +5,8 @@
 # LICENSE file in the root directory of this source tree.
 
 import copy
+import io
+import json
 import unittest
 
 from ..coroutine_utils import while_not_exited
@@ -41,6 +43,16 @@ class SubvolumeTestCase(DeepCopyTestCase):
                 )
             ]
         )
+        out = io.StringIO()
+        subvol.write_rendered_json(out, path.encode())
+        self.assertEqual(
+            json.dumps(
+                emit_non_unique_traversal_ids(subvol.render(path.encode())),
+                sort_keys=True,
+                indent=2,
+            ),
+            out.getvalue(),
+        )
 
     def _check_both_renders(
         self, expected_ser, subvol: Subvolume, path: str = "."
@@ -48,6 +60,10 @@ class SubvolumeTestCase(DeepCopyTestCase):
         self._check_render(expected_ser, subvol, path)
         # Always check the frozen variant, too.
         self._check_render(expected_ser, freeze(subvol), path)
+        # Freezing in place consumes the `Subvolume`, so use a copy.
+        self._check_render(
+            expected_ser, freeze(copy.deepcopy(subvol), in_place=True), path
+        )
 
     def _check_subvolume(self):
         """
@@ -127,10 +143,8 @@ class SubvolumeTestCase(DeepCopyTestCase):
         cat = yield "cat after error testing", cat
         self._check_both_renders(cat_final_repr, cat)
 
-        # Make a snapshot using the hack from `SubvolumeSetMutator`
-        tiger = copy.deepcopy(
-            cat, memo={id(cat.id_map.inner.description): "tiger"}
-        )
+        # Make a copy-on-write snapshot, as `SubvolumeSetMutator` does
+        tiger = cat.snapshot(description="tiger")
         tiger = yield "freshly copied tiger", tiger
         self._check_both_renders(cat_final_repr, tiger)
 
@@ -425,6 +439,84 @@ class SubvolumeTestCase(DeepCopyTestCase):
     def test_subvolume(self):
         self.check_deepcopy_at_each_step(self._check_subvolume)
 
+    def test_snapshot(self):
+        si = SendStreamItems
+        cat = Subvolume.new(id_map=InodeIDMap.new(description="cat"))
+        cat.apply_item(si.mkdir(path=b"a"))
+        cat.apply_item(si.mkdir(path=b"a/b"))
+        cat.apply_item(si.mkfile(path=b"a/b/f"))
+        cat.apply_item(si.write(path=b"a/b/f", offset=0, data=b"xyz"))
+        cat.apply_item(si.link(path=b"g", dest=b"a/b/f"))
+        cat.apply_item(si.mkfile(path=b"a/unchanged"))
+        f = InodeRepr("(File d3)")
+        cat_repr = [
+            "(Dir)",
+            {
+                "a": [
+                    "(Dir)",
+                    {"b": ["(Dir)", {"f": [f]}], "unchanged": ["(File)"]},
+                ],
+                "g": [f],
+            },
+        ]
+        self._check_both_renders(cat_repr, cat)
+
+        tiger = cat.snapshot(description="tiger")
+        self.assertEqual("tiger@a/b/f,g", repr(tiger.id_map.get_id(b"g")))
+        self._check_both_renders(cat_repr, tiger)
+
+        # Mutate both sides, neither sees the changes of the other.
+        tiger.apply_item(si.chmod(path=b"g", mode=0o600))
+        tiger.apply_item(si.mkfile(path=b"a/b/h"))
+        tiger.apply_item(si.rename(path=b"a/b", dest=b"c"))
+        cat.apply_item(si.unlink(path=b"a/b/f"))
+        cat.apply_item(si.truncate(path=b"g", size=1))
+        cat.apply_item(si.mkfile(path=b"a/b/i"))
+        tiger_f = InodeRepr("(File m600 d3)")
+        self._check_both_renders(
+            [
+                "(Dir)",
+                {
+                    "a": ["(Dir)", {"unchanged": ["(File)"]}],
+                    "c": ["(Dir)", {"f": [tiger_f], "h": ["(File)"]}],
+                    "g": [tiger_f],
+                },
+            ],
+            tiger,
+        )
+        self._check_both_renders(
+            [
+                "(Dir)",
+                {
+                    "a": [
+                        "(Dir)",
+                        {
+                            "b": ["(Dir)", {"i": ["(File)"]}],
+                            "unchanged": ["(File)"],
+                        },
+                    ],
+                    "g": ["(File d1)"],
+                },
+            ],
+            cat,
+        )
+
+        # Only the mutated inodes were copied.
+        self.assertIs(
+            cat.inode_at_path(b"a/unchanged"),
+            tiger.inode_at_path(b"a/unchanged"),
+        )
+        self.assertIsNot(cat.inode_at_path(b"g"), tiger.inode_at_path(b"g"))
+
+        # A snapshot of a snapshot has its own copy of inodes as well.
+        lion = tiger.snapshot(description="lion")
+        lion.apply_item(si.chown(path=b"a/unchanged", uid=1, gid=2))
+        self.assertEqual("(File)", repr(tiger.inode_at_path(b"a/unchanged")))
+        self.assertEqual(
+            "(File o1:2)", repr(lion.inode_at_path(b"a/unchanged"))
+        )
+        self.assertEqual("lion@c/f,g", repr(lion.id_map.get_id(b"g")))
+
     def test_rendered_tree(self):
         "Miscellaneous coverage over `rendered_tree.py`."
         with self.assertRaisesRegex(RuntimeError, "Unknown type in rendered"):
@@ -5,12 +5,19 @@
 # LICENSE file in the root directory of this source tree.
 
 import dataclasses
+import io
 import unittest
 
 from ..freeze import freeze
 from ..parse_dump import SendStreamItems
+from ..parse_send_stream import parse_send_stream
 from ..rendered_tree import emit_all_traversal_ids
-from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
+from ..subvolume_set import (
+    apply_send_stream,
+    SubvolumeSet,
+    SubvolumeSetMutator,
+)
+from .demo_sendstreams import gold_demo_sendstreams
 from .subvolume_utils import expected_subvol_add_traversal_ids
 
 
@@ -251,6 +258,51 @@ class SubvolumeSetTestCase(unittest.TestCase):
         for expected, frozen in reprs_and_frozens:
             self._check_repr(expected, frozen)
 
+    def test_apply_send_stream(self):
+        streams = [
+            d["sendstream"]
+            for d in (
+                gold_demo_sendstreams()["create_ops"],
+                gold_demo_sendstreams()["mutate_ops"],
+            )
+        ]
+        via_items = SubvolumeSet.new()
+        for stream in streams:
+            parsed = parse_send_stream(io.BytesIO(stream))
+            mutator = SubvolumeSetMutator.new(via_items, next(parsed))
+            for item in parsed:
+                mutator.apply_item(item)
+        via_fields = SubvolumeSet.new()
+        for stream in streams:
+            apply_send_stream(via_fields, io.BytesIO(stream))
+        self.assertEqual(
+            *[
+                subvols.map(lambda sv: emit_all_traversal_ids(sv.render()))
+                for subvols in (via_items, via_fields)
+            ]
+        )
+
+    def test_apply_fields_errors(self):
+        si = SendStreamItems
+        mutator = SubvolumeSetMutator.new(
+            SubvolumeSet.new(), si.subvol(path=b"s", uuid=b"u", transid=1)
+        )
+        mutator.apply_fields(si.mkdir, (b"d",))
+        # The error messages show the item, just as for `apply_item`.
+        for item_type, fields, msg in [
+            (si.rename, (b"d", b"d/e"), "makes path its own subdirectory"),
+            (si.unlink, (b"d",), r"Cannot unlink\(path=b.d.\) a directory"),
+            (si.chmod, (b"x", 0o644), "Cannot apply chmod.*does not exist"),
+            (si.chmod, (b"d", 0o40755), "chmod.*cannot change file type"),
+            (si.truncate, (b"d", 5), "cannot apply truncate"),
+        ]:
+            with self.assertRaisesRegex(RuntimeError, msg):
+                mutator.apply_fields(item_type, fields)
+        with self.assertRaisesRegex(RuntimeError, "Unknown from_uuid for "):
+            mutator.apply_fields(
+                si.clone, (b"d", 0, 1, b"no-uuid", 1, b"f", 0)
+            )
+
     def test_errors(self):
         si = SendStreamItems
         subvols = SubvolumeSet.new()
@@ -104,10 +104,22 @@ def compile_image_features(
         #
         # `exe` vs `location` is explained in `image_package.py`.
         #
-        # We access `ANTLIR_DEBUG` because this is never expected to
-        # change the output, so it's deliberately not a Buck input.
+        # We access `ANTLIR_DEBUG`, `ANTLIR_LAYER_CACHE`,
+        # `ANTLIR_INCREMENTAL`, `ANTLIR_BUILD_JOBS`, and
+        # `ANTLIR_PRIVILEGED_HELPER` because these are never expected to
+        # change the output, so they're deliberately not Buck inputs.  The
+        # layer cache and the privileged helper are opt-in until they have
+        # seen more use, and the incremental build needs the cache.
+        # `ANTLIR_BUILD_JOBS` sets how many independent items to build at
+        # a time.
         $(exe //antlir:compiler) {maybe_artifacts_require_repo} \
           ${{ANTLIR_DEBUG:+--debug}} \
+          ${{ANTLIR_BUILD_JOBS:+--build-jobs "$ANTLIR_BUILD_JOBS"}} \
+          ${{ANTLIR_PRIVILEGED_HELPER:+--privileged-helper}} \
+          --write-provides-manifest \
+          --cache-dir "$volume_dir/compiler-cache" \
+          ${{ANTLIR_LAYER_CACHE:+--layer-cache \
+            ${{ANTLIR_INCREMENTAL:+--incremental}}}} \
           --subvolumes-dir "$subvolumes_dir" \
           --subvolume-rel-path \
             "$subvolume_wrapper_dir/"{subvol_name_quoted} \
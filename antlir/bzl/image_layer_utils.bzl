@@ -137,7 +137,8 @@ def _image_layer_impl(
                 --refcounts-dir "$refcounts_dir" \
                 --subvolumes-dir "$subvolumes_dir" \
                 --new-subvolume-wrapper-dir "$subvolume_wrapper_dir" \
-                --new-subvolume-json "$layer_json"
+                --new-subvolume-json "$layer_json" \
+                --layer-cache-dir "$volume_dir/compiler-cache/layers"
 
             {make_subvol_cmd}
 
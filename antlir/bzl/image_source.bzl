@@ -57,10 +57,9 @@ def _image_source_impl(
         # Posssible enhancements:
         #   - It's probably reasonable for this to also be able to output
         #     a directory instead of a file. Support this when needed.
-        #   - If useful, the compiler could cache and reuse the output
-        #     of a generator if it occurs multiple times within a single
-        #     layer's build -- this is currently not implemented, but would
-        #     not be hard.
+        #
+        # Within a single layer's build, the compiler runs each distinct
+        # `generator` + `generator_args` just once, and shares its output.
         generator = None,
         # Optional list of strings, requires `generator` to be set.
         generator_args = None,
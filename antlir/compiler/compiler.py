@@ -16,23 +16,56 @@ and invokes `.build()` to apply each item to actually construct the subvol.
 """
 
 import argparse
+import json
 import os
 import stat
 import sys
 from contextlib import ExitStack
+from typing import Any, Iterable, List, Mapping, Optional, Tuple
 
-from antlir.compiler.items.common import LayerOpts
-from antlir.compiler.items.phases_provide import PhasesProvideItem
-from antlir.compiler.items_for_features import gen_items_for_features
+from antlir.common import get_logger
+from antlir.compiler.items.common import ImageItem, LayerOpts
+from antlir.compiler.items.make_subvol import ParentLayerItem
+from antlir.compiler.items.phases_provide import (
+    PhasesProvideItem,
+    write_provides_manifest,
+)
+from antlir.compiler.items_for_features import (
+    gen_items_for_features,
+    replace_targets_by_paths,
+)
 from antlir.find_built_subvol import find_built_subvol
 from antlir.fs_utils import Path
+from antlir.privileged_helper import privileged_helper
 from antlir.rpm.yum_dnf_conf import YumDnf
 from antlir.subvol_utils import Subvol
 
 from .dep_graph import DependencyGraph
+from .incremental_build import (
+    IncrementalPlan,
+    ItemEntry,
+    gen_item_entries,
+    plan_incremental_build,
+    remove_paths,
+    save_record,
+)
+from .layer_cache import (
+    incremental_key,
+    layer_cache_key,
+    layer_context,
+    locked_cache_entry,
+    restore_cached_layer,
+    store_cached_layer,
+    target_identities,
+    write_key,
+)
+from .provides_manifest import manifest_path
 from .subvolume_on_disk import SubvolumeOnDisk
 
 
+log = get_logger()
+
+
 # At the moment, the target names emitted by `image_feature` targets seem to
 # be normalized the same way as those provided to us by `image_layer`.  If
 # this were to ever change, this would be a good place to re-normalize them.
@@ -47,6 +80,16 @@ def make_target_path_map(targets_followed_by_paths):
     return d
 
 
+def _build_items(
+    items: List[ImageItem], subvol: Subvol, layer_opts: LayerOpts
+) -> None:
+    "`DependencyGraph` only batches items that share a `build_batch`."
+    if len(items) == 1:
+        items[0].build(subvol, layer_opts)
+    else:
+        type(items[0]).build_batch(items, subvol, layer_opts)
+
+
 def parse_args(args) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description=__doc__, formatter_class=argparse.RawTextHelpFormatter
@@ -119,6 +162,49 @@ def parse_args(args) -> argparse.Namespace:
         "The argument immediately following each target name must be a "
         "path to the output of that target on disk.",
     )
+    parser.add_argument(
+        "--build-jobs",
+        type=int,
+        default=1,
+        help="Build up to this many independent `ImageItem`s at a time. "
+        "Items that depend on one another are still built in order. Even "
+        "with 1 job, the ready items of a type with `build_batch` are "
+        "built together, so the build order may differ from "
+        "`gen_dependency_order_items`.",
+    )
+    parser.add_argument(
+        "--privileged-helper",
+        action="store_true",
+        help="Start one `root` helper process for the whole build, instead "
+        "of running a `sudo` for each command that modifies the image.",
+    )
+    parser.add_argument(
+        "--write-provides-manifest",
+        action="store_true",
+        help="Once the layer is built, save a list of its paths next to the "
+        "subvolume. Then, child layers and `image.clone` can avoid "
+        "traversing this layer to find what it provides.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path.from_argparse,
+        help="A directory where the compiler may keep data derived from its "
+        "inputs, to reuse it in later builds, e.g. tarball member lists.",
+    )
+    parser.add_argument(
+        "--layer-cache",
+        action="store_true",
+        help="Requires `--cache-dir`. If a layer with the same inputs was "
+        "already built on this host, snapshot it instead of building. "
+        "Otherwise, add the new layer to the cache. See `layer_cache.py`.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Requires `--layer-cache`. If only some items changed since "
+        "the last build of this layer on this host, snapshot that build, "
+        "and replay just the changed items. See `incremental_build.py`.",
+    )
     parser.add_argument("--debug", action="store_true", help="Log more")
     parser.add_argument(
         "--allowed-host-mount-target",
@@ -127,7 +213,136 @@ def parse_args(args) -> argparse.Namespace:
         help="Target name that is allowed to contain host mounts used as "
         "build_sources.  Can be specified more than once.",
     )
-    return Path.parse_args(parser, args)
+    args = Path.parse_args(parser, args)
+    if args.layer_cache and not args.cache_dir:
+        parser.error("--layer-cache requires --cache-dir")
+    if args.incremental and not args.layer_cache:
+        parser.error("--incremental requires --layer-cache")
+    return args
+
+
+def _parent_layer(items: Iterable[ImageItem]) -> Optional[Subvol]:
+    "A snapshot of a parent can reuse its provides manifest."
+    return next(
+        (item.subvol for item in items if isinstance(item, ParentLayerItem)),
+        None,
+    )
+
+
+def _build_layer_incrementally(
+    args: argparse.Namespace,
+    subvol: Subvol,
+    layer_opts: LayerOpts,
+    plan: IncrementalPlan,
+    parent_layer: Optional[Subvol],
+) -> bool:
+    "Returns False if the caller must do a full build instead."
+    with locked_cache_entry(args.cache_dir, plan.base_key) as base:
+        if base is None:
+            log.info(f"The previous build {plan.base_key} is not cached")
+            return False
+        subvol.snapshot(base)
+    log.info(
+        f"Building {subvol.path()} incrementally from {plan.base_key}: "
+        f"removing {len(plan.remove_paths)} paths, adding "
+        f"{len(plan.added_items)} items"
+    )
+    try:
+        remove_paths(subvol, plan.remove_paths)
+        DependencyGraph(
+            plan.added_items, layer_target=args.child_layer_target
+        ).build_dependency_order_items(
+            # The snapshot stands in for the output of the phases.
+            PhasesProvideItem(
+                from_target=args.child_layer_target, subvol=subvol
+            ),
+            lambda items: _build_items(items, subvol, layer_opts),
+            jobs=args.build_jobs,
+        )
+    except Exception:
+        # A full build reports the same error, if it is a real one.
+        log.exception(f"Incremental build of {subvol.path()} failed")
+        subvol.delete()
+        return False
+    subvol.set_readonly(True)
+    if args.write_provides_manifest:
+        write_provides_manifest(subvol, parent_layer)
+    return True
+
+
+def _build_layer(
+    args: argparse.Namespace,
+    subvol: Subvol,
+    layer_opts: LayerOpts,
+    features: List[dict],
+    *,
+    identities: Optional[Mapping[str, str]] = None,
+    context: Optional[Mapping[str, Any]] = None,
+) -> Tuple[List[ItemEntry], bool]:
+    """
+    With `--incremental`, `identities` and `context` are required, and
+    this returns the `ItemEntry`s to record for the next build.  Also
+    returns whether the layer was built incrementally.
+    """
+    # This stack allows build items to hold temporary state on disk.
+    with ExitStack() as exit_stack:
+        if args.privileged_helper:
+            exit_stack.enter_context(privileged_helper())
+        if args.incremental:
+            entries_and_items = list(
+                gen_item_entries(
+                    exit_stack=exit_stack,
+                    features=features,
+                    layer_opts=layer_opts,
+                    identities=identities,
+                )
+            )
+            items = [i for _, its in entries_and_items for i in its]
+            plan = plan_incremental_build(
+                cache_dir=args.cache_dir,
+                layer_target=args.child_layer_target,
+                context=context,
+                entries_and_items=entries_and_items,
+            )
+            if plan and _build_layer_incrementally(
+                args, subvol, layer_opts, plan, _parent_layer(items)
+            ):
+                return [e for e, _ in entries_and_items], True
+        else:
+            entries_and_items = []
+            items = gen_items_for_features(
+                exit_stack=exit_stack,
+                features_or_paths=[
+                    replace_targets_by_paths(f, layer_opts) for f in features
+                ],
+                layer_opts=layer_opts,
+            )
+        dep_graph = DependencyGraph(
+            items, layer_target=args.child_layer_target
+        )
+        phases = list(dep_graph.ordered_phases())
+        # Creating all the builders up-front lets phases validate their input
+        for builder in [
+            builder_maker(items, layer_opts) for builder_maker, items in phases
+        ]:
+            builder(subvol)
+        # We cannot validate or sort `ImageItem`s until the phases are
+        # materialized since the items may depend on the output of the phases.
+        dep_graph.build_dependency_order_items(
+            PhasesProvideItem(
+                from_target=args.child_layer_target, subvol=subvol
+            ),
+            lambda items: _build_items(items, subvol, layer_opts),
+            jobs=args.build_jobs,
+        )
+        # Build artifacts should never change. Run this BEFORE the exit_stack
+        # cleanup to enforce that the cleanup does not touch the image.
+        subvol.set_readonly(True)
+        if args.write_provides_manifest:
+            write_provides_manifest(
+                subvol, _parent_layer(i for _, its in phases for i in its)
+            )
+        return [e for e, _ in entries_and_items], False
 
 
 def build_image(args):
@@ -157,35 +372,67 @@ def build_image(args):
         subvolumes_dir=args.subvolumes_dir,
         debug=args.debug,
         allowed_host_mount_targets=frozenset(args.allowed_host_mount_target),
+        cache_dir=args.cache_dir,
     )
 
-    # This stack allows build items to hold temporary state on disk.
-    with ExitStack() as exit_stack:
-        dep_graph = DependencyGraph(
-            gen_items_for_features(
-                exit_stack=exit_stack,
-                features_or_paths=args.child_feature_json,
-                layer_opts=layer_opts,
-            ),
-            layer_target=args.child_layer_target,
+    # Each feature JSON is read just once, since it may be a pipe.
+    features = []
+    for feature_path in args.child_feature_json:
+        with open(feature_path) as f:
+            features.append(json.load(f))
+    # Shared by the layer cache key and the incremental build, since
+    # hashing big `image.source`s is not free.
+    identities = (
+        target_identities(features, layer_opts) if args.layer_cache else None
+    )
+    context = (
+        layer_context(layer_opts, args.build_appliance_buck_out)
+        if args.incremental
+        else None
+    )
+    cache_key = (
+        layer_cache_key(
+            features=features,
+            layer_opts=layer_opts,
+            build_appliance_buck_out=args.build_appliance_buck_out,
+            identities=identities,
         )
-        # Creating all the builders up-front lets phases validate their input
-        for builder in [
-            builder_maker(items, layer_opts)
-            for builder_maker, items in dep_graph.ordered_phases()
-        ]:
-            builder(subvol)
-        # We cannot validate or sort `ImageItem`s until the phases are
-        # materialized since the items may depend on the output of the phases.
-        for item in dep_graph.gen_dependency_order_items(
-            PhasesProvideItem(
-                from_target=args.child_layer_target, subvol=subvol
-            )
+        if args.layer_cache
+        else None
+    )
+
+    if cache_key and restore_cached_layer(args.cache_dir, cache_key, subvol):
+        # The cached layer may have been built without a manifest.
+        if args.write_provides_manifest and not os.path.exists(
+            manifest_path(subvol)
         ):
-            item.build(subvol, layer_opts)
-        # Build artifacts should never change. Run this BEFORE the exit_stack
-        # cleanup to enforce that the cleanup does not touch the image.
-        subvol.set_readonly(True)
+            write_provides_manifest(subvol, None)
+    else:
+        entries, built_incrementally = _build_layer(
+            args,
+            subvol,
+            layer_opts,
+            features,
+            identities=identities,
+            context=context,
+        )
+        if built_incrementally:
+            # Not verified to match a full build, see `incremental_key`.
+            cache_key = incremental_key(cache_key)
+        if cache_key:
+            store_cached_layer(args.cache_dir, cache_key, subvol)
+        if args.incremental:
+            # Lets the next build of this layer be incremental.
+            save_record(
+                cache_dir=args.cache_dir,
+                layer_target=args.child_layer_target,
+                context=context,
+                layer_cache_key=cache_key,
+                entries=entries,
+            )
+    if cache_key:
+        # Lets child layers hit the cache, see `layer_cache.py`.
+        write_key(subvol, cache_key)
 
     try:
         return SubvolumeOnDisk.from_subvolume_path(
@@ -12,8 +12,10 @@ Item is installed only after all of the Items that match its Requires have
 already been installed.  This is known as dependency order or topological
 sort.
 """
+import collections
+import concurrent.futures
 from collections import namedtuple
-from typing import Iterator
+from typing import Callable, Deque, Iterator, List
 
 from antlir.compiler.items.common import ImageItem, PhaseOrder
 from antlir.compiler.items.make_subvol import FilesystemRootItem
@@ -107,14 +109,12 @@ class ValidatedReqsProvs:
         assert other is None, "Same path in {}, {}".format(req_or_prov, other)
         path_to_req_or_prov[req_or_prov.path] = req_or_prov
 
-        add_to_map_fn(
-            self.path_to_reqs_provs.setdefault(
-                req_or_prov.path,
-                ItemReqsProvs(item_provs=set(), item_reqs=set()),
-            ),
-            req_or_prov,
-            item,
-        )
+        # Unlike `setdefault`, only allocate for the first item at a path.
+        reqs_provs = self.path_to_reqs_provs.get(req_or_prov.path)
+        if reqs_provs is None:
+            reqs_provs = ItemReqsProvs(item_provs=set(), item_reqs=set())
+            self.path_to_reqs_provs[req_or_prov.path] = reqs_provs
+        add_to_map_fn(reqs_provs, req_or_prov, item)
 
 
 class DependencyGraph:
@@ -131,9 +131,15 @@ class DependencyGraph:
         self.items = set()
         # While deduplicating `ImageItem`s, let's also split out the phases.
         self.order_to_phase_items = {}
+        # The input order, which makes parallel builds start items in a
+        # reproducible order.
+        self._item_to_input_idx = {}
         for item in iter_items:
             if item.phase_order() is None:
                 self.items.add(item)
+                self._item_to_input_idx.setdefault(
+                    item, len(self._item_to_input_idx)
+                )
             else:
                 self.order_to_phase_items.setdefault(
                     item.phase_order(), []
@@ -223,22 +229,138 @@ class DependencyGraph:
             else:
                 yield item
             yield_idx += 1
+            ns.items_without_predecessors.update(
+                self._release_requiring_items(ns, item)
+            )
 
-            # All items, which had `item` was a dependency, must have their
-            # "predecessors" sets updated
-            for requiring_item in ns.predecessor_to_items[item]:
-                predecessors = ns.item_to_predecessors[requiring_item]
-                predecessors.remove(item)
-                if not predecessors:
-                    ns.items_without_predecessors.add(requiring_item)
-                    # With no more predecessors, this will no longer be used.
-                    del ns.item_to_predecessors[requiring_item]
+        self._assert_no_cycle(ns)
+
+    @staticmethod
+    def _release_requiring_items(ns, item) -> List[ImageItem]:
+        "Marks `item` installed, returns the items that are now unblocked."
+        unblocked = []
+        # All items, which had `item` was a dependency, must have their
+        # "predecessors" sets updated
+        for requiring_item in ns.predecessor_to_items[item]:
+            predecessors = ns.item_to_predecessors[requiring_item]
+            predecessors.remove(item)
+            if not predecessors:
+                unblocked.append(requiring_item)
+                # With no more predecessors, this will no longer be used.
+                del ns.item_to_predecessors[requiring_item]
 
-            # We won't need this value again, and this lets us detect cycles.
-            del ns.predecessor_to_items[item]
+        # We won't need this value again, and this lets us detect cycles.
+        del ns.predecessor_to_items[item]
+        return unblocked
 
+    @staticmethod
+    def _assert_no_cycle(ns) -> None:
         # Initially, every item was indexed here. If there's anything left,
         # we must have a cycle. Future: print a cycle to simplify debugging.
         assert not ns.predecessor_to_items, "Cycle in {}".format(
             ns.predecessor_to_items
         )
+
+    def build_dependency_order_items(
+        self,
+        phases_provide: PhasesProvideItem,
+        build_items: Callable[[List[ImageItem]], None],
+        *,
+        jobs: int,
+    ) -> None:
+        """
+        Calls `build_items` on every item, running up to `jobs` calls at a
+        time.  An item is only started once all the items that it depends
+        on have finished, so the items that run concurrently never touch
+        the same paths, and the resulting image does not depend on the
+        schedule.  Most items spend their time waiting on `cp`, `tar`,
+        etc, so threads suffice.
+
+        Each call gets one item, except for item types that define a
+        `build_batch` classmethod -- their ready items are passed together,
+        split between the `jobs`, since building many at once is cheaper.
+        Types whose `build_batch` is the same function share batches.  This
+        happens even with `jobs=1`, so the order of the calls need not match
+        `gen_dependency_order_items`, but it still respects dependencies.
+
+        If builds fail, we start no more, wait for the running ones, and
+        raise the error of the one that was started first.
+        """
+        assert jobs >= 1, jobs
+        ns = self._prep_item_predecessors(phases_provide)
+        # Like `gen_dependency_order_items`, we do not build this item, and
+        # we release its dependents first.
+        ns.items_without_predecessors.remove(phases_provide)
+        by_input_idx = self._item_to_input_idx.__getitem__
+        ready = collections.deque(
+            sorted(
+                self._release_requiring_items(ns, phases_provide),
+                key=by_input_idx,
+            )
+        )
+        ready.extend(sorted(ns.items_without_predecessors, key=by_input_idx))
+        ns.items_without_predecessors.clear()
+
+        # Items start in the order they become ready, and for items that
+        # become ready together, in input order.
+        num_started = 0
+        running = {}  # {future: (start_idx, items)}
+        failures = []  # [(start_idx, future)]
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=jobs
+        ) as executor:
+            while True:
+                while ready and not failures and len(running) < jobs:
+                    items = _pop_batch(ready, jobs)
+                    running[executor.submit(build_items, items)] = (
+                        num_started,
+                        items,
+                    )
+                    num_started += 1
+                if not running:
+                    break
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                # Sorting makes the order of `ready` independent of which
+                # of the simultaneously finished builds `wait` lists first.
+                for future in sorted(done, key=lambda f: running[f][0]):
+                    start_idx, items = running.pop(future)
+                    if future.exception() is not None:
+                        failures.append((start_idx, future))
+                        continue
+                    for item in items:
+                        ready.extend(
+                            sorted(
+                                self._release_requiring_items(ns, item),
+                                key=by_input_idx,
+                            )
+                        )
+        if failures:
+            min(failures, key=lambda f: f[0])[1].result()  # Raises
+
+        self._assert_no_cycle(ns)
+
+
+def _batch_builder(item: ImageItem):
+    build_batch = getattr(type(item), "build_batch", None)
+    return None if build_batch is None else build_batch.__func__
+
+
+def _pop_batch(ready: Deque[ImageItem], jobs: int) -> List[ImageItem]:
+    "Pops the first ready item, plus others to build with it, if any."
+    first = ready.popleft()
+    builder = _batch_builder(first)
+    if builder is None:
+        return [first]
+    same_builder = [i for i in ready if _batch_builder(i) is builder]
+    if not same_builder:
+        return [first]
+    # Leave a share for each of the other jobs, so big batches still run
+    # in parallel.
+    batch = same_builder[: -(-(len(same_builder) + 1) // jobs) - 1]
+    batch_ids = {id(i) for i in batch}
+    remaining = [i for i in ready if id(i) not in batch_ids]
+    ready.clear()
+    ready.extend(remaining)
+    return [first, *batch]
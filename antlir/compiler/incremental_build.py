@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Incremental layer builds: when a layer's phases (e.g. `RPM_INSTALL`) are
+unchanged since its last build on this host, and only a few of its regular
+items changed, the compiler snapshots the last build, and replays only
+the changed items.
+
+## The record
+
+After each build with `--incremental`, the compiler saves a record for
+the layer target at `<cache_dir>/incremental/<sha256 of target>.json`.
+It holds the `layer_cache.py` key of the build, and one `ItemEntry` per
+item of the raw feature JSON, whose fingerprint hashes the item and the
+identities of the targets that it references (as in `layer_cache_key`).
+
+A cache hit leaves the record alone, since it still describes a valid
+base for the next build.
+
+## When is it safe?
+
+`plan_incremental_build` compares the record to the new items.  We fall
+back to a full build unless:
+  - the record exists, and was made with the same `layer_context`,
+  - the phase items are the same,
+  - each removed item is of a type that we know how to undo -- it made
+    a file, a directory tree, or a symlink, which we can just delete,
+  - no unchanged item requires any path that a removed item provided,
+  - the layer cache still has the previous build.
+
+Then, the compiler snapshots the previous build, deletes the paths of
+the removed items, and builds the added items against the resulting
+subvolume, as if it were the output of the phases.  The usual dependency
+checks apply to the added items, since `PhasesProvideItem` describes the
+snapshot.  If that build fails, the compiler retries with a full build,
+so that any error it reports is the same as without `--incremental`.
+The result goes into the layer cache under `incremental_key`, so that it
+is never mistaken for a full build.
+"""
+import hashlib
+import json
+import os
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from antlir.common import get_logger
+from antlir.compiler.items.common import ImageItem, LayerOpts
+from antlir.compiler.items.install_file import InstallFileItem
+from antlir.compiler.items.make_dirs import MakeDirsItem
+from antlir.compiler.items.symlink import SymlinkBase
+from antlir.compiler.items_for_features import (
+    gen_items_for_features,
+    replace_targets_by_paths,
+)
+from antlir.fs_utils import Path, populate_temp_file_and_rename
+from antlir.subvol_utils import Subvol
+
+
+log = get_logger()
+
+# Bump this if the format or the meaning of the record changes.
+_RECORD_VERSION = 1
+_RECORDS_DIR = "incremental"
+
+
+class ItemEntry(NamedTuple):
+    "What the record needs to know about one item of the features."
+    fingerprint: str
+    is_phase: bool
+    # The paths from `requires()` and `provides()`
+    requires: List[str]
+    provides: List[str]
+    # If the item can be undone by deleting this path, and None otherwise.
+    remove_path: Optional[str]
+
+
+class IncrementalPlan(NamedTuple):
+    base_key: str  # The layer cache key of the previous build
+    remove_paths: List[str]
+    added_items: List[ImageItem]
+
+
+def _gen_raw_items(feature: Mapping[str, Any]) -> Iterable[Dict[str, Any]]:
+    "Yields a feature with just one item, per item of raw feature JSON."
+    for inner_feature in feature.get("features", []):
+        yield from _gen_raw_items(inner_feature)
+    for key, dcts in feature.items():
+        if key not in ("target", "features"):
+            for dct in dcts:
+                yield {"target": feature["target"], key: [dct]}
+
+
+def _with_identities(x: Any, identities: Mapping[str, str]) -> Any:
+    "Like `replace_targets_by_paths`, but with `target_identities`."
+    if type(x) is dict:
+        if "__BUCK_TARGET" in x or "__BUCK_LAYER_TARGET" in x:
+            ((sigil, target),) = x.items()
+            return identities[f"{sigil}:{target}"]
+        return {k: _with_identities(v, identities) for k, v in x.items()}
+    elif type(x) is list:
+        return [_with_identities(v, identities) for v in x]
+    return x
+
+
+def _remove_path(items: List[ImageItem]) -> Optional[str]:
+    # Only items that are not involved in phases, and that make exactly
+    # one new inode tree, can be undone by deleting it.
+    if len(items) != 1:
+        return None
+    (item,) = items
+    if isinstance(item, (InstallFileItem, SymlinkBase)):
+        return item.dest
+    if isinstance(item, MakeDirsItem):
+        return os.path.join(item.into_dir, item.path_to_make.split("/")[0])
+    return None
+
+
+def gen_item_entries(
+    *,
+    exit_stack,
+    features: Iterable[Mapping[str, Any]],
+    layer_opts: LayerOpts,
+    identities: Mapping[str, str],
+) -> Iterable[Tuple[ItemEntry, List[ImageItem]]]:
+    """
+    Yields each item of the raw feature JSON, with its `ItemEntry`.  The
+    items are the same ones that `gen_items_for_features` would make.
+    """
+    generator_outputs = {}  # Shared, see `image_source_item`
+    for raw_feature in (raw for f in features for raw in _gen_raw_items(f)):
+        items = list(
+            gen_items_for_features(
+                exit_stack=exit_stack,
+                features_or_paths=[
+                    replace_targets_by_paths(raw_feature, layer_opts)
+                ],
+                layer_opts=layer_opts,
+                generator_outputs=generator_outputs,
+            )
+        )
+        is_phase = any(i.phase_order() is not None for i in items)
+        yield ItemEntry(
+            fingerprint=hashlib.sha256(
+                json.dumps(
+                    _with_identities(raw_feature, identities), sort_keys=True
+                ).encode()
+            ).hexdigest(),
+            is_phase=is_phase,
+            # Phase items are never diffed, so they need no paths.
+            requires=[]
+            if is_phase
+            else sorted({r.path for i in items for r in i.requires()}),
+            provides=[]
+            if is_phase
+            else sorted({p.path for i in items for p in i.provides()}),
+            remove_path=None if is_phase else _remove_path(items),
+        ), items
+
+
+def _record_path(cache_dir: Path, layer_target: str) -> Path:
+    return (
+        cache_dir
+        / _RECORDS_DIR
+        / (hashlib.sha256(layer_target.encode()).hexdigest() + ".json")
+    )
+
+
+def save_record(
+    *,
+    cache_dir: Path,
+    layer_target: str,
+    context: Mapping[str, Any],
+    layer_cache_key: str,
+    entries: Iterable[ItemEntry],
+) -> None:
+    path = _record_path(cache_dir, layer_target)
+    os.makedirs(path.dirname(), exist_ok=True)
+    with populate_temp_file_and_rename(path, overwrite=True) as outfile:
+        json.dump(
+            {
+                "version": _RECORD_VERSION,
+                "context": context,
+                "layer_cache_key": layer_cache_key,
+                "entries": [e._asdict() for e in entries],
+            },
+            outfile,
+            sort_keys=True,
+        )
+
+
+def _load_record(cache_dir: Path, layer_target: str) -> Optional[Dict]:
+    try:
+        with open(_record_path(cache_dir, layer_target)) as infile:
+            return json.load(infile)
+    except FileNotFoundError:
+        return None
+
+
+def plan_incremental_build(
+    *,
+    cache_dir: Path,
+    layer_target: str,
+    context: Mapping[str, Any],
+    entries_and_items: Iterable[Tuple[ItemEntry, List[ImageItem]]],
+) -> Optional[IncrementalPlan]:
+    "Returns None if the layer needs a full build, see the docblock."
+    record = _load_record(cache_dir, layer_target)
+    if record is None:
+        log.info(f"No previous build of {layer_target} to reuse")
+        return None
+    if record["version"] != _RECORD_VERSION or record["context"] != context:
+        log.info(f"The inputs of {layer_target} changed, beyond its items")
+        return None
+    old_entries = {
+        e.fingerprint: e
+        for e in (ItemEntry(**dct) for dct in record["entries"])
+    }
+    # Identical items are deduplicated by `DependencyGraph`, too.
+    new_entries = {e.fingerprint: (e, i) for e, i in entries_and_items}
+    if {fp for fp, e in old_entries.items() if e.is_phase} != {
+        fp for fp, (e, _) in new_entries.items() if e.is_phase
+    }:
+        log.info(f"The phases of {layer_target} changed")
+        return None
+    removed = [e for fp, e in old_entries.items() if fp not in new_entries]
+    for e in removed:
+        if e.remove_path is None:
+            log.info(f"Cannot undo the item {e.fingerprint} of {layer_target}")
+            return None
+    removed_provides = {p for e in removed for p in e.provides}
+    for fp, (e, _) in new_entries.items():
+        if fp in old_entries and removed_provides.intersection(e.requires):
+            log.info(
+                f"An unchanged item of {layer_target} requires a path of "
+                f"a removed item: {removed_provides.intersection(e.requires)}"
+            )
+            return None
+    return IncrementalPlan(
+        base_key=record["layer_cache_key"],
+        # Inner paths come first, so that `rm` finds all of them.
+        remove_paths=sorted((e.remove_path for e in removed), reverse=True),
+        added_items=[
+            item
+            for fp, (_, items) in new_entries.items()
+            if fp not in old_entries
+            for item in items
+        ],
+    )
+
+
+def remove_paths(subvol: Subvol, paths: Iterable[str]) -> None:
+    "Undoes the removed items of an `IncrementalPlan` with one root call."
+    full_paths = [subvol.path(p, no_dereference_leaf=True) for p in paths]
+    if not full_paths:
+        return
+    subvol.run_as_root(
+        # See `RemovePathItem` for the reasoning behind these options.
+        ["xargs", "--null", "rm", "--one-file-system", "--recursive", "--"],
+        input=b"".join(p + b"\0" for p in full_paths),
+    )
@@ -21,10 +21,22 @@ import inspect
 import os
 import subprocess
 import tempfile
-from typing import AnyStr, FrozenSet, List, Mapping, NamedTuple, Optional, Set
+import time
+from typing import (
+    AnyStr,
+    Dict,
+    FrozenSet,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
 
 from antlir.compiler import procfs_serde
-from antlir.fs_utils import META_DIR, Path
+from antlir.fs_utils import META_DIR, Path, populate_temp_file_and_rename
 from antlir.rpm.yum_dnf_conf import YumDnf
 from antlir.subvol_utils import Subvol
 
@@ -114,6 +126,8 @@ class LayerOpts(NamedTuple):
     subvolumes_dir: str
     debug: bool = False
     allowed_host_mount_targets: FrozenSet[str] = frozenset()
+    # Items may keep derived data here to reuse it across builds.
+    cache_dir: Optional[Path] = None
 
     def requires_build_appliance(self) -> Subvol:
         assert self.build_appliance is not None, (
@@ -218,6 +232,22 @@ def coerce_path_field_normal_relative(kwargs, field: str):
         kwargs[field] = make_path_normal_relative(d)
 
 
+# Keeps each command of a `build_batch` shell script well under `ARG_MAX`.
+_MAX_PATHS_PER_COMMAND = 1000
+
+
+def shell_join(args) -> str:
+    return " ".join(Path(a).shell_quote() for a in args)
+
+
+def gen_chunked_commands(cmd, paths) -> Iterator[str]:
+    "Yields shell commands that run `cmd` on all of `paths`."
+    for start in range(0, len(paths), _MAX_PATHS_PER_COMMAND):
+        yield shell_join(
+            [*cmd, *paths[start : start + _MAX_PATHS_PER_COMMAND]]
+        )
+
+
 def protected_path_set(subvol: Optional[Subvol]) -> Set[str]:
     """
     Identifies the protected paths in a subvolume.  Pass `subvol=None` if
@@ -286,13 +316,70 @@ def ensure_meta_dir_exists(subvol: Subvol, layer_opts: LayerOpts):
     )
 
 
-def _hash_path(path: str, algorithm: str) -> str:
-    "Returns the hex digest"
-    algo = hashlib.new(algorithm)
+# Bump this if the cache key, or the cached content, changes.
+_CONTENT_HASH_DIR = "content-hash-v1"
+# Like `git`, only trust the `stat` of files that were not changed very
+# recently, since a change in the same timestamp tick would be invisible.
+_CONTENT_HASH_MIN_AGE_NS = 2 * 10 ** 9
+_HASH_CHUNK_SIZE = 2 ** 20
+
+
+def hash_path(
+    path: str, algorithm: str, cache_dir: Optional[Path] = None
+) -> str:
+    """
+    Returns the hex digest.  Given a `cache_dir`, the digest is saved, and
+    reused while the file's device, inode, size, `mtime`, and `ctime` stay
+    the same.  Any write to the file changes its `ctime`.
+    """
     with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            algo.update(chunk)
-    return algo.hexdigest()
+        cache_path = None
+        if cache_dir is not None:
+            st = os.fstat(f.fileno())
+            if st.st_ctime_ns + _CONTENT_HASH_MIN_AGE_NS < time.time_ns():
+                cache_path = (
+                    cache_dir
+                    / _CONTENT_HASH_DIR
+                    / hashlib.sha256(
+                        b"\0".join(
+                            [
+                                algorithm.encode(),
+                                os.path.realpath(Path(path)),
+                                *(
+                                    b"%d" % n
+                                    for n in (
+                                        st.st_dev,
+                                        st.st_ino,
+                                        st.st_size,
+                                        st.st_mtime_ns,
+                                        st.st_ctime_ns,
+                                    )
+                                ),
+                            ]
+                        )
+                    ).hexdigest()
+                )
+                try:
+                    with open(cache_path) as cache_file:
+                        return cache_file.read()
+                except FileNotFoundError:
+                    pass
+        algo = hashlib.new(algorithm)
+        buf = bytearray(_HASH_CHUNK_SIZE)
+        view = memoryview(buf)
+        while True:
+            size = f.readinto(buf)
+            if not size:
+                break
+            algo.update(view[:size])
+    digest = algo.hexdigest()
+    if cache_path is not None:
+        os.makedirs(cache_path.dirname(), exist_ok=True)
+        with populate_temp_file_and_rename(
+            cache_path, overwrite=True
+        ) as outfile:
+            outfile.write(digest)
+    return digest
 
 
 def _generate_file(
@@ -354,6 +441,7 @@ def _make_image_source_item(
     item_cls,
     exit_stack,
     layer_opts: LayerOpts,
+    generator_outputs: Dict[Tuple[bytes, Tuple[str, ...]], str],
     *,
     source: Optional[Mapping[str, str]],
     **kwargs,
@@ -371,28 +459,32 @@ def _make_image_source_item(
     # being constructed.  The file is deleted when the `exit_stack` context
     # exits.
     #
-    # NB: With `generator`, identical constructor arguments to this factory
-    # will create different items, so if we needed item deduplication to
-    # work across inputs, this is broken.  However, I don't believe the
-    # compiler relies on that.  If we need it, it should not be too hard to
-    # share the same source file for all generates with the same command --
-    # you'd add a global map of (generator, args) -> output, perhaps using
-    # weakref hooks to refcount output files and GC them.
+    # Generators must be deterministic, so items with the same `generator`
+    # and `generator_args` share one output, which is memoized in
+    # `generator_outputs`.  Items only ever read their sources, so sharing
+    # the file is safe.
     generator = source.pop("generator", None)
     generator_args = source.pop("generator_args", None)
     generator_args = list(generator_args) if generator_args is not None else []
     if generator or generator_args:
-        source["source"] = _generate_file(
-            exit_stack.enter_context(tempfile.TemporaryDirectory()),
-            generator,
-            generator_args,
-        )
+        memo_key = (generator, tuple(generator_args))
+        output = generator_outputs.get(memo_key)
+        if output is None:
+            output = _generate_file(
+                exit_stack.enter_context(tempfile.TemporaryDirectory()),
+                generator,
+                generator_args,
+            )
+            generator_outputs[memo_key] = output
+        source["source"] = output
 
     algo_and_hash = source.pop("content_hash", None)
     source_path = _image_source_path(layer_opts, **source)
     if algo_and_hash:
         algorithm, expected_hash = algo_and_hash.split(":")
-        actual_hash = _hash_path(source_path, algorithm)
+        actual_hash = hash_path(
+            source_path, algorithm, cache_dir=layer_opts.cache_dir
+        )
         if actual_hash != expected_hash:
             raise AssertionError(
                 f"{item_cls} {kwargs} failed hash validation, got {actual_hash}"
@@ -401,7 +493,18 @@ def _make_image_source_item(
     return item_cls(**kwargs, source=source_path)
 
 
-def image_source_item(item_cls, exit_stack, layer_opts: LayerOpts):
+def image_source_item(
+    item_cls,
+    exit_stack,
+    layer_opts: LayerOpts,
+    generator_outputs: Optional[Dict] = None,
+):
+    """
+    Pass the same `generator_outputs` dict to all the factories of a build,
+    so that each distinct generator runs just once per build.
+    """
+    if generator_outputs is None:
+        generator_outputs = {}
     return lambda **kwargs: _make_image_source_item(
-        item_cls, exit_stack, layer_opts, **kwargs
+        item_cls, exit_stack, layer_opts, generator_outputs, **kwargs
     )
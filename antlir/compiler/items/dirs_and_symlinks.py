@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+`MakeDirsItem` and the symlink items share one `build_batch`, so that
+`DependencyGraph` builds all of them that are ready together.  Layers
+generated from shapes can have thousands of these items, and building one
+at a time spawns a few processes per item, each checking its paths via
+`Subvol.path`.
+
+With the privileged helper, a batch is a single `make_inodes` request,
+which makes the directories & symlinks via syscalls relative to `O_PATH`
+FDs of their parent directories.  Otherwise -- or if a `mode` is
+symbolic, which only `chmod` understands, or if a parent directory is
+reached via a symlink -- a batch runs as one root shell script, like
+`InstallFileItem.build_batch`.
+
+With a build appliance, the same script runs inside it, like the
+commands of `build` do.  The script can be too big for a command-line
+argument, so it is bind-mounted into the one container.
+
+Each item type provides `gen_inodes`, which yields what its `build`
+makes.  Parents come before their children.
+"""
+import itertools
+from typing import AnyStr, Callable, Iterable, NamedTuple, Optional
+
+from antlir.fs_utils import Path, generate_work_dir, temp_dir
+from antlir.nspawn_in_subvol.ba_runner import BuildAppliance
+from antlir.privileged_helper import get_active_privileged_helper
+from antlir.subvol_utils import Subvol
+
+from .common import LayerOpts, gen_chunked_commands, shell_join
+from .stat_options import Mode, mode_to_str
+
+
+class Inode(NamedTuple):
+    path: str  # Normal, and relative to the image root
+    symlink_target: Optional[str]  # None for directories
+    # For directories, set as by `build_stat_options`.
+    mode: Optional[Mode]
+    user_group: Optional[str]
+
+
+def _shell_script(
+    inodes: Iterable[Inode], path: Callable[[str], AnyStr]
+) -> bytes:
+    "`path` maps an image-relative path to where the script sees it."
+    lines = list(
+        gen_chunked_commands(
+            ["mkdir"],
+            [path(i.path) for i in inodes if i.symlink_target is None],
+        )
+    )
+    lines.extend(
+        shell_join(
+            [
+                "ln",
+                "--symbolic",
+                "--no-dereference",
+                i.symlink_target,
+                path(i.path),
+            ]
+        )
+        for i in inodes
+        if i.symlink_target is not None
+    )
+    # Like `build_stat_options`, `chmod` comes before `chown`.
+    for mode_str, mode_inodes in itertools.groupby(
+        sorted(
+            (mode_to_str(i.mode), i.path) for i in inodes if i.mode is not None
+        ),
+        lambda x: x[0],
+    ):
+        lines.extend(
+            gen_chunked_commands(
+                ["chmod", mode_str], [path(p) for _, p in mode_inodes]
+            )
+        )
+    for user_group, group_inodes in itertools.groupby(
+        sorted((i.user_group, i.path) for i in inodes if i.user_group),
+        lambda x: x[0],
+    ):
+        lines.extend(
+            gen_chunked_commands(
+                ["chown", "--no-dereference", user_group],
+                [path(p) for _, p in group_inodes],
+            )
+        )
+    return "\n".join(lines).encode(errors="surrogateescape")
+
+
+def _build_in_build_appliance(
+    inodes: Iterable[Inode], subvol: Subvol, build_appliance: Subvol
+) -> None:
+    ba = BuildAppliance(subvol, build_appliance)
+    ba_script = generate_work_dir() + ".sh"
+    with temp_dir() as td:
+        with open(td / "script.sh", "wb") as outfile:
+            outfile.write(_shell_script(inodes, lambda p: ba.path(Path(p))))
+        ba.run(
+            ["sh", "-ue", ba_script],
+            bindmount_ro=[
+                (td / "script.sh", ba_script),
+                # Like `build_stat_options`, for `chown`.
+                ("/etc/passwd", "/etc/passwd"),
+                ("/etc/group", "/etc/group"),
+            ],
+        )
+
+
+def build_dirs_and_symlinks(
+    cls, items, subvol: Subvol, layer_opts: LayerOpts
+) -> None:
+    """
+    The `build_batch` classmethod of all the item types that implement
+    `gen_inodes` -- `DependencyGraph` batches the types sharing it.
+    """
+    inodes = [inode for item in items for inode in item.gen_inodes()]
+    if layer_opts.build_appliance:
+        _build_in_build_appliance(inodes, subvol, layer_opts.build_appliance)
+        return
+    helper = get_active_privileged_helper()
+    if helper is not None and all(not isinstance(i.mode, str) for i in inodes):
+        try:
+            helper.make_inodes(subvol.path(), inodes)
+            return
+        except NotADirectoryError:
+            # Nothing was made, and `Subvol.path` allows some symlinks.
+            pass
+    subvol.run_as_root(["sh", "-ue"], input=_shell_script(inodes, subvol.path))
@@ -8,7 +8,16 @@ import itertools
 import os
 import stat
 from dataclasses import dataclass
-from typing import Iterable, NamedTuple, Optional, Union
+from typing import (
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 from antlir.compiler.requires_provides import (
     ProvidesDirectory,
@@ -18,7 +27,13 @@ from antlir.compiler.requires_provides import (
 from antlir.fs_utils import Path
 from antlir.subvol_utils import Subvol
 
-from .common import ImageItem, LayerOpts, coerce_path_field_normal_relative
+from .common import (
+    ImageItem,
+    LayerOpts,
+    coerce_path_field_normal_relative,
+    gen_chunked_commands,
+    shell_join,
+)
 from .stat_options import (
     Mode,
     build_stat_options,
@@ -164,40 +179,87 @@ class InstallFileItem(ImageItem):
 
     def build(self, subvol: Subvol, layer_opts: LayerOpts):
         dest = subvol.path(self.dest)
-        # The compiler should have detected any collisons, so `--no-clobber`
-        # is just a failsafe.  `--no-dereference` is also a failsafe since
-        # we ban symlinks above.
-        #
-        # Opportunistic reflinking & mandatory sparsification are easy
-        # efficiency wins.
-        #
-        # Don't bother preserving metadata since we explicitly set mode &
-        # ownership ...  and our build setup lets timestamp float (for now).
-        subvol.run_as_root(
-            [
-                "cp",
-                "--recursive",
-                "--no-clobber",
-                "--no-dereference",
-                "--reflink=auto",
-                "--sparse=always",
-                "--no-preserve=all",
-                self.source,
-                dest,
-            ]
-        )
+        subvol.run_as_root([*_CP_ARGS, self.source, dest])
         build_stat_options(self, subvol, dest, do_not_set_mode=True)
         # Group by mode to make as few shell calls as possible.
-        for mode_str, modes_and_paths in itertools.groupby(
-            sorted((mode_to_str(i.mode), i.provides.path) for i in self.paths),
-            lambda x: x[0],
-        ):
+        for mode_str, paths in _group_paths_by_mode([self]):
             # `chmod` follows symlinks, and there's no option to stop it.
             # However, `customize_fields` should have failed on symlinks.
             subvol.run_as_root(
-                [
-                    "chmod",
-                    mode_str,
-                    *(subvol.path(p) for _, p in modes_and_paths),
-                ]
+                ["chmod", mode_str, *(subvol.path(p) for p in paths)]
+            )
+
+    @classmethod
+    def build_batch(
+        cls,
+        items: Sequence["InstallFileItem"],
+        subvol: Subvol,
+        layer_opts: LayerOpts,
+    ):
+        """
+        Same as `build` on each of `items`, but spawns just one root shell,
+        instead of a few `sudo` processes per item, which dominate the
+        build time of layers with many small files.  The script is fed
+        via `stdin`, so its size is not bounded by `ARG_MAX`.
+        """
+        dests = [subvol.path(i.dest) for i in items]
+        lines = [
+            shell_join([*_CP_ARGS, i.source, d]) for i, d in zip(items, dests)
+        ]
+        # Same as `build_stat_options`, but `test` is a shell builtin.
+        lines.extend(shell_join(["test", "!", "-L", d]) for d in dests)
+        for user_group, group_dests in itertools.groupby(
+            sorted(zip((i.user_group for i in items), dests)),
+            lambda x: x[0],
+        ):
+            lines.extend(
+                gen_chunked_commands(
+                    ["chown", "--no-dereference", "--recursive", user_group],
+                    [d for _, d in group_dests],
+                )
             )
+        # `chmod` comes after `chown`, which clears set-user-ID bits.
+        for mode_str, paths in _group_paths_by_mode(items):
+            lines.extend(
+                gen_chunked_commands(
+                    ["chmod", mode_str], [subvol.path(p) for p in paths]
+                )
+            )
+        subvol.run_as_root(
+            ["sh", "-ue"],
+            input="\n".join(lines).encode(errors="surrogateescape"),
+        )
+
+
+# The compiler should have detected any collisons, so `--no-clobber` is
+# just a failsafe.  `--no-dereference` is also a failsafe since we ban
+# symlinks above.
+#
+# Opportunistic reflinking & mandatory sparsification are easy efficiency
+# wins.
+#
+# Don't bother preserving metadata since we explicitly set mode &
+# ownership ...  and our build setup lets timestamp float (for now).
+_CP_ARGS = (
+    "cp",
+    "--recursive",
+    "--no-clobber",
+    "--no-dereference",
+    "--reflink=auto",
+    "--sparse=always",
+    "--no-preserve=all",
+)
+
+
+def _group_paths_by_mode(
+    items: Iterable[InstallFileItem],
+) -> Iterator[Tuple[str, List[str]]]:
+    for mode_str, modes_and_paths in itertools.groupby(
+        sorted(
+            (mode_to_str(p.mode), p.provides.path)
+            for i in items
+            for p in i.paths
+        ),
+        lambda x: x[0],
+    ):
+        yield mode_str, [p for _, p in modes_and_paths]
@@ -7,6 +7,7 @@
 import os
 import pwd
 from dataclasses import dataclass
+from typing import Iterator
 
 from antlir.compiler.requires_provides import (
     ProvidesDirectory,
@@ -18,6 +19,7 @@ from antlir.nspawn_in_subvol.nspawn import run_nspawn
 from antlir.subvol_utils import Subvol
 
 from .common import ImageItem, LayerOpts, coerce_path_field_normal_relative
+from .dirs_and_symlinks import Inode, build_dirs_and_symlinks
 from .stat_options import Mode, build_stat_options, customize_stat_options
 
 
@@ -48,6 +50,20 @@ class MakeDirsItem(ImageItem):
     def requires(self):
         yield require_directory(self.into_dir)
 
+    def gen_inodes(self) -> Iterator[Inode]:
+        "The directories that `build` makes, see `dirs_and_symlinks.py`."
+        path = self.into_dir
+        for name in self.path_to_make.split("/"):
+            path = os.path.normpath(os.path.join(path, name))
+            yield Inode(
+                path=path,
+                symlink_target=None,
+                mode=self.mode,
+                user_group=self.user_group,
+            )
+
+    build_batch = classmethod(build_dirs_and_symlinks)
+
     def build(self, subvol: Subvol, layer_opts: LayerOpts):
         if layer_opts.build_appliance:
             work_dir = generate_work_dir()
@@ -10,11 +10,23 @@ is ONLY injected by `dep_graph.py` in order to capture the state of the
 subvolume after all the phases have finished executing, in order to
 `provide()` whatever was created during the phases to the dependency sorter.
 """
+import io
 import itertools
 import os
 import subprocess
 from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, Set, Tuple
 
+from antlir.btrfs_diff.parse_send_stream import parse_send_stream_fields
+from antlir.common import get_logger
+from antlir.compiler.provides_manifest import (
+    Entry,
+    PathTree,
+    PathTreeMismatch,
+    load_manifest,
+    manifest_path,
+    write_manifest,
+)
 from antlir.compiler.requires_provides import (
     ProvidesDirectory,
     ProvidesDoNotAccess,
@@ -26,20 +38,22 @@ from antlir.subvol_utils import Subvol
 from .common import ImageItem, is_path_protected, protected_path_set
 
 
-def gen_subvolume_subtree_provides(subvol: Subvol, subtree: Path):
-    'Yields "Provides" instances for a path `subtree` in `subvol`.'
-    # "Provides" classes use image-absolute paths that are `str` (for now).
-    # Accept any string type to ease future migrations.
-    subtree = os.path.join("/", Path(subtree).decode())
+log = get_logger()
 
-    protected_paths = protected_path_set(subvol)
-    for prot_path in protected_paths:
-        rel_to_subtree = os.path.relpath(os.path.join("/", prot_path), subtree)
-        if not Path(rel_to_subtree).has_leading_dot_dot():
-            yield ProvidesDoNotAccess(path=rel_to_subtree)
 
+def _pruned_paths(protected_paths: Iterable[str]) -> Set[bytes]:
+    # `normpath` removes the trailing / for protected dirs
+    return {os.path.normpath(p).encode() for p in protected_paths}
+
+
+def _gen_find_types_and_paths(
+    subvol: Subvol, subtree: str, protected_paths: Set[str]
+) -> Iterator[Tuple[str, str]]:
+    "Yields `(find %y, subtree-relative path)` for the un-pruned paths."
     subtree_full_path = subvol.path(subtree).decode()
-    subtree_exists = False
+    # `find` prints every path with this prefix.  Stripping it is much
+    # cheaper than `os.path.relpath`, which matters for huge subtrees.
+    subtree_prefix = subtree_full_path.rstrip("/") + "/"
     # Traverse the subvolume as root, so that we have permission to access
     # everything.
     for type_and_path in subvol.run_as_root(
@@ -49,8 +63,8 @@ def gen_subvolume_subtree_provides(subvol: Subvol, subtree: Path):
             # Filter out the protected paths at traversal time.  If one of the
             # paths has a very large or very slow mount, traversing it would
             # have a devastating effect on build times, so let's avoid looking
-            # inside protected paths entirely.  An alternative would be to
-            # `send` and to parse the sendstream, but this is ok too.
+            # inside protected paths entirely.  `_gen_incremental_entries`
+            # instead parses a sendstream, and prunes the same paths.
             "find",
             "-P",
             subtree_full_path,
@@ -58,13 +72,8 @@ def gen_subvolume_subtree_provides(subvol: Subvol, subtree: Path):
             *itertools.dropwhile(
                 lambda x: x == "-o",  # Drop the initial `-o`
                 itertools.chain.from_iterable(
-                    [
-                        # `normpath` removes the trailing / for protected dirs
-                        "-o",
-                        "-path",
-                        subvol.path(os.path.normpath(p)),
-                    ]
-                    for p in protected_paths
+                    ["-o", "-path", subvol.path(p)]
+                    for p in _pruned_paths(protected_paths)
                 ),
             ),
             ")",
@@ -78,12 +87,89 @@ def gen_subvolume_subtree_provides(subvol: Subvol, subtree: Path):
         if not type_and_path:  # after the trailing \0
             continue
         filetype, abspath = type_and_path.decode().split(" ", 1)
-        relpath = os.path.relpath(abspath, subtree_full_path)
+        if abspath == subtree_full_path:
+            relpath = "."
+        elif abspath.startswith(subtree_prefix) and not abspath.endswith("/"):
+            relpath = abspath[len(subtree_prefix) :]
+        else:  # pragma: no cover
+            relpath = os.path.relpath(abspath, subtree_full_path)
 
         assert not Path(relpath).has_leading_dot_dot(), (
             abspath,
             subtree_full_path,
         )
+        yield filetype, relpath
+
+
+def _gen_incremental_entries(
+    subvol: Subvol, parent: Subvol, protected_paths: Set[str]
+) -> Optional[Iterator[Entry]]:
+    """
+    If `parent` has a provides manifest, returns the entries of `subvol`,
+    a snapshot of `parent`, computed from the parent's entries, and from
+    `btrfs send --no-data -p`.  This reads the metadata of just the paths
+    that changed, instead of traversing the whole subvolume.
+
+    `btrfs send` needs `subvol` to be read-only, so this is only for
+    finished layers.  We never toggle the flag of a layer that is still
+    being built.
+    """
+    parent_entries = load_manifest(manifest_path(parent))
+    if parent_entries is None:
+        return None
+    tree = PathTree(parent_entries, pruned_paths=_pruned_paths(protected_paths))
+    sendstream = subvol.mark_readonly_and_get_sendstream(
+        no_data=True, parent=parent
+    )
+    try:
+        for item_type, fields in parse_send_stream_fields(
+            io.BytesIO(sendstream)
+        ):
+            tree.apply_fields(item_type, fields)
+    except PathTreeMismatch as ex:  # pragma: no cover
+        log.warning(
+            f"Provides manifest of {parent.path()} does not match the "
+            f"sendstream of {subvol.path()}, traversing instead: {ex}"
+        )
+        return None
+    return tree.gen_entries()
+
+
+def gen_subvolume_subtree_provides(subvol: Subvol, subtree: Path):
+    """
+    Yields "Provides" instances for a path `subtree` in `subvol`.
+
+    Reads the provides manifest of `subvol` if it has one, or else
+    traverses `subtree`.
+    """
+    # "Provides" classes use image-absolute paths that are `str` (for now).
+    # Accept any string type to ease future migrations.
+    subtree = os.path.join("/", Path(subtree).decode())
+
+    protected_paths = protected_path_set(subvol)
+    for prot_path in protected_paths:
+        rel_to_subtree = os.path.relpath(os.path.join("/", prot_path), subtree)
+        if not Path(rel_to_subtree).has_leading_dot_dot():
+            yield ProvidesDoNotAccess(path=rel_to_subtree)
+
+    rel_subtree = subtree.lstrip("/").encode()
+    entries = load_manifest(manifest_path(subvol), rel_subtree)
+    if entries is None:
+        types_and_paths = _gen_find_types_and_paths(
+            subvol, subtree, protected_paths
+        )
+    else:
+        prefix_len = len(rel_subtree) + 1 if rel_subtree else 0
+        types_and_paths = (
+            (
+                filetype,
+                "." if path == rel_subtree else path[prefix_len:].decode(),
+            )
+            for path, filetype in entries
+        )
+
+    subtree_exists = False
+    for filetype, relpath in types_and_paths:
         # We already "provided" this path above, and it should have been
         # filtered out by `find`.
         assert not is_path_protected(relpath, protected_paths), relpath
@@ -96,14 +182,37 @@ def gen_subvolume_subtree_provides(subvol: Subvol, subtree: Path):
         elif filetype == "d":
             yield ProvidesDirectory(path=relpath)
         else:  # pragma: no cover
-            raise AssertionError(f"Unknown {filetype} for {abspath}")
+            raise AssertionError(f"Unknown {filetype} for {relpath}")
         if relpath == ".":
             subtree_exists = True
 
-    # We should've gotten a CalledProcessError from `find`.
+    # We should've gotten a CalledProcessError from `find`, or an empty
+    # manifest subtree.
     assert subtree_exists, f"{subtree} does not exist in {subvol.path()}"
 
 
+def write_provides_manifest(
+    subvol: Subvol, parent: Optional[Subvol] = None
+) -> None:
+    """
+    Saves the paths of a fully built, read-only `subvol`, so that
+    `gen_subvolume_subtree_provides` need not traverse it again.  If
+    `subvol` is a snapshot of `parent`, uses the manifest of `parent`.
+    """
+    protected_paths = protected_path_set(subvol)
+    entries = None
+    if parent is not None:
+        entries = _gen_incremental_entries(subvol, parent, protected_paths)
+    if entries is None:
+        entries = (
+            (b"" if relpath == "." else relpath.encode(), filetype)
+            for filetype, relpath in _gen_find_types_and_paths(
+                subvol, "/", protected_paths
+            )
+        )
+    write_manifest(manifest_path(subvol), entries)
+
+
 @dataclass(init=False, frozen=True)
 class PhasesProvideItem(ImageItem):
     subvol: Subvol
@@ -78,6 +78,12 @@ class RemovePathItem(ImageItem):
             # Reverse-lexicographic order deletes inner paths before
             # deleting the outer paths, thus minimizing conflicts between
             # `remove_paths` items.
+            #
+            # All the paths are removed by one `xargs rm`, so we check them
+            # all up-front, treating the paths queued for removal, and their
+            # descendants, as already gone.
+            paths_to_remove = []
+            queued = set()
             for item in sorted(
                 items, reverse=True, key=lambda i: i.__sort_key()
             ):
@@ -93,26 +99,40 @@ class RemovePathItem(ImageItem):
                 # `rm` does not follow symlinks, it is OK if the inode at
                 # `item.path` is a symlink (or one of its sub-paths).
                 path = subvol.path(item.path, no_dereference_leaf=True)
-                if not os.path.lexists(path):
+                parts = path.split(b"/")
+                if not os.path.lexists(path) or any(
+                    b"/".join(parts[:i]) in queued
+                    for i in range(1, len(parts) + 1)
+                ):
                     if item.action == RemovePathAction.assert_exists:
                         raise AssertionError(f"Path does not exist: {item}")
                     elif item.action == RemovePathAction.if_exists:
                         continue
                     else:  # pragma: no cover
                         raise AssertionError(f"Unknown {item.action}")
-                subvol.run_as_root(
-                    [
-                        "rm",
-                        # This prevents us from making removes outside of the
-                        # per-repo loopback, which is an important safeguard.
-                        # It does not stop us from reaching into other subvols,
-                        # but since those have random IDs in the path, this is
-                        # nearly impossible to do by accident.
-                        "--one-file-system",
-                        "--recursive",
-                        path,
-                    ]
-                )
-            pass
+                paths_to_remove.append(path)
+                queued.add(path)
+            if not paths_to_remove:
+                return
+            # `xargs` reads the NUL-separated paths from `stdin`, so their
+            # total size is not bounded by `ARG_MAX`.  It only splits them
+            # across several `rm`s if they do not fit in one.  Since inner
+            # paths come first, a split cannot change the outcome.
+            subvol.run_as_root(
+                [
+                    "xargs",
+                    "--null",
+                    "rm",
+                    # This prevents us from making removes outside of the
+                    # per-repo loopback, which is an important safeguard.
+                    # It does not stop us from reaching into other subvols,
+                    # but since those have random IDs in the path, this is
+                    # nearly impossible to do by accident.
+                    "--one-file-system",
+                    "--recursive",
+                    "--",
+                ],
+                input=b"".join(p + b"\0" for p in paths_to_remove),
+            )
 
         return builder
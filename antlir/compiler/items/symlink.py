@@ -7,6 +7,7 @@
 import os
 import pwd
 from dataclasses import dataclass
+from typing import Iterator
 
 from antlir.compiler.requires_provides import (
     ProvidesDirectory,
@@ -25,6 +26,7 @@ from .common import (
     coerce_path_field_normal_relative,
     make_path_normal_relative,
 )
+from .dirs_and_symlinks import Inode, build_dirs_and_symlinks
 
 
 def _make_rsync_style_dest_path(dest: str, source: str) -> str:
@@ -100,6 +102,21 @@ class SymlinkBase(ImageItem):
                 ["ln", "--symbolic", "--no-dereference", rel_source, dest]
             )
 
+    def gen_inodes(self) -> Iterator[Inode]:
+        "The symlink that `build` makes, see `dirs_and_symlinks.py`."
+        yield Inode(
+            path=self.dest,
+            # Same as `build`, but without `Subvol.path`.
+            symlink_target=os.path.relpath(
+                os.path.join("/", self.source),
+                os.path.dirname(os.path.join("/", self.dest)),
+            ),
+            mode=None,
+            user_group=None,
+        )
+
+    build_batch = classmethod(build_dirs_and_symlinks)
+
 
 @dataclass(init=False, frozen=True)
 class SymlinkToDirItem(SymlinkBase, ImageItem):
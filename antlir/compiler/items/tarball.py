@@ -4,26 +4,105 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+"""
+`TarballItem.provides()` must list the archive's members before the
+dependency sort, long before `build()` extracts it.  For a big compressed
+tarball, the decompression and the Python `tarfile` walk dominate.  So,
+given an `index_cache_dir`, the members & their types are saved in a
+"tar index" named by the archive's SHA-256, and later builds with the
+same archive just read the index.
+
+Future: The first build still decompresses the archive twice, once to
+index it, and once to extract it.  Sharing that pass would mean spooling
+the decompressed archive to disk, since `provides()` runs first.
+"""
 import os
 import pwd
+from typing import List, Optional, Tuple
 
 from antlir.compiler.requires_provides import (
     ProvidesDirectory,
     ProvidesFile,
     require_directory,
 )
-from antlir.fs_utils import generate_work_dir, open_for_read_decompress
+from antlir.fs_utils import (
+    Path,
+    generate_work_dir,
+    open_for_read_decompress,
+    populate_temp_file_and_rename,
+)
 from antlir.nspawn_in_subvol.args import PopenArgs, new_nspawn_opts
 from antlir.nspawn_in_subvol.nspawn import run_nspawn
 from antlir.subvol_utils import Subvol
 from pydantic import validator
 
-from .common import ImageItem, LayerOpts, make_path_normal_relative
+from .common import (
+    ImageItem,
+    LayerOpts,
+    hash_path,
+    make_path_normal_relative,
+)
 from .tarball_t import tarball_t
 
 
+# Bump this if the format of the index, or its content, changes.
+_TAR_INDEX_DIR = "tarball-index-v1"
+
+
+def _scan_tarball(source: Path) -> List[Tuple[str, bytes]]:
+    "Returns `(name, filetype)` per member, `filetype` is `d` or `f`."
+    # We own ZST decompression, tarfile handles other gz, bz2, etc.
+    import tarfile  # Lazy since only this function needs it.
+
+    with open_for_read_decompress(source) as tf, tarfile.open(
+        fileobj=tf, mode="r|"
+    ) as f:
+        return [(item.name, b"d" if item.isdir() else b"f") for item in f]
+
+
+def _write_tar_index(path: Path, members: List[Tuple[str, bytes]]) -> None:
+    with populate_temp_file_and_rename(
+        path, overwrite=True, mode="wb"
+    ) as outfile:
+        for name, filetype in members:
+            outfile.write(filetype + os.fsencode(name) + b"\0")
+
+
+def _read_tar_index(path: Path) -> Optional[List[Tuple[str, bytes]]]:
+    try:
+        with open(path, "rb") as infile:
+            content = infile.read()
+    except FileNotFoundError:
+        return None
+    # Each record is `filetype + name + b"\0"`.
+    return [
+        (os.fsdecode(record[1:]), record[:1])
+        for record in content.split(b"\0")[:-1]
+    ]
+
+
+def _tarball_members(
+    source: Path, index_cache_dir: Optional[Path]
+) -> List[Tuple[str, bytes]]:
+    if index_cache_dir is None:
+        return _scan_tarball(source)
+    index_dir = index_cache_dir / _TAR_INDEX_DIR
+    index_path = index_dir / hash_path(
+        source, "sha256", cache_dir=index_cache_dir
+    )
+    members = _read_tar_index(index_path)
+    if members is None:
+        members = _scan_tarball(source)
+        os.makedirs(index_dir, exist_ok=True)
+        _write_tar_index(index_path, members)
+    return members
+
+
 class TarballItem(tarball_t, ImageItem):
     from_target: str
+    # If set, `provides()` reuses the member list of identical tarballs
+    # across builds.  The compiler sets this from `--cache-dir`.
+    index_cache_dir: Optional[Path] = None
 
     @validator("into_dir")
     def path_is_normal_relative(cls, into_dir):  # noqa B902
@@ -31,28 +110,22 @@ class TarballItem(tarball_t, ImageItem):
         return make_path_normal_relative(into_dir)
 
     def provides(self):
-        # We own ZST decompression, tarfile handles other gz, bz2, etc.
-        import tarfile  # Lazy since only this method needs it.
-
-        with open_for_read_decompress(self.source) as tf, tarfile.open(
-            fileobj=tf, mode="r|"
-        ) as f:
-            for item in f:
-                path = os.path.join(
-                    self.into_dir, make_path_normal_relative(item.name)
-                )
-                if item.isdir():
-                    # We do NOT provide the installation directory, and the
-                    # image build script tarball extractor takes pains (e.g.
-                    # `tar --no-overwrite-dir`) not to touch the extraction
-                    # directory.
-                    if (
-                        os.path.normpath(os.path.relpath(path, self.into_dir))
-                        != "."
-                    ):
-                        yield ProvidesDirectory(path=path)
-                else:
-                    yield ProvidesFile(path=path)
+        for name, filetype in _tarball_members(
+            self.source, self.index_cache_dir
+        ):
+            path = os.path.join(self.into_dir, make_path_normal_relative(name))
+            if filetype == b"d":
+                # We do NOT provide the installation directory, and the
+                # image build script tarball extractor takes pains (e.g.
+                # `tar --no-overwrite-dir`) not to touch the extraction
+                # directory.
+                if (
+                    os.path.normpath(os.path.relpath(path, self.into_dir))
+                    != "."
+                ):
+                    yield ProvidesDirectory(path=path)
+            else:
+                yield ProvidesFile(path=path)
 
     def requires(self):
         yield require_directory(self.into_dir)
@@ -4,6 +4,11 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import hashlib
+import os
+import time
+import unittest.mock
+from contextlib import ExitStack
 from dataclasses import dataclass, field
 from typing import List
 
@@ -11,8 +16,9 @@ from antlir.compiler.requires_provides import (
     ProvidesDirectory,
     require_directory,
 )
+from antlir.fs_utils import temp_dir
 
-from ..common import ImageItem, image_source_item
+from ..common import ImageItem, hash_path, image_source_item
 from ..install_file import InstallFileItem
 from ..make_dirs import MakeDirsItem
 from .common import DUMMY_LAYER_OPTS, BaseItemTestCase
@@ -38,6 +44,80 @@ class ItemsCommonTestCase(BaseItemTestCase):
         self.assertIsNone(it.source)
         self.assertEqual("meow", it.kitteh)
 
+    def test_image_source_item_generator_runs_once(self):
+        with temp_dir() as td, ExitStack() as exit_stack:
+            make_item = image_source_item(
+                FakeImageSourceItem,
+                exit_stack=exit_stack,
+                layer_opts=DUMMY_LAYER_OPTS,
+            )
+
+            def item(content):
+                return make_item(
+                    from_target="t",
+                    kitteh="meow",
+                    source={
+                        "generator": "/bin/bash",
+                        "generator_args": [
+                            "-c",
+                            'echo run >> "$1"; echo -n "$2" > "$3"/f; echo f',
+                            "test_generator",  # $0
+                            td / "runs",  # $1
+                            content,  # $2, making $3 the output directory
+                        ],
+                        "content_hash": "sha256:"
+                        + hashlib.sha256(content.encode()).hexdigest(),
+                    },
+                )
+
+            a1, a2, b = item("a"), item("a"), item("b")
+            self.assertEqual(a1.source, a2.source)
+            self.assertNotEqual(a1.source, b.source)
+            with open(b.source) as f:
+                self.assertEqual("b", f.read())
+            with open(td / "runs") as f:
+                self.assertEqual("run\nrun\n", f.read())
+
+    def test_hash_path_cache(self):
+        with temp_dir() as td:
+            path = td / "file"
+            with open(path, "w") as f:
+                f.write("content")
+            expected = hashlib.sha256(b"content").hexdigest()
+            cache_dir = td / "cache"
+
+            # A recently changed file is hashed, but not cached.
+            self.assertEqual(expected, hash_path(path, "sha256", cache_dir))
+            self.assertFalse(os.path.exists(cache_dir))
+
+            with unittest.mock.patch.object(
+                time, "time_ns", return_value=time.time_ns() + 10 ** 10
+            ):
+                self.assertEqual(
+                    expected, hash_path(path, "sha256", cache_dir)
+                )
+                (hash_dir,) = cache_dir.listdir()
+                (cache_name,) = (cache_dir / hash_dir).listdir()
+                # Prove that the cached digest is reused.
+                with open(cache_dir / hash_dir / cache_name, "w") as f:
+                    f.write("cached")
+                self.assertEqual(
+                    "cached", hash_path(path, "sha256", cache_dir)
+                )
+                self.assertEqual(
+                    hashlib.md5(b"content").hexdigest(),
+                    hash_path(path, "md5", cache_dir),
+                )
+
+                # Any write changes the `ctime`, invalidating the cache.
+                time.sleep(0.01)
+                with open(path, "w") as f:
+                    f.write("new")
+                self.assertEqual(
+                    hashlib.sha256(b"new").hexdigest(),
+                    hash_path(path, "sha256", cache_dir),
+                )
+
     def test_enforce_no_parent_dir(self):
         with self.assertRaisesRegex(AssertionError, r"cannot start with \.\."):
             InstallFileItem(
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import sys
+import unittest
+import unittest.mock
+
+from antlir.nspawn_in_subvol.ba_runner import BuildAppliance
+from antlir.privileged_helper import privileged_helper
+from antlir.subvol_utils import Subvol
+from antlir.tests.temp_subvolumes import TempSubvolumes
+
+from ..make_dirs import MakeDirsItem
+from ..symlink import SymlinkToDirItem, SymlinkToFileItem
+from .common import DUMMY_LAYER_OPTS, render_subvol
+
+
+def _items(mode):
+    return [
+        MakeDirsItem(
+            from_target="t",
+            into_dir="/d",
+            path_to_make="a/b",
+            mode=mode,
+            user_group="77:88",
+        ),
+        SymlinkToDirItem(from_target="t", source="/d", dest="/d/dir_link"),
+        SymlinkToFileItem(from_target="t", source="/d/f", dest="/file_link"),
+    ]
+
+
+class DirsAndSymlinksTestCase(unittest.TestCase):
+    def _check_build_batch(self, mode, use_helper):
+        with TempSubvolumes(sys.argv[0]) as temp_subvolumes:
+            subvol = temp_subvolumes.create("sv")
+            subvol.run_as_root(["mkdir", subvol.path("d")])
+            items = _items(mode)
+            # Both item types share one `build_batch`
+            if use_helper:
+                with privileged_helper():
+                    type(items[0]).build_batch(items, subvol, DUMMY_LAYER_OPTS)
+            else:
+                type(items[1]).build_batch(items, subvol, DUMMY_LAYER_OPTS)
+            self.assertEqual(
+                [
+                    "(Dir)",
+                    {
+                        "d": [
+                            "(Dir)",
+                            {
+                                "a": [
+                                    "(Dir m500 o77:88)",
+                                    {"b": ["(Dir m500 o77:88)", {}]},
+                                ],
+                                "dir_link": ["(Symlink .)"],
+                            },
+                        ],
+                        "file_link": ["(Symlink d/f)"],
+                    },
+                ],
+                render_subvol(subvol),
+            )
+
+    def test_build_batch_via_shell(self):
+        self._check_build_batch(0o500, use_helper=False)
+
+    def test_build_batch_via_helper(self):
+        self._check_build_batch(0o500, use_helper=True)
+
+    def test_build_batch_symbolic_mode(self):
+        # Only `chmod` understands this, so the helper falls back to it
+        self._check_build_batch("u+rx", use_helper=True)
+
+    def test_build_batch_via_symlinked_parent(self):
+        with TempSubvolumes(sys.argv[0]) as temp_subvolumes:
+            subvol = temp_subvolumes.create("sv")
+            subvol.run_as_root(["mkdir", subvol.path("d")])
+            subvol.run_as_root(["ln", "-s", "d", subvol.path("d_link")])
+            # The helper refuses to follow `d_link`, but `Subvol.path`
+            # allows it, so this falls back to the shell.
+            with privileged_helper():
+                MakeDirsItem.build_batch(
+                    [
+                        MakeDirsItem(
+                            from_target="t", into_dir="/", path_to_make="e"
+                        ),
+                        MakeDirsItem(
+                            from_target="t",
+                            into_dir="/d_link",
+                            path_to_make="c",
+                        ),
+                    ],
+                    subvol,
+                    DUMMY_LAYER_OPTS,
+                )
+            self.assertEqual(
+                [
+                    "(Dir)",
+                    {
+                        "d": ["(Dir)", {"c": ["(Dir)", {}]}],
+                        "d_link": ["(Symlink d)"],
+                        "e": ["(Dir)", {}],
+                    },
+                ],
+                render_subvol(subvol),
+            )
+
+    def test_build_batch_with_build_appliance(self):
+        scripts = []
+
+        def fake_run(ba, cmd, *, bindmount_ro):
+            ((script, ba_script), *user_db) = bindmount_ro
+            self.assertEqual(["sh", "-ue", ba_script], cmd)
+            self.assertEqual(
+                [("/etc/passwd", "/etc/passwd"), ("/etc/group", "/etc/group")],
+                user_db,
+            )
+            with open(script, "rb") as f:
+                scripts.append(f.read().replace(ba.path(b""), b"WORK/"))
+
+        layer_opts = DUMMY_LAYER_OPTS._replace(
+            build_appliance=Subvol("/fake/ba")
+        )
+        with unittest.mock.patch.object(
+            BuildAppliance, "run", autospec=True, side_effect=fake_run
+        ):
+            MakeDirsItem.build_batch(
+                _items(0o500), Subvol("/fake/subvol"), layer_opts
+            )
+        # The whole batch is one script in one container.
+        self.assertEqual(
+            [
+                b"mkdir WORK/d/a WORK/d/a/b\n"
+                b"ln --symbolic --no-dereference . WORK/d/dir_link\n"
+                b"ln --symbolic --no-dereference d/f WORK/file_link\n"
+                b"chmod 0500 WORK/d/a WORK/d/a/b\n"
+                b"chown --no-dereference 77:88 WORK/d/a WORK/d/a/b"
+            ],
+            scripts,
+        )
+
+    def test_build_batch_matches_build(self):
+        with TempSubvolumes(sys.argv[0]) as temp_subvolumes:
+            subvols = []
+            for name in ("one_by_one", "batch"):
+                subvol = temp_subvolumes.create(name)
+                subvol.run_as_root(["mkdir", subvol.path("d")])
+                subvols.append(subvol)
+            items = _items(0o750)
+            for item in items:
+                item.build(subvols[0], DUMMY_LAYER_OPTS)
+            with privileged_helper():
+                MakeDirsItem.build_batch(items, subvols[1], DUMMY_LAYER_OPTS)
+            self.assertEqual(*(render_subvol(sv) for sv in subvols))
@@ -213,3 +213,71 @@ class InstallFileItemTestCase(BaseItemTestCase):
                 ],
                 render_subvol(subvol),
             )
+
+    def test_install_file_build_batch(self):
+        with TempSubvolumes(sys.argv[0]) as temp_subvolumes, temp_dir() as td:
+            subvol = temp_subvolumes.create("tar-sv")
+            subvol.run_as_root(["mkdir", subvol.path("d")])
+            with open(td / "data.txt", "w") as df:
+                print("Hello", file=df)
+            os.mkdir(td / "subdir")
+            with open(td / "subdir/exe.sh", "w") as ef:
+                print('#!/bin/sh\necho "Hello"', file=ef)
+            os.chmod(td / "subdir/exe.sh", 0o100)
+
+            InstallFileItem.build_batch(
+                [
+                    _install_file_item(
+                        from_target="t",
+                        source={"source": td / "data.txt"},
+                        dest="/d/data with space",
+                    ),
+                    _install_file_item(
+                        from_target="t",
+                        source={"source": td / "data.txt"},
+                        dest="/d/owned",
+                        mode="u+rw",
+                        user_group="12:34",
+                    ),
+                    _install_file_item(
+                        from_target="t",
+                        source={"source": td / "subdir"},
+                        dest="/d/subdir",
+                    ),
+                ],
+                subvol,
+                DUMMY_LAYER_OPTS,
+            )
+            self.assertEqual(
+                [
+                    "(Dir)",
+                    {
+                        "d": [
+                            "(Dir)",
+                            {
+                                "data with space": ["(File m444 d6)"],
+                                "owned": ["(File m600 o12:34 d6)"],
+                                "subdir": [
+                                    "(Dir)",
+                                    {"exe.sh": ["(File m555 d23)"]},
+                                ],
+                            },
+                        ]
+                    },
+                ],
+                render_subvol(subvol),
+            )
+
+            # Like `build`, fail to write to a nonexistent dir
+            with self.assertRaises(subprocess.CalledProcessError):
+                InstallFileItem.build_batch(
+                    [
+                        _install_file_item(
+                            from_target="t",
+                            source={"source": td / "data.txt"},
+                            dest="/no_dir/data.txt",
+                        )
+                    ],
+                    subvol,
+                    DUMMY_LAYER_OPTS,
+                )
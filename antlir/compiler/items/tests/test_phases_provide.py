@@ -7,14 +7,21 @@
 import os
 import subprocess
 import sys
+import unittest.mock
 
+from antlir.compiler.provides_manifest import manifest_path
 from antlir.compiler.requires_provides import (
     ProvidesDirectory,
     ProvidesDoNotAccess,
+    ProvidesFile,
 )
 from antlir.tests.temp_subvolumes import TempSubvolumes
 
-from ..phases_provide import PhasesProvideItem, gen_subvolume_subtree_provides
+from ..phases_provide import (
+    PhasesProvideItem,
+    gen_subvolume_subtree_provides,
+    write_provides_manifest,
+)
 from .common import (
     BaseItemTestCase,
     populate_temp_filesystem,
@@ -54,3 +61,74 @@ class PhaseProvidesItemTestCase(BaseItemTestCase):
                     },
                     set(),
                 )
+
+    def test_provides_manifest(self):
+        with TempSubvolumes(sys.argv[0]) as temp_subvolumes:
+            parent = temp_subvolumes.create("parent")
+            parent.run_as_root(
+                [
+                    "chown",
+                    "--no-dereference",
+                    f"{os.geteuid()}:{os.getegid()}",
+                    parent.path(),
+                ]
+            )
+            populate_temp_filesystem(parent.path().decode())
+            parent.run_as_root(["mkdir", parent.path(".meta")])
+            parent.run_as_root(["touch", parent.path(".meta/private")])
+            # Without a manifest, these come from traversing `parent`
+            subtrees = ["/", "a", "a/b", "a/E"]
+            parent_provides = {
+                subtree: set(gen_subvolume_subtree_provides(parent, subtree))
+                for subtree in subtrees
+            }
+            parent.set_readonly(True)
+            write_provides_manifest(parent)
+            self.assertTrue(manifest_path(parent).exists())
+            for subtree in subtrees:
+                self.assertEqual(
+                    parent_provides[subtree],
+                    set(gen_subvolume_subtree_provides(parent, subtree)),
+                )
+            with self.assertRaisesRegex(AssertionError, "does not exist in"):
+                list(gen_subvolume_subtree_provides(parent, "no_such/path"))
+
+            child = temp_subvolumes.snapshot(parent, "child")
+            child.run_as_root(["rm", "-r", child.path("a/b")])
+            child.run_as_root(["mv", child.path("a/E"), child.path("E")])
+            child.run_as_root(["mkdir", child.path("a/b")])
+            child.run_as_root(["touch", child.path(".meta/private2")])
+            expected_child_provides = temp_filesystem_provides() - {
+                ProvidesDirectory(path="/a/b/c"),
+                ProvidesFile(path="/a/b/c/G"),
+                ProvidesFile(path="/a/E"),
+            } | {
+                ProvidesDirectory(path="/"),
+                ProvidesDoNotAccess(path="/.meta"),
+                ProvidesFile(path="/E"),
+            }
+            # The layer is still being built, so this traverses it, and
+            # leaves its read-only flag alone.
+            with unittest.mock.patch.object(
+                child, "set_readonly"
+            ) as set_readonly, unittest.mock.patch.object(
+                child, "mark_readonly_and_get_sendstream"
+            ) as get_sendstream:
+                self._check_item(
+                    PhasesProvideItem(from_target="t", subvol=child),
+                    expected_child_provides,
+                    set(),
+                )
+            set_readonly.assert_not_called()
+            get_sendstream.assert_not_called()
+            child.run_as_root(["rmdir", child.path("a/b")])
+            expected_child_provides.remove(ProvidesDirectory(path="/a/b"))
+            # Once it is built, the parent's manifest is updated via a
+            # sendstream.
+            child.set_readonly(True)
+            write_provides_manifest(child, parent)
+            self._check_item(
+                PhasesProvideItem(from_target="t", subvol=child),
+                expected_child_provides,
+                set(),
+            )
@@ -128,49 +128,72 @@ class RemovePathItemTestCase(BaseItemTestCase):
                 )(subvol)
             self.assertEqual(intact_subvol, render_subvol(subvol))
 
-            # Now remove most of the subvolume.
-            RemovePathItem.get_phase_builder(
-                [
-                    # These 3 removes are not covered by a recursive remove.
-                    # And we leave behind /f/i, which lets us know that neither
-                    # `f_sym` nor `i_sym` were followed during their deletion.
-                    RemovePathItem(
-                        from_target="t",
-                        action=RemovePathAction.assert_exists,
-                        path="/f/i_sym",
-                    ),
-                    RemovePathItem(
-                        from_target="t",
-                        action=RemovePathAction.assert_exists,
-                        path="/f/h",
-                    ),
-                    RemovePathItem(
-                        from_target="t",
-                        action=RemovePathAction.assert_exists,
-                        path="/f/g",
-                    ),
-                    # The next 3 items are intentionally sequenced so that if
-                    # they were applied in the given order, they would fail.
-                    RemovePathItem(
-                        from_target="t",
-                        action=RemovePathAction.if_exists,
-                        path="/a/b/c/e",
-                    ),
-                    RemovePathItem(
-                        from_target="t",
-                        action=RemovePathAction.assert_exists,
-                        # The surrounding items don't delete /a/b/c/d, e.g. so
-                        # this recursive remove is still tested.
-                        path="/a/b/",
-                    ),
-                    RemovePathItem(
-                        from_target="t",
-                        action=RemovePathAction.assert_exists,
-                        path="/a/b/c/e",
-                    ),
-                ],
-                DUMMY_LAYER_OPTS_BA,
-            )(subvol)
+            # Paths are checked before any removal, so a second
+            # `assert_exists` of a removed path fails, and leaves the
+            # subvolume intact.
+            with self.assertRaisesRegex(AssertionError, "does not exist"):
+                RemovePathItem.get_phase_builder(
+                    [
+                        RemovePathItem(
+                            from_target="t",
+                            action=RemovePathAction.assert_exists,
+                            path=p,
+                        )
+                        for p in ["/a/b", "/a/b/c/d", "/a/b/c/d"]
+                    ],
+                    DUMMY_LAYER_OPTS_BA,
+                )(subvol)
+            self.assertEqual(intact_subvol, render_subvol(subvol))
+
+            # Now remove most of the subvolume, with just one `sudo`.
+            with unittest.mock.patch.object(
+                subvol, "run_as_root", wraps=subvol.run_as_root
+            ) as run_as_root:
+                RemovePathItem.get_phase_builder(
+                    [
+                        # These 3 removes are not covered by a recursive
+                        # remove.  And we leave behind /f/i, which lets us
+                        # know that neither `f_sym` nor `i_sym` were
+                        # followed during their deletion.
+                        RemovePathItem(
+                            from_target="t",
+                            action=RemovePathAction.assert_exists,
+                            path="/f/i_sym",
+                        ),
+                        RemovePathItem(
+                            from_target="t",
+                            action=RemovePathAction.assert_exists,
+                            path="/f/h",
+                        ),
+                        RemovePathItem(
+                            from_target="t",
+                            action=RemovePathAction.assert_exists,
+                            path="/f/g",
+                        ),
+                        # The next 3 items are intentionally sequenced so
+                        # that if they were applied in the given order, they
+                        # would fail.
+                        RemovePathItem(
+                            from_target="t",
+                            action=RemovePathAction.if_exists,
+                            path="/a/b/c/e",
+                        ),
+                        RemovePathItem(
+                            from_target="t",
+                            action=RemovePathAction.assert_exists,
+                            # The surrounding items don't delete /a/b/c/d,
+                            # e.g. so this recursive remove is still tested.
+                            path="/a/b/",
+                        ),
+                        RemovePathItem(
+                            from_target="t",
+                            action=RemovePathAction.assert_exists,
+                            path="/a/b/c/e",
+                        ),
+                    ],
+                    DUMMY_LAYER_OPTS_BA,
+                )(subvol)
+            run_as_root.assert_called_once()
             self.assertEqual(
                 [
                     "(Dir)",
@@ -10,13 +10,15 @@ import subprocess
 import sys
 import tarfile
 import tempfile
+import unittest.mock
 from contextlib import ExitStack
 
 from antlir.compiler.requires_provides import require_directory
+from antlir.fs_utils import Path
 from antlir.tests.temp_subvolumes import TempSubvolumes
 
-from ..common import _hash_path, image_source_item
-from ..tarball import TarballItem
+from ..common import hash_path, image_source_item
+from ..tarball import _TAR_INDEX_DIR, TarballItem
 from .common import (
     DUMMY_LAYER_OPTS,
     BaseItemTestCase,
@@ -31,7 +33,10 @@ DUMMY_LAYER_OPTS_BA = get_dummy_layer_opts_ba()
 
 
 def _tarball_item(
-    tarball: str, into_dir: str, force_root_ownership: bool = False
+    tarball: str,
+    into_dir: str,
+    force_root_ownership: bool = False,
+    index_cache_dir=None,
 ) -> TarballItem:
     "Constructs a common-case TarballItem"
     return image_source_item(
@@ -41,9 +46,10 @@ def _tarball_item(
         into_dir=into_dir,
         source={
             "source": tarball,
-            "content_hash": "sha256:" + _hash_path(tarball, "sha256"),
+            "content_hash": "sha256:" + hash_path(tarball, "sha256"),
         },
         force_root_ownership=force_root_ownership,
+        index_cache_dir=index_cache_dir,
     )
 
 
@@ -94,6 +100,33 @@ class TarballItemTestCase(BaseItemTestCase):
                     force_root_ownership=False,
                 )
 
+    def test_tarball_index(self):
+        with temp_filesystem() as fs_path, tempfile.TemporaryDirectory() as td:
+            tar_path = os.path.join(td, "test.tar")
+            with tarfile.TarFile(tar_path, "w") as tar_obj:
+                tar_obj.add(fs_path, filter=_tarinfo_strip_dir_prefix(fs_path))
+            cache_dir = Path(td) / "cache"
+
+            self._check_item(
+                _tarball_item(tar_path, "y", index_cache_dir=cache_dir),
+                temp_filesystem_provides("y"),
+                {require_directory("y")},
+            )
+            (index_name,) = (cache_dir / _TAR_INDEX_DIR).listdir()
+            self.assertEqual(
+                hash_path(tar_path, "sha256").encode(), index_name
+            )
+
+            # The index is keyed by content, not by the item's fields.
+            with unittest.mock.patch.object(
+                tarfile, "open", side_effect=AssertionError
+            ):
+                self._check_item(
+                    _tarball_item(tar_path, "z", index_cache_dir=cache_dir),
+                    temp_filesystem_provides("z"),
+                    {require_directory("z")},
+                )
+
     # NB: We don't need to test `build` because TarballItem has no logic
     # specific to generated vs pre-built tarballs.  It would really be
     # enough just to construct the item, but it was easy to test `provides`.
@@ -118,7 +151,7 @@ class TarballItemTestCase(BaseItemTestCase):
                             t.name,  # $1, making $2 the output directory
                         ],
                         "content_hash": "sha256:"
-                        + _hash_path(t.name, "sha256"),
+                        + hash_path(t.name, "sha256"),
                     },
                     force_root_ownership=False,
                 ),
@@ -6,7 +6,7 @@
 
 "Makes Items from the JSON that was produced by the Buck target image_feature"
 import json
-from typing import Iterable, Union
+from typing import Dict, Iterable, Optional, Union
 
 from antlir.compiler.items.clone import CloneItem
 from antlir.compiler.items.common import LayerOpts, image_source_item
@@ -68,10 +68,18 @@ def gen_items_for_features(
     exit_stack,
     features_or_paths: Iterable[Union[str, dict]],
     layer_opts: LayerOpts,
+    generator_outputs: Optional[Dict] = None,
 ):
+    # Shared by the whole build, see `image_source_item`.
+    if generator_outputs is None:
+        generator_outputs = {}
+
     def image_sourcify(item_cls):
         return image_source_item(
-            item_cls, exit_stack=exit_stack, layer_opts=layer_opts
+            item_cls,
+            exit_stack=exit_stack,
+            layer_opts=layer_opts,
+            generator_outputs=generator_outputs,
         )
 
     key_to_item_factory = {
@@ -84,7 +92,9 @@ def gen_items_for_features(
         "remove_paths": RemovePathItem,
         "symlinks_to_dirs": SymlinkToDirItem,
         "symlinks_to_files": SymlinkToFileItem,
-        "tarballs": image_sourcify(TarballItem),
+        "tarballs": lambda **kwargs: image_sourcify(TarballItem)(
+            **kwargs, index_cache_dir=layer_opts.cache_dir
+        ),
         "receive_sendstreams": image_sourcify(ReceiveSendstreamItem),
         "foreign_layer": ForeignLayerItem,
     }
@@ -117,6 +127,7 @@ def gen_items_for_features(
             exit_stack=exit_stack,
             features_or_paths=items.pop("features", []),
             layer_opts=layer_opts,
+            generator_outputs=generator_outputs,
         )
 
         target = items.pop("target")
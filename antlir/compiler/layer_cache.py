@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+A content-addressed cache of built layers, so that a layer whose inputs
+were already built once on this host is snapshotted, instead of rebuilt.
+
+## The key
+
+`layer_cache_key` hashes everything that the compiler reads to build a
+layer:
+  - the layer's target name, and its `--child-feature-json`s,
+  - the identity of every layer that the features reference (including
+    the parent layer), and of the build appliance -- which also holds the
+    RPM snapshot that `--rpm-repo-snapshot` picks,
+  - the content of every other Buck output that the features reference,
+    e.g. `image.source`s, and
+  - the `LayerOpts` that can affect the image, and
+  - the code of the compiler itself, see `compiler_identity`.
+
+The identity of a layer is its own cache key, if it was built with the
+cache, so that a child of a cache hit can also hit.  Otherwise, it is its
+`layer.json`, which includes the subvolume's unique btrfs UUID.
+
+Generated `image.source`s are identified by their mandatory
+`content_hash`, which is part of the feature JSON.
+
+## On disk
+
+Each entry is `<cache_dir>/layers/<key>/layer`, a read-only snapshot of
+the built subvolume, next to its provides manifest, if any.  Entries are
+populated in a `.tmp-*` directory, which is renamed into place.  Layers
+built incrementally are kept apart, under `incremental_key`.
+
+Builds take a shared `flock` on an entry while snapshotting it, and bump
+its `mtime`.  `subvolume_garbage_collector.py` evicts the least recently
+used entries that it can exclusively `flock`.
+
+`stats.json` counts cache hits, misses, and stores, see
+`layer_cache_stats`.
+"""
+import contextlib
+import fcntl
+import functools
+import hashlib
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, Mapping, Optional
+
+from antlir.common import get_logger
+from antlir.compiler.items.common import hash_path, LayerOpts
+from antlir.fs_utils import Path, populate_temp_file_and_rename
+from antlir.subvol_utils import Subvol
+
+from .provides_manifest import manifest_path
+
+
+log = get_logger()
+
+# Bump this to invalidate all existing entries, e.g. when the format of
+# an entry changes.  Changes to the compiler's code are in the key anyway.
+_KEY_VERSION = 1
+# Keep in sync with `subvolume_garbage_collector.py`.
+_LAYERS_DIR = "layers"
+_ENTRY_SUBVOL = "layer"
+_STATS = "stats.json"
+
+
+def key_path(subvol: Subvol) -> Path:
+    """
+    The cache key of a layer lives next to its subvolume, just like its
+    provides manifest.  Keep in sync with `subvolume_garbage_collector.py`,
+    and with `SubvolumeOnDisk.from_serializable_dict`.
+    """
+    path = subvol.path()
+    return path.dirname() / (b"." + path.basename() + b".layer-cache-key")
+
+
+def incremental_key(key: str) -> str:
+    """
+    An incremental build (see `incremental_build.py`) is stored under
+    this key, instead of under `key`.  It should match a full build, but
+    that is not verified, so it must never be a hit for a full build.
+    Child layers see this key as its identity, so they are stored apart,
+    too.
+    """
+    return "incremental-" + key
+
+
+def write_key(subvol: Subvol, key: str) -> None:
+    with populate_temp_file_and_rename(
+        key_path(subvol), overwrite=True
+    ) as outfile:
+        outfile.write(key)
+
+
+def _layer_identity(layer_output: Path, subvolumes_dir: str) -> str:
+    "See the docblock."
+    with open(layer_output / "layer.json", "rb") as infile:
+        layer_json = infile.read()
+    subvol = Subvol(
+        Path(subvolumes_dir) / json.loads(layer_json)["subvolume_rel_path"]
+    )
+    try:
+        with open(key_path(subvol)) as infile:
+            return "cache-key:" + infile.read()
+    except FileNotFoundError:
+        return "layer-json:" + hashlib.sha256(layer_json).hexdigest()
+
+
+def _hash_tree(path: Path, cache_dir: Optional[Path]) -> str:
+    """
+    Hashes the names, types, permissions, and contents of a Buck output,
+    which may be a file or a directory.  Other metadata, like `mtime`,
+    cannot affect the image.  File contents are hashed via `hash_path`, so
+    unchanged outputs are not read again on every build.
+    """
+    h = hashlib.sha256()
+
+    def add(rel_path: bytes, st: os.stat_result, full_path: bytes):
+        h.update(rel_path + b"\0" + b"%o\0" % st.st_mode)
+        if stat.S_ISLNK(st.st_mode):
+            h.update(os.readlink(full_path) + b"\0")
+        elif stat.S_ISREG(st.st_mode):
+            h.update(
+                b"%d\0%s\0"
+                % (
+                    st.st_size,
+                    hash_path(full_path, "sha256", cache_dir).encode(),
+                )
+            )
+
+    add(b".", os.lstat(path), path)
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for name in sorted([*dirnames, *filenames]):
+            full_path = os.path.join(dirpath, name)
+            add(
+                os.path.relpath(full_path, path),
+                os.lstat(full_path),
+                full_path,
+            )
+    return h.hexdigest()
+
+
+def _gen_target_sigils(x: Any) -> Iterator[Any]:
+    "Yields `(sigil, target)` for the targets in raw feature JSON."
+    if type(x) is dict:
+        if "__BUCK_TARGET" in x or "__BUCK_LAYER_TARGET" in x:
+            ((sigil, target),) = x.items()
+            yield sigil, target
+            return
+        for v in x.values():
+            yield from _gen_target_sigils(v)
+    elif type(x) is list:
+        for v in x:
+            yield from _gen_target_sigils(v)
+
+
+def target_identities(
+    features: Iterable[Mapping[str, Any]], layer_opts: LayerOpts
+) -> Dict[str, str]:
+    """
+    Maps `<sigil>:<target>` to the identity of each target that the raw
+    feature JSON references, see the docblock.
+    """
+    identities = {}
+    for sigil, target in sorted(
+        {s for f in features for s in _gen_target_sigils(f)}
+    ):
+        path = Path(layer_opts.target_to_path[target])
+        identities[f"{sigil}:{target}"] = (
+            _layer_identity(path, layer_opts.subvolumes_dir)
+            if sigil == "__BUCK_LAYER_TARGET"
+            else "sha256:" + _hash_tree(path, layer_opts.cache_dir)
+        )
+    return identities
+
+
+@functools.lru_cache(maxsize=None)
+def compiler_identity() -> str:
+    """
+    Hashes the code of the `antlir` modules that the running compiler has
+    loaded, whether they come from a PAR or from a source tree.  When
+    someone edits the compiler, Buck reruns it on the same inputs, and
+    those must not hit the entries that the old compiler built.
+
+    Call this after the compiler's imports, as `build_image` does.
+    """
+    h = hashlib.sha256()
+    for name, module in sorted(sys.modules.items()):
+        if name != "antlir" and not name.startswith("antlir."):
+            continue
+        path = getattr(module, "__file__", None)
+        loader = getattr(module, "__loader__", None)
+        if path is None or not hasattr(loader, "get_data"):
+            continue  # pragma: no cover
+        data = loader.get_data(path)
+        h.update(b"%s\0%d\0" % (name.encode(), len(data)) + data)
+    return h.hexdigest()
+
+
+def layer_context(
+    layer_opts: LayerOpts, build_appliance_buck_out: Optional[Path]
+) -> Dict[str, Any]:
+    "The inputs of the layer that are not part of its features."
+    return {
+        "version": _KEY_VERSION,
+        "compiler": compiler_identity(),
+        "layer_target": layer_opts.layer_target,
+        "build_appliance": _layer_identity(
+            build_appliance_buck_out, layer_opts.subvolumes_dir
+        )
+        if build_appliance_buck_out
+        else None,
+        "rpm_installer": layer_opts.rpm_installer.value
+        if layer_opts.rpm_installer
+        else None,
+        "rpm_repo_snapshot": layer_opts.rpm_repo_snapshot.decode()
+        if layer_opts.rpm_repo_snapshot
+        else None,
+        "artifacts_may_require_repo": layer_opts.artifacts_may_require_repo,
+        "allowed_host_mount_targets": sorted(
+            layer_opts.allowed_host_mount_targets
+        ),
+    }
+
+
+def layer_cache_key(
+    *,
+    features: Iterable[Mapping[str, Any]],
+    layer_opts: LayerOpts,
+    build_appliance_buck_out: Optional[Path],
+    identities: Optional[Mapping[str, str]] = None,
+) -> str:
+    """
+    `features` is the JSON of the `--child-feature-json`s, BEFORE
+    `replace_targets_by_paths`, since Buck output paths are not content.
+
+    Pass `identities` if you already computed `target_identities`.
+    """
+    features = list(features)
+    if identities is None:
+        identities = target_identities(features, layer_opts)
+    return hashlib.sha256(
+        json.dumps(
+            {
+                **layer_context(layer_opts, build_appliance_buck_out),
+                "features": features,
+                "targets": identities,
+            },
+            sort_keys=True,
+        ).encode()
+    ).hexdigest()
+
+
+@contextlib.contextmanager
+def _locked_stats(cache_dir: Path) -> Iterator[Dict[str, int]]:
+    "Yields the counters; changes to them are saved on exit."
+    layers_dir = cache_dir / _LAYERS_DIR
+    os.makedirs(layers_dir, exist_ok=True)
+    fd = os.open(layers_dir / _STATS, os.O_RDWR | os.O_CREAT, 0o644)
+    with os.fdopen(fd, "r+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        content = f.read()
+        stats = json.loads(content) if content else {}
+        yield stats
+        f.seek(0)
+        f.truncate()
+        json.dump(stats, f, sort_keys=True)
+
+
+def _bump_stat(cache_dir: Path, name: str) -> None:
+    with _locked_stats(cache_dir) as stats:
+        stats[name] = stats.get(name, 0) + 1
+
+
+def layer_cache_stats(cache_dir: Path) -> Dict[str, int]:
+    "Counts of `hit`, `miss`, and `store` events since the cache was made."
+    with _locked_stats(cache_dir) as stats:
+        return {"hit": 0, "miss": 0, "store": 0, **stats}
+
+
+@contextlib.contextmanager
+def locked_cache_entry(
+    cache_dir: Path, key: str
+) -> Iterator[Optional[Subvol]]:
+    """
+    Yields the cached layer for `key`, or None if there is none.  While
+    the context is active, the GC will not evict the entry.
+    """
+    entry_dir = cache_dir / _LAYERS_DIR / key
+    try:
+        fd = os.open(entry_dir, os.O_RDONLY | os.O_DIRECTORY)
+    except FileNotFoundError:
+        yield None
+        return
+    try:
+        try:
+            # If the GC is evicting this entry, we cannot use it.
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            cached = None
+        else:
+            cached = Subvol(entry_dir / _ENTRY_SUBVOL)
+            if os.path.exists(cached.path()):
+                os.utime(entry_dir)  # For LRU eviction
+            else:
+                cached = None
+        yield cached
+    finally:
+        os.close(fd)
+
+
+def restore_cached_layer(cache_dir: Path, key: str, subvol: Subvol) -> bool:
+    """
+    On a cache hit, makes `subvol` a read-only snapshot of the cached layer,
+    copies its provides manifest, if any, and returns True.
+    """
+    with locked_cache_entry(cache_dir, key) as cached:
+        if cached is not None:
+            subvol.snapshot(cached)
+            subvol.set_readonly(True)
+            cached_manifest = manifest_path(cached)
+            if os.path.exists(cached_manifest):
+                shutil.copyfile(cached_manifest, manifest_path(subvol))
+            log.info(f"Layer cache hit {key} for {subvol.path()}")
+            _bump_stat(cache_dir, "hit")
+            return True
+    log.info(f"Layer cache miss {key} for {subvol.path()}")
+    _bump_stat(cache_dir, "miss")
+    return False
+
+
+def store_cached_layer(cache_dir: Path, key: str, subvol: Subvol) -> None:
+    "Adds the read-only `subvol`, with its provides manifest, to the cache."
+    layers_dir = cache_dir / _LAYERS_DIR
+    os.makedirs(layers_dir, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(dir=layers_dir, prefix=f".tmp-{key}-"))
+    fd = os.open(tmp_dir, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        # Lets the GC know that the entry is still being populated.  The
+        # lock follows the directory when it is renamed.
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        cached = Subvol(tmp_dir / _ENTRY_SUBVOL)
+        cached.snapshot(subvol)
+        cached.set_readonly(True)
+        if os.path.exists(manifest_path(subvol)):
+            shutil.copyfile(manifest_path(subvol), manifest_path(cached))
+        try:
+            os.rename(tmp_dir, layers_dir / key)
+        except OSError:
+            # A concurrent build of the same layer stored it first.
+            if not os.path.exists(layers_dir / key):  # pragma: no cover
+                raise
+            cached.delete()
+            shutil.rmtree(tmp_dir)
+            return
+    finally:
+        os.close(fd)
+    log.info(f"Stored layer {subvol.path()} in the layer cache as {key}")
+    _bump_stat(cache_dir, "store")
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+A "provides manifest" lists every path of a built layer, with its file
+type, so that `gen_subvolume_subtree_provides` need not traverse the
+layer again each time a child layer, or an `image.clone`, needs it.
+
+An entry is `(path, filetype)`, where `path` is image-relative bytes
+without a leading or trailing /, the image root being `b""`, and
+`filetype` is the `%y` letter of `find -printf`.
+
+The manifest of a layer is a file next to its subvolume, in the wrapper
+directory (see `subvolume_garbage_collector.py`), so that it lives
+exactly as long as the subvolume.
+
+## File format
+
+After a magic header, each entry is stored as `filetype + path + b"\\0"`.
+The entries are sorted by their path components, so a subtree is a
+contiguous run of entries, right after its root.  Loading a subtree
+`mmap`s the file, and binary-searches for its root, so that an
+`image.clone` of a small directory from a huge layer reads just a few
+pages.
+
+## Incremental updates
+
+A child layer starts as a snapshot of its parent, so its entries are the
+parent's, changed by the operations of `btrfs send --no-data -p parent
+child`.  `PathTree` applies those operations to the parent's entries.
+`btrfs send` needs a read-only `child`, so this is only done once the
+child is built, to write its manifest.
+Any operation that does not fit the tree (e.g. the parent's manifest is
+stale) raises `PathTreeMismatch`, and the caller should then traverse.
+"""
+import mmap
+import stat
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Type
+
+from antlir.btrfs_diff.send_stream import SendStreamItem, SendStreamItems
+from antlir.fs_utils import Path, populate_temp_file_and_rename
+from antlir.subvol_utils import Subvol
+
+
+_MAGIC = b"antlir-provides-manifest-v1\0"
+
+Entry = Tuple[bytes, str]
+
+
+def manifest_path(subvol: Subvol) -> Path:
+    # Keep in sync with `subvolume_garbage_collector.py`, and with
+    # `SubvolumeOnDisk.from_serializable_dict`.
+    path = subvol.path()
+    return path.dirname() / (b"." + path.basename() + b".provides")
+
+
+def _sort_key(path: bytes) -> List[bytes]:
+    return path.split(b"/")
+
+
+def write_manifest(path: Path, entries: Iterable[Entry]) -> None:
+    "Atomically replaces the manifest at `path`."
+    with populate_temp_file_and_rename(
+        path, overwrite=True, mode="wb"
+    ) as outfile:
+        outfile.write(_MAGIC)
+        for entry_path, filetype in sorted(
+            entries, key=lambda e: _sort_key(e[0])
+        ):
+            assert b"\0" not in entry_path, entry_path
+            outfile.write(filetype.encode() + entry_path + b"\0")
+
+
+def _find_subtree_start(buf, lo: int, key: List[bytes]) -> int:
+    """
+    Returns the offset of the first entry whose path sorts at or after
+    `key`, or `len(buf)`.  `lo` must be the offset of an entry.
+    """
+    hi = len(buf)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        # The first entry starting at or after `mid`
+        start = mid if mid == lo else buf.find(b"\0", mid - 1, hi) + 1
+        if start <= 0 or start >= hi:
+            hi = mid
+            continue
+        end = buf.find(b"\0", start)
+        if _sort_key(buf[start + 1 : end]) < key:
+            lo = end + 1
+        else:
+            hi = start
+    return lo
+
+
+def load_manifest(path: Path, subtree: bytes = b"") -> Optional[List[Entry]]:
+    """
+    Returns the entries of `subtree` and of its descendants, in sorted
+    order, or `None` if there is no manifest at `path`.
+    """
+    try:
+        infile = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with infile, mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        if buf[: len(_MAGIC)] != _MAGIC:
+            raise RuntimeError(f"{path} is not a provides manifest")
+        key = _sort_key(subtree)
+        pos = _find_subtree_start(buf, len(_MAGIC), key)
+        entries = []
+        prefix = subtree + b"/" if subtree else b""
+        while pos < len(buf):
+            end = buf.find(b"\0", pos)
+            entry_path = buf[pos + 1 : end]
+            if entry_path != subtree and not entry_path.startswith(prefix):
+                break
+            entries.append((entry_path, chr(buf[pos])))
+            pos = end + 1
+        return entries
+
+
+class PathTreeMismatch(Exception):
+    pass
+
+
+# `find -printf %y` letters for the items that create an inode
+_ITEM_TO_FILETYPE = {
+    SendStreamItems.mkfile: "f",
+    SendStreamItems.mkdir: "d",
+    SendStreamItems.mkfifo: "p",
+    SendStreamItems.mksock: "s",
+    SendStreamItems.symlink: "l",
+}
+
+
+class PathTree:
+    """
+    A mutable tree of entries.  Like `find ... -prune`, the tree omits
+    `pruned_paths` and their descendants, and ignores the send-stream items
+    that touch them.  `entries` must be sorted.
+    """
+
+    def __init__(
+        self, entries: Iterable[Entry] = (), *, pruned_paths=frozenset()
+    ):
+        self._pruned_paths = frozenset(pruned_paths)
+        # Each directory maps its child names to `[filetype, children]`,
+        # where `children` is `None` unless the child is a directory.
+        self._root: Dict[bytes, List[Any]] = {}
+        dirs = {b"": self._root}
+        for path, filetype in entries:
+            # The root is always a directory
+            if not path or self._is_pruned(path):
+                continue
+            parent, _, name = path.rpartition(b"/")
+            children = {} if filetype == "d" else None
+            # Entries are sorted, so parents come before their children.
+            dirs[parent][name] = [filetype, children]
+            if children is not None:
+                dirs[path] = children
+
+    def _lookup_parent(self, path: bytes) -> Tuple[Dict[bytes, Any], bytes]:
+        "Returns the children of the parent directory of `path`, & its name"
+        children = self._root
+        *dir_names, name = path.split(b"/")
+        for dir_name in dir_names:
+            node = children.get(dir_name)
+            if node is None or node[1] is None:
+                raise PathTreeMismatch(f"No directory for {path}")
+            children = node[1]
+        return children, name
+
+    def _add(self, path: bytes, node: List[Any], *, replace=False) -> None:
+        children, name = self._lookup_parent(path)
+        old_node = children.get(name)
+        if old_node is not None:
+            # Like `rename(2)`: a directory may only replace an empty
+            # directory, and a non-directory, a non-directory.
+            if (
+                not replace
+                or old_node[1]
+                or (old_node[1] is None) != (node[1] is None)
+            ):
+                raise PathTreeMismatch(f"Cannot replace {path}")
+        children[name] = node
+
+    def _is_pruned(self, path: bytes) -> bool:
+        if not self._pruned_paths:
+            return False
+        parts = path.split(b"/")
+        return any(
+            b"/".join(parts[:i]) in self._pruned_paths
+            for i in range(1, len(parts) + 1)
+        )
+
+    def _remove(self, path: bytes) -> List[Any]:
+        children, name = self._lookup_parent(path)
+        node = children.pop(name, None)
+        if node is None:
+            raise PathTreeMismatch(f"{path} does not exist")
+        return node
+
+    def apply_fields(
+        self, item_type: Type[SendStreamItem], fields: Tuple[Any, ...]
+    ) -> None:
+        """
+        Applies a send-stream item, in the form of `parse_send_stream_fields`.
+        Items that do not change paths or file types are no-ops.
+        """
+        si = SendStreamItems
+        if item_type in (si.rename, si.link):
+            path, dest = fields[:2]
+            # `rename` & `link` make `dest` & `path`, respectively
+            new, old = (dest, path) if item_type is si.rename else (path, dest)
+            if self._is_pruned(new):
+                if item_type is si.rename and not self._is_pruned(old):
+                    self._remove(old)  # Moved out of sight
+                return
+            if self._is_pruned(old):
+                raise PathTreeMismatch(f"{new} comes from pruned {old}")
+        elif self._is_pruned(fields[0]):
+            return
+        filetype = _ITEM_TO_FILETYPE.get(item_type)
+        if filetype is not None:
+            self._add(fields[0], [filetype, {} if filetype == "d" else None])
+        elif item_type is si.mknod:
+            filetype = "b" if stat.S_ISBLK(fields[1]) else "c"
+            self._add(fields[0], [filetype, None])
+        elif item_type is si.rename:
+            if fields[0] != fields[1]:
+                node = self._remove(fields[0])
+                self._add(fields[1], node, replace=True)
+        elif item_type is si.link:
+            # See `SendStreamItems.link` -- `dest` is the existing path.
+            children, name = self._lookup_parent(fields[1])
+            if name not in children or children[name][1] is not None:
+                raise PathTreeMismatch(f"Cannot hardlink {fields[1]}")
+            self._add(fields[0], [children[name][0], None])
+        elif item_type is si.unlink:
+            if self._remove(fields[0])[1] is not None:
+                raise PathTreeMismatch(f"Cannot unlink dir {fields[0]}")
+        elif item_type is si.rmdir:
+            if self._remove(fields[0])[1] != {}:
+                raise PathTreeMismatch(f"Cannot rmdir {fields[0]}")
+
+    def gen_entries(self) -> Iterator[Entry]:
+        "Yields the entries in sorted order."
+        stack = [(b"", "d", self._root)]
+        while stack:
+            path, filetype, children = stack.pop()
+            yield path, filetype
+            if children:
+                prefix = path + b"/" if path else b""
+                # Reversed, so that we pop the first child first.
+                for name in sorted(children, reverse=True):
+                    stack.append((prefix + name, *children[name]))
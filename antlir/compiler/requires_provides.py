@@ -51,11 +51,16 @@ from enum import Enum, auto
 def _normalize_path(path: str) -> str:
     # Normalize paths as image-absolute. This is crucial since we
     # will use `path` as a dictionary key.
-    return os.path.normpath(
-        # The `lstrip` is needed because `normpath does not
-        # normalize away leading slashes: //b/c
-        os.path.join("/", path.lstrip("/"))
-    )
+    #
+    # The `lstrip` is needed because `normpath does not
+    # normalize away leading slashes: //b/c
+    path = "/" + path.lstrip("/")
+    # Layers can have 100k+ paths, and most are already normal, so skip
+    # the comparatively slow `normpath` unless it would change something.
+    check = path + "/"
+    if "//" in check or "/./" in check or "/../" in check:
+        return os.path.normpath(path)
+    return path
 
 
 class _Predicate(Enum):
@@ -144,7 +144,14 @@ class SubvolumeOnDisk(
                 "Subvolume must have the form <rule name>:<version>/<subvol>,"
                 f" not {d[_SUBVOLUME_REL_PATH]}"
             )
-        outer_dir_content = os.listdir(os.path.join(subvolumes_dir, outer_dir))
+        outer_dir_content = [
+            # The GC also deletes the subvol's `provides_manifest.py` file,
+            # and its `layer_cache.py` key.
+            name
+            for name in os.listdir(os.path.join(subvolumes_dir, outer_dir))
+            if name
+            not in (f".{inner_dir}.provides", f".{inner_dir}.layer-cache-key")
+        ]
         # For GC, the wrapper must contain the subvolume, and nothing else.
         if outer_dir_content != [inner_dir]:
             raise RuntimeError(
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Measures how `ValidatedReqsProvs` and `DependencyGraph` scale with the
+number of items in a layer.  This is a development tool, not a test:
+
+  buck run antlir/compiler:benchmark-dep-graph -- --files 500000
+
+The synthetic layer is a directory tree, `--files-per-dir` files in each
+leaf directory, where every item requires its parent directory -- like
+`install_files` into `image.mkdir`s.  The root directory is provided by
+the item that stands in for `PhasesProvideItem`, so no subvolume is needed.
+"""
+import argparse
+import os
+import time
+from dataclasses import dataclass
+
+from antlir.compiler.items.common import ImageItem
+
+from ..dep_graph import DependencyGraph, ValidatedReqsProvs
+from ..requires_provides import (
+    ProvidesDirectory,
+    ProvidesFile,
+    require_directory,
+)
+
+
+@dataclass(init=False, frozen=True)
+class _RootItem(ImageItem):
+    def provides(self):
+        yield ProvidesDirectory(path="/")
+
+    def requires(self):
+        return ()
+
+
+@dataclass(init=False, frozen=True)
+class _DirItem(ImageItem):
+    path: str
+
+    def provides(self):
+        yield ProvidesDirectory(path=self.path)
+
+    def requires(self):
+        yield require_directory(os.path.dirname(self.path))
+
+
+@dataclass(init=False, frozen=True)
+class _FileItem(ImageItem):
+    path: str
+
+    def provides(self):
+        yield ProvidesFile(path=self.path)
+
+    def requires(self):
+        yield require_directory(os.path.dirname(self.path))
+
+
+def _make_items(num_files: int, files_per_dir: int):
+    items = []
+    num_dirs = -(-num_files // files_per_dir)
+    for d in range(num_dirs):
+        # Two levels, so that directories also depend on directories.
+        if d % 100 == 0:
+            items.append(_DirItem(from_target="t", path=f"/top{d // 100}"))
+        items.append(_DirItem(from_target="t", path=f"/top{d // 100}/d{d}"))
+    for f in range(num_files):
+        d = f // files_per_dir
+        items.append(
+            _FileItem(from_target="t", path=f"/top{d // 100}/d{d}/f{f}")
+        )
+    return items
+
+
+def _main():
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    p.add_argument("--files", type=int, default=500000)
+    p.add_argument("--files-per-dir", type=int, default=100)
+    args = p.parse_args()
+
+    items = _make_items(args.files, args.files_per_dir)
+    root = _RootItem(from_target="t")
+    print(f"{len(items)} items")
+
+    start = time.perf_counter()
+    ValidatedReqsProvs([root, *items])
+    print(f"  {'validate':<10} {time.perf_counter() - start:8.2f} s")
+
+    start = time.perf_counter()
+    dg = DependencyGraph(items, layer_target="t")
+    num_ordered = sum(1 for _ in dg.gen_dependency_order_items(root))
+    assert num_ordered == len(items), (num_ordered, len(items))
+    print(f"  {'graph':<10} {time.perf_counter() - start:8.2f} s")
+
+
+if __name__ == "__main__":
+    _main()
@@ -15,6 +15,7 @@ from contextlib import contextmanager
 
 from antlir import subvol_utils
 from antlir.compiler.items import make_dirs, rpm_action, symlink, tarball
+from antlir.compiler.items.install_file import InstallFileItem
 from antlir.find_built_subvol import subvolumes_dir
 from antlir.fs_utils import Path, temp_dir
 from antlir.nspawn_in_subvol import ba_runner
@@ -24,6 +25,7 @@ from antlir.tests.temp_subvolumes import TempSubvolumes
 
 from .. import subvolume_on_disk as svod
 from ..compiler import LayerOpts, build_image, parse_args
+from ..incremental_build import IncrementalPlan
 from . import sample_items as si
 
 
@@ -67,6 +69,17 @@ def _subvol_mock_lexists_is_btrfs_and_run_as_root(fn):
     return fn
 
 
+def _build_items_one_by_one(cls, items, subvol, layer_opts):
+    """
+    `_expected_run_as_root_calls` builds each item separately, so undo the
+    batching of e.g. `InstallFileItem.build_batch` to get the same commands.
+    `test_install_file.py` and `test_dirs_and_symlinks.py` check that
+    batching gives the same result.
+    """
+    for item in items:
+        item.build(subvol, layer_opts)
+
+
 def _run_as_root(args, **kwargs):
     """
     DependencyGraph adds a PhasesProvideItem to traverse the subvolume, as
@@ -142,6 +155,17 @@ class CompilerTestCase(unittest.TestCase):
 
     @_subvol_mock_lexists_is_btrfs_and_run_as_root
     @unittest.mock.patch.object(svod, "_btrfs_get_volume_props")
+    @unittest.mock.patch.object(
+        InstallFileItem, "build_batch", classmethod(_build_items_one_by_one)
+    )
+    @unittest.mock.patch.object(
+        make_dirs.MakeDirsItem,
+        "build_batch",
+        classmethod(_build_items_one_by_one),
+    )
+    @unittest.mock.patch.object(
+        symlink.SymlinkBase, "build_batch", classmethod(_build_items_one_by_one)
+    )
     def _compile(
         self,
         args,
@@ -197,7 +221,9 @@ class CompilerTestCase(unittest.TestCase):
         ):
             self._compile([])
 
-    def _compiler_run_as_root_calls(self, *, parent_feature_json, parent_dep):
+    def _compiler_run_as_root_calls(
+        self, *, parent_feature_json, parent_dep, extra_args=()
+    ):
         """
         Invoke the compiler on the targets from the "sample_items" test
         example, and ensure that the commands that the compiler would run
@@ -212,6 +238,7 @@ class CompilerTestCase(unittest.TestCase):
         """
         res, run_as_root_calls = self._compile(
             [
+                *extra_args,
                 *parent_feature_json,
                 "--child-dependencies",
                 *itertools.chain.from_iterable(si.TARGET_TO_PATH.items()),
@@ -332,6 +359,261 @@ class CompilerTestCase(unittest.TestCase):
             ),
         )
 
+        # The same commands run when items are built in parallel
+        self._assert_equal_call_sets(
+            expected_calls,
+            self._compiler_run_as_root_calls(
+                parent_feature_json=[],
+                parent_dep=[],
+                extra_args=["--build-jobs=4"],
+            ),
+        )
+
+        # `run_as_root` is mocked, so a real helper would not change the
+        # commands, just how they reach `root`.
+        with unittest.mock.patch(
+            "antlir.compiler.compiler.privileged_helper"
+        ) as privileged_helper:
+            self._assert_equal_call_sets(
+                expected_calls,
+                self._compiler_run_as_root_calls(
+                    parent_feature_json=[],
+                    parent_dep=[],
+                    extra_args=["--privileged-helper"],
+                ),
+            )
+        privileged_helper.assert_called_once_with()
+
+        # `test_phases_provide.py` covers `write_provides_manifest`.
+        with unittest.mock.patch(
+            "antlir.compiler.compiler.write_provides_manifest"
+        ) as write_provides_manifest:
+            self._assert_equal_call_sets(
+                expected_calls,
+                self._compiler_run_as_root_calls(
+                    parent_feature_json=[],
+                    parent_dep=[],
+                    extra_args=["--write-provides-manifest"],
+                ),
+            )
+        ((subvol, parent_layer), _kwargs) = write_provides_manifest.call_args
+        self.assertEqual(
+            f"{_SUBVOLS_DIR}/{_FAKE_SUBVOL}".encode(), subvol.path()
+        )
+        self.assertIsNone(parent_layer)
+
+        # `test_layer_cache.py` covers the cache itself.
+        with temp_dir() as cache_dir, unittest.mock.patch(
+            "antlir.compiler.compiler.layer_cache_key", return_value="key"
+        ) as layer_cache_key, unittest.mock.patch(
+            "antlir.compiler.compiler.restore_cached_layer", return_value=False
+        ) as restore_cached_layer, unittest.mock.patch(
+            "antlir.compiler.compiler.store_cached_layer"
+        ) as store_cached_layer, unittest.mock.patch(
+            "antlir.compiler.compiler.write_key"
+        ) as write_key, unittest.mock.patch(
+            "antlir.compiler.compiler.write_provides_manifest"
+        ) as write_provides_manifest:
+            layer_cache_args = ["--layer-cache", f"--cache-dir={cache_dir}"]
+            # A miss builds the layer, and stores it.
+            self._assert_equal_call_sets(
+                expected_calls,
+                self._compiler_run_as_root_calls(
+                    parent_feature_json=[],
+                    parent_dep=[],
+                    extra_args=layer_cache_args,
+                ),
+            )
+            self.assertEqual(
+                "CHILD_TARGET",
+                layer_cache_key.call_args[1]["layer_opts"].layer_target,
+            )
+            ((_, key, subvol), _kwargs) = restore_cached_layer.call_args
+            self.assertEqual("key", key)
+            self.assertEqual(
+                f"{_SUBVOLS_DIR}/{_FAKE_SUBVOL}".encode(), subvol.path()
+            )
+            store_cached_layer.assert_called_once_with(cache_dir, "key", subvol)
+            write_key.assert_called_once_with(subvol, "key")
+
+            # A hit runs no commands, but still writes the manifest.
+            restore_cached_layer.return_value = True
+            store_cached_layer.reset_mock()
+            self.assertEqual(
+                [],
+                self._compiler_run_as_root_calls(
+                    parent_feature_json=[],
+                    parent_dep=[],
+                    extra_args=[
+                        *layer_cache_args,
+                        "--write-provides-manifest",
+                    ],
+                ),
+            )
+            store_cached_layer.assert_not_called()
+            ((hit_subvol, parent_layer), _kwargs) = (
+                write_provides_manifest.call_args
+            )
+            self.assertEqual(subvol.path(), hit_subvol.path())
+            self.assertIsNone(parent_layer)
+            self.assertEqual(2, write_key.call_count)
+
+        # `test_incremental_build.py` covers the planning.
+        with temp_dir() as cache_dir, unittest.mock.patch(
+            "antlir.compiler.compiler.layer_cache_key", return_value="key"
+        ), unittest.mock.patch(
+            "antlir.compiler.compiler.restore_cached_layer", return_value=False
+        ), unittest.mock.patch(
+            "antlir.compiler.compiler.store_cached_layer"
+        ) as store_cached_layer, unittest.mock.patch(
+            "antlir.compiler.compiler.write_key"
+        ) as write_key, unittest.mock.patch(
+            "antlir.compiler.compiler.plan_incremental_build",
+            return_value=None,
+        ) as plan_incremental_build, unittest.mock.patch(
+            "antlir.compiler.compiler.locked_cache_entry"
+        ) as locked_cache_entry, unittest.mock.patch(
+            "antlir.compiler.compiler.save_record"
+        ) as save_record:
+            incremental_args = [
+                "--incremental",
+                "--layer-cache",
+                f"--cache-dir={cache_dir}",
+            ]
+
+            def incremental_calls():
+                return self._compiler_run_as_root_calls(
+                    parent_feature_json=[],
+                    parent_dep=[],
+                    extra_args=incremental_args,
+                )
+
+            # Without a plan, this is a full build, which is recorded.
+            self._assert_equal_call_sets(expected_calls, incremental_calls())
+            plan_kwargs = plan_incremental_build.call_args[1]
+            self.assertEqual("CHILD_TARGET", plan_kwargs["layer_target"])
+            self.assertEqual(
+                "CHILD_TARGET", plan_kwargs["context"]["layer_target"]
+            )
+            record_kwargs = save_record.call_args[1]
+            self.assertEqual("key", record_kwargs["layer_cache_key"])
+            self.assertEqual(plan_kwargs["context"], record_kwargs["context"])
+            self.assertEqual(
+                [e for e, _ in plan_kwargs["entries_and_items"]],
+                record_kwargs["entries"],
+            )
+            self.assertEqual(
+                {True, False}, {e.is_phase for e in record_kwargs["entries"]}
+            )
+
+            # With a plan, we snapshot the previous build, remove paths, and
+            # build just the added items.
+            plan_incremental_build.return_value = IncrementalPlan(
+                base_key="base", remove_paths=["removed"], added_items=[]
+            )
+            locked_cache_entry.return_value.__enter__.return_value = (
+                subvol_utils.Subvol("/fake/base")
+            )
+            subvol_path = f"{_SUBVOLS_DIR}/{_FAKE_SUBVOL}".encode()
+            snapshot_calls = [
+                (
+                    (["test", "!", "-e", subvol_path],),
+                    {"_subvol_exists": False},
+                ),
+                (
+                    (
+                        [
+                            "btrfs",
+                            "subvolume",
+                            "snapshot",
+                            b"/fake/base",
+                            subvol_path,
+                        ],
+                    ),
+                    {"_subvol_exists": False},
+                ),
+            ]
+            self._assert_equal_call_sets(
+                [
+                    *snapshot_calls,
+                    (
+                        (
+                            [
+                                "xargs",
+                                "--null",
+                                "rm",
+                                "--one-file-system",
+                                "--recursive",
+                                "--",
+                            ],
+                        ),
+                        {"input": subvol_path + b"/removed\0"},
+                    ),
+                    ((_FIND_ARGS,), {"stdout": subprocess.PIPE}),
+                    (
+                        (
+                            [
+                                "btrfs",
+                                "property",
+                                "set",
+                                "-ts",
+                                subvol_path,
+                                "ro",
+                                "true",
+                            ],
+                        ),
+                    ),
+                ],
+                incremental_calls(),
+            )
+            locked_cache_entry.assert_called_with(cache_dir, "base")
+            # The result is kept apart from full builds.
+            self.assertEqual(
+                "incremental-key", store_cached_layer.call_args[0][1]
+            )
+            self.assertEqual("incremental-key", write_key.call_args[0][1])
+            self.assertEqual(
+                "incremental-key", save_record.call_args[1]["layer_cache_key"]
+            )
+
+            # If the incremental build fails, we redo it from scratch.
+            with unittest.mock.patch(
+                "antlir.compiler.compiler.remove_paths",
+                side_effect=RuntimeError("fake failure"),
+            ):
+                self._assert_equal_call_sets(
+                    [
+                        *snapshot_calls,
+                        ((["btrfs", "subvolume", "delete", subvol_path],), {}),
+                        *expected_calls,
+                    ],
+                    incremental_calls(),
+                )
+
+            # The previous build may have been evicted from the cache.
+            locked_cache_entry.return_value.__enter__.return_value = None
+            self._assert_equal_call_sets(expected_calls, incremental_calls())
+
+        with self.assertRaises(SystemExit):
+            parse_args(
+                [
+                    "--subvolumes-dir=x",
+                    "--subvolume-rel-path=y",
+                    "--child-layer-target=z",
+                    "--layer-cache",
+                ]
+            )
+        with self.assertRaises(SystemExit):
+            parse_args(
+                [
+                    "--subvolumes-dir=x",
+                    "--subvolume-rel-path=y",
+                    "--child-layer-target=z",
+                    "--cache-dir=w",
+                    "--incremental",
+                ]
+            )
+
         # Now, add an empty parent layer
         with TempSubvolumes(sys.argv[0]) as temp_subvolumes:
             parent = temp_subvolumes.create("parent")
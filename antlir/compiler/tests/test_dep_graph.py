@@ -4,6 +4,7 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import collections
 import sys
 import unittest
 from dataclasses import dataclass
@@ -19,6 +20,7 @@ from antlir.compiler.items.remove_path import RemovePathItem
 from antlir.tests.temp_subvolumes import TempSubvolumes
 
 from ..dep_graph import (
+    _pop_batch,
     DependencyGraph,
     ItemProv,
     ItemReq,
@@ -297,6 +299,82 @@ class DependencyOrderItemsTestCase(unittest.TestCase):
                 },
             )
 
+    def test_build_dependency_order_items(self):
+        with TempSubvolumes(sys.argv[0]) as temp_subvolumes:
+            subvol = temp_subvolumes.create("subvol")
+            for jobs in [1, 3]:
+                built = []
+                DependencyGraph(
+                    PATH_TO_ITEM.values(), layer_target="t-72"
+                ).build_dependency_order_items(
+                    PhasesProvideItem(from_target="t", subvol=subvol),
+                    built.extend,
+                    jobs=jobs,
+                )
+                self.assertIn(
+                    tuple(built),
+                    {
+                        tuple(PATH_TO_ITEM[p] for p in paths)
+                        for paths in [
+                            ["/a/b/c", "/a/b/c/F", "/a/d/e", "/a/d/e/G"],
+                            ["/a/b/c", "/a/d/e", "/a/b/c/F", "/a/d/e/G"],
+                            ["/a/b/c", "/a/d/e", "/a/d/e/G", "/a/b/c/F"],
+                        ]
+                    },
+                )
+
+            # After a failure, no more items are started.
+            built = []
+
+            def build_items(items):
+                if PATH_TO_ITEM["/a/d/e"] in items:
+                    raise RuntimeError("kaboom")
+                built.extend(items)
+
+            with self.assertRaisesRegex(RuntimeError, "^kaboom$"):
+                DependencyGraph(
+                    PATH_TO_ITEM.values(), layer_target="t-72"
+                ).build_dependency_order_items(
+                    PhasesProvideItem(from_target="t", subvol=subvol),
+                    build_items,
+                    jobs=3,
+                )
+            self.assertNotIn(PATH_TO_ITEM["/a/d/e/G"], built)
+
+    def test_pop_batch(self):
+        class Batchable:
+            @classmethod
+            def build_batch(cls, items, subvol, layer_opts):
+                pass  # pragma: no cover
+
+        b1, b2, b3, b4, b5 = (Batchable() for _ in range(5))
+        o1, o2 = object(), object()
+        ready = collections.deque([o1, b1, b2, o2, b3, b4, b5])
+        self.assertEqual([o1], _pop_batch(ready, 2))
+        # The batch takes half of the 5 items, leaving the rest for the
+        # other job.
+        self.assertEqual([b1, b2, b3], _pop_batch(ready, 2))
+        self.assertEqual([o2, b4, b5], list(ready))
+        self.assertEqual([o2], _pop_batch(ready, 1))
+        self.assertEqual([b4, b5], _pop_batch(ready, 1))
+        ready.append(b1)
+        self.assertEqual([b1], _pop_batch(ready, 1))
+        self.assertEqual(0, len(ready))
+
+        # Types with the same `build_batch` function share batches.
+        class AlsoBatchable:
+            build_batch = Batchable.__dict__["build_batch"]
+
+        class OtherBatchable:
+            @classmethod
+            def build_batch(cls, items, subvol, layer_opts):
+                pass  # pragma: no cover
+
+        a1, a2, c1 = AlsoBatchable(), AlsoBatchable(), OtherBatchable()
+        ready.extend([b1, a1, c1, b2, a2])
+        self.assertEqual([b1, a1, b2, a2], _pop_batch(ready, 1))
+        self.assertEqual([c1], list(ready))
+
     def test_cycle_detection(self):
         def requires_provides_directory_class(requires_dir, provides_dir):
             @dataclass(init=False, frozen=True)
@@ -336,6 +414,10 @@ class DependencyOrderItemsTestCase(unittest.TestCase):
             )
             with self.assertRaisesRegex(AssertionError, "^Cycle in "):
                 list(dg_bad.gen_dependency_order_items(provides_root))
+            with self.assertRaisesRegex(AssertionError, "^Cycle in "):
+                dg_bad.build_dependency_order_items(
+                    provides_root, lambda _items: None, jobs=2
+                )
 
     def test_phase_order(self):
         class FakeRemovePaths:
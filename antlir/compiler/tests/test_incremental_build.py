@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import sys
+import unittest
+
+from antlir.fs_utils import temp_dir
+from antlir.tests.temp_subvolumes import TempSubvolumes
+
+from ..incremental_build import (
+    IncrementalPlan,
+    ItemEntry,
+    gen_item_entries,
+    plan_incremental_build,
+    remove_paths,
+    save_record,
+)
+from ..items.make_dirs import MakeDirsItem
+from ..items.remove_path import RemovePathItem
+from ..items.tests.common import DUMMY_LAYER_OPTS
+
+
+def _entry(fingerprint, **kwargs):
+    return ItemEntry(
+        **{
+            "fingerprint": fingerprint,
+            "is_phase": False,
+            "requires": [],
+            "provides": [],
+            "remove_path": None,
+            **kwargs,
+        }
+    )
+
+
+class IncrementalBuildTestCase(unittest.TestCase):
+    def test_gen_item_entries(self):
+        with temp_dir() as td:
+            (td / "src").touch()
+            (td / "moved_src").touch()
+            features = [
+                {
+                    "target": "//fake:outer",
+                    "remove_paths": [
+                        {"path": "/gone", "action": "if_exists"}
+                    ],
+                    "install_files": [
+                        {
+                            "dest": "/a/b/file",
+                            "source": {
+                                "source": {"__BUCK_TARGET": "//fake:src"}
+                            },
+                        }
+                    ],
+                    "features": [
+                        {
+                            "target": "//fake:inner",
+                            "make_dirs": [
+                                {"into_dir": "/a", "path_to_make": "b/c"}
+                            ],
+                        }
+                    ],
+                }
+            ]
+
+            def entries_and_items(src="src", identity="src identity"):
+                return list(
+                    gen_item_entries(
+                        exit_stack=None,  # No `generator`s here
+                        features=features,
+                        layer_opts=DUMMY_LAYER_OPTS._replace(
+                            target_to_path={"//fake:src": td / src},
+                            subvolumes_dir="/fake/subvolumes",
+                        ),
+                        identities={"__BUCK_TARGET://fake:src": identity},
+                    )
+                )
+
+            res = entries_and_items()
+            self.assertEqual(
+                [
+                    [
+                        MakeDirsItem(
+                            from_target="//fake:inner",
+                            into_dir="/a",
+                            path_to_make="b/c",
+                        )
+                    ],
+                    [
+                        RemovePathItem(
+                            from_target="//fake:outer",
+                            path="/gone",
+                            action="if_exists",
+                        )
+                    ],
+                ],
+                [items for _, items in res[:2]],
+            )
+            make_dirs, remove, install = [e for e, _ in res]
+            self.assertEqual(
+                _entry(
+                    make_dirs.fingerprint,
+                    requires=["/a"],
+                    provides=["/a/b", "/a/b/c"],
+                    remove_path="a/b",
+                ),
+                make_dirs,
+            )
+            self.assertEqual(
+                _entry(remove.fingerprint, is_phase=True), remove
+            )
+            self.assertEqual(
+                _entry(
+                    install.fingerprint,
+                    requires=["/a/b"],
+                    provides=["/a/b/file"],
+                    remove_path="a/b/file",
+                ),
+                install,
+            )
+            self.assertEqual(
+                3, len({e.fingerprint for e in (make_dirs, remove, install)})
+            )
+
+            # The Buck output path is not part of the fingerprint...
+            self.assertEqual(
+                [e for e, _ in res],
+                [e for e, _ in entries_and_items(src="moved_src")],
+            )
+            # ... but the identity of the target is.
+            new_make_dirs, new_remove, new_install = [
+                e for e, _ in entries_and_items(identity="new identity")
+            ]
+            self.assertEqual((make_dirs, remove), (new_make_dirs, new_remove))
+            self.assertNotEqual(install.fingerprint, new_install.fingerprint)
+
+    def test_plan(self):
+        with temp_dir() as td:
+
+            def plan(entries, context=None):
+                return plan_incremental_build(
+                    cache_dir=td,
+                    layer_target="//fake:layer",
+                    context=context or {"ctx": 1},
+                    entries_and_items=[
+                        (e, [f"item {e.fingerprint}"]) for e in entries
+                    ],
+                )
+
+            phase = _entry("phase", is_phase=True)
+            dir_a = _entry("dir a", provides=["/a"], remove_path="a")
+            file_b = _entry(
+                "file b", requires=["/a"], provides=["/a/b"], remove_path="a/b"
+            )
+            mount = _entry("mount", requires=["/"], provides=["/m"])
+            old_entries = [phase, dir_a, file_b, mount]
+
+            self.assertIsNone(plan(old_entries))  # No record yet
+            save_record(
+                cache_dir=td,
+                layer_target="//fake:layer",
+                context={"ctx": 1},
+                layer_cache_key="old key",
+                entries=old_entries,
+            )
+            # Just the record, without a leftover temporary file
+            self.assertEqual(1, len((td / "incremental").listdir()))
+            # Records are per target
+            self.assertIsNone(
+                plan_incremental_build(
+                    cache_dir=td,
+                    layer_target="//other:layer",
+                    context={"ctx": 1},
+                    entries_and_items=[],
+                )
+            )
+            self.assertIsNone(plan(old_entries, context={"ctx": 2}))
+
+            self.assertEqual(
+                IncrementalPlan(
+                    base_key="old key", remove_paths=[], added_items=[]
+                ),
+                plan(old_entries),
+            )
+            new_file = _entry("new file", requires=["/a"], remove_path="a/c")
+            self.assertEqual(
+                IncrementalPlan(
+                    base_key="old key",
+                    remove_paths=["a/b"],
+                    added_items=["item new file"],
+                ),
+                plan([phase, dir_a, mount, new_file]),
+            )
+            # Inner paths are removed first.
+            self.assertEqual(
+                IncrementalPlan(
+                    base_key="old key",
+                    remove_paths=["a/b", "a"],
+                    added_items=[],
+                ),
+                plan([phase, mount]),
+            )
+
+            # Changed phases need a full build.
+            self.assertIsNone(plan([dir_a, file_b, mount]))
+            self.assertIsNone(
+                plan([_entry("phase 2", is_phase=True), dir_a, file_b, mount])
+            )
+            # So does an item that cannot be undone...
+            self.assertIsNone(plan([phase, dir_a, file_b]))
+            # ... or one whose paths are required by an unchanged item.
+            self.assertIsNone(plan([phase, file_b, mount]))
+
+    def test_remove_paths(self):
+        with TempSubvolumes(sys.argv[0]) as temp_subvols:
+            subvol = temp_subvols.create("subvol")
+            subvol.run_as_root(["mkdir", "-p", subvol.path("a/b/c")])
+            subvol.run_as_root(["touch", subvol.path("a/b/c/d")])
+            subvol.run_as_root(["touch", subvol.path("a/e")])
+            subvol.run_as_root(["ln", "-s", "a/b", subvol.path("link")])
+            remove_paths(subvol, [])
+            remove_paths(subvol, ["link", "a/b/c/d", "a/b"])
+            self.assertEqual([b"a"], subvol.path().listdir())
+            self.assertEqual([b"e"], subvol.path("a").listdir())
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import fcntl
+import json
+import os
+import subprocess
+import sys
+import time
+import unittest
+import unittest.mock
+
+from antlir.fs_utils import Path, temp_dir
+from antlir.rpm.yum_dnf_conf import YumDnf
+from antlir.subvol_utils import Subvol
+from antlir.tests.temp_subvolumes import TempSubvolumes
+
+from .. import layer_cache
+from ..items.tests.common import DUMMY_LAYER_OPTS
+from ..layer_cache import (
+    key_path,
+    layer_cache_key,
+    layer_cache_stats,
+    restore_cached_layer,
+    store_cached_layer,
+    write_key,
+)
+from ..provides_manifest import manifest_path
+
+
+class LayerCacheTestCase(unittest.TestCase):
+    def test_key(self):
+        with temp_dir() as td:
+            os.makedirs(td / "src/dir")
+            (td / "src/dir/file").touch()
+            os.symlink("dir/file", td / "src/link")
+            os.makedirs(td / "subvols/parent:1")
+            os.makedirs(td / "parent")
+            with open(td / "parent/layer.json", "w") as f:
+                json.dump({"subvolume_rel_path": "parent:1/volume"}, f)
+            features = [
+                {
+                    "target": "//fake:feature",
+                    "install_files": [
+                        {"source": {"source": {"__BUCK_TARGET": "//fake:src"}}}
+                    ],
+                    "parent_layer": [
+                        {"subvol": {"__BUCK_LAYER_TARGET": "//fake:parent"}}
+                    ],
+                }
+            ]
+
+            def key(features=features, ba=None, **kwargs):
+                return layer_cache_key(
+                    features=features,
+                    layer_opts=DUMMY_LAYER_OPTS._replace(
+                        **{
+                            "target_to_path": {
+                                "//fake:src": td / "src",
+                                "//fake:parent": td / "parent",
+                            },
+                            "subvolumes_dir": td / "subvols",
+                            **kwargs,
+                        }
+                    ),
+                    build_appliance_buck_out=ba,
+                )
+
+            k = key()
+            self.assertEqual(k, key())
+            # The Buck output paths are not part of the key...
+            os.rename(td / "src", td / "moved_src")
+            self.assertEqual(
+                k,
+                key(
+                    target_to_path={
+                        "//fake:src": td / "moved_src",
+                        "//fake:parent": td / "parent",
+                    }
+                ),
+            )
+            os.rename(td / "moved_src", td / "src")
+
+            # ... but every input is.
+            seen_keys = {k}
+
+            def assert_new_key(new_key):
+                self.assertNotIn(new_key, seen_keys)
+                seen_keys.add(new_key)
+
+            assert_new_key(key(features=[{**features[0], "target": "//x:y"}]))
+            assert_new_key(key(layer_target="//other:layer"))
+            assert_new_key(key(rpm_installer=YumDnf.dnf))
+            assert_new_key(
+                key(rpm_installer=YumDnf.dnf, rpm_repo_snapshot=Path("/snap"))
+            )
+            assert_new_key(key(artifacts_may_require_repo=False))
+            assert_new_key(key(allowed_host_mount_targets=frozenset(["//h"])))
+            assert_new_key(key(ba=td / "parent"))
+            # A change to the compiler's code is a new key, too.
+            self.assertRegex(layer_cache.compiler_identity(), "^[0-9a-f]{64}$")
+            with unittest.mock.patch.object(
+                layer_cache, "compiler_identity", return_value="new compiler"
+            ):
+                assert_new_key(key())
+
+            with open(td / "src/dir/file", "w") as f:
+                f.write("new content")
+            assert_new_key(key())
+            os.chmod(td / "src/dir/file", 0o755)
+            assert_new_key(key())
+            os.unlink(td / "src/link")
+            os.symlink("dir", td / "src/link")
+            assert_new_key(key())
+
+            # A parent built without the cache is identified by its JSON...
+            with open(td / "parent/layer.json", "w") as f:
+                json.dump({"subvolume_rel_path": "parent:1/volume", "x": 1}, f)
+            assert_new_key(key())
+            # ... and one built with the cache, by its key.
+            key_file = td / "subvols/parent:1/.volume.layer-cache-key"
+            with open(key_file, "w") as f:
+                f.write("parent key")
+            assert_new_key(key())
+            with open(td / "parent/layer.json", "w") as f:
+                json.dump({"subvolume_rel_path": "parent:1/volume", "x": 2}, f)
+            self.assertIn(key(), seen_keys)
+
+    def test_key_reuses_content_hashes(self):
+        with temp_dir() as td:
+            with open(td / "src", "w") as f:
+                f.write("content")
+            features = [
+                {
+                    "target": "//fake:feature",
+                    "install_files": [
+                        {"source": {"source": {"__BUCK_TARGET": "//fake:src"}}}
+                    ],
+                }
+            ]
+
+            def key():
+                return layer_cache_key(
+                    features=features,
+                    layer_opts=DUMMY_LAYER_OPTS._replace(
+                        target_to_path={"//fake:src": td / "src"},
+                        cache_dir=td / "cache",
+                    ),
+                    build_appliance_buck_out=None,
+                )
+
+            k = key()
+            # Like `hash_path`, only cache the hashes of older files.
+            with unittest.mock.patch.object(
+                time, "time_ns", return_value=time.time_ns() + 10 ** 10
+            ):
+                self.assertEqual(k, key())
+                (hash_dir,) = (td / "cache").listdir()
+                (cache_name,) = (td / "cache" / hash_dir).listdir()
+                # Prove that the cached content hash is reused.
+                with open(td / "cache" / hash_dir / cache_name, "w") as f:
+                    f.write("cached")
+                self.assertNotEqual(k, key())
+
+    def test_stats(self):
+        with temp_dir() as td:
+            self.assertEqual(
+                {"hit": 0, "miss": 0, "store": 0}, layer_cache_stats(td)
+            )
+            subvol = Subvol(td / "subvol")
+            self.assertFalse(restore_cached_layer(td, "no_such_key", subvol))
+            self.assertFalse(restore_cached_layer(td, "no_such_key", subvol))
+            # An entry that the GC is evicting is also a miss.
+            os.mkdir(td / "layers/locked_key")
+            fd = os.open(td / "layers/locked_key", os.O_RDONLY)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                self.assertFalse(
+                    restore_cached_layer(td, "locked_key", subvol)
+                )
+            finally:
+                os.close(fd)
+            self.assertEqual(
+                {"hit": 0, "miss": 3, "store": 0}, layer_cache_stats(td)
+            )
+
+    def test_store_and_restore(self):
+        with TempSubvolumes(sys.argv[0]) as temp_subvols:
+            cache_dir = temp_subvols._temp_dir / "cache"
+            layer = temp_subvols.create("layer:1/volume")
+            layer.run_as_root(["touch", layer.path("hello")])
+            layer.set_readonly(True)
+            with open(manifest_path(layer), "w") as f:
+                f.write("fake manifest")
+            write_key(layer, "the_key")
+            with open(key_path(layer)) as f:
+                self.assertEqual("the_key", f.read())
+
+            store_cached_layer(cache_dir, "the_key", layer)
+            temp_subvols.external_command_will_create(
+                "cache/layers/the_key/layer"
+            )
+            # A concurrent build got there first, so this is a no-op.
+            store_cached_layer(cache_dir, "the_key", layer)
+            self.assertEqual(
+                [b"the_key"],
+                [
+                    p
+                    for p in (cache_dir / "layers").listdir()
+                    if p != b"stats.json"
+                ],
+            )
+
+            child = temp_subvols.caller_will_create("child:1/volume")
+            self.assertTrue(restore_cached_layer(cache_dir, "the_key", child))
+            self.assertEqual([b"hello"], child.path().listdir())
+            with open(manifest_path(child)) as f:
+                self.assertEqual("fake manifest", f.read())
+            # The snapshot is read-only
+            with self.assertRaises(subprocess.CalledProcessError):
+                child.run_as_root(["touch", child.path("world")])
+
+            self.assertEqual(
+                {"hit": 1, "miss": 0, "store": 1}, layer_cache_stats(cache_dir)
+            )
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import random
+import stat
+import unittest
+
+from antlir.btrfs_diff.send_stream import item_fields, SendStreamItems
+from antlir.fs_utils import temp_dir
+
+from ..provides_manifest import (
+    load_manifest,
+    PathTree,
+    PathTreeMismatch,
+    write_manifest,
+)
+
+
+_ENTRIES = [
+    (b"", "d"),
+    (b"a", "d"),
+    (b"a/b", "d"),
+    (b"a/b/c", "f"),
+    (b"a/b-c", "f"),  # `-` sorts before `/`, but not before a component
+    (b"a/d", "l"),
+    (b"a-b", "d"),
+    (b"a-b/c", "f"),
+    (b"z", "p"),
+]
+
+
+def _apply(tree, *items):
+    for item in items:
+        tree.apply_fields(type(item), item_fields(item))
+    return tree
+
+
+class ProvidesManifestTestCase(unittest.TestCase):
+    def test_write_and_load(self):
+        with temp_dir() as td:
+            path = td / "manifest"
+            self.assertIsNone(load_manifest(path))
+            write_manifest(path, reversed(_ENTRIES))
+            self.assertEqual(_ENTRIES, load_manifest(path))
+            self.assertEqual(_ENTRIES, load_manifest(path, b""))
+            self.assertEqual(_ENTRIES[1:6], load_manifest(path, b"a"))
+            self.assertEqual(_ENTRIES[2:4], load_manifest(path, b"a/b"))
+            self.assertEqual(_ENTRIES[4:5], load_manifest(path, b"a/b-c"))
+            self.assertEqual(_ENTRIES[6:8], load_manifest(path, b"a-b"))
+            self.assertEqual(_ENTRIES[8:], load_manifest(path, b"z"))
+            for missing in [b"0", b"a/b/b", b"a/c", b"a/e", b"zz"]:
+                self.assertEqual([], load_manifest(path, missing))
+
+            # A failed write leaves the old manifest, and no temporary file
+            with self.assertRaises(AssertionError):
+                write_manifest(path, [(b"bad\0path", "f")])
+            self.assertEqual([b"manifest"], td.listdir())
+            self.assertEqual(_ENTRIES, load_manifest(path))
+
+            with open(path, "wb") as f:
+                f.write(b"not a manifest")
+            with self.assertRaisesRegex(RuntimeError, "not a provides man"):
+                load_manifest(path)
+
+    def test_load_random_subtrees(self):
+        # Exercises the binary search with various entry lengths.
+        rng = random.Random(0)
+        entries = {(b"", "d")}
+        for _ in range(300):
+            parts = [
+                rng.choice([b"a", b"b", b"a-", b"bb", b"a.b"])
+                for _ in range(rng.randint(1, 4))
+            ]
+            for i in range(1, len(parts)):
+                entries.add((b"/".join(parts[:i]), "d"))
+            entries.add((b"/".join(parts), "f"))
+        # A path cannot be both a file and a directory.
+        dirs = {p for p, t in entries if t == "d"}
+        entries = sorted(
+            {(p, t) for p, t in entries if t == "d" or p not in dirs},
+            key=lambda e: e[0].split(b"/"),
+        )
+        with temp_dir() as td:
+            write_manifest(td / "m", entries)
+            for subtree, _ in entries:
+                self.assertEqual(
+                    [
+                        e
+                        for e in entries
+                        if e[0] == subtree
+                        or not subtree
+                        or e[0].startswith(subtree + b"/")
+                    ],
+                    load_manifest(td / "m", subtree),
+                )
+
+    def test_path_tree(self):
+        si = SendStreamItems
+        tree = _apply(
+            PathTree(_ENTRIES),
+            # `btrfs send` makes new inodes under temporary names
+            si.mkdir(path=b"o257-1-0"),
+            si.rename(path=b"o257-1-0", dest=b"a/new_dir"),
+            si.mkfile(path=b"a/new_dir/f"),
+            si.mknod(path=b"a/new_dir/blk", mode=stat.S_IFBLK, dev=0),
+            si.mknod(path=b"a/new_dir/chr", mode=stat.S_IFCHR, dev=0),
+            si.mksock(path=b"a/new_dir/sock"),
+            si.symlink(path=b"a/new_dir/sym", dest=b"f"),
+            # Replace a file
+            si.mkfile(path=b"o258-1-0"),
+            si.rename(path=b"o258-1-0", dest=b"z"),
+            # Move a subtree
+            si.rename(path=b"a/b", dest=b"a-b/b"),
+            si.link(path=b"a/hardlink", dest=b"a/b-c"),
+            si.unlink(path=b"a/b-c"),
+            si.unlink(path=b"a/d"),
+            si.rename(path=b"a", dest=b"a"),
+            # Other items do not change paths
+            si.chmod(path=b"a", mode=0o755),
+            si.write(path=b"a-b/c", offset=0, data=b"x"),
+        )
+        self.assertEqual(
+            [
+                (b"", "d"),
+                (b"a", "d"),
+                (b"a/hardlink", "f"),
+                (b"a/new_dir", "d"),
+                (b"a/new_dir/blk", "b"),
+                (b"a/new_dir/chr", "c"),
+                (b"a/new_dir/f", "f"),
+                (b"a/new_dir/sock", "s"),
+                (b"a/new_dir/sym", "l"),
+                (b"a-b", "d"),
+                (b"a-b/b", "d"),
+                (b"a-b/b/c", "f"),
+                (b"a-b/c", "f"),
+                (b"z", "f"),
+            ],
+            list(tree.gen_entries()),
+        )
+        _apply(tree, si.unlink(path=b"a-b/b/c"), si.rmdir(path=b"a-b/b"))
+        self.assertNotIn((b"a-b/b", "d"), list(tree.gen_entries()))
+
+    def test_pruned_paths(self):
+        si = SendStreamItems
+        tree = _apply(
+            PathTree(_ENTRIES, pruned_paths=[b"a/b", b"meta"]),
+            si.mkdir(path=b"meta"),
+            si.mkdir(path=b"meta/private"),
+            si.mkfile(path=b"a/b/f"),
+            si.chmod(path=b"a/b/f", mode=0o644),
+            # Making a pruned path under a temporary name
+            si.mkfile(path=b"o257-1-0"),
+            si.rename(path=b"o257-1-0", dest=b"a/b/g"),
+            si.link(path=b"a/b/h", dest=b"a/b/c"),
+            si.rename(path=b"meta/private", dest=b"a/b/private"),
+        )
+        self.assertEqual(
+            _ENTRIES[:2] + _ENTRIES[4:], list(tree.gen_entries())
+        )
+        for bad_item in [
+            si.rename(path=b"a/b/c", dest=b"c"),
+            si.link(path=b"c", dest=b"meta/f"),
+        ]:
+            with self.assertRaises(PathTreeMismatch):
+                _apply(tree, bad_item)
+
+    def test_path_tree_mismatch(self):
+        si = SendStreamItems
+        for bad_item in [
+            si.mkfile(path=b"a"),  # Exists
+            si.mkfile(path=b"no_dir/f"),
+            si.mkfile(path=b"z/f"),  # Not a directory
+            si.unlink(path=b"no_file"),
+            si.unlink(path=b"a"),  # A directory
+            si.rmdir(path=b"a"),  # Not empty
+            si.rename(path=b"a", dest=b"z"),  # Directory over a file
+            si.rename(path=b"z", dest=b"a-b"),  # File over a directory
+            si.rename(path=b"a-b/c", dest=b"a"),
+            si.link(path=b"l", dest=b"a"),  # Cannot hardlink a directory
+            si.link(path=b"l", dest=b"no_file"),
+        ]:
+            with self.assertRaises(PathTreeMismatch):
+                _apply(PathTree(_ENTRIES), bad_item)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -24,6 +24,11 @@ class RequiresProvidesTestCase(unittest.TestCase):
         self.assertEqual("/a", _normalize_path("a//."))
         self.assertEqual("/b/d", _normalize_path("/b/c//../d"))
         self.assertEqual("/x/y", _normalize_path("///x/./y/"))
+        # The fast path for already-normal paths
+        self.assertEqual("/", _normalize_path(""))
+        self.assertEqual("/", _normalize_path("/"))
+        self.assertEqual("/a/.b/..c", _normalize_path("a/.b/..c"))
+        self.assertEqual("/a", _normalize_path("/a/b/.."))
 
     def test_path_normalization(self):
         self.assertEqual("/a", require_directory("a//.").path)
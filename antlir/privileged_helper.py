@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+`Subvol.run_as_root` normally runs each command via `sudo`.  That costs
+a `sudo` process, and its PAM session, per command, and a big layer can
+run thousands of commands.  Instead, a build may opt into a long-lived
+`root` helper, which is started via `sudo` just once:
+
+    with privileged_helper():
+        ...  # `Subvol` methods now talk to the helper
+
+While the context is active, `Subvol.run_as_root` sends the command,
+with its stdin, stdout & stderr FDs, to the helper over a Unix socket,
+and the helper runs it -- so, the commands and their results are exactly
+as with `sudo`.  Calls that the helper cannot handle, like ones with a
+`timeout`, and `Subvol.popen_as_root`, still use `sudo`.  `set_readonly`
+and `delete` skip the `btrfs` CLI, and have the helper make the ioctls.
+Likewise, `make_inodes` makes many directories & symlinks via syscalls.
+
+The socket is in a fresh directory that only the repo user can access,
+and the helper also checks the UID of each client.  Every thread gets its
+own connection, so `compiler --build-jobs` can use the helper in parallel.
+See `privileged_helper_server.py` for the protocol.
+"""
+import os
+import socket
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import (
+    Any,
+    AnyStr,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from .common import check_popen_returncode
+from .fs_utils import Path
+from .privileged_helper_server import recv_msg, send_msg
+
+_ACTIVE_HELPER: Optional["PrivilegedHelper"] = None
+
+
+def _read_all(fd: int, idx: int, out: Dict[int, bytes]) -> None:
+    with os.fdopen(fd, "rb") as f:
+        out[idx] = f.read()
+
+
+def _write_all(fd: int, data: Optional[bytes]) -> None:
+    with os.fdopen(fd, "wb") as f:
+        if data:
+            try:
+                f.write(data)
+            except BrokenPipeError:  # Like `Popen.communicate`
+                pass
+
+
+def _check_reply(
+    msg: Dict[str, Any], reply: Dict[str, Any]
+) -> Dict[str, Any]:
+    if "errno" in reply:
+        raise OSError(reply["errno"], reply["strerror"], msg.get("path"))
+    if "error" in reply:
+        raise RuntimeError(
+            f"Privileged helper failed {msg['op']}: "
+            f"{reply['error']}: {reply['message']}"
+        )
+    return reply
+
+
+class PrivilegedHelper:
+    "A client for the helper listening on `sock_path`.  Thread-safe."
+
+    def __init__(self, sock_path: Path):
+        self._sock_path = sock_path
+        self._local = threading.local()
+        self._socks_lock = threading.Lock()
+        self._socks = []
+
+    def _sock(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self._sock_path)
+            self._local.sock = sock
+            with self._socks_lock:
+                self._socks.append(sock)
+        return sock
+
+    def _call(self, msg: Dict[str, Any]) -> Dict[str, Any]:
+        sock = self._sock()
+        send_msg(sock, msg)
+        reply = recv_msg(sock)
+        if reply is None:
+            raise RuntimeError(f"Privileged helper failed to handle {msg}")
+        reply, reply_fds = reply
+        assert not reply_fds, reply_fds
+        return _check_reply(msg, reply)
+
+    def close(self) -> None:
+        with self._socks_lock:
+            for sock in self._socks:
+                sock.close()
+            self._socks.clear()
+
+    def run(
+        self, args, *, input=None, stdin=None, stdout=None, stderr=None
+    ) -> subprocess.CompletedProcess:
+        """
+        Runs `args` as `root`, taking `stdin`, `stdout` & `stderr` as
+        `subprocess.run` does, and likewise returns their `PIPE` outputs.
+        Does not check the exit code.
+        """
+        child_fds: List[int] = []
+        to_close: List[int] = []  # Our copies of FDs for the child
+        pipes = {}  # Stream index -> our end of its pipe
+        try:
+            for idx, spec in enumerate((stdin, stdout, stderr)):
+                if spec is None:
+                    child_fds.append(idx)
+                elif spec == subprocess.STDOUT:
+                    assert idx == 2, "Only stderr may go to STDOUT"
+                    child_fds.append(child_fds[1])
+                elif spec == subprocess.DEVNULL:
+                    fd = os.open(os.devnull, os.O_RDWR | os.O_CLOEXEC)
+                    to_close.append(fd)
+                    child_fds.append(fd)
+                elif spec == subprocess.PIPE:
+                    r, w = os.pipe2(os.O_CLOEXEC)
+                    theirs, pipes[idx] = (r, w) if idx == 0 else (w, r)
+                    to_close.append(theirs)
+                    child_fds.append(theirs)
+                elif isinstance(spec, int):
+                    child_fds.append(spec)
+                else:
+                    child_fds.append(spec.fileno())
+            sock = self._sock()
+            msg = {"op": "run", "args": [os.fsdecode(a) for a in args]}
+            send_msg(sock, msg, child_fds)
+        except BaseException:
+            for fd in pipes.values():
+                os.close(fd)
+            raise
+        finally:
+            # The helper has its own copies, and the pipes would not get
+            # EOF if we kept ours.
+            for fd in to_close:
+                os.close(fd)
+
+        # Like `Popen.communicate`, feed & drain the pipes while the
+        # command runs, so that it cannot block on a full pipe.
+        outputs: Dict[int, bytes] = {}
+        threads = [
+            threading.Thread(target=_write_all, args=(fd, input))
+            if idx == 0
+            else threading.Thread(target=_read_all, args=(fd, idx, outputs))
+            for idx, fd in pipes.items()
+        ]
+        for t in threads:
+            t.start()
+        try:
+            reply = recv_msg(sock)
+        finally:
+            for t in threads:
+                t.join()
+        if reply is None:
+            raise RuntimeError(f"Privileged helper failed to run {args}")
+        return subprocess.CompletedProcess(
+            args=args,
+            returncode=_check_reply(msg, reply[0])["returncode"],
+            stdout=outputs.get(1),
+            stderr=outputs.get(2),
+        )
+
+    def set_readonly(self, path: Path, readonly: bool) -> None:
+        self._call(
+            {
+                "op": "set_readonly",
+                "path": os.fsdecode(path),
+                "readonly": readonly,
+            }
+        )
+
+    def delete_subvol(self, path: Path) -> None:
+        self._call({"op": "delete_subvol", "path": os.fsdecode(path)})
+
+    def make_inodes(
+        self,
+        path: Path,
+        inodes: Sequence[
+            Tuple[AnyStr, Optional[AnyStr], Optional[int], Optional[str]]
+        ],
+    ) -> None:
+        """
+        Makes `(path, symlink_target, mode, user_group)` directories and
+        symlinks under `path` in one request, see `_make_inodes` in
+        `privileged_helper_server.py`.
+        """
+        self._call(
+            {
+                "op": "make_inodes",
+                "path": os.fsdecode(path),
+                "inodes": [
+                    [
+                        os.fsdecode(p),
+                        None if target is None else os.fsdecode(target),
+                        mode,
+                        user_group,
+                    ]
+                    for p, target, mode, user_group in inodes
+                ],
+            }
+        )
+
+
+def get_active_privileged_helper() -> Optional[PrivilegedHelper]:
+    return _ACTIVE_HELPER
+
+
+@contextmanager
+def privileged_helper() -> Iterator[PrivilegedHelper]:
+    """
+    Starts the helper via `sudo`, and makes `Subvol` use it until the
+    context exits.  Not reentrant.
+    """
+    global _ACTIVE_HELPER
+    assert _ACTIVE_HELPER is None, "A privileged helper is already active"
+    # Hardcoding /tmp is ugly, but Buck sets $TMP to fairly long paths,
+    # which can cause `AF_UNIX path too long`.
+    with tempfile.TemporaryDirectory(dir="/tmp") as td, Path.resource(
+        __package__, "privileged-helper-server", exe=True
+    ) as server_binary, subprocess.Popen(
+        [
+            # Same as `popen_as_root`, see the comments there.
+            "sudo",
+            "TMP=",
+            "--",
+            # Do not write `root`-owned bytecode into `buck-out`, see
+            # `send_fds_and_run.py`.
+            "env",
+            "PYTHONDONTWRITEBYTECODE=1",
+            server_binary,
+            "--unix-sock",
+            Path(td) / "sock",
+            "--owner-uid",
+            str(os.getuid()),
+        ],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    ) as proc:
+        ready = proc.stdout.readline()
+        if ready != b"ready\n":
+            proc.stdin.close()
+            raise RuntimeError(f"Privileged helper did not start: {ready}")
+        helper = PrivilegedHelper(Path(td) / "sock")
+        _ACTIVE_HELPER = helper
+        try:
+            yield helper
+        finally:
+            _ACTIVE_HELPER = None
+            helper.close()
+            proc.stdin.close()  # Tells the helper to exit
+    check_popen_returncode(proc)
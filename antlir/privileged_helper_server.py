@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+The `root` half of `privileged_helper.py` -- see that docblock for how
+it is started, and for how `Subvol` uses it.
+
+This serves requests from the repo user on `--unix-sock`, and exits
+when its stdin is closed.  Each connection gets a thread, and handles one
+request at a time, so that concurrent builders each use a connection.
+The operations are:
+
+  - `run`: runs `args` with the 3 FDs that came with the request as its
+    stdin, stdout & stderr, and replies with the exit code.  This is what
+    `sudo` would do, minus the `sudo` process and its PAM overhead.
+
+  - `set_readonly` & `delete_subvol`: the same btrfs ioctls as the
+    `btrfs property set ... ro` and `btrfs subvolume delete` CLIs make.
+
+  - `make_inodes`: makes many directories & symlinks under `path` via
+    `mkdirat`, `symlinkat`, `fchmodat` & `fchownat`, relative to `O_PATH`
+    FDs of their parents, see `_make_inodes`.
+
+A failed syscall replies with its `errno`, which the client re-raises as
+an `OSError`.  Any other error, like an unknown `op`, replies with the
+exception's type & message, which the client raises as a `RuntimeError`.
+
+## Wire format
+
+Requests and replies are JSON objects, each preceded by its length, as a
+4-byte big-endian integer.  FDs are sent as `SCM_RIGHTS` with the first
+bytes of the request.  Paths & arguments are `os.fsdecode`d, which is
+lossless for any bytes, since JSON escapes the resulting surrogates.
+"""
+import argparse
+import array
+import errno
+import fcntl
+import grp
+import json
+import os
+import pwd
+import socket
+import socketserver
+import stat
+import struct
+import subprocess
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .common import get_logger, init_logging, open_fd, recv_fds
+
+
+log = get_logger()
+
+_LENGTH = struct.Struct("!I")
+_MAX_FDS = 3  # Only `run` sends FDs
+_PEERCRED = struct.Struct("3i")  # pid, uid, gid
+
+# From `linux/btrfs.h`
+_BTRFS_IOCTL_MAGIC = 0x94
+_BTRFS_SUBVOL_RDONLY = 1 << 1
+_BTRFS_VOL_ARGS = struct.Struct("=q4088s")  # `btrfs_ioctl_vol_args`
+
+
+def _ioc(direction: int, nr: int, size: int) -> int:
+    return (direction << 30) | (size << 16) | (_BTRFS_IOCTL_MAGIC << 8) | nr
+
+
+_BTRFS_IOC_SNAP_DESTROY = _ioc(1, 15, _BTRFS_VOL_ARGS.size)
+_BTRFS_IOC_SUBVOL_GETFLAGS = _ioc(2, 25, 8)
+_BTRFS_IOC_SUBVOL_SETFLAGS = _ioc(1, 26, 8)
+
+
+def send_msg(sock: socket.socket, msg: Dict[str, Any], fds=()) -> None:
+    data = json.dumps(msg).encode()
+    header = _LENGTH.pack(len(data))
+    if fds:
+        num_sent = sock.sendmsg(
+            [header],
+            [
+                (
+                    socket.SOL_SOCKET,
+                    socket.SCM_RIGHTS,
+                    array.array("i", fds).tobytes(),
+                )
+            ],
+        )
+        assert num_sent == len(header), (num_sent, header)
+    else:
+        sock.sendall(header)
+    sock.sendall(data)
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise RuntimeError(f"{sock} closed in the middle of a message")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_msg(
+    sock: socket.socket,
+) -> Optional[Tuple[Dict[str, Any], List[int]]]:
+    "Returns `(msg, fds)`, or `None` if the peer closed the connection."
+    header, fds = recv_fds(sock, _LENGTH.size, _MAX_FDS)
+    if not header:
+        assert not fds, fds
+        return None
+    header += _recv_exactly(sock, _LENGTH.size - len(header))
+    (size,) = _LENGTH.unpack(header)
+    return json.loads(_recv_exactly(sock, size)), fds
+
+
+def _run(msg: Dict[str, Any], fds: Sequence[int]) -> Dict[str, Any]:
+    if len(fds) != 3:
+        raise ValueError(f"`run` needs 3 FDs, got {len(fds)}")
+    stdin, stdout, stderr = fds
+    # We were started via `sudo TMP= --`, so the environment is already
+    # the one that `Subvol.popen_as_root` would give the command.
+    return {
+        "returncode": subprocess.run(
+            [os.fsencode(a) for a in msg["args"]],
+            stdin=stdin,
+            stdout=stdout,
+            stderr=stderr,
+        ).returncode
+    }
+
+
+def _set_readonly(msg: Dict[str, Any], fds: Sequence[int]) -> Dict[str, Any]:
+    assert not fds, fds
+    flags = bytearray(8)
+    with open_fd(
+        os.fsencode(msg["path"]), os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW
+    ) as fd:
+        fcntl.ioctl(fd, _BTRFS_IOC_SUBVOL_GETFLAGS, flags)
+        (value,) = struct.unpack("=Q", flags)
+        if msg["readonly"]:
+            value |= _BTRFS_SUBVOL_RDONLY
+        else:
+            value &= ~_BTRFS_SUBVOL_RDONLY
+        fcntl.ioctl(fd, _BTRFS_IOC_SUBVOL_SETFLAGS, struct.pack("=Q", value))
+    return {}
+
+
+def _delete_subvol(msg: Dict[str, Any], fds: Sequence[int]) -> Dict[str, Any]:
+    assert not fds, fds
+    parent, name = os.path.split(os.fsencode(msg["path"]))
+    # The last byte of the name buffer must stay NUL.
+    if not name or len(name) >= _BTRFS_VOL_ARGS.size - 8:
+        raise OSError(errno.EINVAL, f"Bad subvolume name {name}")
+    # A mutable buffer, since `ioctl` copies immutable ones to a buffer of
+    # just 1024 bytes.
+    vol_args = bytearray(_BTRFS_VOL_ARGS.pack(0, name))
+    with open_fd(parent, os.O_RDONLY | os.O_DIRECTORY) as fd:
+        fcntl.ioctl(fd, _BTRFS_IOC_SNAP_DESTROY, vol_args)
+    return {}
+
+
+def _resolve_id(name: str, getter: Callable[[str], Any], field: str) -> int:
+    try:
+        return getattr(getter(name), field)
+    except KeyError:
+        # Like `chown`, fall back to numeric IDs.
+        if name.isdigit():
+            return int(name)
+        raise OSError(errno.EINVAL, f"Unknown user or group {name}")
+
+
+def _resolve_user_group(user_group: str) -> Tuple[int, int]:
+    "`user:group` to `(uid, gid)`, via this host's databases, like `chown`."
+    user, _, group = user_group.partition(":")
+    return (
+        _resolve_id(user, pwd.getpwnam, "pw_uid") if user else -1,
+        _resolve_id(group, grp.getgrnam, "gr_gid") if group else -1,
+    )
+
+
+def _make_inodes(msg: Dict[str, Any], fds: Sequence[int]) -> Dict[str, Any]:
+    """
+    `inodes` is a list of `[path, symlink_target, mode, user_group]`, with
+    `path` relative to the directory `path`.  Each makes a symlink if
+    `symlink_target` is set, or a directory otherwise.  An inode's parent
+    must exist, or come earlier in the list.
+
+    For directories, `mode` and `user_group` are applied as by `chmod`
+    and `chown --no-dereference`, which leave symlinks alone.  Like
+    `chmod`, we keep the set-user-ID and set-group-ID bits that a new
+    directory inherits, unless `mode` sets them.
+
+    Parent directories are opened one component at a time, without
+    following symlinks.  They are all opened before we change anything,
+    so if one goes via a symlink, the request fails with `ENOTDIR`, and
+    has no effect.
+    """
+    assert not fds, fds
+    inodes = [
+        (os.fsencode(path), target, mode, user_group)
+        for path, target, mode, user_group in msg["inodes"]
+    ]
+    for path, *_ in inodes:
+        # `..` would let us escape the root, see also `open_dir`.
+        if os.path.normpath(path) != path or path.split(b"/")[0] in (
+            b"",
+            b"..",
+        ):
+            raise OSError(errno.EINVAL, f"Not a normal relative path: {path}")
+    made = {path for path, *_ in inodes}
+    dir_fds = {}  # Relative path -> `O_PATH` FD
+
+    def open_dir(rel_path: bytes) -> int:
+        fd = dir_fds.get(rel_path)
+        if fd is None:
+            parent, name = os.path.split(rel_path)
+            fd = os.open(
+                name,
+                os.O_PATH | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC,
+                dir_fd=open_dir(parent),
+            )
+            dir_fds[rel_path] = fd
+        return fd
+
+    dir_fds[b""] = os.open(
+        os.fsencode(msg["path"]), os.O_PATH | os.O_DIRECTORY | os.O_CLOEXEC
+    )
+    try:
+        for path, *_ in inodes:
+            parent = os.path.dirname(path)
+            if parent not in made:
+                open_dir(parent)
+        for path, target, mode, user_group in inodes:
+            parent, name = os.path.split(path)
+            parent_fd = open_dir(parent)
+            if target is not None:
+                os.symlink(target, name, dir_fd=parent_fd)
+                continue
+            os.mkdir(name, 0o700, dir_fd=parent_fd)
+            if mode is not None:
+                st = os.stat(name, dir_fd=parent_fd, follow_symlinks=False)
+                os.chmod(
+                    name,
+                    mode | (st.st_mode & (stat.S_ISUID | stat.S_ISGID)),
+                    dir_fd=parent_fd,
+                )
+            if user_group is not None:
+                os.chown(
+                    name,
+                    *_resolve_user_group(user_group),
+                    dir_fd=parent_fd,
+                    follow_symlinks=False,
+                )
+    finally:
+        for fd in dir_fds.values():
+            os.close(fd)
+    return {}
+
+
+_OPS = {
+    "run": _run,
+    "set_readonly": _set_readonly,
+    "delete_subvol": _delete_subvol,
+    "make_inodes": _make_inodes,
+}
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        _pid, uid, _gid = _PEERCRED.unpack(
+            self.request.getsockopt(
+                socket.SOL_SOCKET, socket.SO_PEERCRED, _PEERCRED.size
+            )
+        )
+        # The socket is only accessible to its owner, but let's be sure.
+        allowed = uid == self.server.owner_uid
+        if not allowed:
+            log.error(f"Rejecting requests from UID {uid}")
+        while True:
+            request = recv_msg(self.request)
+            if request is None:
+                return
+            msg, fds = request
+            try:
+                if not allowed:
+                    raise OSError(errno.EPERM, f"UID {uid} is not allowed")
+                op = _OPS.get(msg.get("op"))
+                if op is None:
+                    raise ValueError(f"Unknown op {msg.get('op')!r}")
+                reply = op(msg, fds)
+            except OSError as ex:
+                reply = {"errno": ex.errno, "strerror": ex.strerror}
+            except Exception as ex:
+                # Reply instead of dropping the connection, so the client
+                # sees what went wrong.
+                log.exception(f"Failed to handle {msg.get('op')!r}")
+                reply = {"error": type(ex).__name__, "message": str(ex)}
+            finally:
+                for fd in fds:
+                    os.close(fd)
+            send_msg(self.request, reply)
+
+
+def make_server(
+    sock_path: bytes, owner_uid: int
+) -> socketserver.ThreadingUnixStreamServer:
+    server = socketserver.ThreadingUnixStreamServer(
+        os.fsdecode(sock_path), _RequestHandler
+    )
+    server.daemon_threads = True
+    server.owner_uid = owner_uid
+    os.chown(sock_path, owner_uid, -1)
+    os.chmod(sock_path, 0o600)
+    return server
+
+
+def _shutdown_on_eof(server, infile):
+    while infile.read(4096):
+        pass
+    server.shutdown()
+
+
+def parse_opts(argv):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--debug", action="store_true", help="Log more")
+    parser.add_argument(
+        "--unix-sock",
+        required=True,
+        help="Listen for requests on a new Unix socket at this path.",
+    )
+    parser.add_argument(
+        "--owner-uid",
+        type=int,
+        required=True,
+        help="Only this user may connect to `--unix-sock`.",
+    )
+    return parser.parse_args(argv)
+
+
+# `test_privileged_helper.py` covers this via `privileged_helper()`.
+if __name__ == "__main__":  # pragma: no cover
+    opts = parse_opts(sys.argv[1:])
+    init_logging(debug=opts.debug)
+    with make_server(os.fsencode(opts.unix_sock), opts.owner_uid) as server:
+        threading.Thread(
+            target=_shutdown_on_eof,
+            args=(server, sys.stdin.buffer),
+            daemon=True,
+        ).start()
+        # Tell the client that it may connect.
+        sys.stdout.buffer.write(b"ready\n")
+        sys.stdout.buffer.flush()
+        server.serve_forever()
@@ -16,12 +16,15 @@ from antlir.compiler.subvolume_on_disk import SubvolumeOnDisk
 from .btrfs_loopback import LoopbackVolume, run_stdout_to_err
 from .common import check_popen_returncode, get_logger, open_fd, pipe
 from .fs_utils import Path
+from .privileged_helper import get_active_privileged_helper
 from .unshare import Namespace, Unshare, nsenter_as_root, nsenter_as_user
 
 
 log = get_logger()
 KiB = 2 ** 10
 MiB = 2 ** 20
+# `run_as_root` kwargs that `PrivilegedHelper.run` supports.
+_HELPER_RUN_KWARGS = frozenset(["stdin", "stdout", "stderr"])
 
 
 # Exposed as a helper so that test_compiler.py can mock it.
@@ -156,6 +159,12 @@ class Subvol:
         assert rel.startswith(root + b"/"), (rel, root)
         return Path("/") / rel.relpath(root)
 
+    def _assert_exists(self, exists: bool):
+        if exists != self._exists:
+            raise AssertionError(
+                f"{self.path()} exists is {self._exists}, not {exists}"
+            )
+
     # This differs from the regular `subprocess.Popen` interface in these ways:
     #   - stdout maps to stderr by default (to protect the caller's stdout),
     #   - `check` is supported, and default to `True`,
@@ -187,10 +196,7 @@ class Subvol:
                 "move the usage of our FD-passing wrapper from "
                 "nspawn_in_subvol.py to this function."
             )
-        if _subvol_exists != self._exists:
-            raise AssertionError(
-                f"{self.path()} exists is {self._exists}, not {_subvol_exists}"
-            )
+        self._assert_exists(_subvol_exists)
         # Ban our subcommands from writing to stdout, since many of our
         # tools (e.g. make-demo-sendstream, compiler) write structured
         # data to stdout to be usable in pipelines.
@@ -233,6 +239,15 @@ class Subvol:
             - `stdout` is redirected to stderr by default,
             - `cwd` is prohibited.
         """
+        helper = get_active_privileged_helper()
+        if (
+            helper is not None
+            and timeout is None
+            and _HELPER_RUN_KWARGS.issuperset(kwargs)
+        ):
+            return self._run_via_helper(
+                helper, args, input, _subvol_exists, check, **kwargs
+            )
         # IMPORTANT: Any logic that CAN go in popen_as_root, MUST go there.
         if input:
             assert "stdin" not in kwargs
@@ -248,6 +263,21 @@ class Subvol:
             stderr=stderr,
         )
 
+    def _run_via_helper(
+        self, helper, args, input, _subvol_exists, check, stdout=None, **kwargs
+    ):
+        "Like `run_as_root`, but without a `sudo` per command."
+        self._assert_exists(_subvol_exists)
+        if input:
+            assert "stdin" not in kwargs
+            kwargs["stdin"] = subprocess.PIPE
+        res = helper.run(
+            args, input=input, stdout=2 if stdout is None else stdout, **kwargs
+        )
+        if check:
+            res.check_returncode()
+        return res
+
     # Future: run_in_image()
 
     # From here on out, every public method directly maps to the btrfs API.
@@ -273,7 +303,12 @@ class Subvol:
         self._exists = True
 
     def delete(self):
-        self.run_as_root(["btrfs", "subvolume", "delete", self.path()])
+        helper = get_active_privileged_helper()
+        if helper is None:
+            self.run_as_root(["btrfs", "subvolume", "delete", self.path()])
+        else:
+            self._assert_exists(True)
+            helper.delete_subvol(self.path())
         self._exists = False
 
     def _delete_inner_subvols(self):
@@ -361,6 +396,11 @@ class Subvol:
             yield self.path(inner_subvol)
 
     def set_readonly(self, readonly: bool):
+        helper = get_active_privileged_helper()
+        if helper is not None:
+            self._assert_exists(True)
+            helper.set_readonly(self.path(), readonly)
+            return
         self.run_as_root(
             [
                 "btrfs",
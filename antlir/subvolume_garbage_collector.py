@@ -48,6 +48,7 @@ import re
 import stat
 import subprocess
 import sys
+import time
 from typing import Iterator
 
 from .fs_utils import Path
@@ -157,6 +158,20 @@ def garbage_collect_subvolumes(refcounts_dir, subvolumes_dir):
             assert len(maybe_lockfile) == 1, maybe_lockfile
             (maybe_lockfile,) = maybe_lockfile
             wrapper_content.remove(maybe_lockfile)
+        # The compiler may have saved the paths of the subvolume, see
+        # `manifest_path` in `compiler/provides_manifest.py`.
+        # Likewise, its layer cache key, see `compiler/layer_cache.py`.
+        manifests = [
+            f
+            for f in wrapper_content
+            if f.startswith(b".")
+            and (
+                f.endswith(b".provides")
+                or f.endswith(b".provides.tmp")
+                or f.endswith(b".layer-cache-key")
+            )
+        ]
+        wrapper_content.difference_update(manifests)
 
         if len(wrapper_content) > 1:
             raise RuntimeError(
@@ -183,9 +198,62 @@ def garbage_collect_subvolumes(refcounts_dir, subvolumes_dir):
             # the lockfile before the subvol.
             assert not maybe_lockfile, maybe_lockfile
 
+        for manifest in manifests:
+            os.unlink(wrapper_path / manifest)
         os.rmdir(wrapper_path)
 
 
+# Keep in sync with `compiler/layer_cache.py`
+_LAYER_CACHE_SUBVOL = "layer"
+# A `.tmp-*` entry is locked right after it is made, so an unlocked one is
+# garbage, unless it is so new that its build did not lock it yet.
+_LAYER_CACHE_TMP_MIN_AGE_SEC = 3600
+
+
+def _delete_layer_cache_entry(entry_dir: Path) -> None:
+    if os.path.exists(entry_dir / _LAYER_CACHE_SUBVOL):
+        subprocess.check_call(
+            [
+                "sudo",
+                "btrfs",
+                "subvolume",
+                "delete",
+                entry_dir / _LAYER_CACHE_SUBVOL,
+            ]
+        )
+    for name in entry_dir.listdir():  # e.g. the provides manifest
+        os.unlink(entry_dir / name)
+    os.rmdir(entry_dir)
+
+
+def evict_layer_cache_entries(layers_dir: Path, max_entries: int) -> None:
+    """
+    Deletes all but the `max_entries` most recently used entries of the
+    layer cache (see `compiler/layer_cache.py`), as well as abandoned
+    temporary entries.  Entries that a build is using are skipped.
+    """
+    try:
+        names = layers_dir.listdir()
+    except FileNotFoundError:
+        return
+    entries = []
+    for name in names:
+        st = os.lstat(layers_dir / name)
+        if not stat.S_ISDIR(st.st_mode):
+            continue  # E.g. `stats.json`
+        if name.startswith(b".tmp-"):
+            if st.st_mtime + _LAYER_CACHE_TMP_MIN_AGE_SEC < time.time():
+                entries.append((float("-inf"), name))
+        else:
+            entries.append((st.st_mtime, name))
+    entries.sort(reverse=True)
+    for _, name in entries[max_entries:]:
+        with nonblocking_flock(layers_dir / name) as got_lock:
+            if got_lock:
+                log.warning(f"Evicting {name} from the layer cache")
+                _delete_layer_cache_entry(layers_dir / name)
+
+
 def parse_args(argv):
     parser = argparse.ArgumentParser(
         description=__doc__,
@@ -216,6 +284,18 @@ def parse_args(argv):
         "and hard-link into `--refcounts-dir` for refcounting purposes. "
         "The image compiler will then write data into this file.",
     )
+    parser.add_argument(
+        "--layer-cache-dir",
+        type=Path.from_argparse,
+        help="The `layers` directory of the compiler's layer cache. If set, "
+        "evict its least recently used entries.",
+    )
+    parser.add_argument(
+        "--layer-cache-max-entries",
+        type=int,
+        default=100,
+        help="How many layers to keep in `--layer-cache-dir`.",
+    )
     return Path.parse_args(parser, argv)
 
 
@@ -295,6 +375,10 @@ def subvolume_garbage_collector(argv):
     with nonblocking_flock(args.subvolumes_dir) as got_lock:
         if got_lock:
             garbage_collect_subvolumes(args.refcounts_dir, args.subvolumes_dir)
+            if args.layer_cache_dir:
+                evict_layer_cache_entries(
+                    args.layer_cache_dir, args.layer_cache_max_entries
+                )
         else:
             # That other build probably won't clean up the prior version of
             # the subvolume we are creating, but we don't rely on that to
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Measures the per-operation latency of `Subvol` methods, both via `sudo`,
+and via `privileged_helper()`.  This is a development tool, not a test:
+
+  buck run antlir:benchmark-privileged-helper -- --iterations 200
+
+Each operation runs on a temporary subvolume.  `run_as_root` runs `true`,
+so its latency is all overhead.
+"""
+import argparse
+import time
+from contextlib import nullcontext
+
+from antlir.privileged_helper import privileged_helper
+
+from .temp_subvolumes import TempSubvolumes
+
+
+def _time_per_op(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return (time.perf_counter() - start) / iterations
+
+
+def _main():
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    p.add_argument("--iterations", type=int, default=200)
+    args = p.parse_args()
+
+    with TempSubvolumes() as temp_subvols:
+        sv = temp_subvols.create("sv")
+        for name, ctx in [("sudo", nullcontext), ("helper", privileged_helper)]:
+            with ctx():
+                run_ms = 1e3 * _time_per_op(
+                    lambda _i: sv.run_as_root(["true"]), args.iterations
+                )
+                ro_ms = 1e3 * _time_per_op(
+                    lambda i: sv.set_readonly(i % 2 == 0), args.iterations
+                )
+                sv.set_readonly(False)
+            print(
+                f"  {name:<8} run_as_root {run_ms:7.2f} ms   "
+                f"set_readonly {ro_ms:7.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    _main()
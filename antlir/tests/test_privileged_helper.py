@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import subprocess
+import threading
+import unittest
+
+from ..fs_utils import temp_dir
+from ..privileged_helper import (
+    get_active_privileged_helper,
+    PrivilegedHelper,
+    privileged_helper,
+)
+from ..privileged_helper_server import make_server, recv_msg, send_msg
+from ..subvol_utils import Subvol
+from .temp_subvolumes import with_temp_subvols
+
+
+class PrivilegedHelperTestCase(unittest.TestCase):
+    def test_run_as_root(self):
+        sv = Subvol("/dev/null/no-such-dir")
+        with privileged_helper() as helper:
+            self.assertIs(helper, get_active_privileged_helper())
+            args = ["bash", "-c", "cat; echo -n $SUDO_UID >&2; exit 3"]
+            r = sv.run_as_root(
+                args,
+                input=b"x" * 10 ** 6,  # Bigger than a pipe buffer
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                _subvol_exists=False,
+                check=False,
+            )
+            self.assertEqual(args, r.args)
+            self.assertEqual(3, r.returncode)
+            self.assertEqual(b"x" * 10 ** 6, r.stdout)
+            self.assertEqual(str(os.getuid()).encode(), r.stderr)
+
+            r = sv.run_as_root(
+                ["bash", "-c", "id -u; echo err >&2"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                _subvol_exists=False,
+            )
+            self.assertEqual(b"0\nerr\n", r.stdout)
+
+            # Arguments need not be UTF-8
+            r = sv.run_as_root(
+                ["printf", "%s", b"\xff\xfe"],
+                stdout=subprocess.PIPE,
+                _subvol_exists=False,
+            )
+            self.assertEqual(b"\xff\xfe", r.stdout)
+
+            with self.assertRaises(subprocess.CalledProcessError):
+                sv.run_as_root(["false"], _subvol_exists=False)
+            with self.assertRaisesRegex(AssertionError, "exists is False"):
+                sv.run_as_root(["true"])
+            with self.assertRaisesRegex(AssertionError, "cwd= is not perm"):
+                sv.run_as_root(["true"], _subvol_exists=False, cwd=".")
+
+            # Each thread gets a connection
+            threads = [
+                threading.Thread(
+                    target=sv.run_as_root,
+                    args=(["true"],),
+                    kwargs={"_subvol_exists": False},
+                )
+                for _ in range(3)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(4, len(helper._socks))
+
+            with self.assertRaisesRegex(AssertionError, "already active"):
+                with privileged_helper():
+                    pass  # pragma: no cover
+        self.assertIsNone(get_active_privileged_helper())
+
+    @with_temp_subvols
+    def test_subvol_ops(self, temp_subvols):
+        sv = temp_subvols.create("sv")
+        with privileged_helper():
+            sv.set_readonly(True)
+            with self.assertRaises(subprocess.CalledProcessError):
+                sv.run_as_root(["touch", sv.path("f")])
+            sv.set_readonly(False)
+            sv.run_as_root(["touch", sv.path("f")])
+
+            with self.assertRaises(NotADirectoryError):
+                get_active_privileged_helper().set_readonly(
+                    sv.path("f"), True
+                )
+
+            sv.delete()
+            self.assertFalse(os.path.exists(sv.path()))
+            # `TempSubvolumes` would log an error for the double-delete.
+            temp_subvols.subvols.remove(sv)
+
+    def test_rejects_other_users(self):
+        with temp_dir() as td:
+            with make_server(td / "sock", os.getuid()) as server:
+                server.owner_uid += 1  # Only `root` could `chown` to that
+                t = threading.Thread(target=server.serve_forever)
+                t.start()
+                try:
+                    helper = PrivilegedHelper(td / "sock")
+                    with self.assertRaisesRegex(PermissionError, "not all"):
+                        helper.set_readonly(td, True)
+                    helper.close()
+                finally:
+                    server.shutdown()
+                    t.join()
+
+    def test_make_inodes(self):
+        ug = f"{os.getuid()}:{os.getgid()}"
+        with temp_dir() as td:
+            with make_server(td / "sock", os.getuid()) as server:
+                t = threading.Thread(target=server.serve_forever)
+                t.start()
+                try:
+                    helper = PrivilegedHelper(td / "sock")
+                    os.mkdir(td / "root")
+                    os.mkdir(td / "root/sgid")
+                    os.chmod(td / "root/sgid", 0o2755)
+                    helper.make_inodes(
+                        td / "root",
+                        [
+                            ("d", None, 0o750, ug),
+                            ("d/e", None, None, None),
+                            ("d/link", "e", None, None),
+                            (b"sgid/f", None, 0o711, ug),
+                        ],
+                    )
+                    self.assertEqual(
+                        0o750, os.stat(td / "root/d").st_mode & 0o7777
+                    )
+                    self.assertTrue(os.path.isdir(td / "root/d/e"))
+                    self.assertEqual(b"e", os.readlink(td / "root/d/link"))
+                    # Like `chmod`, keep the inherited set-group-ID bit
+                    self.assertEqual(
+                        0o2711, os.stat(td / "root/sgid/f").st_mode & 0o7777
+                    )
+
+                    # Nothing is made via a symlinked parent...
+                    with self.assertRaises(NotADirectoryError):
+                        helper.make_inodes(
+                            td / "root",
+                            [
+                                ("x", None, None, None),
+                                ("d/link/x", None, 0, ug),
+                            ],
+                        )
+                    self.assertFalse(os.path.exists(td / "root/x"))
+                    # ... or outside of the root.
+                    for bad_path in ["../x", "/x", "d/../x"]:
+                        with self.assertRaisesRegex(OSError, "Not a normal"):
+                            helper.make_inodes(
+                                td / "root", [(bad_path, None, None, None)]
+                            )
+                    with self.assertRaises(FileExistsError):
+                        helper.make_inodes(
+                            td / "root", [("d", "e", None, None)]
+                        )
+                    helper.close()
+                finally:
+                    server.shutdown()
+                    t.join()
+
+    def test_bad_requests(self):
+        with temp_dir() as td:
+            with make_server(td / "sock", os.getuid()) as server:
+                t = threading.Thread(target=server.serve_forever)
+                t.start()
+                try:
+                    helper = PrivilegedHelper(td / "sock")
+                    with self.assertRaisesRegex(
+                        RuntimeError, "ValueError: Unknown op 'no_such_op'"
+                    ):
+                        helper._call({"op": "no_such_op"})
+
+                    sock = helper._sock()
+                    send_msg(sock, {"op": "run", "args": ["true"]}, [0])
+                    self.assertEqual(
+                        (
+                            {
+                                "error": "ValueError",
+                                "message": "`run` needs 3 FDs, got 1",
+                            },
+                            [],
+                        ),
+                        recv_msg(sock),
+                    )
+
+                    # Failing to start the command is an `OSError`
+                    with self.assertRaises(FileNotFoundError):
+                        helper.run(["/no/such/command"])
+                    # The connection still works after the errors
+                    self.assertEqual(0, helper.run(["true"]).returncode)
+                    self.assertEqual(1, len(helper._socks))
+                    helper.close()
+                finally:
+                    server.shutdown()
+                    t.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
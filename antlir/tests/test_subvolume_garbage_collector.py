@@ -154,6 +154,78 @@ class SubvolumeGarbageCollectorTestCase(unittest.TestCase):
             self.assertEqual([], subs_dir.listdir())
             self.assertEqual([], refs_dir.listdir())
 
+    def test_gc_clean_provides_manifest(self):
+        with temp_dir() as refs_dir, temp_dir() as subs_dir:
+            os.makedirs(subs_dir / "no:refs/subvol")
+            (subs_dir / "no:refs/.subvol.provides").touch()
+            (subs_dir / "no:refs/.subvol.provides.tmp").touch()
+            sgc.subvolume_garbage_collector(
+                [f"--refcounts-dir={refs_dir}", f"--subvolumes-dir={subs_dir}"]
+            )
+            self.assertEqual([], subs_dir.listdir())
+
+    def test_gc_clean_layer_cache_key(self):
+        with temp_dir() as refs_dir, temp_dir() as subs_dir:
+            os.makedirs(subs_dir / "no:refs/subvol")
+            (subs_dir / "no:refs/.subvol.layer-cache-key").touch()
+            sgc.subvolume_garbage_collector(
+                [f"--refcounts-dir={refs_dir}", f"--subvolumes-dir={subs_dir}"]
+            )
+            self.assertEqual([], subs_dir.listdir())
+
+    def test_evict_layer_cache_entries(self):
+        with temp_dir() as refs_dir, temp_dir() as subs_dir, temp_dir() as td:
+            layers_dir = td / "layers"
+
+            def gc():
+                sgc.subvolume_garbage_collector(
+                    [
+                        f"--refcounts-dir={refs_dir}",
+                        f"--subvolumes-dir={subs_dir}",
+                        f"--layer-cache-dir={layers_dir}",
+                        "--layer-cache-max-entries=2",
+                    ]
+                )
+
+            gc()  # No cache yet
+            os.mkdir(layers_dir)
+            (layers_dir / "stats.json").touch()
+            for name, mtime in [
+                ("old", 2),
+                ("older", 1),
+                ("new", 3),
+                ("newer", 4),
+            ]:
+                os.makedirs(layers_dir / name / "layer")
+                (layers_dir / name / ".layer.provides").touch()
+                os.utime(layers_dir / name, (mtime, mtime))
+            os.mkdir(layers_dir / "no_subvol")
+            os.utime(layers_dir / "no_subvol", (0, 0))
+            os.mkdir(layers_dir / ".tmp-abandoned")
+            os.utime(layers_dir / ".tmp-abandoned", (5, 5))
+            os.mkdir(layers_dir / ".tmp-in-progress")
+
+            # A build is snapshotting "old", so it cannot be evicted yet.
+            fd = os.open(layers_dir / "old", os.O_RDONLY)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                gc()
+            finally:
+                os.close(fd)
+            self.assertEqual(
+                {b".tmp-in-progress", b"old", b"new", b"newer", b"stats.json"},
+                set(layers_dir.listdir()),
+            )
+            gc()
+            self.assertEqual(
+                {b".tmp-in-progress", b"new", b"newer", b"stats.json"},
+                set(layers_dir.listdir()),
+            )
+            self.assertEqual(
+                {b"layer", b".layer.provides"},
+                set((layers_dir / "new").listdir()),
+            )
+
     @contextlib.contextmanager
     def _gc_test_case(self):
         # NB: I'm too lazy to test that `refs_dir` is created if missing.
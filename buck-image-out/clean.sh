@@ -0,0 +1,15 @@
+#!/bin/bash
+set -ue -o pipefail
+buck clean
+sudo umount -l buck-image-out/volume || true
+rm -f buck-image-out/image.btrfs
+# Just try to remove empty checkout dirs if they exist
+# Leave any checkouts as they may still be mounted by Eden
+REPOS="buck-image-out/eden/repos"
+mkdir -p "$REPOS"
+find "$REPOS" -maxdepth 2 -depth -type d -print0 | xargs -0 rmdir 2>/dev/null || true
+if [ -d "$REPOS" ]; then
+    echo "Eden checkouts remain in $REPOS and were not cleaned up"
+else
+    rm -rf buck-image-out/eden
+fi